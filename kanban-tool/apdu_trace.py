@@ -0,0 +1,608 @@
+"""
+CWT Thread Verification System - APDU Trace
+Record a station's reader traffic to a compact binary trace and replay it
+against RFIDManager, to reproduce field issues and timings in the office
+
+Recording wraps the reader (like simulated_reader.py, it duck-types the
+pyscard reader and connection) and the RFIDManager's public methods. Every
+connect, ATR, APDU and disconnect is saved with its response or exception
+and timing, framed by the manager call that caused it and that call's
+result. Each recorded call holds the reader lock, so calls never interleave
+in the trace.
+
+Replay builds a fresh RFIDManager on a reader that answers from the trace,
+repeats the recorded calls in order and compares their results. APDUs the
+code sends must match the trace; a difference (new retry behaviour, an
+extra command) is reported as a mismatch. Replay runs at recorded speed or
+faster (speed 0 = no waiting).
+
+Usage:
+    python apdu_trace.py info station3.ktr
+    python apdu_trace.py replay station3.ktr               (exit code 1 on mismatch)
+    python apdu_trace.py replay station3.ktr --speed 1     (recorded timing)
+
+Recording is enabled with APDU_TRACE_DIR in config.py (GUI) or
+http_service.py --trace DIR.
+
+File format (little endian): b'KTRC', version (B), start time (d); then
+records of kind (B), offset seconds (d), duration seconds (f), len(a) (H),
+len(b) (H), a, b. Kind bit 7 marks an exception (b = "Type\\0message").
+A control record is an escape command to the reader (a = command, b =
+response). A pipeline record (remote readers, reader_proxy.py) holds the APDUs sent in
+one round trip, each prefixed by its length; the transmits it answers
+follow it as usual.
+"""
+
+import argparse
+import functools
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from collections import defaultdict, namedtuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from smartcard.Exceptions import CardConnectionException, NoCardException
+
+from cancellation import Deadline
+
+
+MAGIC = b'KTRC'
+VERSION = 1
+_HEADER = struct.Struct('<4sBd')
+_RECORD = struct.Struct('<BdfHH')
+
+# Record kinds
+READER = 1       # a = reader name
+CONNECT = 2
+DISCONNECT = 3
+ATR = 4          # b = ATR
+TRANSMIT = 5     # a = command, b = response data + SW1 SW2
+CALL = 6         # a = JSON [method, args, kwargs]
+RESULT = 7       # b = JSON result, duration = call time
+PIPELINE = 8     # a = APDUs sent in one round trip (length byte + APDU each)
+CONTROL = 9      # a = escape command, b = response
+ERROR = 0x80
+
+KIND_NAMES = {READER: 'reader', CONNECT: 'connect', DISCONNECT: 'disconnect', ATR: 'atr',
+              TRANSMIT: 'transmit', CALL: 'call', RESULT: 'result', PIPELINE: 'pipeline',
+              CONTROL: 'control'}
+
+# RFIDManager methods framed as calls (nested calls are part of the outer one)
+RECORDED_CALLS = (
+    'check_card_present', 'poll_presence', 'get_card_uid_quick', 'get_card_uid',
+    'wait_for_card', 'authenticate_block', 'reselect', 'read_block', 'read_blocks', 'write_block',
+    'write_blocks', 'write_kanban', 'read_kanban', 'verify_data', 'write_bypass',
+    'clear_card', 'dump_card', 'set_detect_buzzer', 'signal_exception', 'signal_result', 'disconnect',
+)
+
+_EXCEPTIONS = {'NoCardException': NoCardException,
+               'CardConnectionException': CardConnectionException}
+
+TraceEvent = namedtuple('TraceEvent', 'kind t duration a b')
+
+
+def _encode(value: Any) -> Any:
+    """JSON-safe form of call arguments and results"""
+    if isinstance(value, (bytes, bytearray)):
+        return {'bytes': value.hex()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, Deadline):
+        return {'deadline': value.seconds}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return None  # Callbacks, cancel tokens: not part of the replay
+
+
+def _pack_apdus(apdus: List[List[int]]) -> bytes:
+    return b''.join(bytes([len(apdu)]) + bytes(apdu) for apdu in apdus)
+
+
+def _decode(value: Any) -> Any:
+    if isinstance(value, dict) and 'bytes' in value:
+        return bytes.fromhex(value['bytes'])
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+# ----------------------------------------------------------------------
+# Recording
+# ----------------------------------------------------------------------
+
+class TraceWriter:
+    """Appends records to a trace file (thread-safe, flushed per record)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'wb')
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self._file.write(_HEADER.pack(MAGIC, VERSION, time.time()))
+        self.records = 0
+
+    def now(self) -> float:
+        """Seconds since the trace started"""
+        return time.perf_counter() - self._t0
+
+    def write(self, kind: int, t: float, duration: float = 0.0, a: bytes = b'', b: bytes = b''):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(_RECORD.pack(kind, t, duration, len(a), len(b)) + a + b)
+            self._file.flush()  # A crash must not lose the end of the session
+            self.records += 1
+
+    def write_error(self, kind: int, t: float, duration: float, a: bytes, error: Exception):
+        self.write(kind | ERROR, t, duration, a, f"{type(error).__name__}\0{error}".encode('utf-8'))
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class RecordingConnection:
+    """pyscard connection wrapper that records every exchange"""
+
+    def __init__(self, connection, trace: TraceWriter):
+        self._connection = connection
+        self._trace = trace
+
+    def _record(self, kind: int, fn: Callable, a: bytes = b'', encode=None):
+        t = self._trace.now()
+        try:
+            result = fn()
+        except Exception as e:
+            self._trace.write_error(kind, t, self._trace.now() - t, a, e)
+            raise
+        self._trace.write(kind, t, self._trace.now() - t, a, encode(result) if encode else b'')
+        return result
+
+    def connect(self, *args, **kwargs):
+        return self._record(CONNECT, lambda: self._connection.connect(*args, **kwargs))
+
+    def disconnect(self):
+        return self._record(DISCONNECT, self._connection.disconnect)
+
+    def getATR(self) -> List[int]:
+        return self._record(ATR, self._connection.getATR, encode=bytes)
+
+    def transmit(self, apdu: List[int], *args, **kwargs) -> Tuple[List[int], int, int]:
+        return self._record(TRANSMIT, lambda: self._connection.transmit(apdu, *args, **kwargs),
+                            bytes(apdu), lambda r: bytes(r[0]) + bytes([r[1], r[2]]))
+
+    def control(self, code: int, command: List[int]) -> List[int]:
+        """Escape command (pn532.escape_channel: InAutoPoll, reader profiles)"""
+        if not hasattr(self._connection, 'control'):
+            raise NotImplementedError(f"{type(self._connection).__name__} has no escape commands")
+        return self._record(CONTROL, lambda: self._connection.control(code, command), bytes(command), bytes)
+
+    def pipeline(self, apdus: List[List[int]]):
+        """Pass announced APDUs on to a remote reader (local readers have no pipeline)"""
+        pipeline = getattr(self._connection, 'pipeline', None)
+        if pipeline is not None:
+            self._record(PIPELINE, lambda: pipeline(apdus), _pack_apdus(apdus))
+
+    @property
+    def deadline(self):
+        """Deadline of the running operation, kept by the wrapped CCID or proxy connection"""
+        return getattr(self._connection, 'deadline', None)
+
+    @deadline.setter
+    def deadline(self, value):
+        if hasattr(self._connection, 'deadline'):
+            self._connection.deadline = value
+
+
+class RecordingReader:
+    """pyscard reader wrapper whose connections record to a trace"""
+
+    def __init__(self, reader, trace: TraceWriter):
+        self._reader = reader
+        self._trace = trace
+        trace.write(READER, trace.now(), a=str(reader).encode('utf-8'))
+
+    def __str__(self) -> str:
+        return str(self._reader)
+
+    def createConnection(self) -> RecordingConnection:
+        return RecordingConnection(self._reader.createConnection(), self._trace)
+
+
+def record_session(rfid, path: str) -> TraceWriter:
+    """
+    Record everything an RFIDManager does with its reader
+
+    Works before or after connect_reader(). Close the returned writer at the end.
+
+    Args:
+        rfid: RFIDManager
+        path: Trace file to create
+
+    Returns:
+        TraceWriter: Open trace
+    """
+    trace = TraceWriter(path)
+    depth = threading.local()
+
+    source = rfid.reader_source
+    rfid.reader_source = lambda: [RecordingReader(r, trace) for r in source()]
+    if rfid.reader is not None:
+        rfid.reader = RecordingReader(rfid.reader, trace)
+
+    def wrap(name: str, method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if getattr(depth, 'n', 0):
+                return method(*args, **kwargs)
+            lock = rfid._lock  # Replaced on connect_reader, so looked up per call
+            if not lock.acquire(blocking=name != 'poll_presence'):
+                return None  # poll_presence never waits for the reader
+            depth.n = 1
+            try:
+                t = trace.now()
+                call = json.dumps([name, _encode(args), _encode(kwargs)]).encode('utf-8')
+                trace.write(CALL, t, a=call)
+                try:
+                    result = method(*args, **kwargs)
+                except Exception as e:
+                    trace.write_error(RESULT, t, trace.now() - t, b'', e)
+                    raise
+                trace.write(RESULT, t, trace.now() - t, b=json.dumps(_encode(result)).encode('utf-8'))
+                return result
+            finally:
+                depth.n = 0
+                lock.release()
+        return wrapper
+
+    for name in RECORDED_CALLS:
+        setattr(rfid, name, wrap(name, getattr(rfid, name)))
+    return trace
+
+
+def read_trace(path: str) -> Tuple[float, List[TraceEvent]]:
+    """
+    Load a trace file
+
+    Args:
+        path: Trace file
+
+    Returns:
+        Tuple[float, List[TraceEvent]]: (Start time as Unix time, Events in order)
+
+    Raises:
+        ValueError: Not a trace file (a truncated last record is dropped)
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < _HEADER.size:
+        raise ValueError(f"Not an APDU trace: {path}")
+    magic, version, started = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not an APDU trace (version {VERSION}): {path}")
+
+    events = []
+    pos = _HEADER.size
+    while pos + _RECORD.size <= len(data):
+        kind, t, duration, len_a, len_b = _RECORD.unpack_from(data, pos)
+        pos += _RECORD.size
+        if pos + len_a + len_b > len(data):
+            break
+        a = data[pos:pos + len_a]
+        b = data[pos + len_a:pos + len_a + len_b]
+        pos += len_a + len_b
+        events.append(TraceEvent(kind, t, duration, a, b))
+    return started, events
+
+
+# ----------------------------------------------------------------------
+# Replay
+# ----------------------------------------------------------------------
+
+class TraceMismatch(Exception):
+    """The code under replay did something the trace does not contain"""
+
+
+class ReplayConnection:
+    """Connection answering from the trace"""
+
+    def __init__(self, reader: "ReplayReader"):
+        self.reader = reader
+
+    def connect(self, *args, **kwargs):
+        self.reader.play(CONNECT)
+
+    def disconnect(self):
+        self.reader.play(DISCONNECT)
+
+    def getATR(self) -> List[int]:
+        return list(self.reader.play(ATR).b)
+
+    def transmit(self, apdu: List[int], *args, **kwargs) -> Tuple[List[int], int, int]:
+        response = self.reader.play(TRANSMIT, bytes(apdu)).b
+        return list(response[:-2]), response[-2], response[-1]
+
+    def pipeline(self, apdus: List[List[int]]):
+        if self.reader.next_kind() == PIPELINE:  # Only traces of a remote reader have them
+            self.reader.play(PIPELINE, _pack_apdus(apdus))
+
+
+class ReplayEscapeConnection(ReplayConnection):
+    """Replay connection with escape commands (traces that recorded some)"""
+
+    def control(self, code: int, command: List[int]) -> List[int]:
+        return list(self.reader.play(CONTROL, bytes(command)).b)
+
+
+class ReplayReader:
+    """Reader playing back the connection records of a trace, in order"""
+
+    def __init__(self, events: List[TraceEvent], speed: float = 0.0):
+        """
+        Args:
+            events: Trace events
+            speed: 1 = recorded timing, 10 = ten times faster, 0 = no waiting
+        """
+        self.events = events
+        self.speed = speed
+        self.name = next((e.a.decode('utf-8') for e in events if e.kind == READER), "Replay")
+        self.escape = any(e.kind & ~ERROR == CONTROL for e in events)  # The recorded reader had escape commands
+        self.pos = 0
+        self.end = len(events)      # Replay stops here (the current call's RESULT)
+        self.mismatches: List[str] = []
+        self._clock = None          # (perf_counter, trace offset) at the first played record
+
+    def __str__(self) -> str:
+        return self.name
+
+    def createConnection(self) -> "ReplayConnection":
+        return ReplayEscapeConnection(self) if self.escape else ReplayConnection(self)
+
+    def at_end(self) -> bool:
+        """True when the current call has used all its records"""
+        return self._skip_readers() >= self.end
+
+    def next_kind(self) -> Optional[int]:
+        """Kind of the next record of the current call (None at its end)"""
+        pos = self._skip_readers()
+        return self.events[pos].kind & ~ERROR if pos < self.end else None
+
+    def play(self, kind: int, command: bytes = b'') -> TraceEvent:
+        """
+        Next record, which must be of this kind (and command); raises it if it failed
+
+        Raises:
+            TraceMismatch: The code diverged from the trace
+        """
+        self.pos = self._skip_readers()
+        if self.pos >= self.end:
+            self._mismatch(f"extra {KIND_NAMES[kind]} {command.hex(' ')}".rstrip())
+        event = self.events[self.pos]
+        if event.kind & ~ERROR != kind or (kind in (TRANSMIT, PIPELINE, CONTROL) and event.a != command):
+            self._mismatch(f"{KIND_NAMES[kind]} {command.hex(' ')} where the trace has "
+                           f"{KIND_NAMES.get(event.kind & ~ERROR)} {event.a.hex(' ')}")
+        self.pos += 1
+        self._pace(event)
+        if event.kind & ERROR:
+            name, _, message = event.b.decode('utf-8').partition('\0')
+            raise _EXCEPTIONS.get(name, Exception)(message)
+        return event
+
+    def _skip_readers(self) -> int:
+        pos = self.pos
+        while pos < self.end and self.events[pos].kind == READER:
+            pos += 1
+        return pos
+
+    def _pace(self, event: TraceEvent):
+        if self.speed <= 0:
+            return
+        if self._clock is None:
+            self._clock = (time.perf_counter(), event.t)
+        start, offset = self._clock
+        delay = start + (event.t + event.duration - offset) / self.speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _mismatch(self, message: str):
+        self.mismatches.append(message)
+        raise TraceMismatch(message)
+
+
+class TraceDeadline(Deadline):
+    """A recorded deadline on replay: it expires when the call has used all its records"""
+
+    def __init__(self, reader: ReplayReader, seconds: float):
+        super().__init__(seconds)
+        self.reader = reader
+
+    def remaining(self) -> float:
+        return 0.0 if self.expired else self.seconds
+
+    @property
+    def expired(self) -> bool:
+        return self.reader.at_end()
+
+
+class ReplayReport:
+    """Outcome of a replay: one entry per recorded call"""
+
+    def __init__(self):
+        self.calls: List[Dict] = []
+
+    @property
+    def mismatches(self) -> List[Dict]:
+        return [call for call in self.calls if call['problems']]
+
+    def timings(self) -> Dict[str, Tuple[int, float, float]]:
+        """Per method: (calls, recorded seconds, replayed seconds)"""
+        totals = defaultdict(lambda: [0, 0.0, 0.0])
+        for call in self.calls:
+            total = totals[call['method']]
+            total[0] += 1
+            total[1] += call['recorded_s']
+            total[2] += call['replayed_s']
+        return {name: tuple(total) for name, total in totals.items()}
+
+
+def replay_session(events: List[TraceEvent], speed: float = 0.0, rfid=None) -> ReplayReport:
+    """
+    Repeat the recorded calls on a manager reading from the trace
+
+    Args:
+        events: Trace events (read_trace)
+        speed: 1 = recorded timing, 0 = as fast as possible
+        rfid: RFIDManager to test (default: a new one); it is connected to the replay reader
+
+    Returns:
+        ReplayReport: Per-call results and mismatches
+    """
+    from rfid_manager import RFIDManager  # The code under test
+
+    reader = ReplayReader(events, speed)
+    if rfid is None:
+        rfid = RFIDManager()
+    rfid.reader_source = lambda: [reader]
+    rfid.connect_reader(reader.name)
+
+    report = ReplayReport()
+    i = 0
+    while i < len(events):
+        if events[i].kind != CALL:
+            i += 1
+            continue
+        end = next((j for j in range(i + 1, len(events)) if events[j].kind & ~ERROR == RESULT),
+                   len(events))
+        name, args, kwargs = json.loads(events[i].a)
+        args, kwargs = _decode(args), {k: _decode(v) for k, v in kwargs.items() if v is not None}
+        if isinstance(kwargs.get('deadline'), dict):
+            # A call that ran out of time stops where its records stop
+            kwargs['deadline'] = TraceDeadline(reader, kwargs['deadline']['deadline'])
+        if name == 'wait_for_card':
+            # Poll exactly as often as the recording did
+            kwargs['should_stop'] = reader.at_end
+            kwargs['poll_interval'] = 0
+
+        reader.pos, reader.end = i + 1, end
+        mismatches_before = len(reader.mismatches)
+        started = time.perf_counter()
+        try:
+            result = _encode(getattr(rfid, name)(*args, **kwargs))
+            error = None
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+        replayed = time.perf_counter() - started
+
+        problems = list(reader.mismatches[mismatches_before:])
+        if not reader.at_end():
+            problems.append(f"{end - reader.pos} recorded records not used")
+        recorded_event = events[end] if end < len(events) else None
+        if recorded_event is None:
+            problems.append("trace ends inside this call")
+        elif recorded_event.kind & ERROR:
+            recorded = recorded_event.b.decode('utf-8').replace('\0', ': ')
+            if error != recorded:
+                problems.append(f"raised {error!r}, recorded {recorded!r}")
+        else:
+            recorded = json.loads(recorded_event.b)
+            # A wait ends by its deadline when recorded and by the trace when replayed
+            same = (result[:1] == recorded[:1] if name == 'wait_for_card' and result and recorded
+                    else result == recorded)
+            if error is not None or not same:
+                problems.append(f"returned {error or result!r}, recorded {recorded!r}")
+
+        report.calls.append({'method': name, 'args': args, 'problems': problems,
+                             'recorded_s': recorded_event.duration if recorded_event else 0.0,
+                             'replayed_s': replayed})
+        i = end + 1
+    return report
+
+
+# ----------------------------------------------------------------------
+# Command line
+# ----------------------------------------------------------------------
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def _command_key(apdu: bytes) -> str:
+    """CLA INS, or the PN532 command (and card command) of a direct transmit"""
+    if apdu[:4] == b'\xff\x00\x00\x00' and apdu[5:6] == b'\xd4' and len(apdu) >= 7:
+        if apdu[6] == 0x40 and len(apdu) >= 9:   # InDataExchange: card command
+            return f"D4 40 {apdu[8]:02X}"
+        return f"D4 {apdu[6]:02X}"
+    return f"{apdu[0]:02X} {apdu[1]:02X}"
+
+
+def print_info(path: str):
+    """Summary of a trace: calls, APDU latency per instruction, exceptions"""
+    started, events = read_trace(path)
+    last = max((e.t + e.duration for e in events), default=0.0)
+    print(f"{path}: {len(events)} records, {last:.1f} s from "
+          f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))}")
+
+    calls = defaultdict(int)
+    latency = defaultdict(list)
+    errors = defaultdict(int)
+    for event in events:
+        kind = event.kind & ~ERROR
+        if kind == CALL:
+            calls[json.loads(event.a)[0]] += 1
+        elif kind == TRANSMIT and len(event.a) >= 2:
+            latency[_command_key(event.a)].append(event.duration)
+        elif kind == PIPELINE:
+            latency['pipeline'].append(event.duration)   # Transmits it answered take ~0 ms
+        if event.kind & ERROR and kind != RESULT:
+            name = event.b.partition(b'\0')[0].decode('utf-8')
+            errors[f"{KIND_NAMES[kind]}: {name}"] += 1
+
+    print("\nCalls:")
+    for name, count in sorted(calls.items(), key=lambda item: -item[1]):
+        print(f"  {name:<20} {count}")
+    print("\nAPDU latency (CLA INS, or D4 + PN532 command: count, median / p95 / max ms):")
+    for ins, values in sorted(latency.items()):
+        print(f"  {ins:<8}  {len(values):>6}  {_percentile(values, 0.5) * 1000:7.1f} "
+              f"{_percentile(values, 0.95) * 1000:7.1f} {max(values) * 1000:7.1f}")
+    if errors:
+        print("\nExceptions:")
+        for name, count in sorted(errors.items()):
+            print(f"  {name:<40} {count}")
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Inspect or replay an APDU trace")
+    parser.add_argument('command', choices=('info', 'replay'))
+    parser.add_argument('trace', help="Trace file (.ktr)")
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help="Replay speed: 1 = recorded timing, 0 = no waiting (default)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.trace):
+        print(f"File not found: {args.trace}")
+        return 1
+    if args.command == 'info':
+        print_info(args.trace)
+        return 0
+
+    _, events = read_trace(args.trace)
+    report = replay_session(events, args.speed)
+    for i, call in enumerate(report.calls):
+        for problem in call['problems']:
+            print(f"call {i} {call['method']}{tuple(call['args'])}: {problem}")
+    print(f"\n{len(report.calls)} calls replayed, {len(report.mismatches)} mismatches")
+    print(f"{'Method':<20} {'Calls':>6} {'Recorded s':>11} {'Replayed s':>11}")
+    for name, (count, recorded, replayed) in sorted(report.timings().items()):
+        print(f"{name:<20} {count:>6} {recorded:>11.3f} {replayed:>11.3f}")
+    return 1 if report.mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
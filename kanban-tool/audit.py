@@ -0,0 +1,332 @@
+"""
+CWT Thread Verification System - Card Audit
+Verify-only audit of a rack of Kanban cards against a plan or inventory
+
+Cards are read with one sector authentication and checked in constant time
+against hash indexes of the plan. Only exceptions are signalled (red LED and
+beep on the reader) and written to the discrepancy report as they happen, so
+the operator can sweep cards over the reader without looking at the screen.
+A card that fails to read stays open: placed again, it is read again, and a
+successful read is reported in a row that supersedes its read_error row.
+
+Usage:
+    python audit.py plan.csv -o audit.csv
+    python audit.py plan.csv --count 500 --idle-timeout 120
+"""
+
+import argparse
+import csv
+import logging
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cancellation import Budget, CancelToken
+from config import AUDIT_IDLE_TIMEOUT, AUDIT_POLL_TIMEOUT
+from plan import PlanRow, load_plan, normalize_uid
+from session_stats import SessionStats
+
+
+# Audit results; everything except OK and DUPLICATE is an exception
+OK = 'ok'
+DUPLICATE = 'duplicate'
+WRONG_CONTENT = 'wrong_content'
+NOT_IN_PLAN = 'not_in_plan'
+OVER_QUANTITY = 'over_quantity'
+BLANK = 'blank'
+REVOKED = 'revoked'
+READ_ERROR = 'read_error'
+MISSING = 'missing'
+
+REPORT_FIELDS = ['time', 'uid', 'status', 'thread1', 'thread2', 'expected', 'detail']
+
+
+class CardAudit:
+    """Checks cards against a plan and streams discrepancies to a CSV report"""
+
+    def __init__(self, rows: List[PlanRow], report_path: str):
+        """
+        Args:
+            rows: Plan rows; rows with a UID pin that card, the others are inventory
+            report_path: Discrepancy report (CSV), written as cards are checked
+        """
+        self.by_uid: Dict[str, Tuple[str, str]] = {}
+        self.quota: Counter = Counter()
+        for row in rows:
+            if row.uid:
+                self.by_uid[row.uid] = (row.thread1, row.thread2)
+            else:
+                self.quota[(row.thread1, row.thread2)] += row.quantity
+
+        self.seen = set()
+        self.read_errors = set()    # Cards whose reads failed so far (not seen: they may be placed again)
+        self.found: Counter = Counter()
+        self.counts: Counter = Counter()
+
+        self._file = open(report_path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=REPORT_FIELDS)
+        self._writer.writeheader()
+        self._file.flush()
+
+    def is_seen(self, uid: str) -> bool:
+        """True if this card was already audited (lets the caller skip reading it again)"""
+        return normalize_uid(uid) in self.seen
+
+    def check(self, uid: str, thread1: Optional[str], thread2: Optional[str],
+              error: str = "", revoked: bool = False) -> Tuple[str, str]:
+        """
+        Check one card
+
+        Args:
+            uid: Card UID
+            thread1: Thread 1 code read (None if the read failed)
+            thread2: Thread 2 code read
+            error: Read error message when the read failed
+            revoked: Card is on the revocation list (reported whatever it holds)
+
+        Returns:
+            Tuple[str, str]: (Status, Detail)
+        """
+        uid = normalize_uid(uid)
+        if uid in self.seen:
+            return DUPLICATE, "Already audited"
+
+        expected = self.by_uid.get(uid)
+        content = (thread1, thread2)
+
+        if revoked:
+            status, detail = REVOKED, "Card is on the revocation list"
+        elif thread1 is None:
+            status, detail = READ_ERROR, error
+        elif not thread1 and not thread2:
+            status, detail = BLANK, "Card is blank"
+        elif expected is not None:
+            if content == expected:
+                status, detail = OK, ""
+            else:
+                status, detail = WRONG_CONTENT, "Content differs from the plan row for this card"
+        elif content not in self.quota:
+            status, detail = NOT_IN_PLAN, "No plan row with this content"
+        else:
+            self.found[content] += 1
+            if self.found[content] > self.quota[content]:
+                status = OVER_QUANTITY
+                detail = f"{self.found[content]} cards found, plan has {self.quota[content]}"
+            else:
+                status, detail = OK, ""
+
+        if status == READ_ERROR:
+            if uid not in self.read_errors:
+                self.read_errors.add(uid)
+                self.counts[status] += 1
+                self._report(uid, status, thread1, thread2, expected, detail)
+            return status, detail
+
+        self.seen.add(uid)
+        self.counts[status] += 1
+        if uid in self.read_errors:
+            self.read_errors.discard(uid)
+            self.counts[READ_ERROR] -= 1
+            if not self.counts[READ_ERROR]:
+                del self.counts[READ_ERROR]
+            note = "Read on retry; supersedes the read_error row"
+            self._report(uid, status, thread1, thread2, expected, f"{detail} ({note})" if detail else note)
+        elif status != OK:
+            self._report(uid, status, thread1, thread2, expected, detail)
+        return status, detail
+
+    def finish(self) -> Dict[str, int]:
+        """
+        Report cards the plan expects but the audit did not see, and close the report
+
+        Returns:
+            Dict[str, int]: Count per status
+        """
+        for uid, expected in self.by_uid.items():
+            if uid not in self.seen and uid not in self.read_errors:
+                self.counts[MISSING] += 1
+                self._report(uid, MISSING, "", "", expected, "Planned card not found")
+        for content, quantity in self.quota.items():
+            short = quantity - self.found[content]
+            if short > 0:
+                self.counts[MISSING] += short
+                self._report("", MISSING, "", "", content, f"{short} of {quantity} cards not found")
+        self._file.close()
+        return dict(self.counts)
+
+    def _report(self, uid: str, status: str, thread1, thread2, expected, detail: str):
+        self._writer.writerow({
+            'time': datetime.now().strftime('%H:%M:%S'),
+            'uid': uid,
+            'status': status,
+            'thread1': thread1 or '',
+            'thread2': thread2 or '',
+            'expected': ' / '.join(expected) if expected else '',
+            'detail': detail,
+        })
+        self._file.flush()
+
+
+def run_audit(rfid, audit: CardAudit, should_stop: Callable[[], bool],
+              on_result: Optional[Callable[[str, str, str, Optional[str], Optional[str]], None]] = None,
+              count: Optional[int] = None, idle_timeout: float = AUDIT_IDLE_TIMEOUT) -> int:
+    """
+    Audit cards as they are placed on the reader
+
+    Cards already audited are recognised by UID and skipped without reading,
+    so the operator does not have to wait for removal before the next card.
+    A card whose read failed is read again once it has left the reader.
+
+    Args:
+        rfid: Connected RFIDManager
+        audit: Audit session
+        should_stop: Polled between cards (GUI Stop button, Ctrl+C)
+        on_result: Called with (uid, status, detail, thread1, thread2) per new card
+        count: Stop after this many cards
+        idle_timeout: Stop after this many seconds without a new card
+
+    Returns:
+        int: Number of cards audited
+    """
+    steps = audit_steps(rfid, audit, should_stop, on_result, count, idle_timeout)
+    while True:
+        try:
+            next(steps)
+        except StopIteration as done:
+            return done.value
+
+
+def audit_steps(rfid, audit: CardAudit, should_stop: Callable[[], bool],
+                on_result: Optional[Callable[[str, str, str, Optional[str], Optional[str]], None]] = None,
+                count: Optional[int] = None, idle_timeout: float = AUDIT_IDLE_TIMEOUT,
+                stats: Optional[SessionStats] = None, cancel: Optional[CancelToken] = None):
+    """
+    run_audit as a scheduler job: yields at every card boundary (see scheduler.py)
+
+    Args:
+        stats: Session statistics to update per card (e.g. the GUI's live panel)
+        cancel: Token of the job; ends card waits and reads at once (should_stop
+            is only polled between cards)
+
+    Returns:
+        int: Number of cards audited
+    """
+    audited = 0
+    quiet = False
+    last_new = time.time()
+    failed = None   # Card whose read failed, until it leaves the reader
+    stats = stats if stats is not None else SessionStats('audit')
+    budget = Budget(cancel)
+
+    while not should_stop() and (count is None or audited < count):
+        if time.time() - last_new > idle_timeout:
+            break
+
+        success, _ = rfid.wait_for_card(timeout=AUDIT_POLL_TIMEOUT, cancel=cancel)
+        if not success:
+            failed = None
+            yield
+            continue
+
+        uid = rfid.get_card_uid()
+        if uid != failed:
+            failed = None
+        if uid is None or uid == failed or audit.is_seen(uid):
+            rfid.disconnect()
+            budget.wait(AUDIT_POLL_TIMEOUT / 5)  # Card still on the reader
+            yield
+            continue
+
+        if not quiet:
+            # Beep only on exceptions, not on every card
+            quiet = rfid.set_detect_buzzer(False)
+
+        started = time.perf_counter()
+        ok, thread1, thread2, msg = rfid.read_kanban(cancel=cancel)
+        if not ok and budget.cancelled:
+            rfid.disconnect()
+            break   # Stopped mid-read: not an exception of the card
+        stats.record(ok, time.perf_counter() - started, thread1, thread2)
+        retry = normalize_uid(uid) in audit.read_errors
+        status, detail = audit.check(uid, thread1 if ok else None, thread2 if ok else None, msg,
+                                     revoked=rfid.card_revoked)
+        if status == READ_ERROR:
+            failed = uid
+        if status != OK:
+            rfid.signal_exception()
+        else:
+            rfid.signal_result(True)  # Reader profile LED, if it has one
+        rfid.disconnect()
+
+        if not retry:
+            audited += 1    # A card read again after a read error was counted the first time
+        last_new = time.time()
+        if on_result:
+            on_result(uid, status, detail, thread1, thread2)
+        yield
+
+    if quiet:
+        # The reader setting needs a card; without one it resets at the next power cycle
+        if rfid.wait_for_card(timeout=AUDIT_POLL_TIMEOUT)[0]:
+            rfid.set_detect_buzzer(rfid.profile is None or rfid.profile.detect_buzzer)
+            rfid.disconnect()
+
+    return audited
+
+
+def main():
+    """Command-line entry point (headless audit)"""
+    parser = argparse.ArgumentParser(description="Audit a rack of Kanban cards against a plan")
+    parser.add_argument('plan', help="Plan CSV (thread1, thread2, quantity, uid)")
+    parser.add_argument('-o', '--output', default=f"audit_{datetime.now():%Y%m%d_%H%M}.csv",
+                        help="Discrepancy report CSV")
+    parser.add_argument('--count', type=int, default=None, help="Stop after this many cards")
+    parser.add_argument('--idle-timeout', type=float, default=AUDIT_IDLE_TIMEOUT,
+                        help="Stop after this many seconds without a new card")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+
+    from rfid_manager import RFIDManager  # Needs pyscard; keep plan checks importable without it
+
+    rows, errors = load_plan(args.plan)
+    for err in errors:
+        print(f"Plan {err}")
+    if not rows:
+        print("Plan has no valid rows")
+        return 1
+
+    rfid = RFIDManager()
+    success, msg = rfid.connect_reader()
+    print(msg)
+    if not success:
+        return 1
+
+    audit = CardAudit(rows, args.output)
+    print(f"Auditing against {len(rows)} plan rows. Sweep cards over the reader, Ctrl+C to finish.")
+
+    def show(uid, status, detail, thread1, thread2):
+        if status == OK:
+            print(f"  {uid}  ok")
+        else:
+            print(f"! {uid}  {status.upper()}  {thread1 or ''} / {thread2 or ''}  {detail}")
+
+    start = time.time()
+    try:
+        audited = run_audit(rfid, audit, lambda: False, show, args.count, args.idle_timeout)
+    except KeyboardInterrupt:
+        audited = len(audit.seen)
+    counts = audit.finish()
+
+    elapsed = time.time() - start
+    print(f"\n{audited} cards in {elapsed:.0f}s")
+    for status, n in sorted(counts.items()):
+        print(f"  {status:<14} {n:>5}")
+    print(f"Report: {args.output}")
+    return 0 if all(s == OK for s in counts) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+CWT Thread Verification System - Cancellation
+Cancellation tokens and deadlines for card operations
+
+Every RFIDManager card operation (read_kanban, write_kanban, write_bypass,
+clear_card, dump_card, verify_data and the block methods) takes two keyword
+arguments:
+
+    cancel      A CancelToken; cancel() it from any thread (the Stop button)
+    deadline    A Deadline (default: CARD_OPERATION_BUDGET seconds from the start)
+
+Both are checked before each APDU and end every wait inside the operation
+(retry backoff, reconnect after RF loss), so a cancelled operation stops
+within one APDU. It then returns its usual failure tuple, with the reason
+as message. An APDU already inside the reader driver is not interrupted:
+the CCID and proxy transports bound their I/O by the deadline, a PC/SC
+driver by its own timeouts.
+
+Example:
+    token = CancelToken()
+    success, msg = rfid.write_kanban(thread1, thread2, cancel=token, deadline=Deadline(2.0))
+
+    token.cancel("Stopped by operator")   # From another thread
+"""
+
+import threading
+import time
+from typing import Optional
+
+
+class OperationCancelled(Exception):
+    """The operation's token was cancelled"""
+
+
+class DeadlineExceeded(OperationCancelled):
+    """The operation ran out of time"""
+
+
+class CancelToken(threading.Event):
+    """An Event set once to cancel, with the reason (wait() returns at once when cancelled)"""
+
+    def __init__(self):
+        super().__init__()
+        self.reason = ""
+
+    def cancel(self, reason: str = "Stopped"):
+        if not self.is_set():
+            self.reason = reason
+        self.set()
+
+
+class Deadline:
+    """Point in time (monotonic clock) an operation must be finished by"""
+
+    def __init__(self, seconds: float):
+        """
+        Args:
+            seconds: Time allowed from now
+        """
+        self.seconds = seconds
+        self.at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.at
+
+
+class Budget:
+    """A token and a deadline together: what one card operation may still spend"""
+
+    def __init__(self, cancel: Optional[threading.Event] = None, deadline: Optional[Deadline] = None):
+        """
+        Args:
+            cancel: CancelToken (any threading.Event works)
+            deadline: Deadline, or None for no time limit
+        """
+        self.cancel = cancel
+        self.deadline = deadline
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel is not None and self.cancel.is_set()
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and self.deadline.expired
+
+    def timeout(self, seconds: float) -> float:
+        """seconds, shortened to the time left before the deadline"""
+        return seconds if self.deadline is None else min(seconds, self.deadline.remaining())
+
+    def check(self):
+        """
+        Raises:
+            OperationCancelled: The token was cancelled
+            DeadlineExceeded: The deadline has passed
+        """
+        if self.cancelled:
+            raise OperationCancelled(f"Cancelled: {getattr(self.cancel, 'reason', '') or 'Stopped'}")
+        if self.expired:
+            raise DeadlineExceeded(f"Deadline exceeded ({self.deadline.seconds:g} s)")
+
+    def wait(self, seconds: float) -> bool:
+        """
+        Sleep up to seconds, waking at once on cancel and at the deadline
+
+        Returns:
+            bool: True if the budget is spent (cancelled or expired)
+        """
+        seconds = self.timeout(seconds)
+        if self.cancel is not None:
+            self.cancel.wait(seconds)
+        elif seconds > 0:
+            time.sleep(seconds)
+        return self.cancelled or self.expired
+
+    def sleep(self, seconds: float):
+        """
+        wait(), raising if the budget is spent
+
+        Raises:
+            OperationCancelled: The token was cancelled
+            DeadlineExceeded: The deadline has passed
+        """
+        if self.wait(seconds):
+            self.check()
+
+
+UNBOUNDED = Budget()   # Calls made outside a card operation (presence polls, buzzer)
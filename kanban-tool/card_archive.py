@@ -0,0 +1,477 @@
+"""
+CWT Thread Verification System - Card Archive
+Full card images for audits and failure analysis, in an append-only file with a memory-mapped UID index
+
+Each dump (RFIDManager.dump_card) is one fixed-size record appended to
+ARCHIVE_FILE:
+
+    header (32 bytes)   "KD", UID length, UID (10 bytes, zero padded),
+                        readable-sector mask, time (Unix seconds, double)
+    image (1024 bytes)  blocks 0-63; sectors no key opened are zeros, and
+                        Key A always reads as zeros
+
+The index (ARCHIVE_FILE + ".idx") is a sorted array of 24-byte entries
+(UID length, UID, record offset) for the archive up to the size recorded in
+its header. Lookups binary-search the memory-mapped index, so finding a card
+touches a few pages of it and reads only the records asked for, whatever the
+archive size. Records appended since the index was written are kept in a
+small in-memory tail (rebuilt at open from their headers); once it holds
+ARCHIVE_INDEX_TAIL records the index is rewritten, merging the tail in.
+
+A torn last record (power lost during an append) is cut off at open, and a
+missing or stale index is rebuilt from the record headers.
+
+Usage:
+    python card_archive.py dump                # Sweep cards over the reader, Ctrl+C to finish
+    python card_archive.py show "04 A1 B2 C3"  # Latest image (--all for every dump)
+    python card_archive.py diff "04 A1 B2 C3"  # Latest two dumps of a card
+    python card_archive.py diff "04 A1 B2 C3" "04 55 66 77"
+"""
+
+import argparse
+import heapq
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Set
+
+from config import (
+    BLOCK_SIZE, ARCHIVE_FILE, ARCHIVE_INDEX_TAIL, ARCHIVE_IDLE_TIMEOUT, ARCHIVE_POLL_TIMEOUT
+)
+from card_drivers import CLASSIC_1K_SECTORS
+from plan import normalize_uid
+from session_stats import SessionStats
+
+
+RECORD_MAGIC = b"KD"
+INDEX_MAGIC = b"KDIX"
+INDEX_VERSION = 1
+UID_SIZE = 10                                     # Triple-size UID
+
+RECORD_HEADER = struct.Struct('>2sB10sHd9x')      # magic, UID length, UID, readable mask, time
+IMAGE_SIZE = CLASSIC_1K_SECTORS * 4 * BLOCK_SIZE
+RECORD_SIZE = RECORD_HEADER.size + IMAGE_SIZE
+INDEX_HEADER = struct.Struct('>4sH2xQ')           # magic, version, archive size covered
+INDEX_ENTRY = struct.Struct('>B10s5xQ')           # UID length, UID, record offset
+KEY_SIZE = 1 + UID_SIZE                           # Entry prefix compared by lookups
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CardImage:
+    """One archived dump"""
+    uid: str
+    ts: datetime
+    readable: int        # Bit n set: sector n was read
+    image: bytes
+    offset: int          # Record position in the archive
+
+    def block(self, block: int) -> bytes:
+        return self.image[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE]
+
+    def sector_read(self, sector: int) -> bool:
+        return bool(self.readable >> sector & 1)
+
+
+def uid_key(uid: str) -> bytes:
+    """Index key of a UID: length byte and zero-padded UID bytes"""
+    try:
+        raw = bytes.fromhex(uid.replace(':', ' ').replace('-', ' '))  # Any normalize_uid input
+    except ValueError:
+        raw = b""
+    if not 0 < len(raw) <= UID_SIZE:
+        raise ValueError(f"Invalid card UID: {uid!r}")
+    return bytes([len(raw)]) + raw.ljust(UID_SIZE, b'\0')
+
+
+def diff_images(a: CardImage, b: CardImage) -> List[int]:
+    """
+    Blocks whose content differs between two images
+
+    Sectors that were not read in both images are left out.
+
+    Returns:
+        List[int]: Block numbers
+    """
+    both = a.readable & b.readable
+    return [block for block in range(CLASSIC_1K_SECTORS * 4)
+            if both >> (block // 4) & 1 and a.block(block) != b.block(block)]
+
+
+class CardArchive:
+    """Append-only card image archive with a sorted, memory-mapped UID index"""
+
+    def __init__(self, path: str = ARCHIVE_FILE, tail_limit: int = ARCHIVE_INDEX_TAIL):
+        """
+        Args:
+            path: Archive file (created if missing)
+            tail_limit: Records kept out of the index file before it is rewritten
+        """
+        self.path = path
+        self.index_path = path + ".idx"
+        self.tail_limit = tail_limit
+        self.logger = logging.getLogger(__name__)
+
+        self._file = open(path, 'a+b')
+        self._size = os.fstat(self._file.fileno()).st_size
+        torn = self._size % RECORD_SIZE
+        if torn:
+            self.logger.warning(f"{path}: incomplete last record ({torn} bytes) removed")
+            self._size -= torn
+            self._file.truncate(self._size)
+
+        self._index: Optional[mmap.mmap] = None
+        self._entries = 0
+        self._covered = 0                        # Archive bytes the index file covers
+        self._tail: Dict[bytes, List[int]] = {}  # Key -> offsets appended since
+        self._tail_count = 0
+        self._open_index()
+        for offset in range(self._covered, self._size, RECORD_SIZE):
+            self._add_tail(self._read_key(offset), offset)
+        if self._tail_count >= self.tail_limit:
+            self.reindex()
+
+    def __enter__(self) -> "CardArchive":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._size // RECORD_SIZE
+
+    def append(self, uid: str, image: bytes, readable: int, ts: Optional[float] = None) -> int:
+        """
+        Archive one card image
+
+        Args:
+            uid: Card UID
+            image: 1 KB image (RFIDManager.dump_card)
+            readable: Readable sectors bit mask
+            ts: Dump time (default: now)
+
+        Returns:
+            int: Record offset
+        """
+        if len(image) != IMAGE_SIZE:
+            raise ValueError(f"Card image must be {IMAGE_SIZE} bytes, got {len(image)}")
+        key = uid_key(uid)
+        header = RECORD_HEADER.pack(RECORD_MAGIC, key[0], key[1:], readable,
+                                    time.time() if ts is None else ts)
+        offset = self._size
+        self._file.write(header + bytes(image))
+        self._file.flush()
+        self._size += RECORD_SIZE
+
+        self._add_tail(key, offset)
+        if self._tail_count >= self.tail_limit:
+            self.reindex()
+        return offset
+
+    def offsets(self, uid: str) -> List[int]:
+        """Record offsets of a card, oldest first"""
+        key = uid_key(uid)
+        return self._search(key) + self._tail.get(key, [])
+
+    def images(self, uid: str) -> List[CardImage]:
+        """Every archived image of a card, oldest first"""
+        return [self.read(offset) for offset in self.offsets(uid)]
+
+    def latest(self, uid: str) -> Optional[CardImage]:
+        """Most recent image of a card, or None if it was never dumped"""
+        offsets = self.offsets(uid)
+        return self.read(offsets[-1]) if offsets else None
+
+    def read(self, offset: int) -> CardImage:
+        """
+        Read one record
+
+        Raises:
+            ValueError: Not a record boundary, or a damaged record
+        """
+        if offset % RECORD_SIZE or not 0 <= offset < self._size:
+            raise ValueError(f"No record at offset {offset}")
+        self._file.seek(offset)
+        record = self._file.read(RECORD_SIZE)
+        magic, length, uid, readable, ts = RECORD_HEADER.unpack_from(record)
+        if magic != RECORD_MAGIC:
+            raise ValueError(f"Damaged record at offset {offset}")
+        return CardImage(uid=uid[:length].hex(' ').upper(), ts=datetime.fromtimestamp(ts),
+                         readable=readable, image=record[RECORD_HEADER.size:], offset=offset)
+
+    def uids(self) -> Iterator[str]:
+        """Archived card UIDs, each once (index order, then cards only in the tail)"""
+        last = None
+        for entry in self._index_entries():
+            if entry[:KEY_SIZE] != last:
+                last = entry[:KEY_SIZE]
+                yield last[1:1 + last[0]].hex(' ').upper()
+        for key in self._tail:
+            if not self._search(key):
+                yield key[1:1 + key[0]].hex(' ').upper()
+
+    def reindex(self):
+        """Rewrite the index file with every record (merges the tail into the sorted entries)"""
+        tail = sorted(INDEX_ENTRY.pack(key[0], key[1:], offset)
+                      for key, offsets in self._tail.items() for offset in offsets)
+        temp = self.index_path + ".tmp"
+        with open(temp, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, self._size))
+            for entry in heapq.merge(self._index_entries(), tail):
+                f.write(entry)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._close_index()  # An open mapping blocks the replace on Windows
+        os.replace(temp, self.index_path)
+        self._tail.clear()
+        self._tail_count = 0
+        self._open_index()
+        self.logger.info(f"{self.index_path}: {self._entries} records indexed")
+
+    def close(self):
+        """Write the tail into the index and close the files"""
+        if self._file.closed:
+            return
+        if self._tail_count:
+            try:
+                self.reindex()
+            except OSError as e:
+                self.logger.error(f"Failed to write {self.index_path}: {e}")
+        self._close_index()
+        self._file.close()
+
+    def _open_index(self):
+        self._index, self._entries, self._covered = None, 0, 0
+        try:
+            with open(self.index_path, 'rb') as f:
+                index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):  # Missing, or empty (cannot be mapped)
+            return
+
+        valid = len(index) >= INDEX_HEADER.size and (len(index) - INDEX_HEADER.size) % INDEX_ENTRY.size == 0
+        magic, version, covered = INDEX_HEADER.unpack_from(index) if valid else (b"", 0, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or covered > self._size:
+            self.logger.warning(f"{self.index_path} does not match the archive, rebuilding it")
+            index.close()
+            return
+        self._index = index
+        self._entries = (len(index) - INDEX_HEADER.size) // INDEX_ENTRY.size
+        self._covered = covered
+
+    def _close_index(self):
+        if self._index is not None:
+            self._index.close()
+        self._index, self._entries, self._covered = None, 0, 0
+
+    def _index_entries(self) -> Iterator[bytes]:
+        for i in range(self._entries):
+            start = INDEX_HEADER.size + i * INDEX_ENTRY.size
+            yield self._index[start:start + INDEX_ENTRY.size]
+
+    def _search(self, key: bytes) -> List[int]:
+        """Offsets of a key in the index file (binary search on the mapping)"""
+        index, size = self._index, INDEX_ENTRY.size
+        lo, hi = 0, self._entries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = INDEX_HEADER.size + mid * size
+            if index[start:start + KEY_SIZE] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        offsets = []
+        start = INDEX_HEADER.size + lo * size
+        while lo < self._entries and index[start:start + KEY_SIZE] == key:
+            offsets.append(INDEX_ENTRY.unpack_from(index, start)[2])
+            lo += 1
+            start += size
+        return offsets
+
+    def _read_key(self, offset: int) -> bytes:
+        self._file.seek(offset)
+        magic, length, uid, _, _ = RECORD_HEADER.unpack(self._file.read(RECORD_HEADER.size))
+        if magic != RECORD_MAGIC:
+            raise ValueError(f"{self.path}: damaged record at offset {offset}")
+        return bytes([length]) + uid
+
+    def _add_tail(self, key: bytes, offset: int):
+        self._tail.setdefault(key, []).append(offset)
+        self._tail_count += 1
+
+
+def format_image(image: CardImage) -> str:
+    """Hex listing of an image, one block per line (sectors not read shown as --)"""
+    lines = [f"{image.uid}  {image.ts:%Y-%m-%d %H:%M:%S}  "
+             f"{bin(image.readable).count('1')}/{CLASSIC_1K_SECTORS} sectors read"]
+    for block in range(CLASSIC_1K_SECTORS * 4):
+        if image.sector_read(block // 4):
+            data = image.block(block)
+            text = "".join(chr(b) if 32 <= b < 127 else '.' for b in data)
+            lines.append(f"  {block:2d}  {data.hex(' ').upper()}  {text}")
+        else:
+            lines.append(f"  {block:2d}  {' '.join(['--'] * BLOCK_SIZE)}")
+    return "\n".join(lines)
+
+
+def format_diff(a: CardImage, b: CardImage) -> str:
+    """Blocks that differ between two images, old and new content under each other"""
+    blocks = diff_images(a, b)
+    lines = [f"{a.uid} {a.ts:%Y-%m-%d %H:%M:%S}  ->  {b.uid} {b.ts:%Y-%m-%d %H:%M:%S}: "
+             f"{len(blocks)} block(s) differ"]
+    for block in blocks:
+        lines.append(f"  {block:2d}  - {a.block(block).hex(' ').upper()}")
+        lines.append(f"      + {b.block(block).hex(' ').upper()}")
+    only = (a.readable ^ b.readable) & ((1 << CLASSIC_1K_SECTORS) - 1)
+    if only:
+        sectors = [str(s) for s in range(CLASSIC_1K_SECTORS) if only >> s & 1]
+        lines.append(f"  Sectors read in one image only: {', '.join(sectors)}")
+    return "\n".join(lines)
+
+
+def dump_steps(rfid, archive: CardArchive, should_stop: Callable[[], bool],
+               on_result: Optional[Callable[[str, Optional[CardImage], str], None]] = None,
+               count: Optional[int] = None, idle_timeout: float = ARCHIVE_IDLE_TIMEOUT,
+               stats: Optional[SessionStats] = None):
+    """
+    Dump cards as they are placed on the reader (scheduler job: yields at every card boundary)
+
+    Args:
+        rfid: Connected RFIDManager
+        archive: Archive the images are appended to
+        should_stop: Polled between cards (Ctrl+C, GUI Stop button)
+        on_result: Called with (uid, image or None, message) once per card
+        count: Stop after this many cards
+        idle_timeout: Stop after this many seconds without a new card
+        stats: Session statistics to update per card
+
+    Returns:
+        int: Number of cards dumped
+    """
+    dumped = 0
+    seen: Set[str] = set()   # Cards handled in this run (still on the reader, or passed again)
+    last_new = time.time()
+    stats = stats if stats is not None else SessionStats('dump')
+
+    while not should_stop() and (count is None or dumped < count):
+        if time.time() - last_new > idle_timeout:
+            break
+
+        success, _ = rfid.wait_for_card(timeout=ARCHIVE_POLL_TIMEOUT)
+        if not success:
+            yield
+            continue
+
+        uid = rfid.card_uid
+        if uid is None or normalize_uid(uid) in seen:
+            rfid.disconnect()
+            time.sleep(ARCHIVE_POLL_TIMEOUT / 5)  # Card still on the reader
+            yield
+            continue
+        seen.add(normalize_uid(uid))
+
+        started = time.perf_counter()
+        with rfid.session():
+            ok, image, readable, msg = rfid.dump_card()
+            rfid.signal_result(ok)
+            rfid.disconnect()
+        stats.record(ok, time.perf_counter() - started)
+
+        record = archive.read(archive.append(uid, image, readable)) if ok else None
+        dumped += ok
+        last_new = time.time()
+        if on_result:
+            on_result(uid, record, msg)
+        yield
+
+    return dumped
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Dump Kanban cards and look up archived card images")
+    parser.add_argument('--archive', default=ARCHIVE_FILE, help="Archive file")
+    commands = parser.add_subparsers(dest='command', required=True)
+    dump = commands.add_parser('dump', help="Dump cards swept over the reader")
+    dump.add_argument('--count', type=int, default=None, help="Stop after this many cards")
+    dump.add_argument('--idle-timeout', type=float, default=ARCHIVE_IDLE_TIMEOUT,
+                      help="Stop after this many seconds without a new card")
+    show = commands.add_parser('show', help="Print the latest image of a card")
+    show.add_argument('uid')
+    show.add_argument('--all', action='store_true', help="Every archived image of the card")
+    diff = commands.add_parser('diff', help="Compare the latest two images of a card, or of two cards")
+    diff.add_argument('uid')
+    diff.add_argument('other', nargs='?')
+    commands.add_parser('reindex', help="Rebuild the UID index")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+
+    with CardArchive(args.archive) as archive:
+        if args.command == 'dump':
+            return _dump(archive, args)
+
+        if args.command == 'reindex':
+            archive.reindex()
+            print(f"{len(archive)} records indexed")
+            return 0
+
+        images = archive.images(args.uid)
+        if not images:
+            print(f"{args.uid}: not in the archive")
+            return 1
+        if args.command == 'show':
+            for image in images if args.all else images[-1:]:
+                print(format_image(image))
+            return 0
+
+        if args.other:
+            other = archive.latest(args.other)
+            if other is None:
+                print(f"{args.other}: not in the archive")
+                return 1
+            pair = (images[-1], other)
+        elif len(images) < 2:
+            print(f"{args.uid}: only one image archived")
+            return 1
+        else:
+            pair = (images[-2], images[-1])
+        print(format_diff(*pair))
+        return 0 if not diff_images(*pair) else 2
+
+
+def _dump(archive: CardArchive, args) -> int:
+    from rfid_manager import RFIDManager  # Needs pyscard; keep lookups usable without it
+
+    rfid = RFIDManager()
+    success, msg = rfid.connect_reader()
+    print(msg)
+    if not success:
+        return 1
+    print(f"{len(archive)} images archived. Sweep cards over the reader, Ctrl+C to finish.")
+
+    def show(uid, image, msg):
+        print(f"  {uid}  {msg}" if image else f"! {uid}  {msg}")
+
+    steps = dump_steps(rfid, archive, lambda: False, show, args.count, args.idle_timeout)
+    dumped = 0
+    try:
+        while True:
+            next(steps)
+    except StopIteration as done:
+        dumped = done.value
+    except KeyboardInterrupt:
+        pass
+    print(f"Archive: {archive.path} ({len(archive)} images{f', {dumped} new' if dumped else ''})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+CWT Thread Verification System - Card Drivers
+Card type detection from the ATR and per-type access to the Kanban blocks
+
+The Kanban data is three 16-byte logical blocks (BLOCK_THREAD1, BLOCK_THREAD2,
+BLOCK_COMMIT, see docs/DATA_FORMAT.md). A driver maps them to the card's
+memory:
+
+    MIFARE Classic   blocks 4-6 of sector 1, Load Key + Authenticate per sector
+    NTAG21x /        pages 4-15 (block 4 -> pages 4-7, 5 -> 8-11, 6 -> 12-15),
+    Ultralight       no authentication; one read returns four pages (16 bytes),
+                     writes are one page (4 bytes) each, unchanged pages skipped
+
+A commit (PENDING -> COMMITTED) changes only page 12 on these cards, so it
+is a single page write.
+
+The card type comes from the ATR that the ACR122U builds from the card's SAK
+(PC/SC Part 3: standard byte 12, card name bytes 13-14). Pages 4-15 exist on
+every Ultralight variant and NTAG213/215/216, so one layout serves them all.
+The NDEF area of NTAG cards is overwritten: use cards dedicated to Kanban.
+"""
+
+from itertools import takewhile
+from typing import Dict, List, Optional, Tuple
+
+from config import BLOCK_SIZE, BLOCK_THREAD1
+from retry_policy import STEP_AUTH, STEP_LOAD_KEY, STEP_READ, STEP_WRITE
+
+
+# Card types (also the card_type metrics label)
+CARD_CLASSIC_1K = 'classic_1k'
+CARD_CLASSIC_4K = 'classic_4k'
+CARD_ULTRALIGHT = 'ultralight'    # MIFARE Ultralight / Ultralight C / NTAG21x
+CARD_UNKNOWN = 'unknown'
+
+# PC/SC Part 3 card names (ATR bytes 13-14) for ISO 14443 A part 3 cards
+_CARD_NAMES = {
+    (0x00, 0x01): CARD_CLASSIC_1K,
+    (0x00, 0x02): CARD_CLASSIC_4K,
+    (0x00, 0x03): CARD_ULTRALIGHT,
+    (0x00, 0x26): CARD_CLASSIC_1K,    # MIFARE Mini: sector 1 has the same layout
+}
+
+PAGE_SIZE = 4
+CLASSIC_1K_SECTORS = 16           # 4 blocks each, the last one the sector trailer
+FIRST_DATA_PAGE = 4               # Pages 0-3: UID, lock bytes, OTP / capability container
+
+
+def card_type_from_atr(atr: List[int]) -> str:
+    """
+    Card type from a PC/SC contactless ATR
+
+    Args:
+        atr: ATR bytes as returned by getATR()
+
+    Returns:
+        str: CARD_* constant (CARD_UNKNOWN for other cards and readers)
+    """
+    # 3B 8F 80 01 80 4F 0C A0 00 00 03 06 SS C0 C1 00 00 00 00 TCK
+    if len(atr) < 15 or atr[4:6] != [0x80, 0x4F] or atr[7:11] != [0xA0, 0x00, 0x00, 0x03]:
+        return CARD_UNKNOWN
+    return _CARD_NAMES.get((atr[13], atr[14]), CARD_UNKNOWN)
+
+
+class ClassicDriver:
+    """MIFARE Classic: authenticate once per sector, then 16-byte block reads and writes"""
+
+    name = "MIFARE Classic"
+    transport = 'pcsc'            # ACR122U pseudo-APDUs (see pn532.py for the direct path)
+    needs_auth = True
+
+    def auth_apdus(self, rfid, block: int, key: List[int]) -> List[List[int]]:
+        # Load Key (FF 82 00 00 06 + 6 key bytes) into the reader, then
+        # Authenticate (FF 86 00 00 05 01 00 + block + 60 + key_number); 60 = Key A, 61 = Key B
+        return [[0xFF, 0x82, 0x00, 0x00, 0x06] + list(key),
+                [0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, block, 0x60, 0x00]]
+
+    def read_apdu(self, block: int) -> List[int]:
+        # Read Binary (FF B0 00 + block + 10)
+        return [0xFF, 0xB0, 0x00, block, BLOCK_SIZE]
+
+    def write_apdu(self, block: int, data: bytes) -> List[int]:
+        # Update Binary (FF D6 00 + block + 10 + 16 data bytes)
+        return [0xFF, 0xD6, 0x00, block, BLOCK_SIZE] + list(data)
+
+    def authenticate(self, rfid, block: int, key: List[int]) -> Tuple[bool, str]:
+        load_key, auth_cmd = self.auth_apdus(rfid, block, key)
+        data, sw1, sw2 = rfid._transmit(STEP_LOAD_KEY, load_key)
+
+        if sw1 != 0x90 or sw2 != 0x00:
+            return False, f"Failed to load key: {sw1:02X} {sw2:02X}"
+
+        data, sw1, sw2 = rfid._transmit(STEP_AUTH, auth_cmd)
+
+        if sw1 != 0x90 or sw2 != 0x00:
+            return False, f"Authentication failed: {sw1:02X} {sw2:02X}"
+        return True, f"Block {block} authenticated"
+
+    def read_block(self, rfid, block: int) -> Tuple[list, int, int]:
+        return rfid._transmit(STEP_READ, self.read_apdu(block), block)
+
+    def write_block(self, rfid, block: int, data: bytes) -> Tuple[list, int, int]:
+        return rfid._transmit(STEP_WRITE, self.write_apdu(block, data), block)
+
+    def read_blocks(self, rfid, blocks: List[int]) -> Tuple[bool, Optional[List[bytes]], str]:
+        result = []
+        sector = None
+        for i, block in enumerate(blocks):
+            # MIFARE Classic 1K: 4 blocks per sector share one authentication
+            if block // 4 != sector:
+                sector = block // 4
+                # A remote reader gets the sector's reads in the authentication's frame
+                reads = [self.read_apdu(b) for b in takewhile(lambda b: b // 4 == sector, blocks[i:])]
+                success, msg = rfid.authenticate_block(block, then=reads)
+                if not success:
+                    return False, None, msg
+
+            data, sw1, sw2 = self.read_block(rfid, block)
+
+            if sw1 != 0x90 or sw2 != 0x00:
+                return False, None, f"Read failed for block {block}: {sw1:02X} {sw2:02X}"
+            result.append(bytes(data))
+
+        return True, result, f"{len(blocks)} blocks read"
+
+    def write_blocks(self, rfid, items: List[Tuple[int, bytes]],
+                     current: Optional[Dict[int, bytes]] = None) -> Tuple[bool, str]:
+        sector = None
+        for i, (block, data) in enumerate(items):
+            if block // 4 != sector:
+                sector = block // 4
+                writes = [self.write_apdu(b, d) for b, d in takewhile(lambda item: item[0] // 4 == sector, items[i:])]
+                success, msg = rfid.authenticate_block(block, then=writes)
+                if not success:
+                    return False, msg
+
+            response, sw1, sw2 = self.write_block(rfid, block, data)
+
+            if sw1 != 0x90 or sw2 != 0x00:
+                return False, f"Write failed for block {block}: {sw1:02X} {sw2:02X}"
+
+        return True, f"{len(items)} blocks written"
+
+
+class UltralightDriver:
+    """NTAG21x / MIFARE Ultralight: no authentication, four pages per logical block"""
+
+    name = "NTAG/Ultralight"
+    transport = 'pcsc'
+    needs_auth = False
+
+    def authenticate(self, rfid, block: int, key: List[int]) -> Tuple[bool, str]:
+        return False, "NTAG/Ultralight cards have no MIFARE authentication"
+
+    def read_apdu(self, page: int) -> List[int]:
+        # Read Binary returns four consecutive pages
+        return [0xFF, 0xB0, 0x00, page, BLOCK_SIZE]
+
+    def write_apdu(self, page: int, data: bytes) -> List[int]:
+        return [0xFF, 0xD6, 0x00, page, PAGE_SIZE] + list(data)
+
+    def read_pages(self, rfid, page: int) -> Tuple[list, int, int]:
+        return rfid._transmit(STEP_READ, self.read_apdu(page))
+
+    def write_page(self, rfid, page: int, data: bytes) -> Tuple[list, int, int]:
+        return rfid._transmit(STEP_WRITE, self.write_apdu(page, data))
+
+    @staticmethod
+    def first_page(block: int) -> int:
+        """First page of a logical Kanban block"""
+        if block < BLOCK_THREAD1:
+            raise ValueError(f"Block {block} has no page mapping on Ultralight cards")
+        return FIRST_DATA_PAGE + (block - BLOCK_THREAD1) * (BLOCK_SIZE // PAGE_SIZE)
+
+    def read_blocks(self, rfid, blocks: List[int]) -> Tuple[bool, Optional[List[bytes]], str]:
+        result = []
+        rfid._pipeline([self.read_apdu(self.first_page(block)) for block in blocks])
+        for block in blocks:
+            page = self.first_page(block)
+            data, sw1, sw2 = self.read_pages(rfid, page)
+
+            if sw1 != 0x90 or sw2 != 0x00 or len(data) < BLOCK_SIZE:
+                return False, None, f"Read failed for pages {page}-{page + 3}: {sw1:02X} {sw2:02X}"
+            result.append(bytes(data[:BLOCK_SIZE]))
+
+        return True, result, f"{len(blocks)} blocks read"
+
+    def write_blocks(self, rfid, items: List[Tuple[int, bytes]],
+                     current: Optional[Dict[int, bytes]] = None) -> Tuple[bool, str]:
+        writes = []
+        for block, data in items:
+            page = self.first_page(block)
+            old = (current or {}).get(block)
+            for i in range(BLOCK_SIZE // PAGE_SIZE):
+                chunk = data[i * PAGE_SIZE:(i + 1) * PAGE_SIZE]
+                if old is not None and old[i * PAGE_SIZE:(i + 1) * PAGE_SIZE] == chunk:
+                    continue  # Page already holds this data
+                writes.append((page + i, chunk))
+
+        rfid._pipeline([self.write_apdu(page, chunk) for page, chunk in writes])
+        for page, chunk in writes:
+            response, sw1, sw2 = self.write_page(rfid, page, chunk)
+
+            if sw1 != 0x90 or sw2 != 0x00:
+                return False, f"Write failed for page {page}: {sw1:02X} {sw2:02X}"
+
+        return True, f"{len(items)} blocks written"
+
+
+CLASSIC = ClassicDriver()
+ULTRALIGHT = UltralightDriver()
+
+_DRIVERS: Dict[str, object] = {
+    CARD_CLASSIC_1K: CLASSIC,
+    CARD_CLASSIC_4K: CLASSIC,     # Blocks 4-6 are in sector 1 on both
+    CARD_ULTRALIGHT: ULTRALIGHT,
+}
+
+
+def driver_for(card_type: str):
+    """
+    Driver for a card type (unknown cards get the Classic driver, as before detection existed)
+
+    Returns:
+        ClassicDriver or UltralightDriver
+    """
+    return _DRIVERS.get(card_type, CLASSIC)
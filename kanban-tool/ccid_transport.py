@@ -0,0 +1,404 @@
+"""
+CWT Thread Verification System - CCID Transport
+The ACR122U on its USB CCID endpoints (pyusb), without pcscd or the PC/SC service
+
+On the PC/SC path every APDU goes through pyscard, the PC/SC library, the
+pcscd daemon (Windows: the smart card service) and its CCID driver. This
+module speaks CCID to the reader itself on the bulk endpoints:
+
+    PC_to_RDR_IccPowerOn    62  ->  RDR_to_PC_DataBlock 80 (ATR)     connect()
+    PC_to_RDR_IccPowerOff   63  ->  RDR_to_PC_SlotStatus 81          disconnect()
+    PC_to_RDR_XfrBlock      6F  ->  RDR_to_PC_DataBlock 80           transmit()
+    PC_to_RDR_Escape        6B  ->  RDR_to_PC_Escape 83              control()
+
+Each message starts with a 10-byte header: type, data length (little
+endian), slot, sequence number and 3 type-specific bytes. CcidReader and
+CcidConnection duck-type the pyscard reader and connection and raise the
+same exceptions, so RFIDManager, the card drivers, pn532.py and
+reader_profiles.py work unchanged on either transport (READER_TRANSPORT).
+
+Only one transport can own the reader, because pcscd (Windows: the CCID
+class driver) claims its USB interface:
+
+    Linux:    stop pcscd (systemctl stop pcscd.socket pcscd); the pn533_usb
+              kernel NFC driver is detached automatically
+    Windows:  install the WinUSB driver for the reader (Zadig); PC/SC no
+              longer sees it then
+
+Needs pyusb and a libusb backend (pip install pyusb).
+
+Compare both transports per operation, with a Kanban card left on the reader:
+    python ccid_transport.py --transport pcsc        # pcscd running
+    python ccid_transport.py --transport ccid        # pcscd stopped; prints the comparison
+"""
+
+import argparse
+import json
+import logging
+import statistics
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import usb.core
+    import usb.util
+except ImportError:  # Optional dependency, only needed for the USB transport
+    usb = None
+
+from smartcard.Exceptions import CardConnectionException, NoCardException
+from smartcard.scard import SCARD_SHARE_DIRECT
+
+from cancellation import Deadline
+from config import CCID_DEVICES, CCID_TIMEOUT, CCID_BENCH_FILE
+
+
+# Message types
+PC_TO_RDR_ICC_POWER_ON = 0x62
+PC_TO_RDR_ICC_POWER_OFF = 0x63
+PC_TO_RDR_XFR_BLOCK = 0x6F
+PC_TO_RDR_ESCAPE = 0x6B
+RDR_TO_PC_DATA_BLOCK = 0x80
+RDR_TO_PC_SLOT_STATUS = 0x81
+RDR_TO_PC_ESCAPE = 0x83
+
+HEADER = struct.Struct('<BIBB3s')  # Type, length, slot, sequence, type-specific
+USB_CLASS_SMART_CARD = 0x0B
+
+# bStatus: ICC status (bits 0-1) and command status (bits 6-7)
+ICC_ABSENT = 0x02
+COMMAND_FAILED = 0x01
+TIME_EXTENSION = 0x02
+ICC_MUTE = 0xFE                   # bError: no card answered
+
+logger = logging.getLogger(__name__)
+
+
+class CcidDevice:
+    """One claimed reader: CCID messages are exchanged one at a time"""
+
+    def __init__(self, device, name: str, timeout: float = CCID_TIMEOUT):
+        """
+        Args:
+            device: pyusb device
+            name: Reader name (shown like a PC/SC reader name)
+            timeout: Seconds to wait for an answer (a time extension request restarts it)
+        """
+        self.device = device
+        self.name = name
+        self.timeout_ms = int(timeout * 1000)
+        self.lost = False              # Unplugged: a new CcidDevice is made when it is back
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._buffer = bytearray()     # Bulk-in bytes not consumed yet
+        self._ep_out = self._ep_in = None
+
+    def exchange(self, message_type: int, data: List[int] = (), params: bytes = b"\x00\x00\x00",
+                 deadline: Optional[Deadline] = None) -> Tuple[int, int, List[int]]:
+        """
+        Send one message and wait for its answer
+
+        Args:
+            message_type: PC_TO_RDR_* message type
+            data: Message data
+            params: Type-specific header bytes
+            deadline: Deadline the answer must come by (time extensions do not go past it)
+
+        Returns:
+            Tuple[int, int, List[int]]: (bStatus, bError, data)
+
+        Raises:
+            CardConnectionException: The reader cannot be claimed or stopped answering
+        """
+        with self._lock:
+            try:
+                if self._ep_out is None:
+                    self._claim()
+                seq = self._seq = (self._seq + 1) & 0xFF
+                self._ep_out.write(HEADER.pack(message_type, len(data), 0, seq, params) + bytes(data),
+                                   self._timeout_ms(deadline))
+                while True:
+                    status, error, seq_in, payload = self._read(deadline)
+                    if seq_in != seq:
+                        continue  # Late answer to a command that timed out
+                    if status >> 6 != TIME_EXTENSION:
+                        return status, error, payload
+            except usb.core.USBError as e:
+                if e.errno == 19:  # ENODEV
+                    self.lost = True
+                    _devices.pop(self.name, None)
+                self._release()
+                raise CardConnectionException(f"{self.name}: {e}")
+
+    def _timeout_ms(self, deadline: Optional[Deadline]) -> int:
+        if deadline is None:
+            return self.timeout_ms
+        return max(1, min(self.timeout_ms, int(deadline.remaining() * 1000)))  # 0 would wait forever
+
+    def _read(self, deadline: Optional[Deadline] = None) -> Tuple[int, int, int, List[int]]:
+        """Next message from the bulk-in endpoint: (bStatus, bError, sequence, data)"""
+        buffer = self._buffer
+        while True:
+            if len(buffer) >= HEADER.size:
+                _, length, _, seq, specific = HEADER.unpack_from(buffer)
+                end = HEADER.size + length
+                if len(buffer) >= end:
+                    data = list(buffer[HEADER.size:end])
+                    del buffer[:end]
+                    return specific[0], specific[1], seq, data
+            buffer += self._ep_in.read(self._ep_in.wMaxPacketSize * 8, self._timeout_ms(deadline))
+
+    def _claim(self):
+        interface = usb.util.find_descriptor(self.device.get_active_configuration(),
+                                             bInterfaceClass=USB_CLASS_SMART_CARD)
+        if interface is None:
+            raise usb.core.USBError("No CCID interface")
+        number = interface.bInterfaceNumber
+        try:
+            if self.device.is_kernel_driver_active(number):
+                self.device.detach_kernel_driver(number)  # pn533_usb (Linux NFC stack)
+        except NotImplementedError:
+            pass  # Windows: no kernel drivers to detach
+        try:
+            usb.util.claim_interface(self.device, number)
+        except usb.core.USBError as e:
+            if e.errno == 16:  # EBUSY
+                raise CardConnectionException(f"{self.name} is in use by pcscd or another program")
+            raise
+
+        def endpoint(direction):
+            return usb.util.find_descriptor(interface, custom_match=lambda ep:
+                                            usb.util.endpoint_direction(ep.bEndpointAddress) == direction
+                                            and usb.util.endpoint_type(ep.bmAttributes) == usb.util.ENDPOINT_TYPE_BULK)
+        self._ep_out, self._ep_in = endpoint(usb.util.ENDPOINT_OUT), endpoint(usb.util.ENDPOINT_IN)
+        logger.info(f"Claimed {self.name}")
+
+    def _release(self):
+        self._ep_out = self._ep_in = None
+        self._buffer.clear()
+        try:
+            usb.util.dispose_resources(self.device)
+        except usb.core.USBError:
+            pass
+
+
+class CcidReader:
+    """A reader on the USB transport (duck-types the pyscard reader)"""
+
+    def __init__(self, device: CcidDevice):
+        self.device = device
+
+    def __str__(self) -> str:
+        return self.device.name
+
+    def createConnection(self) -> "CcidConnection":
+        return CcidConnection(self.device)
+
+
+class CcidConnection:
+    """Card connection (or direct reader connection) on one CCID slot"""
+
+    def __init__(self, device: CcidDevice):
+        self.device = device
+        self.powered = False
+        self.direct = False   # SCARD_SHARE_DIRECT: escape commands without a card
+        self.deadline: Optional[Deadline] = None  # Deadline of the running card operation (set by RFIDManager)
+        self._atr: List[int] = []
+
+    def connect(self, *args, mode: Optional[int] = None, **kwargs):
+        if mode == SCARD_SHARE_DIRECT:
+            self.direct = True
+            return
+        status, error, atr = self.device.exchange(PC_TO_RDR_ICC_POWER_ON)
+        if status & 0x03 == ICC_ABSENT or (status >> 6 == COMMAND_FAILED and error == ICC_MUTE):
+            raise NoCardException("No smart card inserted")
+        if status >> 6 == COMMAND_FAILED:
+            raise CardConnectionException(f"Card power on failed (error {error:02X})")
+        self._atr = atr
+        self.powered = True
+
+    def disconnect(self):
+        self.direct = False
+        if self.powered:
+            self.powered = False
+            try:
+                self.device.exchange(PC_TO_RDR_ICC_POWER_OFF)
+            except CardConnectionException:
+                pass  # Unplugged: nothing left to power off
+
+    def getATR(self) -> List[int]:
+        return list(self._atr)
+
+    def transmit(self, apdu: List[int]) -> Tuple[List[int], int, int]:
+        if not self.powered:
+            raise CardConnectionException("Card connection is closed")
+        status, error, response = self.device.exchange(PC_TO_RDR_XFR_BLOCK, apdu, deadline=self.deadline)
+        if status & 0x03 == ICC_ABSENT:
+            self.powered = False
+            raise CardConnectionException("Card was removed")
+        if status >> 6 == COMMAND_FAILED or len(response) < 2:
+            raise CardConnectionException(f"Transmit failed (error {error:02X})")
+        return response[:-2], response[-2], response[-1]
+
+    def control(self, code: int, command: List[int]) -> List[int]:
+        """Escape command (the SCardControl code only selects the escape IOCTL on PC/SC)"""
+        status, error, response = self.device.exchange(PC_TO_RDR_ESCAPE, command)
+        if status >> 6 == COMMAND_FAILED:
+            raise CardConnectionException(f"Escape command failed (error {error:02X})")
+        return response
+
+
+_devices: Dict[str, CcidDevice] = {}
+
+
+def usb_readers() -> List[CcidReader]:
+    """
+    Readers on the USB transport (reader_source for RFIDManager)
+
+    Raises:
+        ImportError: pyusb is not installed
+    """
+    if usb is None:
+        raise ImportError("The USB transport needs pyusb (pip install pyusb)")
+    found = []
+    for vendor, product in CCID_DEVICES:
+        for device in usb.core.find(find_all=True, idVendor=vendor, idProduct=product):
+            try:
+                label = usb.util.get_string(device, device.iProduct) or "CCID reader"
+            except (usb.core.USBError, ValueError):
+                label = "ACR122U PICC Interface"  # No permission to read strings before claiming
+            name = f"{label} (USB {device.bus}-{device.address})"
+            if name not in _devices or _devices[name].lost:
+                _devices[name] = CcidDevice(device, name)
+            found.append(CcidReader(_devices[name]))
+    return found
+
+
+# ----------------------------------------------------------------------
+# Transport benchmark
+# ----------------------------------------------------------------------
+
+OPERATIONS = ('probe', 'connect', 'uid', 'read', 'write', 'disconnect')
+
+
+def measure(rfid, cycles: int, write: bool = False) -> Dict[str, List[float]]:
+    """
+    Time each card operation on the manager's transport (card left on the reader)
+
+    Args:
+        rfid: RFIDManager with a connected reader
+        cycles: Number of cycles
+        write: Also write the card's own data back (write_kanban)
+
+    Returns:
+        Dict[str, List[float]]: Seconds per cycle for each of OPERATIONS
+    """
+    times = {op: [] for op in OPERATIONS}
+
+    def timed(op, call, *args):
+        started = time.perf_counter()
+        result = call(*args)
+        times[op].append(time.perf_counter() - started)
+        return result
+
+    for _ in range(cycles):
+        if not timed('probe', rfid.check_card_present):
+            raise RuntimeError("No card for the benchmark")
+        success, msg = timed('connect', rfid.wait_for_card, 5, None, 0.01)
+        if not success:
+            raise RuntimeError(f"No card for the benchmark: {msg}")
+        timed('uid', rfid.get_card_uid)
+        success, thread1, thread2, msg = timed('read', rfid.read_kanban)
+        if not success:
+            raise RuntimeError(f"Read failed: {msg}")
+        if write:
+            success, msg = timed('write', rfid.write_kanban, thread1, thread2)
+            if not success:
+                raise RuntimeError(f"Write failed: {msg}")
+        timed('disconnect', rfid.disconnect)
+    return {op: values for op, values in times.items() if values}
+
+
+def format_report(results: Dict[str, Dict]) -> str:
+    """Median and p95 per operation in milliseconds, for each transport measured"""
+    def quantiles(values: List[float]) -> Tuple[float, float]:
+        ordered = sorted(values)
+        return statistics.median(ordered) * 1000, ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000
+
+    transports = [t for t in ('pcsc', 'ccid') if t in results]
+    header = f"{'operation':<11}" + "".join(f"{t + ' p50':>14} {'p95':>8}" for t in transports)
+    lines = [header + (f" {'change':>8}" if len(transports) == 2 else "")]
+    for op in OPERATIONS:
+        if not all(op in results[t]['times'] for t in transports):
+            continue
+        medians = []
+        line = f"{op:<11}"
+        for t in transports:
+            p50, p95 = quantiles(results[t]['times'][op])
+            medians.append(p50)
+            line += f"{p50:>11.1f} ms {p95:>8.1f}"
+        if len(medians) == 2:
+            line += f" {(medians[1] - medians[0]) / medians[0]:>+8.0%}" if medians[0] > 0.05 else f" {'-':>8}"
+        lines.append(line)
+    for t in transports:
+        lines.append(f"{t}: {results[t]['reader']}, {results[t]['cycles']} cycles, {results[t]['ts']}")
+    return "\n".join(lines)
+
+
+def main():
+    """Command-line entry point (per-operation benchmark of one transport)"""
+    parser = argparse.ArgumentParser(description="Benchmark the PC/SC and USB CCID transports per card operation")
+    parser.add_argument('--transport', required=True, choices=('pcsc', 'ccid'),
+                        help="Transport to measure now (the other one comes from earlier runs)")
+    parser.add_argument('--cycles', type=int, default=50, help="Card cycles")
+    parser.add_argument('--write', action='store_true', help="Also time writes (the card's own data is written back)")
+    parser.add_argument('--reader', help="Exact reader name (default: first ACR122U)")
+    parser.add_argument('--results', default=CCID_BENCH_FILE, help="Results of both transports (JSON)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(name)s: %(message)s')
+    from rfid_manager import RFIDManager
+
+    if args.transport == 'ccid':
+        source = usb_readers
+    else:
+        from smartcard.System import readers as source
+    rfid = RFIDManager(reader_source=source)
+    success, msg = rfid.connect_reader(args.reader)
+    if not success:
+        print(msg, file=sys.stderr)
+        return 1
+
+    print(f"Leave a Kanban card on the reader ({rfid.reader}).")
+    try:
+        times = measure(rfid, args.cycles, args.write)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        rfid.disconnect()
+
+    try:
+        with open(args.results, encoding='utf-8') as f:
+            results = json.load(f)
+    except (OSError, ValueError):
+        results = {}
+    results[args.transport] = {
+        'ts': datetime.now().isoformat(timespec='seconds'),
+        'reader': str(rfid.reader),
+        'cycles': args.cycles,
+        'times': times,
+    }
+    with open(args.results, 'w', encoding='utf-8') as f:
+        json.dump(results, f)
+
+    print()
+    print(format_report(results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,11 +7,18 @@ Configuration constants for RFID Kanban card operations
 BLOCK_THREAD1 = 4  # Block number for Thread 1 data
 BLOCK_THREAD2 = 5  # Block number for Thread 2 data
 BLOCK_SIZE = 16    # MIFARE Classic block size in bytes
+BLOCK_COMMIT = 6   # Commit record: write state, generation and CRC of blocks 4-5
+ACCEPT_LEGACY_CARDS = True  # Accept cards written before commit records (block 6 blank)
 
 # Default MIFARE Classic Key (Key A)
 # Factory default: all bytes are 0xFF
 DEFAULT_KEY_A = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
 
+# Key Ring Settings (key_ring.py; KANBAN_KEY_MASTER overrides the master secret file)
+KEY_CANDIDATES = [DEFAULT_KEY_A]  # Keys tried in order on cards without a remembered key
+KEY_MASTER_FILE = ""             # Hex master secret for UID-diversified keys; empty disables them
+KEY_MEMO_SIZE = 4096             # (UID, sector) pairs whose working key is remembered
+
 # Special Keywords
 BYPASS_KEYWORD = "bypass"  # Keyword for bypass mode
 
@@ -24,6 +31,13 @@ APP_HEIGHT = 650
 # Reader Settings
 READER_TIMEOUT = 10  # Seconds to wait for card
 READER_NAME_FILTER = "acr122"  # Filter for ACR122U reader (case-insensitive)
+PRESENCE_POLL_INTERVAL = 0.5  # Seconds between background card presence checks
+
+# Retry Settings (retry_policy.py)
+RETRY_MAX_ATTEMPTS = 4        # Attempts per APDU step (first try included)
+RETRY_BASE_DELAY = 0.02       # Seconds before the first retry, doubled each time
+RETRY_MAX_DELAY = 0.2         # Upper bound for one backoff
+RETRY_REMOVED_WINDOW = 0.5    # Seconds to wait for the same card to return after RF loss
 
 # UI Colors
 COLOR_SUCCESS = "#28a745"  # Green
@@ -34,3 +48,94 @@ COLOR_BG = "#f8f9fa"       # Light gray background
 
 # Log Settings
 LOG_MAX_LINES = 1000  # Maximum lines in log display
+
+# Bobbin Label Settings (label_generator.py)
+LABEL_DPI = 300                  # Print resolution
+LABEL_PAGE_MM = (210, 297)       # A4 portrait
+LABEL_SIZE_MM = (50, 30)         # One bobbin label (width, height)
+LABEL_MARGIN_MM = 8              # Page margin
+LABEL_BOBBINS_PER_CARD = 1       # Labels per thread for each Kanban card in a plan
+
+# Write History Settings (write_history.py, event_join.py)
+WRITE_HISTORY_FILE = "kanban_history.jsonl"  # Append-only log of card writes by UID
+JOIN_CLOCK_SKEW_S = 120          # Tolerated clock difference between PC and machine log collectors
+JOIN_STALE_HOURS = 72            # Card written longer ago than this is reported as stale
+JOIN_OVERRIDE_WINDOW_S = 600     # Bypass card on the same machine within this window = operator override
+
+# Audit Settings (audit.py)
+AUDIT_POLL_TIMEOUT = 0.5         # Seconds per card detection attempt
+AUDIT_IDLE_TIMEOUT = 60          # Stop the audit after this many seconds without a new card
+
+# HTTP Service Settings (http_service.py)
+SERVICE_HOST = "127.0.0.1"       # Local only; MES connects from the same PC or through a tunnel
+SERVICE_PORT = 8765
+SERVICE_CARD_TIMEOUT = 30        # Seconds a job waits for each card
+SERVICE_MAX_WAIT = 30            # Longest long-poll (seconds)
+SERVICE_JOBS_KEPT = 500          # Finished jobs kept for status queries
+
+# Scheduler Settings (scheduler.py)
+SCHEDULER_POLL_INTERVAL = 0.3    # Card poll slice; a waiting batch yields to urgent jobs this often
+
+# Metrics Settings (metrics.py)
+METRICS_HOST = "127.0.0.1"       # "0.0.0.0" lets a central Prometheus scrape this station
+METRICS_PORT = 9464              # GET /metrics from the GUI; None disables the endpoint
+METRICS_TEXTFILE = ""            # node_exporter textfile path (e.g. .../kanban.prom); empty disables
+METRICS_TEXTFILE_INTERVAL = 15   # Seconds between textfile rewrites
+
+# APDU Trace Settings (apdu_trace.py)
+APDU_TRACE_DIR = ""              # Record each GUI session to <dir>/session_<time>.ktr; empty disables
+
+# Startup Settings (main.py)
+STARTUP_BUDGET = 1.0             # Seconds until the window is interactive; slower starts are logged as warnings
+READER_DISCOVERY_INTERVAL = 2.0  # Seconds between reader searches while none is connected
+
+# Profiling Settings (profiling.py; KANBAN_PROFILE / KANBAN_PROFILE_CAPTURE override)
+PROFILE_DIR = ""                 # Write spans and summaries here at exit; empty disables profiling
+PROFILE_CAPTURE = ""             # Extras: "cprofile", "tracemalloc" (comma-separated)
+
+# PN532 Direct Settings (pn532.py)
+PN532_DIRECT = False             # Card commands straight to the ACR122U's PN532 (falls back to pseudo-APDUs)
+PN532_AUTOPOLL = False           # Reader-side card polling (InAutoPoll); needs the CCID escape command enabled
+PN532_AUTOPOLL_PERIOD = 0.3      # Seconds per InAutoPoll (rounded to 150 ms units)
+
+# Reader Profile Settings (reader_profiles.py)
+READER_PROFILE = ""              # "factory", "quiet" or "fast" (reader_profiles.PROFILES); empty leaves the reader as it is
+
+# Provisioning Settings (provisioning.py)
+PROVISION_FILE = "provisioned_cards.jsonl"        # Append-only record of provisioned card UIDs
+PROVISION_ACCESS_BITS = [0x7F, 0x07, 0x88, 0x69]  # Blocks 4-6 read/write with Key A or B; trailer writable with Key B only
+PROVISION_KEY_A = DEFAULT_KEY_A  # 6-byte Key A to set; the machine firmware reads with the factory key only.
+                                 # None = UID-diversified (opt-in, needs the master secret and firmware that derives it)
+PROVISION_KEY_B = None           # 6-byte Key B to set; None = UID-diversified
+PROVISION_IDLE_TIMEOUT = 60      # Stop after this many seconds without a new card
+PROVISION_POLL_TIMEOUT = 0.5     # Card poll interval between cards (seconds)
+
+# Card Archive Settings (card_archive.py)
+ARCHIVE_FILE = "card_dumps.kda"  # Append-only full card images; the UID index is ARCHIVE_FILE + ".idx"
+ARCHIVE_INDEX_TAIL = 1024        # Records appended before the index file is rewritten
+ARCHIVE_IDLE_TIMEOUT = 60        # Dump sweep: stop after this many seconds without a new card
+ARCHIVE_POLL_TIMEOUT = 0.5       # Dump sweep: card poll interval between cards (seconds)
+
+# Revocation Settings (revocation.py)
+REVOCATION_FILE = "revoked_cards.jsonl"  # Revoke / restore events by UID; compiled to REVOCATION_FILE + ".set"
+REVOCATION_FALSE_POSITIVE = 0.001  # Bloom filter false-positive rate (a false positive costs one disk lookup)
+REVOCATION_RELOAD_INTERVAL = 5.0   # Seconds between checks for a changed revocation list
+
+# Reader Proxy Settings (reader_proxy.py)
+READER_PROXY = ""                # "host:port" of a reader proxy (kiosk PC with the reader); empty = local PC/SC readers
+READER_PROXY_PORT = 7725         # Port the proxy listens on
+READER_PROXY_TOKEN = ""          # Shared secret between tool and proxy (KANBAN_PROXY_TOKEN overrides)
+READER_PROXY_TIMEOUT = 5.0       # Seconds to wait for a proxy reply
+
+# CCID Transport Settings (ccid_transport.py)
+READER_TRANSPORT = "pcsc"        # "pcsc" (pyscard / pcscd) or "ccid" (USB direct: needs pyusb and pcscd stopped)
+CCID_DEVICES = [(0x072F, 0x2200)]  # USB vendor / product IDs of the readers to use (ACS ACR122U)
+CCID_TIMEOUT = 2.0               # Seconds to wait for a reader answer (time extension requests restart it)
+CCID_BENCH_FILE = "transport_bench.json"  # Benchmark results per transport (ccid_transport.py)
+
+# Event Bus Settings (event_bus.py)
+EVENT_QUEUE_SIZE = 1000          # Events queued per subscriber before its drop policy applies
+EVENT_LOG_FILE = ""              # JSON lines file of all card and session events (e.g. "card_events.jsonl"); empty = off
+
+# Cancellation Settings (cancellation.py, rfid_manager.py)
+CARD_OPERATION_BUDGET = 5.0      # Seconds one card operation may take before it fails (0 = no limit)
@@ -0,0 +1,278 @@
+"""
+CWT Thread Verification System - Event Bus
+Typed card and session events, delivered to each subscriber through its own bounded queue
+
+publish() never blocks and never runs subscriber code: it puts the event in
+the queue of every subscription that wants its type and returns. A
+subscriber takes events from its queue on its own thread (subscribe with a
+handler starts one) or from its own loop (the window drains its
+subscription with the Tk timer), so a slow sink (file export, database,
+dashboard) only delays itself, never a card operation. When a queue is full
+its policy decides:
+
+    DROP_NEWEST   The new event is dropped (the queue keeps the start of a burst)
+    DROP_OLDEST   The oldest queued event is dropped (the queue keeps the latest)
+    COALESCE      An event replaces the queued one with the same key, so the
+                  queue holds the latest state per key (presence per reader,
+                  progress per batch); distinct keys beyond the limit drop the oldest
+
+Dropped events are counted per subscription (Subscription.dropped).
+
+Events:
+    CardArrived         A card was connected for an operation, or seen by the presence monitor
+    CardRemoved         The presence monitor saw the card leave
+    OperationStarted    A card operation (read, write, bypass, clear, dump) began
+    OperationFinished   ... ended: result, message, duration
+    ApduStats           APDUs sent and steps retried by one card operation
+    BatchProgress       Counts of a multi-card run after each card
+
+Example:
+    subscription = BUS.subscribe((OperationFinished,), handler=export_row)
+    ...
+    BUS.unsubscribe(subscription)
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Hashable, List, Optional, Sequence, Tuple, Type
+
+from config import EVENT_QUEUE_SIZE
+
+
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+COALESCE = 'coalesce'
+
+
+class Event:
+    """Base of all events (subscribe to Event for everything)"""
+
+    @property
+    def key(self) -> Hashable:
+        """Coalescing key: a COALESCE queue keeps the latest event per key"""
+        return type(self).__name__
+
+
+@dataclass
+class CardArrived(Event):
+    reader: str
+    uid: Optional[str]
+    card_type: str = ""           # card_drivers.CARD_* ("" from the presence monitor)
+    ts: float = field(default_factory=time.time)
+
+    @property
+    def key(self) -> Hashable:
+        return 'presence', self.reader
+
+
+@dataclass
+class CardRemoved(Event):
+    reader: str
+    ts: float = field(default_factory=time.time)
+
+    @property
+    def key(self) -> Hashable:
+        return 'presence', self.reader
+
+
+@dataclass
+class OperationStarted(Event):
+    op: str
+    reader: str
+    uid: Optional[str]
+    ts: float = field(default_factory=time.time)
+
+
+@dataclass
+class OperationFinished(Event):
+    op: str
+    reader: str
+    uid: Optional[str]
+    ok: bool
+    message: str
+    seconds: float
+    ts: float = field(default_factory=time.time)
+
+
+@dataclass
+class ApduStats(Event):
+    op: str
+    reader: str
+    apdus: int                    # APDUs sent, retries included
+    retries: int                  # Steps repeated by the retry policy
+    ts: float = field(default_factory=time.time)
+
+    @property
+    def key(self) -> Hashable:
+        return 'apdu', self.reader, self.op
+
+
+@dataclass
+class BatchProgress(Event):
+    op: str                       # SessionStats.op
+    done: int
+    total: Optional[int]          # None for continuous runs
+    ok: int
+    failed: int
+    summary: str                  # SessionStats.summary_line()
+    ts: float = field(default_factory=time.time)
+
+    @property
+    def key(self) -> Hashable:
+        return 'batch', self.op
+
+
+class Subscription:
+    """One subscriber's queue; filled by publish(), emptied by the subscriber"""
+
+    def __init__(self, types: Tuple[Type[Event], ...], policy: str, maxsize: int, name: str):
+        if policy not in (DROP_NEWEST, DROP_OLDEST, COALESCE):
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.types = types
+        self.policy = policy
+        self.maxsize = max(1, maxsize)
+        self.name = name
+        self.dropped = 0
+        self.closed = False
+        self._queue = OrderedDict() if policy == COALESCE else deque()
+        self._ready = threading.Condition(threading.Lock())
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def offer(self, event: Event):
+        """Queue an event without waiting (publish() calls this)"""
+        with self._ready:
+            queue = self._queue
+            if self.policy == COALESCE:
+                key = event.key
+                if queue.pop(key, None) is not None:
+                    self.dropped += 1  # Superseded by the newer state
+                elif len(queue) >= self.maxsize:
+                    queue.popitem(last=False)
+                    self.dropped += 1
+                queue[key] = event
+            elif len(queue) < self.maxsize:
+                queue.append(event)
+            elif self.policy == DROP_OLDEST:
+                queue.popleft()
+                queue.append(event)
+                self.dropped += 1
+            else:
+                self.dropped += 1
+                return
+            self._ready.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Event]:
+        """
+        Next event, waiting up to timeout seconds
+
+        Returns:
+            Optional[Event]: The event, or None on timeout or once closed
+        """
+        with self._ready:
+            if not self._queue and not self.closed:
+                self._ready.wait(timeout)
+            if not self._queue:
+                return None
+            return self._queue.popitem(last=False)[1] if self.policy == COALESCE else self._queue.popleft()
+
+    def drain(self) -> List[Event]:
+        """All queued events, oldest first, without waiting"""
+        with self._ready:
+            events = list(self._queue.values()) if self.policy == COALESCE else list(self._queue)
+            self._queue.clear()
+        return events
+
+    def close(self):
+        with self._ready:
+            self.closed = True
+            self._ready.notify_all()
+
+    def _run(self, handler: Callable[[Event], None]):
+        logger = logging.getLogger(__name__)
+        while True:
+            event = self.get()
+            if event is None:
+                if self.closed:
+                    return
+                continue
+            try:
+                handler(event)
+            except Exception as e:
+                logger.error(f"Event subscriber {self.name} failed on {type(event).__name__}: {e}")
+
+
+class EventBus:
+    """Publish / subscribe between the card engine and its consumers"""
+
+    def __init__(self):
+        self._subscriptions: Tuple[Subscription, ...] = ()  # Replaced, never changed in place
+        self._lock = threading.Lock()
+
+    def publish(self, event: Event):
+        """Hand an event to every interested subscriber (never blocks)"""
+        for subscription in self._subscriptions:
+            if isinstance(event, subscription.types):
+                subscription.offer(event)
+
+    def wants(self, event_type: Type[Event]) -> bool:
+        """True if some subscriber takes this type (skip building events nobody reads)"""
+        return any(issubclass(event_type, s.types) for s in self._subscriptions)
+
+    def subscribe(self, types: Sequence[Type[Event]] = (Event,), policy: str = DROP_OLDEST,
+                  maxsize: int = EVENT_QUEUE_SIZE, handler: Optional[Callable[[Event], None]] = None,
+                  name: str = "") -> Subscription:
+        """
+        Add a subscriber
+
+        Args:
+            types: Event classes to receive (subclasses included)
+            policy: DROP_NEWEST, DROP_OLDEST or COALESCE when the queue is full
+            maxsize: Queued events (COALESCE: distinct keys) before the policy applies
+            handler: Called with each event on a thread of its own; None to
+                take events with get() / drain()
+            name: Shown in logs and thread names
+
+        Returns:
+            Subscription: Pass to unsubscribe()
+        """
+        subscription = Subscription(tuple(types), policy, maxsize,
+                                    name or getattr(handler, '__name__', 'subscriber'))
+        if handler is not None:
+            subscription._thread = threading.Thread(target=subscription._run, args=(handler,),
+                                                    name=f"EventBus-{subscription.name}", daemon=True)
+            subscription._thread.start()
+        with self._lock:
+            self._subscriptions += (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription, timeout: float = 2.0):
+        """Remove a subscriber; its handler thread finishes the queued events first"""
+        with self._lock:
+            self._subscriptions = tuple(s for s in self._subscriptions if s is not subscription)
+        subscription.close()
+        if subscription._thread is not None:
+            subscription._thread.join(timeout)
+
+
+class EventLog:
+    """Handler writing events as JSON lines (EVENT_LOG_FILE)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8', buffering=1)
+
+    def __call__(self, event: Event):
+        self._file.write(json.dumps(dict(asdict(event), event=type(event).__name__)) + '\n')
+
+    def close(self):
+        self._file.close()
+
+
+BUS = EventBus()
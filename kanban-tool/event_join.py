@@ -0,0 +1,431 @@
+"""
+CWT Thread Verification System - Event Join
+Joins machine verification logs with the Kanban tool's write history by card UID
+
+Machine logs are the serial output of the ESP32 firmware as collected on the
+floor, one file per machine (or per machine and day). Each line must start
+with a timestamp, either a full date and time or a time only (as written by
+`pio device monitor --filter time`), in which case the date is taken from the
+file name:
+
+    2025-01-15 08:30:12.345 > [RFID] UID:  04 A1 B2 C3
+    08:30:12.345 > [RFID] UID:  04 A1 B2 C3          (file M01_2025-01-15.log)
+
+Every failed verification is matched to the last write of that card before
+it and given a root cause:
+
+    unknown_card      Card was never written by the tool (no history for the UID)
+    failed_write      Last write to the card failed; it may hold partial data
+    not_as_written    Card content differs from its last write (cleared or written elsewhere)
+    wrong_plan_row    Card content is not a row of the plan, or not the row planned for this UID
+    stale_card        Card was written longer ago than JOIN_STALE_HOURS
+    swapped_bobbins   Both bobbins are correct but loaded in each other's position
+    wrong_bobbin      Card is correct; a bobbin did not match it
+
+A bypass card read on the same machine shortly after a mismatch is reported
+as an operator override.
+
+Usage:
+    python event_join.py logs/*.log --history kanban_history.jsonl -o mismatches.csv
+    python event_join.py logs/ --history pc1.jsonl --history pc2.jsonl --plan plan.csv
+"""
+
+import argparse
+import csv
+import logging
+import os
+import re
+import sys
+import time
+from bisect import bisect_right
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config import (
+    BYPASS_KEYWORD, WRITE_HISTORY_FILE,
+    JOIN_CLOCK_SKEW_S, JOIN_STALE_HOURS, JOIN_OVERRIDE_WINDOW_S
+)
+from plan import load_plan, normalize_uid
+from write_history import WriteRecord, load_history
+
+
+CAUSES = (
+    'unknown_card', 'failed_write', 'not_as_written', 'wrong_plan_row',
+    'stale_card', 'swapped_bobbins', 'wrong_bobbin',
+)
+
+REPORT_FIELDS = [
+    'time', 'machine', 'uid', 'kanban1', 'kanban2', 'qr1', 'qr2', 'cause', 'detail',
+    'written', 'session', 'next_op', 'next_time', 'override',
+]
+
+_TIMESTAMP = re.compile(r'(\d{4}-\d{2}-\d{2}[ T])?(\d{1,2}:\d{2}:\d{2}(?:\.\d+)?)\s*[>|]?\s?')
+_FILE_DATE = re.compile(r'\d{4}-\d{2}-\d{2}')
+_VERIFY = re.compile(r'Thread ([12]): \S* ?(MISMATCH|MATCH) \(Kanban: (.*), QR: (.*)\)\s*$')
+
+
+@dataclass(frozen=True)
+class MachineEvent:
+    """A verification result or bypass card read reported by a machine"""
+    ts: datetime
+    machine: str
+    uid: Optional[str]
+    kind: str                 # 'verify' or 'bypass'
+    kanban1: str = ""
+    kanban2: str = ""
+    qr1: str = ""
+    qr2: str = ""
+    passed: bool = True
+
+
+# ----- Machine log parsing -----
+
+def machine_name(path: str) -> str:
+    """Machine name from a log file name ('M01_2025-01-15.log' -> 'M01')"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return _FILE_DATE.sub('', stem).strip('_- .') or stem
+
+
+def parse_machine_log(path: str, machine: Optional[str] = None) -> Iterator[MachineEvent]:
+    """
+    Extract verification results and bypass reads from one machine log
+
+    Only lines that can carry an event are timestamp-parsed, so a month of
+    serial output streams through at disk speed.
+
+    Args:
+        path: Log file
+        machine: Machine name (default: from file name)
+
+    Yields:
+        MachineEvent: Events in log order
+    """
+    machine = machine or machine_name(path)
+    found = _FILE_DATE.search(os.path.basename(path))
+    day = datetime.fromisoformat(found.group(0)) if found else None
+    last_ts = None
+
+    uid = None
+    first = None  # Thread 1 result waiting for Thread 2
+
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if 'Kanban:' in line:
+                match = _VERIFY.search(line)
+                if match is None:
+                    continue
+                if match.group(1) == '1':
+                    first = match.groups()[1:]
+                    continue
+                if first is None:
+                    continue
+                result, first = (first, match.groups()[1:]), None
+            elif 'UID:' in line:
+                uid = normalize_uid(line.split('UID:', 1)[1].strip())
+                first = None
+                continue
+            elif 'Bypass: YES' in line:
+                result = None
+            else:
+                continue
+
+            # Timestamps are parsed for event lines only
+            ts = _line_time(line, day)
+            if ts is None:
+                continue
+            if last_ts is not None and ts < last_ts - timedelta(hours=12) and day is not None:
+                day += timedelta(days=1)  # Time-only log crossed midnight
+                ts += timedelta(days=1)
+            last_ts = ts
+
+            if result is None:
+                yield MachineEvent(ts, machine, uid, 'bypass', BYPASS_KEYWORD)
+            else:
+                (status1, kanban1, qr1), (status2, kanban2, qr2) = result
+                yield MachineEvent(ts, machine, uid, 'verify', kanban1, kanban2, qr1, qr2,
+                                   passed=(status1 == 'MATCH' and status2 == 'MATCH'))
+
+
+def _line_time(line: str, day: Optional[datetime]) -> Optional[datetime]:
+    """Timestamp at the start of a log line; time-only stamps need the file's day"""
+    stamp = _TIMESTAMP.match(line)
+    if stamp is None:
+        return None
+    date_part, time_part = stamp.groups()
+    if date_part:
+        return datetime.fromisoformat(date_part.strip() + 'T' + time_part.zfill(8))
+    if day is None:
+        return None
+    hours, minutes, seconds = time_part.split(':')
+    return day + timedelta(hours=int(hours), minutes=int(minutes), seconds=float(seconds))
+
+
+def parse_machine_logs(paths: List[str], workers: Optional[int] = None) -> List[MachineEvent]:
+    """
+    Parse many machine logs, one file per task across worker processes
+
+    Args:
+        paths: Log files
+        workers: Worker processes (default: CPU count)
+
+    Returns:
+        List[MachineEvent]: Events of all files
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(paths) < 2:
+        return [event for path in paths for event in parse_machine_log(path)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [event for events in pool.map(_parse_file, paths) for event in events]
+
+
+def _parse_file(path: str) -> List[MachineEvent]:
+    return list(parse_machine_log(path))
+
+
+def collect_logs(paths: Iterable[str]) -> List[str]:
+    """Expand directories into the log files they contain"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names)
+                             if name.endswith(('.log', '.txt')))
+        else:
+            files.append(path)
+    return files
+
+
+# ----- Indexes -----
+
+class WriteIndex:
+    """Write records hashed by UID, each UID's records sorted by time"""
+
+    def __init__(self, records: Iterable[WriteRecord]):
+        by_uid: Dict[str, List[WriteRecord]] = defaultdict(list)
+        for record in records:
+            by_uid[record.uid].append(record)
+        self._records = {}
+        self._times = {}
+        for uid, items in by_uid.items():
+            items.sort(key=lambda r: r.ts)
+            self._records[uid] = items
+            self._times[uid] = [r.ts for r in items]
+
+    def __len__(self) -> int:
+        return sum(len(items) for items in self._records.values())
+
+    def last_write(self, uid: str, ts: datetime, skew: timedelta,
+                   content: Tuple[str, str]) -> Tuple[Optional[WriteRecord], Optional[WriteRecord]]:
+        """
+        Find the write a machine read came from, and the next operation after it
+
+        A write up to `skew` after the event still counts when it carries the
+        content the machine read (PC and collector clocks are not synchronised).
+
+        Returns:
+            Tuple[Optional[WriteRecord], Optional[WriteRecord]]: (Last write, Next operation)
+        """
+        records = self._records.get(uid)
+        if not records:
+            return None, None
+        times = self._times[uid]
+        before = bisect_right(times, ts)
+        within = bisect_right(times, ts + skew, lo=before)
+
+        for i in range(within - 1, before - 1, -1):
+            if (records[i].thread1, records[i].thread2) == content:
+                return records[i], records[i + 1] if i + 1 < len(records) else None
+
+        last = records[before - 1] if before else None
+        following = records[before] if before < len(records) else None
+        return last, following
+
+
+class OverrideIndex:
+    """Bypass card reads per machine, sorted by time"""
+
+    def __init__(self):
+        self._times: Dict[str, List[datetime]] = defaultdict(list)
+
+    def add(self, event: MachineEvent):
+        self._times[event.machine].append(event.ts)
+
+    def finish(self):
+        for times in self._times.values():
+            times.sort()
+
+    def after(self, machine: str, ts: datetime, window: timedelta) -> Optional[datetime]:
+        """First bypass on a machine within `window` after ts"""
+        times = self._times.get(machine)
+        if not times:
+            return None
+        i = bisect_right(times, ts)
+        if i < len(times) and times[i] - ts <= window:
+            return times[i]
+        return None
+
+
+# ----- Join -----
+
+def classify(event: MachineEvent, write: Optional[WriteRecord],
+             plan_pairs: Optional[set], plan_by_uid: Dict[str, Tuple[str, str]],
+             stale: timedelta) -> Tuple[str, str]:
+    """
+    Root cause of one failed verification
+
+    Returns:
+        Tuple[str, str]: (Cause, Detail)
+    """
+    content = (event.kanban1, event.kanban2)
+
+    if write is None:
+        return 'unknown_card', "No tool write for this UID before the event"
+    if not write.ok:
+        return 'failed_write', f"Last {write.op} at {write.ts:%Y-%m-%d %H:%M} did not verify"
+    if (write.thread1, write.thread2) != content:
+        if write.op == 'clear':
+            return 'not_as_written', f"Card was cleared at {write.ts:%Y-%m-%d %H:%M} but carries data"
+        return 'not_as_written', f"Last write was {write.thread1} / {write.thread2}"
+
+    planned = plan_by_uid.get(event.uid)
+    if planned is not None and planned != content:
+        return 'wrong_plan_row', f"Plan assigns {planned[0]} / {planned[1]} to this card"
+    if plan_pairs is not None and content not in plan_pairs:
+        if (event.qr1, event.qr2) in plan_pairs:
+            return 'wrong_plan_row', "Bobbins match a plan row, the card does not"
+        return 'wrong_plan_row', "Card content is not in the plan"
+
+    age = event.ts - write.ts
+    if age > stale:
+        return 'stale_card', f"Written {age.days}d {age.seconds // 3600}h before the event"
+
+    if event.qr1 == event.kanban2 and event.qr2 == event.kanban1:
+        return 'swapped_bobbins', "Thread 1 and Thread 2 bobbins are swapped"
+
+    wrong = [n for n, (k, q) in ((1, (event.kanban1, event.qr1)), (2, (event.kanban2, event.qr2))) if k != q]
+    return 'wrong_bobbin', "Bobbin " + " and ".join(str(n) for n in wrong) + " does not match the card"
+
+
+def join(events: Iterable[MachineEvent], index: WriteIndex,
+         plan_pairs: Optional[set] = None, plan_by_uid: Optional[Dict[str, Tuple[str, str]]] = None,
+         skew_s: float = JOIN_CLOCK_SKEW_S, stale_hours: float = JOIN_STALE_HOURS,
+         override_window_s: float = JOIN_OVERRIDE_WINDOW_S) -> Iterator[dict]:
+    """
+    Match failed verifications to write history
+
+    Args:
+        events: Machine events (any order)
+        index: Write history index
+        plan_pairs: (thread1, thread2) pairs of the plan, or None without a plan
+        plan_by_uid: Planned content for cards the plan assigns by UID
+        skew_s: Tolerated clock difference (seconds)
+        stale_hours: Age after which a card is stale
+        override_window_s: Bypass within this time after a mismatch is an override
+
+    Yields:
+        dict: One report row (REPORT_FIELDS) per failed verification
+    """
+    plan_by_uid = plan_by_uid or {}
+    skew = timedelta(seconds=skew_s)
+    stale = timedelta(hours=stale_hours)
+    window = timedelta(seconds=override_window_s)
+
+    overrides = OverrideIndex()
+    failed = []
+    for event in events:
+        if event.kind == 'bypass':
+            overrides.add(event)
+        elif not event.passed:
+            failed.append(event)
+    overrides.finish()
+
+    for event in failed:
+        content = (event.kanban1, event.kanban2)
+        write, following = index.last_write(event.uid, event.ts, skew, content) if event.uid else (None, None)
+        cause, detail = classify(event, write, plan_pairs, plan_by_uid, stale)
+        override = overrides.after(event.machine, event.ts, window)
+
+        yield {
+            'time': event.ts.isoformat(sep=' ', timespec='seconds'),
+            'machine': event.machine,
+            'uid': event.uid or '',
+            'kanban1': event.kanban1,
+            'kanban2': event.kanban2,
+            'qr1': event.qr1,
+            'qr2': event.qr2,
+            'cause': cause,
+            'detail': detail,
+            'written': write.ts.isoformat(sep=' ', timespec='seconds') if write else '',
+            'session': write.session if write else '',
+            'next_op': following.op if following else '',
+            'next_time': following.ts.isoformat(sep=' ', timespec='seconds') if following else '',
+            'override': override.isoformat(sep=' ', timespec='seconds') if override else '',
+        }
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Explain machine thread mismatches from Kanban write history")
+    parser.add_argument('logs', nargs='+', help="Machine log files or directories")
+    parser.add_argument('--history', action='append', default=None,
+                        help=f"Write history file, repeat for several PCs (default: {WRITE_HISTORY_FILE})")
+    parser.add_argument('--plan', help="Plan CSV to check card content against")
+    parser.add_argument('-o', '--output', default='mismatches.csv', help="Report CSV")
+    parser.add_argument('--skew', type=float, default=JOIN_CLOCK_SKEW_S, help="Clock skew tolerance (s)")
+    parser.add_argument('--stale-hours', type=float, default=JOIN_STALE_HOURS, help="Card age reported as stale")
+    parser.add_argument('--override-window', type=float, default=JOIN_OVERRIDE_WINDOW_S,
+                        help="Bypass after mismatch reported as override (s)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes for log parsing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+    logger = logging.getLogger(__name__)
+    start = time.perf_counter()
+
+    histories = args.history or [WRITE_HISTORY_FILE]
+    index = WriteIndex(record for path in histories for record in load_history(path))
+    logger.info(f"{len(index)} write records from {len(histories)} history file(s)")
+
+    plan_pairs = None
+    plan_by_uid = {}
+    if args.plan:
+        rows, errors = load_plan(args.plan)
+        for err in errors:
+            logger.warning(f"Plan {err}")
+        plan_pairs = {(row.thread1, row.thread2) for row in rows}
+        plan_by_uid = {row.uid: (row.thread1, row.thread2) for row in rows if row.uid}
+
+    files = collect_logs(args.logs)
+    events = parse_machine_logs(files, args.workers)
+    verified = sum(1 for event in events if event.kind == 'verify')
+    logger.info(f"{verified} verifications in {len(files)} machine log(s)")
+
+    causes = Counter()
+    overridden = 0
+    try:
+        with open(args.output, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            for row in join(events, index, plan_pairs, plan_by_uid,
+                            args.skew, args.stale_hours, args.override_window):
+                writer.writerow(row)
+                causes[row['cause']] += 1
+                overridden += bool(row['override'])
+    except OSError as e:
+        logger.error(f"Failed to write report: {e}")
+        return 1
+
+    total = sum(causes.values())
+    logger.info(f"{total} mismatches, {overridden} followed by a bypass override")
+    for cause in CAUSES:
+        if causes[cause]:
+            logger.info(f"  {cause:<16} {causes[cause]:>6}")
+    logger.info(f"Report written to {args.output} in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,7 +4,7 @@ Tkinter-based graphical user interface for Kanban card management
 """
 
 import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox
+from tkinter import ttk, scrolledtext, messagebox, filedialog
 from datetime import datetime
 from typing import Callable, Optional
 
@@ -39,11 +39,13 @@ class KanbanGUI:
         self.on_write_multiple: Optional[Callable] = None
         self.on_read_multiple: Optional[Callable] = None
         self.on_clear_multiple: Optional[Callable] = None  # NEW
+        self.on_audit_cards: Optional[Callable] = None
         
         # Status variables
         self.reader_status = tk.StringVar(value="Not Connected")
         self.card_status = tk.StringVar(value="No Card")
         self.uid_var = tk.StringVar(value="-")
+        self.session_var = tk.StringVar(value="-")
         
         # Thread input variables
         self.thread1_var = tk.StringVar()
@@ -129,6 +131,15 @@ class KanbanGUI:
             font=('Consolas', 9)
         )
         uid_label.grid(row=2, column=1, sticky=tk.W, padx=(10, 0), pady=(5, 0))
+        
+        # Live statistics of the current (or last) multi-card run
+        ttk.Label(status_frame, text="Session:").grid(row=3, column=0, sticky=tk.W, pady=(5, 0))
+        session_label = ttk.Label(
+            status_frame,
+            textvariable=self.session_var,
+            font=('Consolas', 9)
+        )
+        session_label.grid(row=3, column=1, sticky=tk.W, padx=(10, 0), pady=(5, 0))
     
     def _create_input_section(self, parent):
         """Create thread input section"""
@@ -263,6 +274,14 @@ class KanbanGUI:
             style='Large.TButton'
         )
         clear_multi_btn.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E), padx=(0, 5), pady=(8, 0), ipady=5)
+        
+        audit_btn = ttk.Button(
+            button_frame,
+            text="🔍 Audit Cards",
+            command=self._handle_audit_cards,
+            style='Large.TButton'
+        )
+        audit_btn.grid(row=2, column=2, sticky=(tk.W, tk.E), pady=(8, 0), ipady=5)
     
     def _create_log_section(self, parent):
         """Create log display section"""
@@ -499,6 +518,24 @@ class KanbanGUI:
             if result:
                 self.on_clear_multiple()
     
+    def _handle_audit_cards(self):
+        """Handle Audit Cards button click"""
+        if self.on_audit_cards:
+            plan_path = filedialog.askopenfilename(
+                title="Select plan to audit against",
+                filetypes=[("Plan CSV", "*.csv"), ("All files", "*.*")]
+            )
+            if not plan_path:
+                return
+            report_path = filedialog.asksaveasfilename(
+                title="Save discrepancy report",
+                defaultextension=".csv",
+                initialfile=f"audit_{datetime.now():%Y%m%d_%H%M}.csv",
+                filetypes=[("CSV", "*.csv")]
+            )
+            if report_path:
+                self.on_audit_cards(plan_path, report_path)
+    
     def _ask_quantity_clear(self) -> int:
         """Ask user for number of cards to clear"""
         dialog = tk.Toplevel(self.root)
@@ -586,6 +623,10 @@ class KanbanGUI:
         """Update card UID display"""
         self.uid_var.set(uid if uid else "-")
     
+    def set_session_stats(self, summary: str):
+        """Update the multi-card session statistics line"""
+        self.session_var.set(summary if summary else "-")
+    
     def set_thread_values(self, thread1: str, thread2: str):
         """Set thread input values"""
         self.thread1_var.set(thread1)
@@ -0,0 +1,615 @@
+"""
+CWT Thread Verification System - HTTP Service
+Local HTTP/JSON API over the card engine, for MES integration without the GUI
+
+Every card operation is a job. A job is queued on a reader, runs when the
+reader is free and reports progress as numbered events. Reader connections
+are opened once at startup and kept between jobs; jobs are run by the
+scheduler (scheduler.py), one at a time per reader and in parallel across
+readers.
+
+    GET    /health                       Service and reader status
+    GET    /readers                      Readers with queue length and current job
+    GET    /metrics                      OpenMetrics / Prometheus text (metrics.py)
+    POST   /jobs                         Queue a job: {"op": "write", "thread1": .., "thread2": ..}
+    POST   /write | /read | /clear | /bypass | /batch
+                                         Same as POST /jobs with that op
+    GET    /jobs                         Recent jobs
+    GET    /jobs/<id>?since=N&wait=S     Job status; with wait, long-polls until an
+                                         event after N arrives or the job ends
+    GET    /jobs/<id>/events             Server-sent events until the job ends
+    DELETE /jobs/<id>                    Cancel (a batch stops at the next card boundary)
+
+Job fields: op (write, read, clear, bypass, batch), thread1, thread2,
+quantity (batch), reader (reader name, default: first free reader),
+timeout (seconds to wait for each card) and priority (urgent, interactive,
+batch; default batch for batch jobs, interactive otherwise). Jobs run by
+priority; a running batch pauses between cards for a higher-priority job
+on its reader (state "paused") and then carries on.
+
+Usage:
+    python http_service.py
+    python http_service.py --port 9000 --history kanban_history.jsonl
+    python http_service.py --simulate 2        (simulated readers, no hardware)
+    python http_service.py --trace traces      (record reader traffic, see apdu_trace.py)
+
+With --simulate, cards are placed and removed over HTTP as well:
+
+    POST   /simulator/<n>/card  {"uid": "04 A1 B2 C3"}
+    POST   /simulator/<n>/card  {"uid": "04 11 22 33 44 55 66", "type": "ultralight"}
+    DELETE /simulator/<n>/card
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Set
+from urllib.parse import parse_qs, urlparse
+
+from config import (
+    SERVICE_HOST, SERVICE_PORT, SERVICE_CARD_TIMEOUT, SERVICE_MAX_WAIT, SERVICE_JOBS_KEPT,
+    WRITE_HISTORY_FILE, APP_VERSION
+)
+from kanban_format import validate_thread_code
+import metrics
+from plan import normalize_uid
+from scheduler import (
+    CardScheduler, ScheduledJob, wait_for_card_steps, PRIORITY_NAMES,
+    QUEUED, RUNNING, PAUSED, DONE, FAILED, CANCELLED, FINAL_STATES
+)
+from session_stats import SessionStats
+from write_history import WriteHistory
+
+
+OPS = ('write', 'read', 'clear', 'bypass', 'batch')
+
+
+class JobError(ValueError):
+    """Invalid job request (answered with 400)"""
+
+
+class Job:
+    """One queued card operation and its progress events"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, op: str, params: Dict):
+        self.id = str(next(self._ids))
+        self.op = op
+        self.params = params
+        self.priority = PRIORITY_NAMES[params['priority']]
+        self.handle: Optional[ScheduledJob] = None
+        self.reader = None
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.events: List[Dict] = []
+        self.cancelled = threading.Event()
+        self._changed = threading.Condition()
+
+    def emit(self, event: str, **data):
+        """Append a progress event and wake long-polls and event streams"""
+        with self._changed:
+            self.events.append({'seq': len(self.events) + 1, 'event': event,
+                                'time': round(time.time(), 3), **data})
+            self._changed.notify_all()
+
+    def start(self, reader: str) -> bool:
+        """Mark the job running on a reader (False if it was cancelled while queued)"""
+        with self._changed:
+            if self.cancelled.is_set():
+                return False
+            self.state = RUNNING
+            self.reader = reader
+        self.emit(RUNNING)
+        return True
+
+    def cancel(self):
+        """Stop the job; a queued job never runs, a running one stops at the next card"""
+        with self._changed:
+            self.cancelled.set()
+            queued = self.state == QUEUED  # start() checks the flag under the same lock
+        if self.handle is not None:
+            self.handle.cancel()
+        if queued:
+            self.finish(CANCELLED, error="Cancelled before start")
+
+    def finish(self, state: str, result: Optional[Dict] = None, error: Optional[str] = None):
+        with self._changed:
+            self.state = state
+            self.result = result
+            self.error = error
+            self.finished = time.time()
+        self.emit(state, result=result, error=error)
+
+    def wait(self, since: int, timeout: float) -> bool:
+        """
+        Wait for an event after `since` (or the end of the job)
+
+        Returns:
+            bool: True if there is something new
+        """
+        with self._changed:
+            return self._changed.wait_for(
+                lambda: len(self.events) > since or self.state in FINAL_STATES, timeout)
+
+    def to_dict(self, since: Optional[int] = None) -> Dict:
+        with self._changed:
+            state = self.state
+            if state == RUNNING and self.handle is not None and self.handle.state == PAUSED:
+                state = PAUSED  # Preempted by a higher-priority job, resumes at the card boundary
+            data = {
+                'id': self.id, 'op': self.op, 'params': self.params, 'reader': self.reader,
+                'state': state, 'result': self.result, 'error': self.error,
+                'created': round(self.created, 3),
+                'finished': round(self.finished, 3) if self.finished else None,
+                'last_seq': len(self.events),
+            }
+            if since is not None:
+                data['events'] = self.events[since:]
+            return data
+
+
+def parse_job(op: str, body: Dict) -> Job:
+    """
+    Validate a job request
+
+    Args:
+        op: Operation
+        body: Request JSON
+
+    Returns:
+        Job: New job (not queued yet)
+
+    Raises:
+        JobError: Unknown op or invalid parameters
+    """
+    if op not in OPS:
+        raise JobError(f"Unknown op: {op!r} (expected one of {', '.join(OPS)})")
+
+    try:
+        params = {'timeout': float(body.get('timeout', SERVICE_CARD_TIMEOUT))}
+    except (TypeError, ValueError):
+        raise JobError("timeout must be a number")
+    if body.get('reader'):
+        params['reader'] = str(body['reader'])
+    params['priority'] = str(body.get('priority', 'batch' if op == 'batch' else 'interactive'))
+    if params['priority'] not in PRIORITY_NAMES:
+        raise JobError(f"Unknown priority: {params['priority']!r} "
+                       f"(expected one of {', '.join(PRIORITY_NAMES)})")
+
+    if op in ('write', 'batch'):
+        for field in ('thread1', 'thread2'):
+            code = str(body.get(field, '')).strip()
+            error = validate_thread_code(code)
+            if error:
+                raise JobError(f"{field}: {error}")
+            params[field] = code
+    if op == 'batch':
+        try:
+            params['quantity'] = int(body.get('quantity', 1))
+        except (TypeError, ValueError):
+            raise JobError("quantity must be an integer")
+        if params['quantity'] < 1:
+            raise JobError("quantity must be at least 1")
+    return Job(op, params)
+
+
+class CardService:
+    """Reader pool, job queue and the card operations behind the HTTP API"""
+
+    def __init__(self, managers: List, history: Optional[WriteHistory] = None):
+        """
+        Args:
+            managers: Connected RFIDManager per reader (kept open for the life of the service)
+            history: Write history for write/bypass/clear jobs
+        """
+        self.history = history
+        self.scheduler = CardScheduler(managers)
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def submit(self, job: Job) -> Job:
+        """
+        Queue a job on the requested reader, or on the first reader to become free
+
+        Raises:
+            JobError: No such reader / no readers
+        """
+        if not self.scheduler.managers:
+            raise JobError("No readers available")
+        reader = job.params.get('reader')
+        if reader is not None and reader not in self.scheduler.managers:
+            raise JobError(f"Reader not found: {reader}")
+
+        with self._jobs_lock:
+            self.jobs[job.id] = job
+            self._prune()
+        job.emit(QUEUED, priority=job.params['priority'])
+        job.handle = self.scheduler.submit(lambda rfid, _: self._run_job(rfid, job),
+                                           job.priority, job.id, reader)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._jobs_lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self) -> List[Dict]:
+        with self._jobs_lock:
+            jobs = list(self.jobs.values())
+        return [job.to_dict() for job in jobs]
+
+    def readers(self) -> List[Dict]:
+        readers = []
+        for name in self.scheduler.managers:
+            running = self.scheduler.running(name)
+            readers.append({'name': name, 'queued': len(self.scheduler.queued(name)),
+                            'job': running.name if running else None})
+        return readers
+
+    def close(self):
+        self.scheduler.shutdown()
+        for rfid in self.scheduler.managers.values():
+            rfid.disconnect()
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond SERVICE_JOBS_KEPT"""
+        excess = len(self.jobs) - SERVICE_JOBS_KEPT
+        for job_id in [j.id for j in self.jobs.values() if j.state in FINAL_STATES][:max(excess, 0)]:
+            del self.jobs[job_id]
+
+    # ------------------------------------------------------------------
+    # Card operations (scheduler jobs: generators yielding at card boundaries)
+    # ------------------------------------------------------------------
+
+    def _run_job(self, rfid, job: Job):
+        if not job.start(str(rfid.reader)):
+            return
+        try:
+            if job.op == 'batch':
+                result, error = yield from self._run_batch(rfid, job)
+            else:
+                result, error = yield from self._run_single(rfid, job)
+        except Exception as e:
+            self.logger.exception(f"Job {job.id} failed")
+            result, error = None, f"Internal error: {e}"
+        finally:
+            rfid.disconnect()
+
+        if job.cancelled.is_set() and error:
+            job.finish(CANCELLED, result, error)
+        else:
+            job.finish(FAILED if error else DONE, result, error)
+
+    def _wait_card(self, rfid, job: Job, skip: Set[str] = frozenset()):
+        """Wait for a card not in `skip` (cards of this batch already done)"""
+        job.emit('waiting_card')
+        success, msg = yield from wait_for_card_steps(rfid, job.handle, job.params['timeout'], skip)
+        if not success:
+            return None, msg
+        uid = rfid.get_card_uid()
+        job.emit('card_detected', uid=uid)
+        return uid or "", msg
+
+    def _operate(self, rfid, op: str, thread1: str = "", thread2: str = "") -> Dict:
+        """Run one operation on the connected card"""
+        uid = rfid.get_card_uid()
+        if op == 'read':
+            success, t1, t2, msg = rfid.read_kanban()
+            return {'ok': success, 'uid': uid, 'thread1': t1, 'thread2': t2, 'message': msg,
+                    'revoked': rfid.card_revoked}
+
+        if op == 'write':
+            success, msg = rfid.write_kanban(thread1, thread2)
+        elif op == 'bypass':
+            success, msg = rfid.write_bypass()
+        else:
+            success, msg = rfid.clear_card()
+        if self.history is not None:
+            self.history.record(op, uid, thread1, thread2, ok=success)
+        return {'ok': success, 'uid': uid, 'thread1': thread1, 'thread2': thread2,
+                'message': msg}
+
+    def _run_single(self, rfid, job: Job):
+        uid, msg = yield from self._wait_card(rfid, job)
+        if uid is None:
+            return None, msg
+        result = self._operate(rfid, job.op, job.params.get('thread1', ''),
+                               job.params.get('thread2', ''))
+        rfid.signal_result(result['ok'])  # Reader LED, if the reader profile has feedback
+        rfid.disconnect()
+        job.emit('card_done', **result)
+        return result, None if result['ok'] else result['message']
+
+    def _run_batch(self, rfid, job: Job):
+        quantity = job.params['quantity']
+        written = set()
+        tried = set()   # Written or failed: wait for another card instead of retrying forever
+        cards = []
+        stats = SessionStats('write')
+        uid, msg = None, "Cancelled"
+        while len(written) < quantity:
+            if job.cancelled.is_set():
+                break
+            uid, msg = yield from self._wait_card(rfid, job, tried)
+            if uid is None:
+                break
+            started = time.perf_counter()
+            result = self._operate(rfid, 'write', job.params['thread1'], job.params['thread2'])
+            stats.record(result['ok'], time.perf_counter() - started, result['thread1'], result['thread2'])
+            rfid.signal_result(result['ok'])
+            rfid.disconnect()
+            tried.add(uid)
+            if result['ok']:
+                written.add(uid)
+            cards.append(result)
+            job.emit('card_done', index=len(written), quantity=quantity, **result)
+            yield  # Card boundary: urgent jobs on this reader run here
+
+        summary = {'quantity': quantity, 'written': len(written),
+                   'failed': stats.failed, 'stats': stats.summary_line(), 'cards': cards}
+        if len(written) < quantity:
+            return summary, msg if uid is None else "Stopped"
+        return summary, None
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """JSON request handler; the CardService is server.service"""
+
+    server_version = f"KanbanService/{APP_VERSION}"
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def service(self) -> CardService:
+        return self.server.service
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug("%s - %s", self.address_string(), format % args)
+
+    # -- routing --------------------------------------------------------
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        query = parse_qs(url.query)
+
+        if parts == ['health']:
+            return self._send(200, {'status': 'ok', 'version': APP_VERSION,
+                                    'readers': len(self.service.scheduler.managers)})
+        if parts == ['readers']:
+            return self._send(200, {'readers': self.service.readers()})
+        if parts == ['metrics']:
+            content_type, body = metrics.negotiate(self.headers.get('Accept'))
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if parts == ['jobs']:
+            return self._send(200, {'jobs': self.service.list_jobs()})
+        if len(parts) in (2, 3) and parts[0] == 'jobs':
+            job = self.service.get(parts[1])
+            if job is None:
+                return self._send(404, {'error': f"Job not found: {parts[1]}"})
+            if len(parts) == 3 and parts[2] == 'events':
+                return self._stream_events(job)
+            if len(parts) == 2:
+                return self._job_status(job, query)
+        return self._send(404, {'error': f"Not found: {url.path}"})
+
+    def do_POST(self):
+        parts = [p for p in urlparse(self.path).path.split('/') if p]
+        try:
+            body = self._read_json()
+            if parts == ['jobs']:
+                job = self.service.submit(parse_job(str(body.get('op', '')), body))
+            elif len(parts) == 1 and parts[0] in OPS:
+                job = self.service.submit(parse_job(parts[0], body))
+            elif parts[:1] == ['simulator'] and self.server.simulator is not None:
+                return self._simulator(parts[1:], body)
+            else:
+                return self._send(404, {'error': f"Not found: {self.path}"})
+        except JobError as e:
+            return self._send(400, {'error': str(e)})
+        self._send(202, job.to_dict(), headers={'Location': f"/jobs/{job.id}"})
+
+    def do_DELETE(self):
+        parts = [p for p in urlparse(self.path).path.split('/') if p]
+        if len(parts) == 2 and parts[0] == 'jobs':
+            job = self.service.get(parts[1])
+            if job is None:
+                return self._send(404, {'error': f"Job not found: {parts[1]}"})
+            job.cancel()
+            return self._send(200, job.to_dict())
+        if parts[:1] == ['simulator'] and self.server.simulator is not None:
+            return self._simulator(parts[1:], None)
+        self._send(404, {'error': f"Not found: {self.path}"})
+
+    # -- handlers -------------------------------------------------------
+
+    def _job_status(self, job: Job, query: Dict):
+        try:
+            since = int(query.get('since', ['0'])[0])
+            wait = min(float(query.get('wait', ['0'])[0]), SERVICE_MAX_WAIT)
+        except ValueError:
+            return self._send(400, {'error': "since and wait must be numbers"})
+        if wait > 0:
+            job.wait(since, wait)
+        self._send(200, job.to_dict(since=since))
+
+    def _stream_events(self, job: Job):
+        """Server-sent events; resumes after Last-Event-ID on reconnect"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        sent = int(self.headers.get('Last-Event-ID') or 0)
+        try:
+            while True:
+                job.wait(sent, SERVICE_MAX_WAIT)
+                for event in job.to_dict(since=sent)['events']:
+                    self.wfile.write(f"id: {event['seq']}\nevent: {event['event']}\n"
+                                     f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+                    sent = event['seq']
+                if job.state in FINAL_STATES and sent >= len(job.events):
+                    break
+                self.wfile.write(b": keep-alive\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client went away; the job carries on
+
+    def _simulator(self, parts: List[str], body: Optional[Dict]):
+        """Place (POST) or remove (DELETE) a card on simulated reader n"""
+        from simulated_reader import SimulatedCard, SimulatedUltralightCard
+
+        try:
+            reader = self.server.simulator[int(parts[0])]
+        except (IndexError, ValueError):
+            return self._send(404, {'error': "Unknown simulated reader"})
+        if parts[1:] != ['card']:
+            return self._send(404, {'error': f"Not found: {self.path}"})
+        if body is None:
+            card = reader.remove()
+            return self._send(200, {'reader': reader.name, 'removed': card.uid if card else None})
+        uid = body.get('uid')
+        if not uid:
+            return self._send(400, {'error': "uid is required"})
+        card_class = SimulatedUltralightCard if body.get('type') == 'ultralight' else SimulatedCard
+        card = self.server.simulated_cards.setdefault(normalize_uid(uid), card_class.blank(uid))
+        reader.place(card)
+        self._send(200, {'reader': reader.name, 'placed': card.uid})
+
+    # -- helpers --------------------------------------------------------
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise JobError("Request body is not valid JSON")
+        if not isinstance(body, dict):
+            raise JobError("Request body must be a JSON object")
+        return body
+
+    def _send(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def make_server(service: CardService, host: str = SERVICE_HOST, port: int = SERVICE_PORT,
+                simulator: Optional[List] = None) -> ThreadingHTTPServer:
+    """
+    Create the HTTP server (call serve_forever() to run it)
+
+    Args:
+        service: Card service
+        host: Bind address
+        port: Port (0 picks a free port, see server.server_address)
+        simulator: Simulated readers to expose under /simulator
+    """
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.simulator = simulator
+    server.simulated_cards = {}
+    return server
+
+
+def open_readers(reader_source: Optional[Callable[[], List]] = None) -> List:
+    """
+    Connect one RFIDManager to every reader (the connection pool)
+
+    Args:
+        reader_source: Reader list provider (default: PC/SC readers)
+
+    Returns:
+        List: Connected RFIDManager per reader
+    """
+    from rfid_manager import RFIDManager  # Needs pyscard; keep job parsing importable without it
+
+    probe = RFIDManager(reader_source=reader_source)
+    managers = []
+    for reader in probe.reader_source():
+        rfid = RFIDManager(reader_source=reader_source)
+        success, msg = rfid.connect_reader(str(reader))
+        logging.getLogger(__name__).info(msg)
+        if success:
+            managers.append(rfid)
+    return managers
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Local HTTP API for Kanban card operations")
+    parser.add_argument('--host', default=SERVICE_HOST, help="Bind address")
+    parser.add_argument('--port', type=int, default=SERVICE_PORT, help="Port")
+    parser.add_argument('--history', default=WRITE_HISTORY_FILE, help="Write history file")
+    parser.add_argument('--simulate', type=int, metavar='N', default=0,
+                        help="Use N simulated readers instead of PC/SC")
+    parser.add_argument('--trace', metavar='DIR', help="Record each reader's traffic to DIR/reader<n>.ktr")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Log reader and card activity")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    simulator = None
+    reader_source = None
+    if args.simulate:
+        from simulated_reader import SimulatedReader
+        simulator = [SimulatedReader(f"Simulated ACR122U PICC Interface {i:02d} 00")
+                     for i in range(args.simulate)]
+        reader_source = lambda: simulator
+
+    managers = open_readers(reader_source)
+    if not managers:
+        print("No RFID readers found. Please connect ACR122U.")
+        return 1
+
+    traces = []
+    if args.trace:
+        import apdu_trace
+        os.makedirs(args.trace, exist_ok=True)
+        traces = [apdu_trace.record_session(rfid, os.path.join(args.trace, f"reader{i}.ktr"))
+                  for i, rfid in enumerate(managers)]
+
+    service = CardService(managers, WriteHistory(args.history))
+    server = make_server(service, args.host, args.port, simulator)
+    host, port = server.server_address[:2]
+    print(f"Kanban service on http://{host}:{port} with {len(managers)} reader(s), Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        for trace in traces:
+            trace.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
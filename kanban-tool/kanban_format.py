@@ -0,0 +1,154 @@
+"""
+CWT Thread Verification System - Kanban Data Format
+Encoding of thread codes to card blocks and back (see docs/DATA_FORMAT.md)
+"""
+
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+from config import BLOCK_SIZE, BYPASS_KEYWORD, ACCEPT_LEGACY_CARDS
+
+# Commit record (block 6): magic, version, state, generation, CRC32 of blocks 4+5
+COMMIT_MAGIC = b'KB'
+COMMIT_VERSION = 1
+STATE_PENDING = ord('P')
+STATE_COMMITTED = ord('C')
+_COMMIT_LAYOUT = struct.Struct('>2sBBII4x')
+
+
+def encode_thread_code(code: str) -> bytes:
+    """
+    Encode a thread code into one 16-byte block (ASCII, NULL padded)
+
+    Args:
+        code: Thread code (max 16 characters)
+
+    Returns:
+        bytes: Block data exactly BLOCK_SIZE bytes long
+    """
+    return code.encode('ascii').ljust(BLOCK_SIZE, b'\x00')
+
+
+def decode_thread_code(data: bytes) -> str:
+    """
+    Decode a block the way the Kanban tool reads it (strip NULL padding)
+
+    Args:
+        data: Block data
+
+    Returns:
+        str: Thread code
+    """
+    return data.decode('ascii', errors='ignore').rstrip('\x00')
+
+
+def machine_thread_code(data: bytes) -> str:
+    """
+    Decode a block the way the machine firmware does (byteArrayToString):
+    stop at the first NULL, keep printable ASCII only, trim whitespace
+
+    Args:
+        data: Block data
+
+    Returns:
+        str: Thread code as compared against the bobbin QR code
+    """
+    text = []
+    for b in data[:BLOCK_SIZE]:
+        if b == 0:
+            break
+        if 32 <= b <= 126:
+            text.append(chr(b))
+    return ''.join(text).strip()
+
+
+def validate_thread_code(code: str) -> Optional[str]:
+    """
+    Check that a thread code survives card write and machine read unchanged
+
+    Args:
+        code: Thread code
+
+    Returns:
+        Optional[str]: Error message, or None if the code is valid
+    """
+    if not code:
+        return "Thread code is empty"
+    if len(code) > BLOCK_SIZE:
+        return f"Thread code too long (max {BLOCK_SIZE} chars)"
+    try:
+        data = encode_thread_code(code)
+    except UnicodeEncodeError:
+        return "Thread code must be ASCII"
+    if machine_thread_code(data) != code:
+        return "Thread code has leading/trailing spaces or non-printable characters"
+    if code.lower() == BYPASS_KEYWORD.lower():
+        return f"'{code}' is reserved for bypass cards"
+    return None
+
+
+def payload_crc(block_thread1: bytes, block_thread2: bytes) -> int:
+    """CRC32 of the two payload blocks as stored on the card"""
+    return zlib.crc32(block_thread1 + block_thread2) & 0xFFFFFFFF
+
+
+@dataclass(frozen=True)
+class CommitRecord:
+    """
+    Two-phase write state kept in block 6
+
+    A write first stores a PENDING record with the CRC of the new payload,
+    then writes blocks 4-5, then stores the COMMITTED record. A card pulled
+    mid-write keeps the PENDING record, so readers can tell it is torn and
+    the tool can finish the same write later.
+    """
+    state: int
+    generation: int
+    crc: int
+
+    @property
+    def committed(self) -> bool:
+        return self.state == STATE_COMMITTED
+
+    def encode(self) -> bytes:
+        """Block 6 data (16 bytes)"""
+        return _COMMIT_LAYOUT.pack(COMMIT_MAGIC, COMMIT_VERSION, self.state, self.generation, self.crc)
+
+    @staticmethod
+    def decode(data: bytes) -> Optional["CommitRecord"]:
+        """
+        Parse block 6
+
+        Returns:
+            Optional[CommitRecord]: Record, or None for a card without one (legacy or blank)
+        """
+        if len(data) < BLOCK_SIZE or data[:2] != COMMIT_MAGIC:
+            return None
+        _, version, state, generation, crc = _COMMIT_LAYOUT.unpack(data[:BLOCK_SIZE])
+        if version != COMMIT_VERSION:
+            return None
+        return CommitRecord(state, generation, crc)
+
+
+def check_commit(block_thread1: bytes, block_thread2: bytes, block_commit: bytes) -> Optional[str]:
+    """
+    Check that the payload blocks belong to a completed write
+
+    Args:
+        block_thread1: Block 4 data
+        block_thread2: Block 5 data
+        block_commit: Block 6 data
+
+    Returns:
+        Optional[str]: Error message, or None if the card can be used
+    """
+    record = CommitRecord.decode(block_commit)
+    if record is None:
+        return None if ACCEPT_LEGACY_CARDS else "Card has no commit record"
+    if not record.committed:
+        return "Card write was interrupted (not committed)"
+    if record.crc != payload_crc(block_thread1, block_thread2):
+        return "Card data does not match its commit record"
+    return None
@@ -0,0 +1,192 @@
+"""
+CWT Thread Verification System - Key Ring
+MIFARE Classic Key A selection: candidate keys, UID-diversified keys and a per-card memo
+
+Cards are not all keyed alike: factory cards use the transport key, cards
+secured later use a key derived from the card UID and a master secret
+(diversified keys: one leaked card key does not open the others), and
+migrated stock may use any of a few known keys. For each (UID, sector) the
+ring returns the keys to try in order:
+
+    1. The key that worked last time for this card and sector (memo)
+    2. The UID-diversified key, if a master secret is configured
+    3. KEY_CANDIDATES, in config order (the transport key first by default)
+
+A failed MIFARE authentication halts the card, so each further key costs a
+re-selection as well; the memo keeps that search to the first time a card
+is seen. The memo is an LRU of KEY_MEMO_SIZE entries.
+
+Diversified key: the first 6 bytes of HMAC-SHA256(master, "KANBAN-KEY-A" ||
+UID || sector); Key B, written to the trailer by provisioning.py, uses
+"KANBAN-KEY-B". The HMAC state of the master is computed once, and the keys
+of a card are derived when it is detected (prepare), before any
+authentication.
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+from config import (
+    BLOCK_THREAD1, BLOCK_COMMIT, KEY_CANDIDATES, KEY_MASTER_FILE, KEY_MEMO_SIZE
+)
+
+
+DIVERSIFY_LABEL = b"KANBAN-KEY-A"
+DIVERSIFY_LABEL_B = b"KANBAN-KEY-B"
+KEY_SIZE = 6
+
+# Sectors holding the Kanban blocks (derived ahead when a card is detected)
+KANBAN_SECTORS = tuple(range(BLOCK_THREAD1 // 4, BLOCK_COMMIT // 4 + 1))
+
+logger = logging.getLogger(__name__)
+
+
+def uid_bytes(uid: str) -> bytes:
+    """UID string as shown by RFIDManager ("04 A1 B2 C3") to bytes"""
+    return bytes.fromhex(uid.replace(" ", "").replace(":", ""))
+
+
+def load_master(path: str = KEY_MASTER_FILE) -> Optional[bytes]:
+    """
+    Master secret for diversified keys (KANBAN_KEY_MASTER, hex, overrides the file)
+
+    Args:
+        path: File holding the secret as hex; empty for none
+
+    Returns:
+        Optional[bytes]: The secret, or None if diversification is off
+
+    Raises:
+        ValueError: The secret is not hex or shorter than 16 bytes
+        OSError: The file cannot be read
+    """
+    text = os.environ.get('KANBAN_KEY_MASTER', '')
+    if not text and path:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+    text = "".join(text.split())
+    if not text:
+        return None
+    master = bytes.fromhex(text)
+    if len(master) < 16:
+        raise ValueError(f"Key master secret too short ({len(master)} bytes, need at least 16)")
+    return master
+
+
+class KeyRing:
+    """Keys to try per (UID, sector), with an LRU memo of the key that worked"""
+
+    def __init__(self, candidates: Iterable[Iterable[int]] = KEY_CANDIDATES,
+                 master: Optional[bytes] = None, memo_size: int = KEY_MEMO_SIZE):
+        """
+        Args:
+            candidates: Fixed keys (6 bytes each), tried after the memo and the diversified key
+            master: Master secret for UID-diversified keys; None disables them
+            memo_size: (UID, sector) entries remembered
+        """
+        self.candidates: List[Tuple[int, ...]] = []
+        for key in candidates:
+            key = tuple(key)
+            if len(key) != KEY_SIZE:
+                raise ValueError(f"Key must be {KEY_SIZE} bytes: {key}")
+            if key not in self.candidates:
+                self.candidates.append(key)
+        self.memo_size = memo_size
+        self._memo: "OrderedDict[Tuple[str, int], Tuple[int, ...]]" = OrderedDict()
+        self._derived: "OrderedDict[Tuple[str, int], Tuple[int, ...]]" = OrderedDict()
+        self._hmac = hmac.new(master, DIVERSIFY_LABEL, hashlib.sha256) if master else None
+        self._hmac_b = hmac.new(master, DIVERSIFY_LABEL_B, hashlib.sha256) if master else None
+
+    @classmethod
+    def from_settings(cls) -> "KeyRing":
+        """Key ring from config.py (a broken master secret is logged and left out)"""
+        try:
+            master = load_master()
+        except (OSError, ValueError) as e:
+            logger.error(f"Diversified keys disabled: {e}")
+            master = None
+        return cls(KEY_CANDIDATES, master)
+
+    @property
+    def diversified(self) -> bool:
+        return self._hmac is not None
+
+    def derive(self, uid: str, sector: int) -> Optional[Tuple[int, ...]]:
+        """
+        Diversified key of one card sector (computed once, then cached)
+
+        Returns:
+            Optional[Tuple[int, ...]]: 6-byte key, or None without a master secret
+        """
+        if self._hmac is None:
+            return None
+        entry = (uid, sector)
+        key = self._derived.get(entry)
+        if key is None:
+            mac = self._hmac.copy()
+            mac.update(uid_bytes(uid) + bytes([sector]))
+            key = tuple(mac.digest()[:KEY_SIZE])
+            self._store(self._derived, entry, key)
+        else:
+            self._derived.move_to_end(entry)
+        return key
+
+    def derive_key_b(self, uid: str, sector: int) -> Optional[Tuple[int, ...]]:
+        """Diversified Key B of one card sector (provisioning only, not cached)"""
+        if self._hmac_b is None:
+            return None
+        mac = self._hmac_b.copy()
+        mac.update(uid_bytes(uid) + bytes([sector]))
+        return tuple(mac.digest()[:KEY_SIZE])
+
+    def prepare(self, uid: Optional[str], sectors: Iterable[int] = KANBAN_SECTORS):
+        """Derive a card's keys ahead of authentication (call when the card is detected)"""
+        if uid is not None and self._hmac is not None:
+            for sector in sectors:
+                self.derive(uid, sector)
+
+    def keys_for(self, uid: Optional[str], sector: int) -> List[Tuple[int, ...]]:
+        """
+        Keys to try, most likely first
+
+        Args:
+            uid: Card UID (None: candidates only)
+            sector: Sector to authenticate
+
+        Returns:
+            List[Tuple[int, ...]]: Distinct keys in trial order
+        """
+        keys = []
+        if uid is not None:
+            remembered = self._memo.get((uid, sector))
+            if remembered is not None:
+                self._memo.move_to_end((uid, sector))
+                keys.append(remembered)
+            derived = self.derive(uid, sector)
+            if derived is not None and derived not in keys:
+                keys.append(derived)
+        keys.extend(key for key in self.candidates if key not in keys)
+        return keys
+
+    def remembered(self, uid: Optional[str], sector: int) -> Optional[Tuple[int, ...]]:
+        """Key memoized for a card sector, if any"""
+        return self._memo.get((uid, sector))
+
+    def remember(self, uid: Optional[str], sector: int, key: Iterable[int]):
+        """Record the key that authenticated a card sector"""
+        if uid is not None:
+            self._store(self._memo, (uid, sector), tuple(key))
+
+    def forget(self, uid: Optional[str], sector: int):
+        """Drop a memo entry whose key stopped working (card re-keyed)"""
+        self._memo.pop((uid, sector), None)
+
+    def _store(self, table: OrderedDict, entry: Tuple[str, int], key: Tuple[int, ...]):
+        table[entry] = key
+        table.move_to_end(entry)
+        while len(table) > self.memo_size:
+            table.popitem(last=False)
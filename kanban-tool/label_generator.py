@@ -0,0 +1,260 @@
+"""
+CWT Thread Verification System - Bobbin Label Generator
+Renders bobbin QR labels that match the thread codes written to Kanban cards
+
+The QR payload is taken from the same encoding the tool writes to the card
+(kanban_format.encode_thread_code) as decoded by the machine firmware, so a
+label always scans to exactly what the machine compares against.
+
+Usage:
+    python label_generator.py plan.csv -o labels.pdf
+    python label_generator.py plan.csv --bobbins-per-card 2 -o labels/
+    python label_generator.py --catalog codes.txt --copies 20 -o labels.pdf
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from typing import List, Optional, Tuple
+
+try:
+    import qrcode
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:  # Optional dependency, only needed for label printing
+    qrcode = None
+    Image = ImageDraw = ImageFont = None
+
+from config import (
+    LABEL_DPI, LABEL_PAGE_MM, LABEL_SIZE_MM, LABEL_MARGIN_MM,
+    LABEL_BOBBINS_PER_CARD
+)
+from kanban_format import encode_thread_code, machine_thread_code, validate_thread_code
+from plan import load_plan, load_catalog
+
+
+def _mm_to_px(mm: float, dpi: int) -> int:
+    return int(round(mm / 25.4 * dpi))
+
+
+class LabelLayout:
+    """Page geometry in pixels"""
+
+    def __init__(self, dpi: int = LABEL_DPI, page_mm=LABEL_PAGE_MM,
+                 label_mm=LABEL_SIZE_MM, margin_mm: float = LABEL_MARGIN_MM):
+        self.dpi = dpi
+        self.page_w = _mm_to_px(page_mm[0], dpi)
+        self.page_h = _mm_to_px(page_mm[1], dpi)
+        self.label_w = _mm_to_px(label_mm[0], dpi)
+        self.label_h = _mm_to_px(label_mm[1], dpi)
+        self.margin = _mm_to_px(margin_mm, dpi)
+        self.columns = max(1, (self.page_w - 2 * self.margin) // self.label_w)
+        self.rows = max(1, (self.page_h - 2 * self.margin) // self.label_h)
+
+    @property
+    def per_page(self) -> int:
+        return self.columns * self.rows
+
+    def as_tuple(self) -> tuple:
+        """Picklable form for worker processes"""
+        return (self.dpi, self.page_w, self.page_h, self.label_w, self.label_h,
+                self.margin, self.columns, self.rows)
+
+
+def qr_payload(code: str) -> str:
+    """
+    QR text for a thread code: what the machine reads back from the card
+
+    Raises:
+        ValueError: If the code would not match after a card round trip
+    """
+    err = validate_thread_code(code)
+    if err:
+        raise ValueError(f"'{code}': {err}")
+    payload = machine_thread_code(encode_thread_code(code))
+    if payload != code:
+        raise ValueError(f"'{code}': card round trip gives '{payload}'")
+    return payload
+
+
+def labels_from_plan(path: str, bobbins_per_card: int = LABEL_BOBBINS_PER_CARD) -> Tuple[List[str], List[str]]:
+    """
+    Expand a plan file into bobbin labels (Thread 1 and Thread 2 for every card)
+
+    Returns:
+        Tuple[List[str], List[str]]: (Label codes in print order, Plan errors)
+    """
+    rows, errors = load_plan(path)
+    codes = []
+    for row in rows:
+        count = row.quantity * bobbins_per_card
+        codes.extend([row.thread1] * count)
+        codes.extend([row.thread2] * count)
+    return codes, errors
+
+
+def labels_from_catalog(path: str, copies: int = 1) -> Tuple[List[str], List[str]]:
+    """
+    Expand a catalog into labels (each code repeated `copies` times)
+
+    Returns:
+        Tuple[List[str], List[str]]: (Label codes in print order, Catalog errors)
+    """
+    codes, errors = load_catalog(path)
+    return [code for code in codes for _ in range(copies)], errors
+
+
+# ----- Rendering (runs in worker processes) -----
+
+@lru_cache(maxsize=None)
+def _load_font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 has a single bitmap font
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=4096)
+def _render_label(code: str, label_w: int, label_h: int):
+    """Render one label tile; repeated codes are served from the cache"""
+    caption_h = label_h // 5
+    qr_size = label_h - caption_h - label_h // 20
+
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=2)
+    qr.add_data(qr_payload(code))
+    qr.make(fit=True)
+    # Whole pixels per module keep every module the same width for the scanner
+    qr.box_size = max(1, qr_size // (qr.modules_count + 2 * qr.border))
+    qr_img = qr.make_image(fill_color="black", back_color="white").get_image().convert('1')
+
+    # Everything stays 1-bit: no dithering pass and small sheets
+    tile = Image.new('1', (label_w, label_h), 1)
+    tile.paste(qr_img, ((label_w - qr_img.width) // 2, (label_h - caption_h - qr_img.height) // 2))
+
+    draw = ImageDraw.Draw(tile)
+    font = _load_font(int(caption_h * 0.7))
+    text_w = draw.textlength(code, font=font)
+    draw.text(((label_w - text_w) / 2, label_h - caption_h), code, fill=0, font=font)
+    draw.rectangle([0, 0, label_w - 1, label_h - 1], outline=0)
+    return tile
+
+
+def _render_page(task: Tuple[tuple, List[str], bool]) -> bytes:
+    """Render one sheet; returns PNG bytes, or raw 1-bit pixels when as_png is False"""
+    layout, codes, as_png = task
+    _, page_w, page_h, label_w, label_h, margin, columns, _ = layout
+
+    page = Image.new('1', (page_w, page_h), 1)
+    for index, code in enumerate(codes):
+        row, col = divmod(index, columns)
+        page.paste(_render_label(code, label_w, label_h),
+                   (margin + col * label_w, margin + row * label_h))
+
+    if not as_png:
+        return page.tobytes()
+    buffer = BytesIO()
+    page.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+# ----- Public API -----
+
+def generate_labels(codes: List[str], output: str, layout: LabelLayout = None,
+                    workers: Optional[int] = None) -> Tuple[bool, str]:
+    """
+    Render label sheets for a list of codes
+
+    Args:
+        codes: Label codes in print order
+        output: '*.pdf' for a single PDF, otherwise a directory for PNG sheets
+        layout: Page layout (default from config)
+        workers: Worker processes (default: CPU count)
+
+    Returns:
+        Tuple[bool, str]: (Success status, Message)
+    """
+    if qrcode is None or Image is None:
+        return False, "Label printing needs 'qrcode' and 'Pillow' (pip install qrcode pillow)"
+    if not codes:
+        return False, "No labels to print"
+
+    try:
+        for code in set(codes):
+            qr_payload(code)
+    except ValueError as e:
+        return False, f"Invalid thread code {e}"
+
+    layout = layout or LabelLayout()
+    per_page = layout.per_page
+    as_pdf = output.lower().endswith('.pdf')
+    tasks = [(layout.as_tuple(), codes[i:i + per_page], not as_pdf)
+             for i in range(0, len(codes), per_page)]
+    workers = workers or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    try:
+        if workers == 1 or len(tasks) == 1:
+            pages = [_render_page(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                chunk = max(1, len(tasks) // (workers * 4))
+                pages = list(pool.map(_render_page, tasks, chunksize=chunk))
+
+        if as_pdf:
+            size = (layout.page_w, layout.page_h)
+            images = [Image.frombytes('1', size, data) for data in pages]
+            images[0].save(output, save_all=True, append_images=images[1:],
+                           resolution=layout.dpi)
+        else:
+            os.makedirs(output, exist_ok=True)
+            for number, data in enumerate(pages, start=1):
+                with open(os.path.join(output, f"labels_{number:03d}.png"), 'wb') as f:
+                    f.write(data)
+    except OSError as e:
+        return False, f"Failed to write labels: {e}"
+
+    elapsed = time.perf_counter() - start
+    return True, (f"{len(codes)} labels ({len(set(codes))} unique codes) on {len(pages)} sheets "
+                  f"written to {output} in {elapsed:.1f}s")
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Print bobbin QR labels for Kanban thread codes")
+    parser.add_argument('plan', nargs='?', help="Plan CSV (thread1, thread2, quantity)")
+    parser.add_argument('--catalog', help="Catalog file with one thread code per line")
+    parser.add_argument('--copies', type=int, default=1, help="Labels per catalog code")
+    parser.add_argument('--bobbins-per-card', type=int, default=LABEL_BOBBINS_PER_CARD,
+                        help="Labels per thread for every Kanban card in the plan")
+    parser.add_argument('-o', '--output', default='labels.pdf', help="Output PDF or PNG directory")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+    logger = logging.getLogger(__name__)
+
+    if bool(args.plan) == bool(args.catalog):
+        parser.error("give either a plan file or --catalog")
+
+    if args.plan:
+        codes, errors = labels_from_plan(args.plan, args.bobbins_per_card)
+    else:
+        codes, errors = labels_from_catalog(args.catalog, args.copies)
+
+    for err in errors:
+        logger.warning(err)
+
+    success, msg = generate_labels(codes, args.output, workers=args.workers)
+    if success:
+        logger.info(msg)
+        return 0
+    logger.error(msg)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
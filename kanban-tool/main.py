@@ -7,33 +7,105 @@ Version: 1.0.0
 License: MIT
 """
 
+import time
+_STARTED = time.perf_counter()  # Startup profile: everything below counts as imports
+
+import argparse
 import tkinter as tk
 import logging
+import os
+import queue
 import sys
+import threading
 from typing import Optional
 
 from gui import KanbanGUI
-from rfid_manager import RFIDManager
-from config import APP_TITLE, BYPASS_KEYWORD
+from scheduler import CardScheduler, INTERACTIVE, BATCH, FAILED, wait_for_card_steps
+from write_history import WriteHistory
+from audit import CardAudit, OK, audit_steps
+from plan import load_plan
+from session_stats import SessionStats
+from event_bus import BUS, COALESCE, BatchProgress, CardArrived, CardRemoved, EventLog
+import metrics
+from config import (
+    APP_TITLE, BYPASS_KEYWORD, METRICS_PORT, METRICS_TEXTFILE, APDU_TRACE_DIR,
+    READER_DISCOVERY_INTERVAL, STARTUP_BUDGET, EVENT_LOG_FILE
+)
+
+
+class StartupProfile:
+    """Durations of the startup phases, logged once the window is interactive"""
+    
+    def __init__(self, started: float):
+        self.started = started
+        self._last = started
+        self.phases = []        # (name, seconds) on the Tk thread, in order
+        self.background = []    # (name, seconds) on the reader startup thread
+    
+    def mark(self, name: str):
+        """End a Tk-thread phase"""
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+    
+    def report(self, logger: logging.Logger, budget: float):
+        """Log the profile (a warning if the window took longer than budget seconds)"""
+        total = time.perf_counter() - self.started
+        details = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.phases)
+        message = f"Startup: interactive after {total * 1000:.0f} ms ({details})"
+        if total > budget:
+            logger.warning(f"{message}, over the {budget * 1000:.0f} ms budget")
+        else:
+            logger.debug(message)
+    
+    def report_background(self, logger: logging.Logger):
+        details = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.background)
+        logger.debug(f"Startup (background): {details}")
 
 
 class KanbanToolApp:
-    """Main application controller"""
+    """
+    Main application controller
+    
+    Card operations run as scheduler jobs on the reader's worker thread, so
+    the window stays responsive. Single-card actions have priority over
+    continuous runs: a read clicked during a 200-card batch runs between two
+    cards of the batch, which then carries on. Jobs reach the GUI only
+    through _ui(), which hands the call to the Tk loop.
+    
+    The window comes up before the card engine: pyscard is imported and the
+    reader is looked for on a background thread (the reader is picked up
+    whenever it is plugged in), so no PC/SC call sits on the startup path.
+    """
     
-    def __init__(self):
+    def __init__(self, debug: bool = False):
+        """
+        Args:
+            debug: Log at debug level (includes the startup profile)
+        """
         # Setup logging
         logging.basicConfig(
-            level=logging.INFO,
+            level=logging.DEBUG if debug else logging.INFO,
             format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
         )
         self.logger = logging.getLogger(__name__)
+        self.profile = StartupProfile(_STARTED)
+        self.profile.mark("imports")
         
         # Create main window
         self.root = tk.Tk()
         self.gui = KanbanGUI(self.root)
+        self.profile.mark("window")
         
-        # Create RFID manager
-        self.rfid = RFIDManager()
+        # Card engine (set up by the reader startup thread)
+        self.rfid = None
+        self.monitor = None
+        self.scheduler = None
+        self.trace = None
+        self._closing = threading.Event()
+        
+        # Card write history (joined with machine logs by event_join.py)
+        self.history = WriteHistory()
         
         # Connect GUI callbacks
         self.gui.on_write_kanban = self.write_kanban
@@ -43,59 +115,123 @@ class KanbanToolApp:
         self.gui.on_write_multiple = self.write_multiple
         self.gui.on_read_multiple = self.read_multiple
         self.gui.on_clear_multiple = self.clear_multiple  # NEW
+        self.gui.on_audit_cards = self.audit_cards
         
-        # Card detection state
+        # Card detection state and batch progress (event bus -> Tk loop, latest state only)
         self.card_present = False
-        self.is_busy = False  # Flag to prevent checking during operations
-        self.stop_multiple_operation = False  # Flag to stop continuous operations
+        self.events = BUS
+        self.window_events = self.events.subscribe((CardArrived, CardRemoved, BatchProgress), COALESCE,
+                                                   name="window")
+        
+        # Event log for other consumers (own thread and queue, never on the card path)
+        self.event_log = EventLog(EVENT_LOG_FILE) if EVENT_LOG_FILE else None
+        self.event_log_events = self.events.subscribe(handler=self.event_log, name="event-log") \
+            if self.event_log is not None else None
         
-        # Initialize reader
+        # Card jobs (worker thread -> Tk loop through ui_calls)
+        self.ui_calls = queue.Queue()
+        
+        # Metrics for the production dashboard
+        self.metrics_server = metrics.serve_metrics(METRICS_PORT) if METRICS_PORT else None
+        self.metrics_file = metrics.TextfileWriter(METRICS_TEXTFILE).start() if METRICS_TEXTFILE else None
+        
+        self.profile.mark("services")
+        
+        # Initialize reader (background)
         self.initialize_reader()
         
         # Start card detection polling
-        self.start_card_detection()
+        self.check_card_status()
+        self._process_ui_calls()
+        self.root.after_idle(self.profile.report, self.logger, STARTUP_BUDGET)
+    
+    @property
+    def is_busy(self) -> bool:
+        """True while card jobs run or wait (they report their own card status)"""
+        return self.scheduler is not None and self.scheduler.busy
     
     def initialize_reader(self):
-        """Initialize RFID reader connection"""
+        """Load the card engine and look for the reader on a background thread"""
         self.gui.log("Initializing RFID reader...", 'info')
+        self.gui.set_reader_status("Searching...", False)
+        threading.Thread(target=self._reader_startup, name="ReaderStartup", daemon=True).start()
+    
+    def _reader_startup(self):
+        """Reader startup thread: import pyscard, then retry discovery until a reader is found"""
+        started = time.perf_counter()
+        try:
+            from rfid_manager import RFIDManager, PresenceMonitor  # Loads pyscard and the PC/SC layer
+            rfid = RFIDManager()
+            
+            # Reader traffic recording for field issues (apdu_trace.py)
+            trace = None
+            if APDU_TRACE_DIR:
+                import apdu_trace
+                os.makedirs(APDU_TRACE_DIR, exist_ok=True)
+                path = os.path.join(APDU_TRACE_DIR, f"session_{time.strftime('%Y%m%d_%H%M%S')}.ktr")
+                trace = apdu_trace.record_session(rfid, path)
+            
+            monitor = PresenceMonitor(rfid)  # Publishes CardArrived / CardRemoved
+        except Exception as e:
+            # Missing pyscard, an unknown READER_PROFILE, an unreadable revocation list or trace folder
+            self.logger.error(f"Card engine unavailable: {e}")
+            self._ui(self._reader_missing, f"Card engine unavailable: {e}", False)
+            return
+        self.profile.background.append(("card engine", time.perf_counter() - started))
+        self._ui(self._engine_ready, rfid, monitor, trace)
         
-        success, msg = self.rfid.connect_reader()
-        
-        if success:
-            self.gui.log(msg, 'success')
-            self.gui.set_reader_status("Connected", True)
-        else:
-            self.gui.log(msg, 'error')
-            self.gui.set_reader_status("Not Connected", False)
-            self.gui.show_warning(
-                "Reader Not Found",
-                "ACR122U reader not detected.\n\n"
-                "Please connect the reader and restart the application.\n\n"
-                "You can still use the interface, but card operations will fail."
-            )
+        reported = False
+        while not self._closing.is_set():
+            started = time.perf_counter()
+            success, msg = rfid.connect_reader()
+            if success:
+                self.profile.background.append(("reader discovery", time.perf_counter() - started))
+                self.profile.report_background(self.logger)
+                self._ui(self._reader_found, msg)
+                return
+            if not reported:
+                self._ui(self._reader_missing, msg, True)
+                reported = True
+            self._closing.wait(READER_DISCOVERY_INTERVAL)
     
-    def wait_for_card(self) -> bool:
+    def _engine_ready(self, rfid, monitor, trace):
+        """Card engine loaded (Tk thread): card jobs can be queued from now on"""
+        self.rfid = rfid
+        self.monitor = monitor
+        self.trace = trace
+        self.scheduler = CardScheduler([rfid])
+    
+    def _reader_found(self, msg: str):
+        self.gui.log(msg, 'success')
+        self.gui.set_reader_status("Connected", True)
+        self.start_card_detection()
+    
+    def _reader_missing(self, msg: str, retrying: bool):
+        # Not a dialog: the operator can still use the window, and the reader is picked up when plugged in
+        self.gui.log(msg, 'error')
+        self.gui.set_reader_status("Not Connected", False)
+        if retrying:
+            self.gui.log("Connect the ACR122U reader; it will be detected automatically.", 'warning')
+    
+    def wait_for_card(self, job, timeout: float = 10):
         """
-        Wait for card to be placed on reader
+        Wait for card to be placed on reader (job step, yields between attempts)
         
         Returns:
             bool: True if card detected, False otherwise
         """
-        self.gui.log("Waiting for card... Please place card on reader.", 'info')
-        self.gui.set_card_status("Waiting...", False)
+        self._log("Waiting for card... Please place card on reader.", 'info')
+        self._ui(self.gui.set_card_status, "Waiting...", False)
         
-        # Allow GUI to update
-        self.root.update()
-        
-        success, msg = self.rfid.wait_for_card(timeout=10)
+        success, msg = yield from wait_for_card_steps(self.rfid, job, timeout)
         
         if success:
-            self.gui.log(msg, 'success')
-            self.gui.set_card_status("Card Detected", True)
+            self._log(msg, 'success')
+            self._ui(self.gui.set_card_status, "Card Detected", True)
             return True
         else:
-            self.gui.log(msg, 'warning')
-            self.gui.set_card_status("No Card", False)
+            self._log(msg, 'warning')
+            self._ui(self.gui.set_card_status, "No Card", False)
             return False
     
     def write_kanban(self, thread1: str, thread2: str):
@@ -106,42 +242,41 @@ class KanbanToolApp:
             thread1: Thread 1 code
             thread2: Thread 2 code
         """
-        self.is_busy = True  # Disable card detection during operation
-        self.gui.log(f"Writing Kanban: Thread1='{thread1}', Thread2='{thread2}'", 'info')
+        self._submit(self._write_kanban_job, INTERACTIVE, "Write Kanban", thread1, thread2)
+    
+    def _write_kanban_job(self, job, thread1: str, thread2: str):
+        self._log(f"Writing Kanban: Thread1='{thread1}', Thread2='{thread2}'", 'info')
         
         # Wait for card
-        if not self.wait_for_card():
-            self.gui.show_error(
+        if not (yield from self.wait_for_card(job)):
+            self._ui(self.gui.show_error,
                 "No Card Detected",
                 "Please place a card on the reader and try again."
             )
-            self.is_busy = False
             return
         
         # Write data
         success, msg = self.rfid.write_kanban(thread1, thread2)
+        self.rfid.signal_result(success)  # LED feedback of the reader profile
+        self._record_history('write', thread1, thread2, success)
         
         if success:
-            self.gui.log(msg, 'success')
-            self.gui.show_success(
+            self._log(msg, 'success')
+            self._ui(self.gui.show_success,
                 "Success",
                 f"Kanban card written successfully!\n\n"
                 f"Thread 1: {thread1}\n"
                 f"Thread 2: {thread2}"
             )
         else:
-            self.gui.log(f"Failed to write Kanban: {msg}", 'error')
-            self.gui.show_error(
+            self._log(f"Failed to write Kanban: {msg}", 'error')
+            self._ui(self.gui.show_error,
                 "Write Failed",
                 f"Failed to write Kanban card.\n\n{msg}"
             )
         
         # Disconnect from card
         self.rfid.disconnect()
-        self.is_busy = False  # Re-enable card detection
-        
-        # Force immediate card status check
-        self.root.after(100, self.update_card_status_now)
     
     def write_multiple(self, thread1: str, thread2: str, quantity: int):
         """
@@ -152,517 +287,570 @@ class KanbanToolApp:
             thread2: Thread 2 code
             quantity: Number of cards to write
         """
-        self.is_busy = True  # Disable card detection during operation
-        self.gui.log(f"=== Writing {quantity} cards ===", 'info')
-        self.gui.log(f"Thread1='{thread1}', Thread2='{thread2}'", 'info')
+        self._submit(self._write_multiple_job, BATCH, f"Write {quantity} cards",
+                     thread1, thread2, quantity)
+    
+    def _write_multiple_job(self, job, thread1: str, thread2: str, quantity: int):
+        self._log(f"=== Writing {quantity} cards ===", 'info')
+        self._log(f"Thread1='{thread1}', Thread2='{thread2}'", 'info')
         
-        success_count = 0
-        failed_count = 0
+        stats = SessionStats('write')
         
         for i in range(1, quantity + 1):
-            self.gui.log(f"\n[Card {i}/{quantity}] Waiting for card...", 'warning')
+            self._log(f"\n[Card {i}/{quantity}] Waiting for card...", 'warning')
             
             # Wait for card
-            if not self.wait_for_card():
-                self.gui.log(f"[Card {i}/{quantity}] No card detected - Skipping", 'error')
-                failed_count += 1
+            if not (yield from self.wait_for_card(job)):
+                self._log(f"[Card {i}/{quantity}] No card detected - Skipping", 'error')
+                stats.record_no_card()
                 continue
             
             # Write data
-            self.gui.log(f"[Card {i}/{quantity}] Writing data...", 'info')
+            self._log(f"[Card {i}/{quantity}] Writing data...", 'info')
+            started = time.perf_counter()
             success, msg = self.rfid.write_kanban(thread1, thread2)
+            stats.record(success, time.perf_counter() - started, thread1, thread2)
+            self.rfid.signal_result(success)
+            self._record_history('write', thread1, thread2, success)
+            self._show_stats(stats, quantity)
             
             if success:
-                success_count += 1
-                self.gui.log(f"[Card {i}/{quantity}] ✓ Success!", 'success')
+                self._log(f"[Card {i}/{quantity}] ✓ Success!", 'success')
                 
                 # Disconnect and wait for card removal
                 self.rfid.disconnect()
                 
                 if i < quantity:  # Not the last card
-                    self.gui.log(f"[Card {i}/{quantity}] Please remove card and place next card", 'warning')
-                    
-                    # Wait for card to be removed
-                    removed = False
-                    for _ in range(50):  # Wait up to 5 seconds
-                        self.root.update()
-                        if not self.rfid.check_card_present():
-                            removed = True
-                            break
-                        import time
-                        time.sleep(0.1)
+                    self._log(f"[Card {i}/{quantity}] Please remove card and place next card", 'warning')
                     
-                    if not removed:
-                        self.gui.log(f"[Card {i}/{quantity}] Warning: Card not removed yet", 'warning')
+                    if not (yield from self._wait_card_removed(job)):
+                        self._log(f"[Card {i}/{quantity}] Warning: Card not removed yet", 'warning')
             else:
-                failed_count += 1
-                self.gui.log(f"[Card {i}/{quantity}] ✗ Failed: {msg}", 'error')
+                self._log(f"[Card {i}/{quantity}] ✗ Failed: {msg}", 'error')
                 self.rfid.disconnect()
+            
+            yield  # Card boundary: single-card actions run here
         
         # Summary
-        self.gui.log(f"\n=== Write Multiple Complete ===", 'info')
-        self.gui.log(f"Success: {success_count}/{quantity}", 'success')
+        success_count = stats.ok
+        failed_count = stats.failed + stats.no_card
+        self._log(f"\n=== Write Multiple Complete ===", 'info')
+        self._log(f"Success: {success_count}/{quantity}", 'success')
         if failed_count > 0:
-            self.gui.log(f"Failed: {failed_count}/{quantity}", 'error')
+            self._log(f"Failed: {failed_count}/{quantity}", 'error')
         
         # Show summary dialog
         if failed_count == 0:
-            self.gui.show_success(
+            self._ui(self.gui.show_success,
                 "All Cards Written",
                 f"Successfully wrote all {quantity} cards!\n\n"
                 f"Thread 1: {thread1}\n"
                 f"Thread 2: {thread2}"
             )
         else:
-            self.gui.show_warning(
+            self._ui(self.gui.show_warning,
                 "Write Complete with Errors",
                 f"Success: {success_count}/{quantity}\n"
                 f"Failed: {failed_count}/{quantity}\n\n"
                 f"Please check the log for details."
             )
-        
-        self.is_busy = False  # Re-enable card detection
-        
-        # Force immediate card status check
-        self.root.after(100, self.update_card_status_now)
     
     def read_kanban(self):
         """Read and display thread codes from Kanban card"""
-        self.is_busy = True  # Disable card detection during operation
-        self.gui.log("Reading Kanban card...", 'info')
+        self._submit(self._read_kanban_job, INTERACTIVE, "Read Kanban")
+    
+    def _read_kanban_job(self, job):
+        self._log("Reading Kanban card...", 'info')
         
         # Wait for card
-        if not self.wait_for_card():
-            self.gui.show_error(
+        if not (yield from self.wait_for_card(job)):
+            self._ui(self.gui.show_error,
                 "No Card Detected",
                 "Please place a card on the reader and try again."
             )
-            self.is_busy = False
             return
         
         # Read data
-        success, thread1, thread2, msg = self.rfid.read_kanban()
+        success, thread1, thread2, msg = self.rfid.read_kanban(cancel=job.cancelled)
+        self.rfid.signal_result(success)
         
         if success:
-            self.gui.log(msg, 'success')
-            self.gui.log(f"Thread 1: {thread1}", 'info')
-            self.gui.log(f"Thread 2: {thread2}", 'info')
+            self._log(msg, 'success')
+            self._log(f"Thread 1: {thread1}", 'info')
+            self._log(f"Thread 2: {thread2}", 'info')
             
             # Update GUI inputs
-            self.gui.set_thread_values(thread1, thread2)
+            self._ui(self.gui.set_thread_values, thread1, thread2)
             
             # Show results
             if thread1.lower() == BYPASS_KEYWORD.lower():
-                self.gui.show_warning(
+                self._ui(self.gui.show_warning,
                     "Bypass Card",
                     "This is a BYPASS card.\n\n"
                     "Machine will operate without verification."
                 )
             else:
-                self.gui.show_success(
+                self._ui(self.gui.show_success,
                     "Card Read Successfully",
                     f"Thread 1: {thread1}\n"
                     f"Thread 2: {thread2}"
                 )
+        elif self.rfid.card_revoked:
+            self._log(f"⛔ REVOKED CARD: {msg}", 'error')
+            self._ui(self.gui.set_card_status, "REVOKED CARD", True)
+            self._ui(self.gui.show_error,
+                "Revoked Card",
+                f"{msg}\n\n"
+                f"Do not use this card. Return it to the supervisor."
+            )
         else:
-            self.gui.log(f"Failed to read Kanban: {msg}", 'error')
-            self.gui.show_error(
+            self._log(f"Failed to read Kanban: {msg}", 'error')
+            self._ui(self.gui.show_error,
                 "Read Failed",
                 f"Failed to read Kanban card.\n\n{msg}"
             )
         
         # Disconnect from card
         self.rfid.disconnect()
-        self.is_busy = False  # Re-enable card detection
-        
-        # Force immediate card status check
-        self.root.after(100, self.update_card_status_now)
     
     def read_multiple(self):
         """
         Read multiple Kanban cards continuously until stopped
         """
-        self.is_busy = True
-        self.stop_multiple_operation = False
-        self.gui.log(f"=== Reading Multiple Cards (Continuous Mode) ===", 'info')
-        self.gui.log("Click 'Stop' button to finish reading.", 'warning')
-        
-        # Create stop button window
-        stop_window = self._create_stop_window("Reading Cards")
+        self._submit_continuous(self._read_multiple_job, "Reading Cards")
+    
+    def _read_multiple_job(self, job):
+        self._log(f"=== Reading Multiple Cards (Continuous Mode) ===", 'info')
+        self._log("Click 'Stop' button to finish reading.", 'warning')
         
-        success_count = 0
-        failed_count = 0
-        cards_data = []
+        stats = SessionStats('read')
         card_number = 1
         
-        while not self.stop_multiple_operation:
-            self.gui.log(f"\n[Card {card_number}] Waiting for card...", 'warning')
-            self.root.update()
+        while not job.cancelled.is_set():
+            self._log(f"\n[Card {card_number}] Waiting for card...", 'warning')
             
-            # Wait for card with shorter timeout for better responsiveness
-            if not self._wait_for_card_continuous(timeout=10):
-                if self.stop_multiple_operation:
+            # Wait for card
+            if not (yield from self.wait_for_card(job)):
+                if job.cancelled.is_set():
                     break
-                self.gui.log(f"[Card {card_number}] No card detected - Skipping", 'error')
-                failed_count += 1
+                self._log(f"[Card {card_number}] No card detected - Skipping", 'error')
+                stats.record_no_card()
                 card_number += 1
                 continue
             
-            if self.stop_multiple_operation:
+            # Read data
+            self._log(f"[Card {card_number}] Reading data...", 'info')
+            started = time.perf_counter()
+            success, thread1, thread2, msg = self.rfid.read_kanban(cancel=job.cancelled)
+            if not success and job.cancelled.is_set():
                 self.rfid.disconnect()
                 break
-            
-            # Read data
-            self.gui.log(f"[Card {card_number}] Reading data...", 'info')
-            success, thread1, thread2, msg = self.rfid.read_kanban()
+            stats.record(success, time.perf_counter() - started, thread1, thread2)
+            self.rfid.signal_result(success)
+            self._show_stats(stats)
             
             if success:
-                success_count += 1
-                
-                # Store card data
-                cards_data.append({
-                    'number': card_number,
-                    'thread1': thread1,
-                    'thread2': thread2,
-                    'is_bypass': thread1.lower() == BYPASS_KEYWORD.lower()
-                })
-                
                 # Log the data
                 if thread1.lower() == BYPASS_KEYWORD.lower():
-                    self.gui.log(f"[Card {card_number}] ⚠️ BYPASS CARD", 'warning')
+                    self._log(f"[Card {card_number}] ⚠️ BYPASS CARD", 'warning')
                 else:
-                    self.gui.log(f"[Card {card_number}] Thread 1: {thread1}", 'success')
-                    self.gui.log(f"[Card {card_number}] Thread 2: {thread2}", 'success')
+                    self._log(f"[Card {card_number}] Thread 1: {thread1}", 'success')
+                    self._log(f"[Card {card_number}] Thread 2: {thread2}", 'success')
                 
                 # Disconnect and wait for card removal
                 self.rfid.disconnect()
                 
-                if not self.stop_multiple_operation:
-                    self.gui.log(f"[Card {card_number}] Please remove card and place next card", 'warning')
-                    
-                    # Wait for card to be removed
-                    removed = False
-                    for _ in range(50):
-                        self.root.update()
-                        if self.stop_multiple_operation:
-                            break
-                        if not self.rfid.check_card_present():
-                            removed = True
-                            break
-                        import time
-                        time.sleep(0.1)
+                if not job.cancelled.is_set():
+                    self._log(f"[Card {card_number}] Please remove card and place next card", 'warning')
                     
-                    if not removed and not self.stop_multiple_operation:
-                        self.gui.log(f"[Card {card_number}] Warning: Card not removed yet", 'warning')
+                    removed = yield from self._wait_card_removed(job)
+                    if not removed and not job.cancelled.is_set():
+                        self._log(f"[Card {card_number}] Warning: Card not removed yet", 'warning')
             else:
-                failed_count += 1
-                self.gui.log(f"[Card {card_number}] ✗ Failed: {msg}", 'error')
+                if self.rfid.card_revoked:
+                    self._log(f"[Card {card_number}] ⛔ REVOKED CARD: {msg}", 'error')
+                else:
+                    self._log(f"[Card {card_number}] ✗ Failed: {msg}", 'error')
                 self.rfid.disconnect()
             
             card_number += 1
-            self.root.update()
-        
-        # Close stop window
-        stop_window.destroy()
+            yield  # Card boundary: single-card actions run here
         
         # Summary
         total_cards = card_number - 1
-        self.gui.log(f"\n=== Read Multiple Complete ===", 'info')
-        self.gui.log(f"Total cards processed: {total_cards}", 'info')
-        self.gui.log(f"Success: {success_count}", 'success')
+        success_count = stats.ok
+        failed_count = stats.failed + stats.no_card
+        self._log(f"\n=== Read Multiple Complete ===", 'info')
+        self._log(f"Total cards processed: {total_cards}", 'info')
+        self._log(f"Success: {success_count}", 'success')
         if failed_count > 0:
-            self.gui.log(f"Failed: {failed_count}", 'error')
-        
-        # Show detailed summary
-        if cards_data:
-            self.gui.log(f"\n--- Cards Summary ---", 'info')
-            for card in cards_data:
-                if card['is_bypass']:
-                    self.gui.log(f"Card {card['number']}: BYPASS CARD", 'warning')
-                else:
-                    self.gui.log(f"Card {card['number']}: {card['thread1']} / {card['thread2']}", 'info')
+            self._log(f"Failed: {failed_count}", 'error')
+        self._log(stats.summary_line(), 'info')
+        
+        # Cards per thread code pair
+        codes = self._code_summary(stats)
+        if codes:
+            self._log(f"\n--- Cards Summary ---", 'info')
+            for line in codes:
+                self._log(line, 'warning' if 'BYPASS' in line else 'info')
         
         # Show summary dialog
         if total_cards > 0:
             if failed_count == 0:
                 summary_text = f"Successfully read {success_count} cards!\n\n"
-                if cards_data:
-                    summary_text += "Cards:\n"
-                    for card in cards_data[:10]:
-                        if card['is_bypass']:
-                            summary_text += f"{card['number']}. BYPASS CARD\n"
-                        else:
-                            summary_text += f"{card['number']}. {card['thread1']} / {card['thread2']}\n"
-                    if len(cards_data) > 10:
-                        summary_text += f"... and {len(cards_data) - 10} more\n"
+                if codes:
+                    summary_text += "Cards:\n" + "\n".join(codes[:10]) + "\n"
+                    if len(codes) > 10:
+                        summary_text += f"... and {len(codes) - 10} more codes\n"
                 
-                self.gui.show_success("Cards Read", summary_text)
+                self._ui(self.gui.show_success, "Cards Read", summary_text)
             else:
-                self.gui.show_warning(
+                self._ui(self.gui.show_warning,
                     "Read Complete",
                     f"Total: {total_cards}\n"
                     f"Success: {success_count}\n"
                     f"Failed: {failed_count}\n\n"
                     f"Please check the log for details."
                 )
-        
-        self.is_busy = False
-        self.root.after(100, self.update_card_status_now)
     
     def write_bypass(self):
         """Write bypass mode to card"""
-        self.is_busy = True  # Disable card detection during operation
-        self.gui.log("Writing BYPASS card...", 'warning')
+        self._submit(self._write_bypass_job, INTERACTIVE, "Write Bypass")
+    
+    def _write_bypass_job(self, job):
+        self._log("Writing BYPASS card...", 'warning')
         
         # Wait for card
-        if not self.wait_for_card():
-            self.gui.show_error(
+        if not (yield from self.wait_for_card(job)):
+            self._ui(self.gui.show_error,
                 "No Card Detected",
                 "Please place a card on the reader and try again."
             )
-            self.is_busy = False
             return
         
         # Write bypass
         success, msg = self.rfid.write_bypass()
+        self.rfid.signal_result(success)
+        self._record_history('bypass', BYPASS_KEYWORD, "", success)
         
         if success:
-            self.gui.log("BYPASS card written successfully", 'success')
-            self.gui.show_success(
+            self._log("BYPASS card written successfully", 'success')
+            self._ui(self.gui.show_success,
                 "Success",
                 "BYPASS card written successfully!\n\n"
                 "⚠️ WARNING: This card will bypass all verification.\n"
                 "Use only for maintenance or special operations."
             )
         else:
-            self.gui.log(f"Failed to write BYPASS: {msg}", 'error')
-            self.gui.show_error(
+            self._log(f"Failed to write BYPASS: {msg}", 'error')
+            self._ui(self.gui.show_error,
                 "Write Failed",
                 f"Failed to write BYPASS card.\n\n{msg}"
             )
         
         # Disconnect from card
         self.rfid.disconnect()
-        self.is_busy = False  # Re-enable card detection
-        
-        # Force immediate card status check
-        self.root.after(100, self.update_card_status_now)
     
     def clear_card(self):
         """Clear all data from card"""
-        self.is_busy = True  # Disable card detection during operation
-        self.gui.log("Clearing card...", 'info')
+        self._submit(self._clear_card_job, INTERACTIVE, "Clear Card")
+    
+    def _clear_card_job(self, job):
+        self._log("Clearing card...", 'info')
         
         # Wait for card
-        if not self.wait_for_card():
-            self.gui.show_error(
+        if not (yield from self.wait_for_card(job)):
+            self._ui(self.gui.show_error,
                 "No Card Detected",
                 "Please place a card on the reader and try again."
             )
-            self.is_busy = False
             return
         
         # Clear data
         success, msg = self.rfid.clear_card()
+        self.rfid.signal_result(success)
+        self._record_history('clear', "", "", success)
         
         if success:
-            self.gui.log(msg, 'success')
-            self.gui.show_success(
+            self._log(msg, 'success')
+            self._ui(self.gui.show_success,
                 "Success",
                 "Card cleared successfully!"
             )
         else:
-            self.gui.log(f"Failed to clear card: {msg}", 'error')
-            self.gui.show_error(
+            self._log(f"Failed to clear card: {msg}", 'error')
+            self._ui(self.gui.show_error,
                 "Clear Failed",
                 f"Failed to clear card.\n\n{msg}"
             )
         
         # Disconnect from card
         self.rfid.disconnect()
-        self.is_busy = False  # Re-enable card detection
-        
-        # Force immediate card status check
-        self.root.after(100, self.update_card_status_now)
     
     def clear_multiple(self):
         """
         Clear multiple Kanban cards continuously until stopped
         """
-        self.is_busy = True
-        self.stop_multiple_operation = False
-        self.gui.log(f"=== Clearing Multiple Cards (Continuous Mode) ===", 'info')
-        self.gui.log("Click 'Stop' button to finish clearing.", 'warning')
-        
-        # Create stop button window
-        stop_window = self._create_stop_window("Clearing Cards")
+        self._submit_continuous(self._clear_multiple_job, "Clearing Cards")
+    
+    def _clear_multiple_job(self, job):
+        self._log(f"=== Clearing Multiple Cards (Continuous Mode) ===", 'info')
+        self._log("Click 'Stop' button to finish clearing.", 'warning')
         
-        success_count = 0
-        failed_count = 0
+        stats = SessionStats('clear')
         card_number = 1
         
-        while not self.stop_multiple_operation:
-            self.gui.log(f"\n[Card {card_number}] Waiting for card...", 'warning')
-            self.root.update()
+        while not job.cancelled.is_set():
+            self._log(f"\n[Card {card_number}] Waiting for card...", 'warning')
             
-            # Wait for card with shorter timeout
-            if not self._wait_for_card_continuous(timeout=10):
-                if self.stop_multiple_operation:
+            # Wait for card
+            if not (yield from self.wait_for_card(job)):
+                if job.cancelled.is_set():
                     break
-                self.gui.log(f"[Card {card_number}] No card detected - Skipping", 'error')
-                failed_count += 1
+                self._log(f"[Card {card_number}] No card detected - Skipping", 'error')
+                stats.record_no_card()
                 card_number += 1
                 continue
             
-            if self.stop_multiple_operation:
-                self.rfid.disconnect()
-                break
-            
             # Clear data
-            self.gui.log(f"[Card {card_number}] Clearing data...", 'info')
+            self._log(f"[Card {card_number}] Clearing data...", 'info')
+            started = time.perf_counter()
             success, msg = self.rfid.clear_card()
+            stats.record(success, time.perf_counter() - started)
+            self.rfid.signal_result(success)
+            self._record_history('clear', "", "", success)
+            self._show_stats(stats)
             
             if success:
-                success_count += 1
-                self.gui.log(f"[Card {card_number}] ✓ Cleared!", 'success')
+                self._log(f"[Card {card_number}] ✓ Cleared!", 'success')
                 
                 # Disconnect and wait for card removal
                 self.rfid.disconnect()
                 
-                if not self.stop_multiple_operation:
-                    self.gui.log(f"[Card {card_number}] Please remove card and place next card", 'warning')
-                    
-                    # Wait for card to be removed
-                    removed = False
-                    for _ in range(50):
-                        self.root.update()
-                        if self.stop_multiple_operation:
-                            break
-                        if not self.rfid.check_card_present():
-                            removed = True
-                            break
-                        import time
-                        time.sleep(0.1)
+                if not job.cancelled.is_set():
+                    self._log(f"[Card {card_number}] Please remove card and place next card", 'warning')
                     
-                    if not removed and not self.stop_multiple_operation:
-                        self.gui.log(f"[Card {card_number}] Warning: Card not removed yet", 'warning')
+                    removed = yield from self._wait_card_removed(job)
+                    if not removed and not job.cancelled.is_set():
+                        self._log(f"[Card {card_number}] Warning: Card not removed yet", 'warning')
             else:
-                failed_count += 1
-                self.gui.log(f"[Card {card_number}] ✗ Failed: {msg}", 'error')
+                self._log(f"[Card {card_number}] ✗ Failed: {msg}", 'error')
                 self.rfid.disconnect()
             
             card_number += 1
-            self.root.update()
-        
-        # Close stop window
-        stop_window.destroy()
+            yield  # Card boundary: single-card actions run here
         
         # Summary
         total_cards = card_number - 1
-        self.gui.log(f"\n=== Clear Multiple Complete ===", 'info')
-        self.gui.log(f"Total cards processed: {total_cards}", 'info')
-        self.gui.log(f"Success: {success_count}", 'success')
+        success_count = stats.ok
+        failed_count = stats.failed + stats.no_card
+        self._log(f"\n=== Clear Multiple Complete ===", 'info')
+        self._log(f"Total cards processed: {total_cards}", 'info')
+        self._log(f"Success: {success_count}", 'success')
         if failed_count > 0:
-            self.gui.log(f"Failed: {failed_count}", 'error')
+            self._log(f"Failed: {failed_count}", 'error')
         
         # Show summary dialog
         if total_cards > 0:
             if failed_count == 0:
-                self.gui.show_success(
+                self._ui(self.gui.show_success,
                     "All Cards Cleared",
                     f"Successfully cleared {success_count} cards!"
                 )
             else:
-                self.gui.show_warning(
+                self._ui(self.gui.show_warning,
                     "Clear Complete",
                     f"Total: {total_cards}\n"
                     f"Success: {success_count}\n"
                     f"Failed: {failed_count}\n\n"
                     f"Please check the log for details."
                 )
-        
-        self.is_busy = False
-        self.root.after(100, self.update_card_status_now)
     
-    def start_card_detection(self):
-        """Start automatic card detection polling"""
-        if self.rfid.reader is None:
-            # No reader, try again later
-            self.root.after(2000, self.start_card_detection)
+    def audit_cards(self, plan_path: str, report_path: str):
+        """
+        Audit cards against a plan until stopped (exceptions only are logged)
+        
+        Args:
+            plan_path: Plan CSV with expected card contents
+            report_path: Discrepancy report CSV
+        """
+        rows, errors = load_plan(plan_path)
+        for err in errors:
+            self.gui.log(f"Plan {err}", 'warning')
+        if not rows:
+            self.gui.show_error("Audit", "The plan has no valid rows.")
             return
         
-        self.check_card_status()
+        self._submit_continuous(self._audit_job, "Auditing Cards", plan_path, report_path, rows)
+    
+    def _audit_job(self, job, plan_path: str, report_path: str, rows):
+        self._log(f"=== Auditing Cards against {plan_path} ({len(rows)} rows) ===", 'info')
+        self._log("Sweep cards over the reader. Only exceptions beep.", 'warning')
+        
+        audit = CardAudit(rows, report_path)
+        stats = SessionStats('audit')
+        
+        def on_result(uid, status, detail, thread1, thread2):
+            self._show_stats(stats)
+            self._ui(self.gui.set_card_uid, uid)
+            if status != OK:
+                self._log(f"[{uid}] {status.upper()}: {thread1 or ''} / {thread2 or ''} {detail}", 'error')
+        
+        audited = yield from audit_steps(self.rfid, audit, job.cancelled.is_set, on_result, stats=stats,
+                                         cancel=job.cancelled)
+        counts = audit.finish()
+        
+        # Summary
+        exceptions = sum(n for status, n in counts.items() if status != OK)
+        self._log(f"\n=== Audit Complete ===", 'info')
+        self._log(f"Cards audited: {audited}", 'info')
+        for status, n in sorted(counts.items()):
+            self._log(f"  {status}: {n}", 'success' if status == OK else 'error')
+        self._log(f"Report: {report_path}", 'info')
+        
+        summary = f"Cards audited: {audited}\nExceptions: {exceptions}\n\nReport: {report_path}"
+        if exceptions == 0:
+            self._ui(self.gui.show_success, "Audit Passed", summary)
+        else:
+            self._ui(self.gui.show_warning, "Audit Found Exceptions", summary)
+    
+    def start_card_detection(self):
+        """Start background card detection (once the reader is connected)"""
+        self.monitor.start()
     
     def check_card_status(self):
-        """Check if card is present and update GUI"""
-        if not self.is_busy and self.rfid.reader is not None:
-            card_now = self.rfid.check_card_present()
+        """Apply card presence changes and batch progress published on the event bus"""
+        for event in self.window_events.drain():
+            if isinstance(event, BatchProgress):
+                progress = f"{event.done}/{event.total} | " if event.total else ""
+                self.gui.set_session_stats(progress + event.summary)
+                continue
+            
+            card_now = isinstance(event, CardArrived)
+            uid = event.uid if card_now else None
+            
+            # Operations report their own card status
+            if self.is_busy or card_now == self.card_present:
+                continue
             
-            # Update GUI only if status changed
-            if card_now != self.card_present:
-                self.card_present = card_now
-                if card_now:
-                    self.gui.set_card_status("Card Detected", True)
-                    # Try to get and display UID
-                    uid = self._get_card_uid_safe()
-                    if uid:
-                        self.gui.set_card_uid(uid)
-                        self.gui.log(f"Card detected - UID: {uid}", 'success')
-                    else:
-                        self.gui.set_card_uid("-")
-                        self.gui.log("Card detected on reader", 'success')
+            self.card_present = card_now
+            if card_now:
+                revoked = bool(uid) and self.rfid.card_revoked
+                self.gui.set_card_status("REVOKED CARD" if revoked else "Card Detected", True)
+                if revoked:
+                    self.gui.set_card_uid(uid)
+                    self.gui.log(f"⛔ Revoked card detected - UID: {uid}", 'error')
+                elif uid:
+                    self.gui.set_card_uid(uid)
+                    self.gui.log(f"Card detected - UID: {uid}", 'success')
                 else:
-                    self.gui.set_card_status("No Card", False)
                     self.gui.set_card_uid("-")
-                    self.gui.log("Card removed from reader", 'info')
+                    self.gui.log("Card detected on reader", 'success')
+            else:
+                self.gui.set_card_status("No Card", False)
+                self.gui.set_card_uid("-")
+                self.gui.log("Card removed from reader", 'info')
         
-        # Schedule next check (every 500ms)
-        self.root.after(500, self.check_card_status)
+        # Schedule next check
+        self.root.after(100, self.check_card_status)
     
     def update_card_status_now(self):
-        """Force immediate card status update (called after operations)"""
-        if self.rfid.reader is not None:
-            card_now = self.rfid.check_card_present()
-            self.card_present = card_now
-            
-            if card_now:
-                self.gui.set_card_status("Card Detected", True)
-                uid = self._get_card_uid_safe()
-                self.gui.set_card_uid(uid if uid else "-")
+        """Show the card status again after an operation (the presence monitor reports it)"""
+        if self.monitor is not None and not self.is_busy:
+            self.card_present = None  # Apply the next CardArrived / CardRemoved even if unchanged
+            self.monitor.refresh()
+    
+    def _submit(self, fn, priority: int, name: str, *args, on_done=None):
+        """Queue a card job; fn(job, *args) runs on the reader's worker thread"""
+        if self.scheduler is None:
+            self.gui.log(f"{name}: the card reader is still starting, try again in a moment", 'warning')
+            return None
+        if self.is_busy:
+            self.gui.log(f"{name}: queued, runs when the reader is free", 'info')
+        
+        def done(job):
+            if job.state == FAILED:
+                self.gui.log(f"{name} failed: {job.error}", 'error')
+            if on_done is not None:
+                on_done(job)
+            self.root.after(100, self.update_card_status_now)
+        
+        return self.scheduler.submit(lambda rfid, job: fn(job, *args), priority, name,
+                                     on_done=lambda job: self._ui(done, job))
+    
+    def _submit_continuous(self, fn, title: str, *args):
+        """Queue a continuous job with a Stop window (closed when the job ends)"""
+        if self.scheduler is None:
+            return self._submit(fn, BATCH, title, *args)
+        stop_window = self._create_stop_window(title)
+        job = self._submit(fn, BATCH, title, *args, on_done=lambda job: stop_window.destroy())
+        stop_window.on_stop = job.cancel
+        return job
+    
+    def _show_stats(self, stats: SessionStats, total: Optional[int] = None):
+        """Publish the live session statistics (status panel, event log) from a job thread"""
+        self.events.publish(BatchProgress(stats.op, stats.total + stats.no_card, total, stats.ok,
+                                          stats.failed + stats.no_card, stats.summary_line()))
+    
+    @staticmethod
+    def _code_summary(stats: SessionStats):
+        """Card counts per thread code pair, most frequent first"""
+        lines = []
+        for (thread1, thread2), count in stats.top_codes(len(stats.codes)):
+            if thread1.lower() == BYPASS_KEYWORD.lower():
+                lines.append(f"BYPASS CARD × {count}")
             else:
-                self.gui.set_card_status("No Card", False)
-                self.gui.set_card_uid("-")
+                lines.append(f"{thread1} / {thread2} × {count}")
+        if stats.other_codes:
+            lines.append(f"(other codes) × {stats.other_codes}")
+        return lines
+    
+    def _ui(self, fn, *args):
+        """Run a GUI call on the Tk thread (safe from job threads)"""
+        self.ui_calls.put((fn, args))
     
-    def _get_card_uid_safe(self) -> Optional[str]:
-        """Safely get card UID without interfering with operations"""
+    def _log(self, message: str, level: str = 'info'):
+        """gui.log from a job thread"""
+        self._ui(self.gui.log, message, level)
+    
+    def _process_ui_calls(self):
+        """Run GUI calls queued by job threads"""
+        # Reschedule first: a dialog below runs a nested loop that keeps the log moving
+        self.root.after(50, self._process_ui_calls)
         try:
-            # Create temporary connection to get UID
-            if self.rfid.reader is None:
-                return None
-            
-            temp_conn = self.rfid.reader.createConnection()
-            temp_conn.connect()
-            
-            # Get UID
-            from smartcard.util import toHexString
-            get_uid_cmd = [0xFF, 0xCA, 0x00, 0x00, 0x00]
-            data, sw1, sw2 = temp_conn.transmit(get_uid_cmd)
-            
-            temp_conn.disconnect()
-            
-            if sw1 == 0x90 and sw2 == 0x00:
-                return toHexString(data)
-            return None
-        except:
-            return None
+            while True:
+                fn, args = self.ui_calls.get_nowait()
+                fn(*args)
+        except queue.Empty:
+            pass
+    
+    def _wait_card_removed(self, job, timeout: float = 5.0):
+        """
+        Wait for the card to leave the reader (job step, yields at every poll)
+        
+        Returns:
+            bool: True if removed (or the job was stopped)
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if job.cancelled.is_set() or not self.rfid.check_card_present():
+                return True
+            job.cancelled.wait(0.1)
+            yield
+        return False
+    
+    def _record_history(self, op: str, thread1: str, thread2: str, success: bool):
+        """Record a card write by UID (call while the card is still connected)"""
+        self.history.record(op, self.rfid.get_card_uid(), thread1, thread2, ok=success)
     
     def _create_stop_window(self, title: str):
-        """Create a window with Stop button for continuous operations"""
+        """Create a window with Stop button for continuous operations (Stop calls stop_win.on_stop)"""
         stop_win = tk.Toplevel(self.root)
         stop_win.title(title)
         stop_win.geometry("500x250")
         stop_win.resizable(False, False)
         stop_win.transient(self.root)
+        stop_win.on_stop = lambda: None
         
         # Center on main window
         stop_win.update_idletasks()
@@ -706,7 +894,7 @@ class KanbanToolApp:
         
         # Stop button - MUCH LARGER
         def stop_operation():
-            self.stop_multiple_operation = True
+            stop_win.on_stop()
         
         stop_btn = tk.Button(
             main_frame,
@@ -728,83 +916,36 @@ class KanbanToolApp:
         stop_win.update()
         return stop_win
     
-    def _wait_for_card_continuous(self, timeout: int = 10) -> bool:
-        """
-        Wait for card with continuous operation support (can be interrupted)
-        
-        Returns:
-            bool: True if card detected, False otherwise
-        """
-        self.gui.set_card_status("Waiting...", False)
-        self.root.update()
-        
-        import time
-        start_time = time.time()
-        
-        while time.time() - start_time < timeout:
-            if self.stop_multiple_operation:
-                return False
-            
-            # Try to detect card
-            if self.rfid.reader is None:
-                return False
-            
-            # Close any existing connection first
-            if self.rfid.connection is not None:
-                try:
-                    self.rfid.connection.disconnect()
-                except:
-                    pass
-                self.rfid.connection = None
-            
-            try:
-                from smartcard.Exceptions import NoCardException, CardConnectionException
-                
-                # Create new connection
-                self.rfid.connection = self.rfid.reader.createConnection()
-                self.rfid.connection.connect()
-                
-                # Get card ATR
-                atr = self.rfid.connection.getATR()
-                self.gui.set_card_status("Card Detected", True)
-                return True
-                
-            except NoCardException:
-                # No card, keep waiting
-                self.root.update()
-                time.sleep(0.3)
-                continue
-            except CardConnectionException:
-                # Connection error, retry
-                if self.rfid.connection is not None:
-                    try:
-                        self.rfid.connection.disconnect()
-                    except:
-                        pass
-                    self.rfid.connection = None
-                self.root.update()
-                time.sleep(0.3)
-                continue
-            except Exception as e:
-                self.logger.debug(f"Error waiting for card: {e}")
-                self.root.update()
-                time.sleep(0.3)
-                continue
-        
-        self.gui.set_card_status("No Card", False)
-        return False
-    
     def run(self):
         """Start the application"""
         self.gui.log("=== Thread Verification - Kanban Tool ===", 'info')
         self.gui.log("Ready to use. Please ensure ACR122U reader is connected.", 'info')
         self.root.mainloop()
+        self._closing.set()
+        if self.scheduler is not None:
+            self.scheduler.shutdown()
+        if self.monitor is not None:
+            self.monitor.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+        if self.metrics_file is not None:
+            self.metrics_file.stop()
+        if self.trace is not None:
+            self.trace.close()
+        self.events.unsubscribe(self.window_events)
+        if self.event_log is not None:
+            self.events.unsubscribe(self.event_log_events)
+            self.event_log.close()
 
 
 def main():
     """Main entry point"""
+    parser = argparse.ArgumentParser(description=APP_TITLE)
+    parser.add_argument('--debug', action='store_true', help="Debug logging, including the startup profile")
+    args = parser.parse_args()
+    
     try:
-        app = KanbanToolApp()
+        app = KanbanToolApp(debug=args.debug)
         app.run()
     except Exception as e:
         logging.error(f"Fatal error: {e}", exc_info=True)
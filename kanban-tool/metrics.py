@@ -0,0 +1,297 @@
+"""
+CWT Thread Verification System - Metrics
+Counters and histograms of card operations, exported in OpenMetrics / Prometheus text format
+
+Recording is lock-free: every thread bumps its own shard (a dict only that
+thread writes), and shards are summed only when the metrics are scraped.
+The card engine records APDU latency and failures, card operations, reader
+reconnects and card wait time; multi-card runs record their throughput.
+
+Export either on a local endpoint or as a textfile for node_exporter's
+textfile collector:
+
+    serve_metrics(9464)                          # GET http://127.0.0.1:9464/metrics
+    TextfileWriter('/var/lib/node_exporter/kanban.prom').start()
+
+The HTTP service (http_service.py) also answers GET /metrics on its own port.
+"""
+
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from config import METRICS_HOST, METRICS_TEXTFILE_INTERVAL
+
+
+OPENMETRICS_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Metric:
+    """Base of a metric family with per-thread shards"""
+
+    kind = ''
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[Dict] = []
+        self._shards_lock = threading.Lock()  # Taken once per thread, not per update
+        REGISTRY.append(self)
+
+    def _shard(self) -> Dict:
+        try:
+            return self._local.values
+        except AttributeError:
+            values = {}
+            self._local.values = values
+            with self._shards_lock:
+                self._shards.append(values)
+            return values
+
+    def _snapshots(self) -> Iterator[Dict]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            yield shard.copy()  # Atomic under the GIL; the owner may be adding keys
+
+    def _labels(self, values: Tuple, extra: str = '') -> str:
+        pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter(_Metric):
+    """Monotonic counter; inc(*label_values)"""
+
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def collect(self) -> Dict[Tuple, float]:
+        totals: Dict[Tuple, float] = {}
+        for shard in self._snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self, openmetrics: bool) -> List[str]:
+        name = self.name if openmetrics else f"{self.name}_total"
+        lines = [f"# TYPE {name} counter", f"# HELP {name} {self.help}"]
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}_total{self._labels(labels)} {_number(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Cumulative histogram; observe(value, *label_values)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # Per-bucket counts (last one is +Inf), then sum
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def collect(self) -> Dict[Tuple, List]:
+        totals: Dict[Tuple, List] = {}
+        for shard in self._snapshots():
+            for labels, counts in shard.items():
+                counts = list(counts)
+                total = totals.get(labels)
+                if total is None:
+                    totals[labels] = counts
+                else:
+                    for i, value in enumerate(counts):
+                        total[i] += value
+        return totals
+
+    def render(self, openmetrics: bool) -> List[str]:
+        lines = [f"# TYPE {self.name} histogram", f"# HELP {self.name} {self.help}"]
+        for labels, counts in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{self._labels(labels, le)} {cumulative}")
+            lines.append(f"{self.name}_count{self._labels(labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(labels)} {_number(counts[-1])}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(openmetrics: bool = True) -> str:
+    """
+    All metrics as exposition text
+
+    Args:
+        openmetrics: OpenMetrics 1.0 (with # EOF); False for Prometheus text 0.0.4
+
+    Returns:
+        str: Exposition text
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(openmetrics))
+    if openmetrics:
+        lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def negotiate(accept: Optional[str]) -> Tuple[str, bytes]:
+    """Content type and body for a scrape with this Accept header"""
+    openmetrics = 'application/openmetrics-text' in (accept or '')
+    return (OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE), render(openmetrics).encode('utf-8')
+
+
+# ----------------------------------------------------------------------
+# Card station metrics
+# ----------------------------------------------------------------------
+
+CARD_OPERATIONS = Counter(
+    'kanban_card_operations', "Card operations by type and result", ('op', 'result'))
+CARD_OPERATION_SECONDS = Histogram(
+    'kanban_card_operation_seconds',
+    "Card operation time (card already on the reader) by op, card type and transport (pcsc / pn532)",
+    ('op', 'card_type', 'transport'), buckets=(0.01, 0.02, 0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 1, 2))
+APDU_SECONDS = Histogram(
+    'kanban_apdu_seconds', "APDU round trip time by step", ('step',),
+    buckets=(0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1))
+APDU_FAILURES = Counter(
+    'kanban_apdu_failures', "Failed APDU attempts by step and cause (retry_policy class)",
+    ('step', 'cause'))
+CARD_WAIT_SECONDS = Histogram(
+    'kanban_card_wait_seconds', "Time waiting for a card to be placed",
+    buckets=(0.25, 0.5, 1, 2, 3, 5, 10, 20, 30, 60))
+READER_RECONNECTS = Counter(
+    'kanban_reader_reconnects', "Reconnects after RF loss by result", ('result',))
+KEY_LOOKUPS = Counter(
+    'kanban_key_lookups', "Sector key selection by result (memo, search = found by trying keys, none)",
+    ('result',))
+BATCH_CARDS = Counter(
+    'kanban_batch_cards', "Cards handled by multi-card runs by op and result", ('op', 'result'))
+BATCH_CARD_SECONDS = Histogram(
+    'kanban_batch_card_seconds', "Time per card in multi-card runs, from the previous card to this one",
+    ('op',), buckets=(0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60))
+
+
+class BatchTimer:
+    """Records throughput of one multi-card run"""
+
+    def __init__(self, op: str):
+        self.op = op
+        self._last = time.perf_counter()
+
+    def card(self, ok: bool):
+        """Call after each card of the run"""
+        now = time.perf_counter()
+        BATCH_CARDS.inc(self.op, 'ok' if ok else 'failed')
+        BATCH_CARD_SECONDS.observe(now - self._last, self.op)
+        self._last = now
+
+
+# ----------------------------------------------------------------------
+# Exporters
+# ----------------------------------------------------------------------
+
+def serve_metrics(port: int, host: str = METRICS_HOST):
+    """
+    Serve GET /metrics from a daemon thread
+
+    Args:
+        port: Port (0 picks a free port, see server.server_address)
+        host: Bind address
+
+    Returns:
+        Optional[ThreadingHTTPServer]: Server, or None if the port is unavailable
+    """
+    # http.server pulls in the email package; keep it off the GUI's import path
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            content_type, body = negotiate(self.headers.get('Accept'))
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes every few seconds would flood the log
+
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        logging.getLogger(__name__).warning(f"Metrics endpoint not started on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+    return server
+
+
+class TextfileWriter:
+    """Rewrites a .prom file periodically for node_exporter's textfile collector"""
+
+    def __init__(self, path: str, interval: float = METRICS_TEXTFILE_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.logger = logging.getLogger(__name__)
+
+    def write(self):
+        """Write the metrics now (atomic replace, so the collector never sees half a file)"""
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(render(openmetrics=False))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            self.logger.error(f"Failed to write metrics {self.path}: {e}")
+
+    def start(self) -> "TextfileWriter":
+        self._thread = threading.Thread(target=self._run, name="MetricsTextfile", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop and write a last time"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval + 1)
+        self.write()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
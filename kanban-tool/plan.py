@@ -0,0 +1,109 @@
+"""
+CWT Thread Verification System - Production Plan
+Loads plan files (CSV) and thread code catalogs used by batch tools
+"""
+
+import csv
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from kanban_format import validate_thread_code
+
+
+@dataclass(frozen=True)
+class PlanRow:
+    """One plan line: a Kanban card content and how many cards carry it"""
+    line: int             # Line number in the plan file (for reports)
+    thread1: str
+    thread2: str
+    quantity: int = 1
+    uid: Optional[str] = None  # Card UID when the plan assigns physical cards
+
+
+def normalize_uid(uid: str) -> str:
+    """Normalise a UID to the tool's format ('04 A1 B2 C3')"""
+    hex_digits = ''.join(ch for ch in uid if ch not in ' :-').upper()
+    return ' '.join(hex_digits[i:i + 2] for i in range(0, len(hex_digits), 2))
+
+
+def load_plan(path: str) -> Tuple[List[PlanRow], List[str]]:
+    """
+    Load a plan file
+
+    Format: CSV with a header row. Columns thread1 and thread2 are required,
+    quantity (default 1) and uid are optional. Extra columns are ignored.
+
+    Args:
+        path: Path to plan CSV
+
+    Returns:
+        Tuple[List[PlanRow], List[str]]: (Valid rows, Error messages for rejected lines)
+    """
+    rows = []
+    errors = []
+
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames is None:
+            return rows, [f"{path}: empty plan file"]
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+        if 'thread1' not in reader.fieldnames or 'thread2' not in reader.fieldnames:
+            return rows, [f"{path}: header must contain thread1 and thread2"]
+
+        for record in reader:
+            line = reader.line_num
+            thread1 = (record.get('thread1') or '').strip()
+            thread2 = (record.get('thread2') or '').strip()
+            if not thread1 and not thread2:
+                continue
+
+            bad = [
+                f"Thread {n}: {err}"
+                for n, err in ((1, validate_thread_code(thread1)), (2, validate_thread_code(thread2)))
+                if err
+            ]
+            if bad:
+                errors.append(f"Line {line}: " + "; ".join(bad))
+                continue
+
+            quantity_text = (record.get('quantity') or '1').strip()
+            try:
+                quantity = int(quantity_text)
+            except ValueError:
+                errors.append(f"Line {line}: invalid quantity '{quantity_text}'")
+                continue
+            if quantity < 1:
+                errors.append(f"Line {line}: quantity must be at least 1")
+                continue
+
+            uid = (record.get('uid') or '').strip()
+            rows.append(PlanRow(line, thread1, thread2, quantity, normalize_uid(uid) if uid else None))
+
+    return rows, errors
+
+
+def load_catalog(path: str) -> Tuple[List[str], List[str]]:
+    """
+    Load a thread code catalog (one code per line, '#' starts a comment)
+
+    Args:
+        path: Path to catalog file
+
+    Returns:
+        Tuple[List[str], List[str]]: (Valid codes in file order, Error messages)
+    """
+    codes = []
+    errors = []
+
+    with open(path, encoding='utf-8-sig') as f:
+        for line_number, line in enumerate(f, start=1):
+            code = line.split('#', 1)[0].strip()
+            if not code:
+                continue
+            err = validate_thread_code(code)
+            if err:
+                errors.append(f"Line {line_number}: {err}")
+            else:
+                codes.append(code)
+
+    return codes, errors
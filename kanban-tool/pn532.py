@@ -0,0 +1,354 @@
+"""
+CWT Thread Verification System - PN532 Direct Commands
+Card operations as PN532 commands through the ACR122U direct transmit (FF 00 00 00 + D4 ...)
+
+The ACR122U is a PN532 behind a CCID shim, and each of its storage
+pseudo-APDUs costs a full USB / pcscd round trip. Sent to the PN532
+directly (InDataExchange), fewer are needed:
+
+    MIFARE Classic   authenticate with the key inline: one command instead
+                     of Load Key + Authenticate, once per sector
+    NTAG21x          blocks 4-6 in one FAST_READ of pages 4-15 instead of a
+                     READ per block (a card without FAST_READ, such as the
+                     first MIFARE Ultralight, is selected again with
+                     InListPassiveTarget and read per block)
+
+With PN532_AUTOPOLL, wait_for_card leaves the polling to the reader
+(InAutoPoll on a direct connection, through the escape IOCTL) instead of
+asking pcscd for a card every poll interval, so a card is picked up as soon
+as it is in the field.
+
+Both are off by default (config.py). The reader is probed with
+GetFirmwareVersion on its first card; a reader that does not answer like a
+PN532 keeps the pseudo-APDU drivers of card_drivers.py, and so does the
+whole session if the escape channel is not enabled in the PC/SC driver.
+"""
+
+import logging
+import sys
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from config import BLOCK_SIZE, PN532_AUTOPOLL_PERIOD
+from card_drivers import (
+    ClassicDriver, UltralightDriver, CLASSIC, ULTRALIGHT,
+    CARD_CLASSIC_1K, CARD_CLASSIC_4K, CARD_ULTRALIGHT, CARD_UNKNOWN, PAGE_SIZE
+)
+from retry_policy import STEP_AUTH, STEP_READ, STEP_WRITE
+
+
+DIRECT_TRANSMIT = [0xFF, 0x00, 0x00, 0x00]
+HOST_TO_PN532 = 0xD4
+PN532_TO_HOST = 0xD5
+
+# PN532 commands (UM0701-02)
+GET_FIRMWARE_VERSION = 0x02
+IN_DATA_EXCHANGE = 0x40
+IN_LIST_PASSIVE_TARGET = 0x4A
+IN_AUTO_POLL = 0x60
+
+# Card commands carried by InDataExchange
+MIFARE_AUTH_A = 0x60
+MIFARE_READ = 0x30               # 16 bytes: a Classic block or four Ultralight pages
+MIFARE_WRITE = 0xA0              # Classic block (the PN532 sends both halves)
+ULTRALIGHT_WRITE = 0xA2          # One page
+NTAG_FAST_READ = 0x3A            # Page range
+
+TARGET = 0x01                    # Logical number of the card the ACR122U activated
+PN532_IC = 0x32                  # GetFirmwareVersion IC byte
+TYPE_106A = 0x00                 # InListPassiveTarget / InAutoPoll: 106 kbps type A
+
+# SAK -> card type for targets found by InListPassiveTarget / InAutoPoll
+_SAK_TYPES = {0x08: CARD_CLASSIC_1K, 0x09: CARD_CLASSIC_1K, 0x18: CARD_CLASSIC_4K, 0x00: CARD_ULTRALIGHT}
+
+logger = logging.getLogger(__name__)
+
+
+def frame(command: int, params: List[int] = ()) -> List[int]:
+    """Direct transmit APDU for one PN532 command"""
+    body = [HOST_TO_PN532, command] + list(params)
+    return DIRECT_TRANSMIT + [len(body)] + body
+
+
+def unwrap(command: int) -> Callable[[list, int, int], Tuple[list, int, int]]:
+    """
+    Response mapper for RFIDManager._transmit
+
+    Strips the D5 <command + 1> header. A PN532 error (InDataExchange status
+    byte, bits 0-5) becomes 63 00, the status word the ACR122U itself answers
+    for a failed card operation, so retries are classified the same way on
+    both paths.
+    """
+    def response(data: list, sw1: int, sw2: int) -> Tuple[list, int, int]:
+        if sw1 != 0x90 or sw2 != 0x00:
+            return data, sw1, sw2
+        if len(data) < 2 or data[0] != PN532_TO_HOST or data[1] != command + 1:
+            return [], 0x63, 0x00
+        payload = list(data[2:])
+        if command == IN_DATA_EXCHANGE:
+            if not payload or payload[0] & 0x3F:
+                return [], 0x63, 0x00
+            payload = payload[1:]
+        return payload, 0x90, 0x00
+    return response
+
+
+def exchange_apdu(params: List[int]) -> List[int]:
+    """Direct transmit APDU of one card command through InDataExchange"""
+    return frame(IN_DATA_EXCHANGE, [TARGET] + list(params))
+
+
+def exchange(rfid, step: str, params: List[int], block: Optional[int] = None,
+             retry: bool = True) -> Tuple[list, int, int]:
+    """One card command through InDataExchange (caller holds the reader lock)"""
+    return rfid._transmit(step, exchange_apdu(params), block,
+                          response=unwrap(IN_DATA_EXCHANGE), retry=retry)
+
+
+def reselect(rfid, step: str) -> bool:
+    """
+    Select the card in the field again with InListPassiveTarget (caller holds the reader lock)
+
+    A card that failed an authentication, or a command it does not know,
+    stops answering until it is selected again. Works on every ACR122U, with
+    or without PN532_DIRECT.
+
+    Returns:
+        bool: True if a card answered
+    """
+    data, sw1, sw2 = rfid._transmit(step, frame(IN_LIST_PASSIVE_TARGET, [0x01, TYPE_106A]),
+                                    response=unwrap(IN_LIST_PASSIVE_TARGET), retry=False)
+    return sw1 == 0x90 and bool(data) and data[0] > 0
+
+
+@dataclass(frozen=True)
+class Target:
+    """A card found by InListPassiveTarget / InAutoPoll"""
+    uid: Tuple[int, ...]
+    sak: int
+
+    @property
+    def card_type(self) -> str:
+        return _SAK_TYPES.get(self.sak, CARD_UNKNOWN)
+
+
+def parse_target(data: List[int]) -> Optional[Target]:
+    """Target data of a 106 kbps type A card: Tg, SENS_RES (2), SEL_RES, NFCID length, NFCID"""
+    if len(data) < 5 or len(data) < 5 + data[4]:
+        return None
+    return Target(tuple(data[5:5 + data[4]]), data[3])
+
+
+class DirectClassicDriver(ClassicDriver):
+    """MIFARE Classic through InDataExchange (authentication in one command)"""
+
+    name = "MIFARE Classic (PN532 direct)"
+    transport = 'pn532'
+
+    def auth_apdus(self, rfid, block: int, key: List[int]) -> List[List[int]]:
+        # 60 block key(6) uid(4): the key goes with the command, no Load Key
+        uid = [int(part, 16) for part in (rfid._card_uid or "").split()][-4:]
+        return [exchange_apdu([MIFARE_AUTH_A, block] + list(key) + uid)]
+
+    def read_apdu(self, block: int) -> List[int]:
+        return exchange_apdu([MIFARE_READ, block])
+
+    def write_apdu(self, block: int, data: bytes) -> List[int]:
+        return exchange_apdu([MIFARE_WRITE, block] + list(data))
+
+    def authenticate(self, rfid, block: int, key: List[int]) -> Tuple[bool, str]:
+        data, sw1, sw2 = rfid._transmit(STEP_AUTH, self.auth_apdus(rfid, block, key)[0],
+                                        response=unwrap(IN_DATA_EXCHANGE))
+
+        if sw1 != 0x90 or sw2 != 0x00:
+            return False, f"Authentication failed: {sw1:02X} {sw2:02X}"
+        return True, f"Block {block} authenticated"
+
+    def read_block(self, rfid, block: int) -> Tuple[list, int, int]:
+        return rfid._transmit(STEP_READ, self.read_apdu(block), block, response=unwrap(IN_DATA_EXCHANGE))
+
+    def write_block(self, rfid, block: int, data: bytes) -> Tuple[list, int, int]:
+        return rfid._transmit(STEP_WRITE, self.write_apdu(block, data), block, response=unwrap(IN_DATA_EXCHANGE))
+
+
+class DirectUltralightDriver(UltralightDriver):
+    """NTAG21x / Ultralight through InDataExchange (FAST_READ of all requested pages)"""
+
+    name = "NTAG/Ultralight (PN532 direct)"
+    transport = 'pn532'
+    MAX_PLAIN = 256               # UIDs remembered as having no FAST_READ
+
+    def __init__(self):
+        self._plain: Set[str] = set()
+
+    def read_apdu(self, page: int) -> List[int]:
+        return exchange_apdu([MIFARE_READ, page])
+
+    def write_apdu(self, page: int, data: bytes) -> List[int]:
+        return exchange_apdu([ULTRALIGHT_WRITE, page] + list(data))
+
+    def read_pages(self, rfid, page: int) -> Tuple[list, int, int]:
+        return rfid._transmit(STEP_READ, self.read_apdu(page), response=unwrap(IN_DATA_EXCHANGE))
+
+    def write_page(self, rfid, page: int, data: bytes) -> Tuple[list, int, int]:
+        return rfid._transmit(STEP_WRITE, self.write_apdu(page, data), response=unwrap(IN_DATA_EXCHANGE))
+
+    def read_blocks(self, rfid, blocks: List[int]) -> Tuple[bool, Optional[List[bytes]], str]:
+        if rfid._card_uid in self._plain:
+            return super().read_blocks(rfid, blocks)
+        first = min(self.first_page(block) for block in blocks)
+        last = max(self.first_page(block) for block in blocks) + BLOCK_SIZE // PAGE_SIZE - 1
+        data, sw1, sw2 = exchange(rfid, STEP_READ, [NTAG_FAST_READ, first, last], retry=False)
+
+        if sw1 == 0x90 and sw2 == 0x00 and len(data) >= (last - first + 1) * PAGE_SIZE:
+            offsets = [(self.first_page(block) - first) * PAGE_SIZE for block in blocks]
+            return True, [bytes(data[o:o + BLOCK_SIZE]) for o in offsets], f"{len(blocks)} blocks read"
+
+        # No FAST_READ (or an RF error): the card stopped answering, wake it up and read per block
+        if len(self._plain) >= self.MAX_PLAIN:
+            self._plain.clear()
+        self._plain.add(rfid._card_uid)
+        reselect(rfid, STEP_READ)
+        return super().read_blocks(rfid, blocks)
+
+
+_DIRECT = {id(CLASSIC): DirectClassicDriver(), id(ULTRALIGHT): DirectUltralightDriver()}
+_probed: Dict[str, bool] = {}    # Reader name -> answers like a PN532
+
+
+def direct_driver(connection, reader_name: str, driver):
+    """
+    Direct-command variant of a driver, if the reader is a PN532 (probed once per reader)
+
+    Args:
+        connection: Open card connection (the probe needs a card in the field)
+        reader_name: Reader name (probe cache key)
+        driver: Pseudo-APDU driver chosen for the card type
+
+    Returns:
+        The direct driver, or `driver` itself
+    """
+    if id(driver) not in _DIRECT:
+        return driver
+    if reader_name not in _probed:
+        _probed[reader_name] = _probe(connection)
+        if _probed[reader_name]:
+            logger.info(f"PN532 direct commands enabled for {reader_name}")
+        else:
+            logger.warning(f"{reader_name} does not answer PN532 direct commands, using pseudo-APDUs")
+    return _DIRECT[id(driver)] if _probed[reader_name] else driver
+
+
+def _probe(connection) -> bool:
+    try:
+        data, sw1, sw2 = unwrap(GET_FIRMWARE_VERSION)(*connection.transmit(frame(GET_FIRMWARE_VERSION)))
+        return sw1 == 0x90 and len(data) >= 1 and data[0] == PN532_IC
+    except Exception as e:
+        logger.debug(f"PN532 probe failed: {e}")
+        return False
+
+
+# ----------------------------------------------------------------------
+# Escape channel (reader commands without a card)
+# ----------------------------------------------------------------------
+
+_escape_unavailable: Set[str] = set()
+
+
+def _escape_code() -> int:
+    """SCardControl code of the CCID escape command"""
+    from smartcard.scard import SCARD_CTL_CODE
+    # Windows driver: IOCTL 3500; pcsc-lite CCID: IOCTL_CCID_ESCAPE (needs
+    # DRIVER_OPTION_CCID_EXCHANGE_AUTHORIZED in the driver's Info.plist)
+    return SCARD_CTL_CODE(3500 if sys.platform == 'win32' else 1)
+
+
+def escape_available(reader) -> bool:
+    """False once the escape channel failed on this reader"""
+    return str(reader) not in _escape_unavailable
+
+
+@contextmanager
+def escape_channel(reader):
+    """
+    Escape commands on a direct connection (no card needed)
+
+    Example:
+        with escape_channel(reader) as control:
+            raw = control([0xFF, 0x00, 0x48, 0x00, 0x00])
+
+    Yields:
+        Callable[[List[int]], List[int]]: Command -> raw response
+
+    Raises:
+        Exception: The channel is not enabled in the PC/SC driver (escape_available
+            is False for this reader from then on)
+    """
+    connection = None
+    try:
+        from smartcard.scard import SCARD_SHARE_DIRECT
+        candidate = reader.createConnection()
+        if not hasattr(candidate, 'control'):
+            raise NotImplementedError(f"{type(candidate).__name__} has no escape commands")
+        connection = candidate
+        connection.connect(mode=SCARD_SHARE_DIRECT)
+        code = _escape_code()
+        yield lambda command: list(connection.control(code, command))
+    except Exception:
+        _escape_unavailable.add(str(reader))
+        raise
+    finally:
+        if connection is not None:
+            try:
+                connection.disconnect()
+            except Exception:
+                pass
+
+
+# ----------------------------------------------------------------------
+# Reader-side polling (InAutoPoll)
+# ----------------------------------------------------------------------
+
+class AutoPoller:
+    """Waits for a card with the reader's own InAutoPoll (no card connection needed)"""
+
+    def __init__(self, reader, period: float = PN532_AUTOPOLL_PERIOD):
+        """
+        Args:
+            reader: PC/SC reader
+            period: Seconds one InAutoPoll runs in the reader before returning
+        """
+        self.reader = reader
+        # PollNr x Period (150 ms units), type A only
+        self.params = [0x01, max(1, min(15, round(period / 0.15))), TYPE_106A]
+
+    @property
+    def available(self) -> bool:
+        return escape_available(self.reader)
+
+    def poll(self) -> Optional[Target]:
+        """
+        Run one InAutoPoll (caller holds the reader lock)
+
+        Returns:
+            Optional[Target]: Card in the field, or None (none found, or the
+                escape channel is unavailable: see `available`)
+        """
+        try:
+            with escape_channel(self.reader) as control:
+                raw = control(frame(IN_AUTO_POLL, self.params))
+        except Exception as e:
+            logger.warning(f"InAutoPoll unavailable on {self.reader} ({e}), polling from the host")
+            return None
+
+        if raw[-2:] == [0x90, 0x00]:
+            raw = raw[:-2]
+        data, sw1, sw2 = unwrap(IN_AUTO_POLL)(raw, 0x90, 0x00)
+        # NbTg, then per target: type, length, target data
+        if sw1 != 0x90 or not data or data[0] == 0 or len(data) < 3:
+            return None
+        target = parse_target(data[3:3 + data[2]])
+        if target is not None:
+            logger.debug(f"InAutoPoll: card {bytes(target.uid).hex(' ').upper()}, SAK {target.sak:02X}")
+        return target
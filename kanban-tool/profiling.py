@@ -0,0 +1,229 @@
+"""
+CWT Thread Verification System - Profiling
+Opt-in timing spans, cProfile and tracemalloc capture for card operations
+
+Off by default. Enable with PROFILE_DIR in config.py or the environment:
+
+    KANBAN_PROFILE=profiles python main.py
+    KANBAN_PROFILE=profiles KANBAN_PROFILE_CAPTURE=cprofile,tracemalloc python http_service.py
+
+Card operations (RFIDManager.write_kanban, read_kanban, ...) are spans, and
+so are the APDU steps inside them. When the program exits, the directory
+receives:
+
+    spans.folded        Self time per span stack in microseconds, one
+                        "write_kanban;auth 5230" line per stack (flamegraph.pl,
+                        speedscope, inferno)
+    summary.txt         Calls, mean / p95 / max time per operation and, with
+                        tracemalloc, peak allocation per operation and the top
+                        allocating lines
+    <operation>.pstats  cProfile statistics per operation (pstats, snakeviz)
+
+Zip the directory and send it to the developers.
+
+When profiling is off, @profiled returns the function unchanged and span()
+returns a shared no-op context manager, so instrumented code pays nothing
+measurable.
+"""
+
+import atexit
+import contextlib
+import functools
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Callable, Dict, List, Optional
+
+from config import PROFILE_CAPTURE, PROFILE_DIR
+
+
+PROFILE_ENV = 'KANBAN_PROFILE'
+CAPTURE_ENV = 'KANBAN_PROFILE_CAPTURE'
+KEPT_DURATIONS = 10000   # Latest durations per operation kept for the p95
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class Profiler:
+    """Collects spans (and optional cProfile / tracemalloc data) in memory until dump()"""
+
+    def __init__(self, directory: str, capture: str = ""):
+        """
+        Args:
+            directory: Output directory (created on dump)
+            capture: Comma-separated extras: "cprofile", "tracemalloc"
+        """
+        self.directory = directory
+        extras = {part.strip().lower() for part in capture.split(',') if part.strip()}
+        self.cprofile = 'cprofile' in extras
+        self.tracemalloc = 'tracemalloc' in extras
+        self.logger = logging.getLogger(__name__)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._folded: Dict[str, float] = defaultdict(float)         # stack -> self seconds
+        self._durations: Dict[str, deque] = {}                       # op -> recent seconds
+        self._calls: Dict[str, int] = defaultdict(int)
+        self._peaks: Dict[str, int] = {}                             # op -> largest peak bytes
+        self._profiles: Dict[tuple, object] = {}                     # (op, thread) -> cProfile.Profile
+        if self.tracemalloc:
+            import tracemalloc
+            tracemalloc.start(10)
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        top = not stack
+        profile = self._start_top(name) if top else None
+        frame = [name, time.perf_counter(), 0.0]   # name, start, time in child spans
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - frame[1]
+            stack.pop()
+            key = ';'.join(f[0] for f in stack + [frame])
+            with self._lock:
+                self._folded[key] += elapsed - frame[2]
+            if stack:
+                stack[-1][2] += elapsed
+            else:
+                self._end_top(name, elapsed, profile)
+
+    def _start_top(self, name: str):
+        if self.tracemalloc:
+            import tracemalloc
+            tracemalloc.reset_peak()
+            self._local.traced = tracemalloc.get_traced_memory()[0]
+        if not self.cprofile:
+            return None
+        import cProfile
+        key = (name, threading.get_ident())
+        with self._lock:
+            profile = self._profiles.get(key)
+            if profile is None:
+                profile = self._profiles[key] = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # Another profiler is active in this thread
+            return None
+        return profile
+
+    def _end_top(self, name: str, elapsed: float, profile):
+        if profile is not None:
+            profile.disable()
+        peak = None
+        if self.tracemalloc:
+            import tracemalloc
+            # Process-wide peak: includes other threads' allocations during the operation
+            peak = tracemalloc.get_traced_memory()[1] - self._local.traced
+        with self._lock:
+            self._calls[name] += 1
+            self._durations.setdefault(name, deque(maxlen=KEPT_DURATIONS)).append(elapsed)
+            if peak is not None and peak > self._peaks.get(name, 0):
+                self._peaks[name] = peak
+
+    def dump(self):
+        """Write spans.folded, summary.txt and the .pstats files"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with self._lock:
+                folded = dict(self._folded)
+                durations = {name: sorted(values) for name, values in self._durations.items()}
+                calls = dict(self._calls)
+                peaks = dict(self._peaks)
+                profiles = dict(self._profiles)
+
+            with open(os.path.join(self.directory, 'spans.folded'), 'w', encoding='utf-8') as f:
+                for stack, seconds in sorted(folded.items()):
+                    f.write(f"{stack} {int(seconds * 1e6)}\n")
+
+            lines = [f"{'Operation':<22} {'Calls':>7} {'Mean ms':>9} {'p95 ms':>9} {'Max ms':>9} {'Peak KiB':>9}"]
+            for name, values in sorted(durations.items()):
+                p95 = values[min(len(values) - 1, int(0.95 * len(values)))]
+                peak = f"{peaks[name] / 1024:9.1f}" if name in peaks else f"{'-':>9}"
+                lines.append(f"{name:<22} {calls[name]:>7} {sum(values) / len(values) * 1000:9.1f} "
+                             f"{p95 * 1000:9.1f} {values[-1] * 1000:9.1f} {peak}")
+            if self.tracemalloc:
+                lines += ["", "Top allocations (live at exit):"]
+                lines += [f"  {stat}" for stat in self._top_allocations()]
+            with open(os.path.join(self.directory, 'summary.txt'), 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+
+            self._dump_pstats(profiles)
+            self.logger.info(f"Profile written to {self.directory}")
+        except OSError as e:
+            self.logger.error(f"Failed to write profile to {self.directory}: {e}")
+
+    @staticmethod
+    def _top_allocations(limit: int = 25) -> List[str]:
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        return [str(stat) for stat in snapshot.statistics('lineno')[:limit]]
+
+    def _dump_pstats(self, profiles: Dict[tuple, object]):
+        if not profiles:
+            return
+        import pstats
+        by_op = defaultdict(list)
+        for (name, _), profile in profiles.items():
+            by_op[name].append(profile)
+        for name, parts in by_op.items():
+            stats = pstats.Stats(parts[0])
+            for profile in parts[1:]:
+                stats.add(profile)
+            stats.dump_stats(os.path.join(self.directory, f"{name}.pstats"))
+
+
+def _from_settings() -> Optional[Profiler]:
+    directory = os.environ.get(PROFILE_ENV, PROFILE_DIR)
+    if not directory:
+        return None
+    profiler = Profiler(directory, os.environ.get(CAPTURE_ENV, PROFILE_CAPTURE))
+    atexit.register(profiler.dump)
+    return profiler
+
+
+PROFILER = _from_settings()
+
+
+def span(name: str):
+    """
+    Time a block as a child of the enclosing span
+
+    Example:
+        with profiling.span('auth'):
+            ...
+
+    Returns:
+        Context manager (a shared no-op one when profiling is off)
+    """
+    if PROFILER is None:
+        return _NULL_SPAN
+    return PROFILER.span(name)
+
+
+def profiled(fn: Callable = None, *, name: str = None) -> Callable:
+    """
+    Decorator: run every call of fn as a span (named after the function)
+
+    Returns fn itself when profiling is off.
+    """
+    if fn is None:
+        return lambda f: profiled(f, name=name)
+    if PROFILER is None:
+        return fn
+    label = name or fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with PROFILER.span(label):
+            return fn(*args, **kwargs)
+    return wrapper
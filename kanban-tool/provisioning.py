@@ -0,0 +1,385 @@
+"""
+CWT Thread Verification System - Card Provisioning
+Bulk preparation of new MIFARE Classic stock: sector 1 keys and access bits, blank blocks 4-6
+
+New cards arrive with transport trailers (Key A = Key B = FF FF FF FF FF FF,
+access bits FF 07 80 69). Provisioning writes in one sector 1 session:
+
+    blocks 4-6   zeros (the blank layout of a cleared card)
+    block 7      Key A, PROVISION_ACCESS_BITS, Key B
+
+then authenticates with the new Key A, reads the access bits back and
+records the UID in PROVISION_FILE. The trailer is written last: a card
+pulled mid-way still opens with the transport key and is simply provisioned
+again.
+
+A card that opens with the transport key but holds data in blocks 4-6 is a
+card in use (written cards keep the factory keys too): it is reported as
+in_use and left alone, unless --force is given.
+
+Cards already done are skipped after one cheap check, the UID (read when
+the card was detected) against the records of PROVISION_FILE, without any
+APDU. A provisioned card missing from the file fails the transport key, is
+recognised by its new key and access bits, and is added to the file. As in
+audit.py, the operator does not wait for removal: a box of cards can be
+swept over the reader.
+
+Usage:
+    python provisioning.py                  # Until Ctrl+C or PROVISION_IDLE_TIMEOUT
+    python provisioning.py --count 1000
+    python provisioning.py --force          # Also erase cards that hold Kanban data
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import sys
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence, Set, Tuple
+
+from config import (
+    BLOCK_THREAD1, BLOCK_THREAD2, BLOCK_COMMIT, BLOCK_SIZE, DEFAULT_KEY_A,
+    PROVISION_FILE, PROVISION_ACCESS_BITS, PROVISION_KEY_A, PROVISION_KEY_B,
+    PROVISION_IDLE_TIMEOUT, PROVISION_POLL_TIMEOUT
+)
+from key_ring import KeyRing
+from plan import normalize_uid
+from session_stats import SessionStats
+
+
+SECTOR = BLOCK_THREAD1 // 4
+TRAILER_BLOCK = SECTOR * 4 + 3
+BLANK = bytes(BLOCK_SIZE)
+
+# Results
+PROVISIONED = 'provisioned'
+ALREADY = 'already'              # In PROVISION_FILE, or found with the provisioning keys
+UNKNOWN_KEYS = 'unknown_keys'    # Neither the transport key nor the provisioning key opens sector 1
+CONFLICT = 'conflict'            # The provisioning key opens it, but the access bits differ
+IN_USE = 'in_use'                # Opens with the transport key, but blocks 4-6 hold data
+UNSUPPORTED = 'unsupported'      # NTAG / Ultralight: no sector keys
+FAILED = 'failed'
+
+logger = logging.getLogger(__name__)
+
+
+def parse_access_bits(bits: Sequence[int]) -> Optional[List[Tuple[int, int, int]]]:
+    """
+    Access conditions (C1, C2, C3) of blocks 0-3 of a sector
+
+    Args:
+        bits: Trailer bytes 6-8 (byte 9, the user byte, is ignored)
+
+    Returns:
+        Optional[List[Tuple[int, int, int]]]: Conditions per block, or None if
+            the inverted copies do not match (a card would lock the sector)
+    """
+    b6, b7, b8 = bits[0], bits[1], bits[2]
+    c1, c2, c3 = b7 >> 4, b8 & 0x0F, b8 >> 4
+    if (~b6 & 0x0F) != c1 or (~b6 >> 4 & 0x0F) != c2 or (~b7 & 0x0F) != c3:
+        return None
+    return [((c1 >> i) & 1, (c2 >> i) & 1, (c3 >> i) & 1) for i in range(4)]
+
+
+def access_bits(conditions: Sequence[Tuple[int, int, int]], user_byte: int = 0x69) -> List[int]:
+    """
+    Trailer bytes 6-9 for the access conditions of blocks 0-3
+
+    Example:
+        access_bits([(0, 0, 0)] * 3 + [(0, 1, 1)]) == [0x7F, 0x07, 0x88, 0x69]
+    """
+    c1 = sum(c[0] << i for i, c in enumerate(conditions))
+    c2 = sum(c[1] << i for i, c in enumerate(conditions))
+    c3 = sum(c[2] << i for i, c in enumerate(conditions))
+    return [(~c2 & 0x0F) << 4 | (~c1 & 0x0F), c1 << 4 | (~c3 & 0x0F), c3 << 4 | c2, user_byte]
+
+
+class TrailerPlan:
+    """Keys and access bits written to the Kanban sector of each card"""
+
+    def __init__(self, key_ring: KeyRing, access: Sequence[int] = PROVISION_ACCESS_BITS,
+                 key_a: Optional[Sequence[int]] = PROVISION_KEY_A,
+                 key_b: Optional[Sequence[int]] = PROVISION_KEY_B):
+        """
+        Args:
+            key_ring: Key ring of the reader (diversified keys, and the keys later reads try)
+            access: Trailer bytes 6-9
+            key_a: Fixed Key A (default: the factory key), or None for the UID-diversified key
+            key_b: Fixed Key B, or None for the UID-diversified key
+
+        Raises:
+            ValueError: Inconsistent access bits, or diversified keys without a master secret
+        """
+        if len(access) != 4 or parse_access_bits(access) is None:
+            raise ValueError(f"Access bits {bytes(access).hex(' ').upper()} are inconsistent "
+                             f"(the sector would be locked)")
+        if (key_a is None or key_b is None) and not key_ring.diversified:
+            raise ValueError("Diversified keys need the key ring master secret (KEY_MASTER_FILE or "
+                             "KANBAN_KEY_MASTER); or set PROVISION_KEY_A and PROVISION_KEY_B")
+        if key_a is not None and tuple(key_a) not in key_ring.candidates:
+            logger.warning("PROVISION_KEY_A is not in KEY_CANDIDATES: provisioned cards will not open for reads")
+        self.key_ring = key_ring
+        self.access = bytes(access)
+        self.key_a = tuple(key_a) if key_a is not None else None
+        self.key_b = tuple(key_b) if key_b is not None else None
+
+    @property
+    def label(self) -> str:
+        """How the keys are chosen (recorded with each card; keys themselves never are)"""
+        if self.key_a is not None and self.key_b is not None:
+            return 'fixed'
+        if self.key_a is not None:
+            return 'diversified_b'   # Default: factory Key A for the machines
+        return 'diversified' if self.key_b is None else 'diversified_a'
+
+    def keys(self, uid: str) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+        """(Key A, Key B) for a card"""
+        key_a = self.key_a or self.key_ring.derive(uid, SECTOR)
+        key_b = self.key_b or self.key_ring.derive_key_b(uid, SECTOR)
+        return key_a, key_b
+
+    def trailer(self, uid: str) -> bytes:
+        key_a, key_b = self.keys(uid)
+        return bytes(key_a) + self.access + bytes(key_b)
+
+
+class ProvisionRegistry:
+    """UIDs of provisioned cards, loaded once and appended to as cards are done"""
+
+    def __init__(self, path: str = PROVISION_FILE):
+        self.path = path
+        self.session = f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+        self.uids: Set[str] = set()
+        self.logger = logging.getLogger(__name__)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self.uids.add(normalize_uid(json.loads(line)['uid']))
+                    except (ValueError, KeyError, TypeError):
+                        continue
+
+    def __contains__(self, uid: str) -> bool:
+        return normalize_uid(uid) in self.uids
+
+    def __len__(self) -> int:
+        return len(self.uids)
+
+    def record(self, uid: str, result: str, plan: TrailerPlan):
+        """Append one card (result PROVISIONED, or ALREADY for a card found provisioned)"""
+        uid = normalize_uid(uid)
+        self.uids.add(uid)
+        entry = {
+            'ts': datetime.now().isoformat(timespec='milliseconds'),
+            'session': self.session,
+            'uid': uid,
+            'result': result,
+            'keys': plan.label,
+            'access': plan.access.hex(),
+        }
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+        except OSError as e:
+            self.logger.error(f"Failed to write {self.path}: {e}")
+
+
+def provision_card(rfid, plan: TrailerPlan, registry: ProvisionRegistry,
+                   force: bool = False) -> Tuple[str, str]:
+    """
+    Provision the connected card (call inside rfid.session())
+
+    Args:
+        rfid: RFIDManager with a card connected
+        plan: Keys and access bits to write
+        registry: Provisioned UIDs
+        force: Also provision a card whose blocks 4-6 hold data (erasing it)
+
+    Returns:
+        Tuple[str, str]: (Result, Detail)
+    """
+    uid = rfid.card_uid
+    if uid is None:
+        return FAILED, "Card UID unavailable"
+    if uid in registry:
+        return ALREADY, "Already provisioned"
+    if not rfid.driver.needs_auth:
+        return UNSUPPORTED, f"{rfid.driver.name} cards have no sector keys"
+
+    key_a, key_b = plan.keys(uid)
+    trailer = plan.trailer(uid)
+    transport = tuple(DEFAULT_KEY_A)
+
+    # New stock opens with the transport key; anything else may be provisioned already
+    opened, msg = rfid.authenticate_block(BLOCK_THREAD1, key=list(transport))
+    if not opened or key_a == transport:
+        if not opened and not rfid.reselect():
+            return FAILED, "Card stopped answering"
+        found = opened if key_a == transport else rfid.authenticate_block(BLOCK_THREAD1, key=list(key_a))[0]
+        if found:
+            success, data, msg = rfid.read_block(TRAILER_BLOCK)
+            if success and data[6:10] == plan.access:
+                registry.record(uid, ALREADY, plan)
+                return ALREADY, "Provisioned before (added to the record)"
+            if not opened:
+                return CONFLICT, "The provisioning key opens the card, but its access bits differ"
+        elif not opened:
+            return UNKNOWN_KEYS, "Neither the transport key nor the provisioning key opens the card"
+
+    # Cards in use open with the same key: only blank cards are erased without --force
+    if not force:
+        for block in (BLOCK_THREAD1, BLOCK_THREAD2, BLOCK_COMMIT):
+            data, sw1, sw2 = rfid.driver.read_block(rfid, block)  # Sector still authenticated
+            if sw1 != 0x90 or sw2 != 0x00:
+                return FAILED, f"Read failed for block {block}: {sw1:02X} {sw2:02X}"
+            if bytes(data) != BLANK:
+                return IN_USE, f"Block {block} holds data (card in use); --force erases it"
+
+    # Blank layout first, trailer last (a torn write leaves a transport card)
+    items = [(BLOCK_THREAD1, BLANK), (BLOCK_THREAD2, BLANK), (BLOCK_COMMIT, BLANK), (TRAILER_BLOCK, trailer)]
+    success, msg = rfid.write_blocks(items)
+    if not success:
+        return FAILED, msg
+
+    # The new Key A must open the sector and the access bits must read back
+    success, msg = rfid.authenticate_block(BLOCK_THREAD1, key=list(key_a))
+    if not success:
+        return FAILED, f"Trailer written but the new key does not authenticate: {msg}"
+    success, data, msg = rfid.read_block(TRAILER_BLOCK)
+    if not success or data[6:10] != plan.access:
+        return FAILED, f"Trailer written but the access bits do not read back: {msg}"
+
+    registry.record(uid, PROVISIONED, plan)
+    return PROVISIONED, ""
+
+
+def provision_steps(rfid, plan: TrailerPlan, registry: ProvisionRegistry,
+                    should_stop: Callable[[], bool],
+                    on_result: Optional[Callable[[str, str, str], None]] = None,
+                    count: Optional[int] = None, idle_timeout: float = PROVISION_IDLE_TIMEOUT,
+                    stats: Optional[SessionStats] = None, force: bool = False):
+    """
+    Provision cards as they are placed on the reader (scheduler job: yields at every card boundary)
+
+    Args:
+        rfid: Connected RFIDManager
+        plan: Keys and access bits to write
+        registry: Provisioned UIDs
+        should_stop: Polled between cards (Ctrl+C, GUI Stop button)
+        on_result: Called with (uid, result, detail) once per card
+        count: Stop after this many new cards (provisioned or found)
+        idle_timeout: Stop after this many seconds without a new card
+        stats: Session statistics to update per card
+        force: Also provision cards that hold data (see provision_card)
+
+    Returns:
+        Counter: Cards per result
+    """
+    results: Counter = Counter()
+    seen: Set[str] = set()   # Cards handled in this run (still on the reader, or passed again)
+    last_new = time.time()
+    stats = stats if stats is not None else SessionStats('provision')
+
+    while not should_stop() and (count is None or results[PROVISIONED] + results[ALREADY] < count):
+        if time.time() - last_new > idle_timeout:
+            break
+
+        success, _ = rfid.wait_for_card(timeout=PROVISION_POLL_TIMEOUT)
+        if not success:
+            yield
+            continue
+
+        uid = rfid.card_uid
+        if uid is None or normalize_uid(uid) in seen:
+            rfid.disconnect()
+            time.sleep(PROVISION_POLL_TIMEOUT / 5)  # Card still on the reader
+            yield
+            continue
+        seen.add(normalize_uid(uid))
+
+        started = time.perf_counter()
+        with rfid.session():
+            result, detail = provision_card(rfid, plan, registry, force)
+            rfid.signal_result(result in (PROVISIONED, ALREADY))
+            rfid.disconnect()
+        stats.record(result in (PROVISIONED, ALREADY), time.perf_counter() - started)
+
+        results[result] += 1
+        last_new = time.time()
+        if on_result:
+            on_result(uid, result, detail)
+        yield
+
+    return results
+
+
+def run_provisioning(rfid, plan: TrailerPlan, registry: ProvisionRegistry,
+                     should_stop: Callable[[], bool], **kwargs) -> Counter:
+    """provision_steps run to the end (command line)"""
+    steps = provision_steps(rfid, plan, registry, should_stop, **kwargs)
+    while True:
+        try:
+            next(steps)
+        except StopIteration as done:
+            return done.value
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Provision new MIFARE Classic cards for Kanban use")
+    parser.add_argument('--count', type=int, default=None, help="Stop after this many cards")
+    parser.add_argument('--idle-timeout', type=float, default=PROVISION_IDLE_TIMEOUT,
+                        help="Stop after this many seconds without a new card")
+    parser.add_argument('--record', default=PROVISION_FILE, help="Provisioned UIDs file (JSON lines)")
+    parser.add_argument('--force', action='store_true',
+                        help="Also provision cards that hold Kanban data (erases them)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+
+    from rfid_manager import RFIDManager  # Needs pyscard
+
+    rfid = RFIDManager()
+    try:
+        plan = TrailerPlan(rfid.key_ring)
+    except ValueError as e:
+        print(e)
+        return 1
+    registry = ProvisionRegistry(args.record)
+
+    success, msg = rfid.connect_reader()
+    print(msg)
+    if not success:
+        return 1
+    print(f"{len(registry)} cards on record. Access bits {plan.access.hex(' ').upper()}, {plan.label} keys.")
+    print("Sweep cards over the reader, Ctrl+C to finish.")
+
+    def show(uid, result, detail):
+        mark = ' ' if result in (PROVISIONED, ALREADY) else '!'
+        print(f"{mark} {uid}  {result}  {detail}".rstrip())
+
+    stop = []
+    start = time.time()
+    try:
+        results = run_provisioning(rfid, plan, registry, lambda: bool(stop), on_result=show,
+                                   count=args.count, idle_timeout=args.idle_timeout, force=args.force)
+    except KeyboardInterrupt:
+        results = None
+    elapsed = time.time() - start
+
+    if results is not None:
+        total = sum(results.values())
+        print(f"\n{total} cards in {elapsed:.0f}s ({total * 60 / elapsed:.0f}/min)" if elapsed else "")
+        for result, n in sorted(results.items()):
+            print(f"  {result:<14} {n:>5}")
+    print(f"Record: {args.record} ({len(registry)} cards)")
+    return 0 if results is None or all(r in (PROVISIONED, ALREADY) for r in results) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,318 @@
+"""
+CWT Thread Verification System - Reader Profiles
+ACR122U tuning (detection buzzer, LED feedback, PICC polling, timeout) applied per reader
+
+A profile is a set of ACR122U pseudo-APDUs sent when the reader is
+connected and again after a reconnect (a reader that reset on the USB bus
+is back at its defaults):
+
+    FF 00 52 P2 00               Buzzer output during card detection (00 off, FF on)
+    FF 00 51 P2 00               PICC operating parameter: auto polling, poll
+                                 interval, card types to look for
+    FF 00 41 P2 00               Timeout for the PN532's answers (5 s units)
+    FF 00 40 P2 04 T1 T2 R L     LED / buzzer sequence, used for the success and
+                                 failure feedback after each card operation
+
+The settings stay in the reader until it loses power. They are sent on the
+escape channel when the PC/SC driver allows it (no card needed), otherwise
+on the first card connection. The firmware version (FF 00 48 00 00) is
+probed once per reader name: readers that are not an ACR122U are left alone.
+
+Feedback is not free: the reader answers an LED command only after the
+whole sequence, so (T1 + T2) x repeats x 100 ms is added to every card.
+Measure a profile before rolling it out:
+
+    python reader_profiles.py --profile fast --simulate
+    python reader_profiles.py --profile quiet --cycles 50     # Card left on the reader
+"""
+
+import argparse
+import logging
+import statistics
+import sys
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+# PICC operating parameter bits (FF 00 51)
+PICC_AUTO_POLLING = 0x80
+PICC_AUTO_ATS = 0x40             # RATS for ISO 14443-4 cards (not needed for Classic / NTAG)
+PICC_POLL_250MS = 0x20           # Poll interval 250 ms instead of 500 ms
+PICC_FELICA_424 = 0x10
+PICC_FELICA_212 = 0x08
+PICC_TOPAZ = 0x04
+PICC_ISO14443B = 0x02
+PICC_ISO14443A = 0x01            # MIFARE Classic, Ultralight, NTAG
+PICC_DEFAULT = 0xFF
+
+# LED state control (P2 of FF 00 40)
+LED_BLINK_GREEN = 0xA0           # Green blinking mask + initial blinking state
+LED_BLINK_RED = 0x50
+
+# Link to buzzer (last byte of FF 00 40)
+BUZZER_OFF = 0x00
+BUZZER_ON_T1 = 0x01
+
+Transmit = Callable[[List[int]], Tuple[list, int, int]]
+
+
+@dataclass(frozen=True)
+class LedPattern:
+    """Bi-Color LED and Buzzer Control sequence (FF 00 40 P2 04 T1 T2 Repeats Link)"""
+    state: int                   # LED_* state control
+    on: int                      # T1 in 100 ms units
+    off: int                     # T2 in 100 ms units
+    repeats: int = 1
+    buzzer: int = BUZZER_OFF
+
+    @property
+    def seconds(self) -> float:
+        """Time the reader is busy with the sequence"""
+        return (self.on + self.off) * self.repeats * 0.1
+
+    def apdu(self) -> List[int]:
+        return [0xFF, 0x00, 0x40, self.state, 0x04, self.on, self.off, self.repeats, self.buzzer]
+
+
+@dataclass(frozen=True)
+class ReaderProfile:
+    """Reader settings for one kind of station"""
+    name: str
+    detect_buzzer: bool = True                 # Beep when a card enters the field (reader default)
+    picc_parameter: Optional[int] = None       # PICC_* bits; None leaves the reader's value
+    timeout: Optional[int] = None              # 5 s units, 0x00 no check, 0xFF wait forever; None leaves it
+    success: Optional[LedPattern] = None       # Feedback after a successful card operation
+    failure: Optional[LedPattern] = None       # ... and after a failed one
+
+    def commands(self) -> List[Tuple[str, List[int]]]:
+        """(setting, APDU) pairs applying the profile"""
+        commands = [('detect buzzer', [0xFF, 0x00, 0x52, 0xFF if self.detect_buzzer else 0x00, 0x00])]
+        if self.picc_parameter is not None:
+            commands.append(('PICC parameter', [0xFF, 0x00, 0x51, self.picc_parameter, 0x00]))
+        if self.timeout is not None:
+            commands.append(('timeout', [0xFF, 0x00, 0x41, self.timeout, 0x00]))
+        return commands
+
+
+PROFILES: Dict[str, ReaderProfile] = {profile.name: profile for profile in (
+    # Reader defaults: detection beep, every card type, 250 ms polling with ATS, no feedback
+    ReaderProfile('factory', detect_buzzer=True, picc_parameter=PICC_DEFAULT),
+    # No detection beep; the reader's LED tells the result, failures also beep
+    ReaderProfile('quiet', detect_buzzer=False,
+                  success=LedPattern(LED_BLINK_GREEN, on=1, off=1),
+                  failure=LedPattern(LED_BLINK_RED, on=2, off=2, repeats=3, buzzer=BUZZER_ON_T1)),
+    # Type A only (shorter poll cycle), no ATS, a card that stops answering fails after 5 s
+    ReaderProfile('fast', detect_buzzer=False,
+                  picc_parameter=PICC_AUTO_POLLING | PICC_POLL_250MS | PICC_ISO14443A,
+                  timeout=0x01,
+                  success=LedPattern(LED_BLINK_GREEN, on=1, off=0),
+                  failure=LedPattern(LED_BLINK_RED, on=1, off=1, repeats=2, buzzer=BUZZER_ON_T1)),
+)}
+
+logger = logging.getLogger(__name__)
+
+
+def get_profile(name: str) -> Optional[ReaderProfile]:
+    """
+    Profile by name
+
+    Args:
+        name: Key of PROFILES; empty for none (the reader is left as it is)
+
+    Returns:
+        Optional[ReaderProfile]: The profile, or None
+
+    Raises:
+        ValueError: Unknown profile name
+    """
+    if not name:
+        return None
+    if name not in PROFILES:
+        raise ValueError(f"Unknown reader profile '{name}' (known: {', '.join(PROFILES)})")
+    return PROFILES[name]
+
+
+@dataclass(frozen=True)
+class ReaderInfo:
+    """Result of the firmware probe"""
+    firmware: str                # e.g. "ACR122U207"; empty if the reader did not answer
+
+    @property
+    def supported(self) -> bool:
+        """The reader takes the ACR122U pseudo-APDUs of a profile"""
+        return self.firmware.upper().startswith("ACR122U")
+
+
+_info: Dict[str, ReaderInfo] = {}    # Reader name -> probe result
+
+
+def probe(transmit: Transmit, reader_name: str) -> ReaderInfo:
+    """
+    Firmware version of a reader (probed once per reader name)
+
+    Args:
+        transmit: Sends one pseudo-APDU (card connection or escape channel)
+        reader_name: Reader name (cache key)
+
+    Returns:
+        ReaderInfo: Cached probe result
+
+    Raises:
+        Exception: The pyscard exception if the command got no answer (nothing is cached)
+    """
+    if reader_name not in _info:
+        data, sw1, sw2 = transmit([0xFF, 0x00, 0x48, 0x00, 0x00])
+        # The ACR122U answers the bare ASCII version, without a status word
+        raw = list(data) if sw1 == 0x90 else list(data) + [sw1, sw2]
+        printable = raw and all(0x20 <= b < 0x7F for b in raw)
+        _info[reader_name] = ReaderInfo(bytes(raw).decode('ascii') if printable else "")
+        logger.info(f"Reader firmware: {_info[reader_name].firmware or 'unknown'} ({reader_name})")
+    return _info[reader_name]
+
+
+def apply(transmit: Transmit, reader_name: str, profile: ReaderProfile) -> Tuple[bool, str]:
+    """
+    Send a profile's settings to a reader
+
+    Args:
+        transmit: Sends one pseudo-APDU (card connection or escape channel)
+        reader_name: Reader name (probe cache key)
+        profile: Profile to apply
+
+    Returns:
+        Tuple[bool, str]: (Success status, Message)
+
+    Raises:
+        Exception: The pyscard exception if the reader stopped answering
+    """
+    info = probe(transmit, reader_name)
+    if not info.supported:
+        return False, f"Profile '{profile.name}' not applied: {info.firmware or 'unknown firmware'} is not an ACR122U"
+
+    rejected = []
+    for setting, apdu in profile.commands():
+        data, sw1, sw2 = transmit(apdu)
+        if sw1 != 0x90:
+            rejected.append(f"{setting} ({sw1:02X} {sw2:02X})")
+    if rejected:
+        return False, f"Profile '{profile.name}': reader rejected {', '.join(rejected)}"
+    return True, f"Profile '{profile.name}' applied ({info.firmware})"
+
+
+def escape_transmit(control: Callable[[List[int]], List[int]]) -> Transmit:
+    """Pseudo-APDU transmit over pn532.escape_channel (raw response split like pyscard's)"""
+    def transmit(apdu: List[int]) -> Tuple[list, int, int]:
+        raw = control(apdu)
+        if len(raw) < 2:
+            return raw, 0x00, 0x00
+        return raw[:-2], raw[-2], raw[-1]
+    return transmit
+
+
+# ----------------------------------------------------------------------
+# Latency report
+# ----------------------------------------------------------------------
+
+PHASES = ('detect', 'read', 'feedback', 'cycle')
+
+
+def measure(rfid, cycles: int, replace_card: Optional[Callable[[], None]] = None) -> Dict[str, List[float]]:
+    """
+    Time card cycles (wait for card, read, feedback, disconnect) with the manager's profile
+
+    Args:
+        rfid: RFIDManager with a connected reader
+        cycles: Number of cycles
+        replace_card: Takes the card off and puts it back before each cycle, so
+            detection (and its beep) is part of it; None keeps the card on the reader
+
+    Returns:
+        Dict[str, List[float]]: Seconds per cycle for each of PHASES
+    """
+    times = {phase: [] for phase in PHASES}
+    for _ in range(cycles):
+        if replace_card is not None:
+            replace_card()
+        started = time.perf_counter()
+        success, msg = rfid.wait_for_card(timeout=5, poll_interval=0.01)
+        if not success:
+            raise RuntimeError(f"No card for the latency report: {msg}")
+        detected = time.perf_counter()
+        ok = rfid.read_kanban()[0]
+        read = time.perf_counter()
+        rfid.signal_result(ok)
+        signalled = time.perf_counter()
+        rfid.disconnect()
+        times['detect'].append(detected - started)
+        times['read'].append(read - detected)
+        times['feedback'].append(signalled - read)
+        times['cycle'].append(time.perf_counter() - started)
+    return times
+
+
+def format_report(before: ReaderProfile, after: ReaderProfile,
+                  results: Dict[str, Dict[str, List[float]]]) -> str:
+    """Before/after table: median and p95 per phase in milliseconds"""
+    def quantiles(values: List[float]) -> Tuple[float, float]:
+        ordered = sorted(values)
+        return statistics.median(ordered) * 1000, ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000
+
+    lines = [f"{'phase':<10} {before.name + ' p50':>14} {'p95':>8} {after.name + ' p50':>14} {'p95':>8} {'change':>8}"]
+    for phase in PHASES:
+        b50, b95 = quantiles(results[before.name][phase])
+        a50, a95 = quantiles(results[after.name][phase])
+        change = f"{(a50 - b50) / b50:+.0%}" if b50 > 0.05 else "-"
+        lines.append(f"{phase:<10} {b50:>11.1f} ms {b95:>8.1f} {a50:>11.1f} ms {a95:>8.1f} {change:>8}")
+    return "\n".join(lines)
+
+
+def main():
+    """Command-line entry point (before/after latency report)"""
+    parser = argparse.ArgumentParser(description="Measure card cycle latency before and after a reader profile")
+    parser.add_argument('--profile', required=True, choices=sorted(PROFILES), help="Profile to measure")
+    parser.add_argument('--baseline', default='factory', choices=sorted(PROFILES), help="Profile to compare with")
+    parser.add_argument('--cycles', type=int, default=20, help="Card cycles per profile")
+    parser.add_argument('--reader', help="Exact reader name (default: first ACR122U)")
+    parser.add_argument('--simulate', action='store_true', help="Use the simulated reader (card replaced every cycle)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(name)s: %(message)s')
+    from rfid_manager import RFIDManager
+
+    source, replace_card = None, None
+    if args.simulate:
+        from simulated_reader import SimulatedCard, SimulatedReader
+        reader = SimulatedReader()
+        card = SimulatedCard.blank("04 A1 B2 C3")
+        source = lambda: [reader]
+
+        def replace():
+            reader.remove()
+            reader.place(card)
+        replace_card = replace
+    else:
+        print("Leave a Kanban card on the reader during the measurement.")
+
+    before, after = PROFILES[args.baseline], PROFILES[args.profile]
+    results = {}
+    for profile in (before, after):
+        rfid = RFIDManager(reader_source=source, profile=profile)
+        success, msg = rfid.connect_reader(args.reader)
+        if not success:
+            print(msg, file=sys.stderr)
+            return 1
+        try:
+            results[profile.name] = measure(rfid, args.cycles, replace_card)
+        except RuntimeError as e:
+            print(e, file=sys.stderr)
+            return 1
+        print(rfid.profile_status)
+
+    print(f"\n{args.cycles} cycles per profile on {rfid.reader}\n")
+    print(format_report(before, after, results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
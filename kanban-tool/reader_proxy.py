@@ -0,0 +1,503 @@
+"""
+CWT Thread Verification System - Reader Proxy
+A PC/SC reader on another PC (thin kiosk next to the machine), reached over TCP
+
+The proxy runs on the PC with the reader and serves its readers; the tool
+sets READER_PROXY = "kiosk:7725" and RFIDManager uses RemoteReader objects,
+which duck-type the pyscard reader and connection like simulated_reader.py.
+
+Messages are length-prefixed JSON (4-byte big-endian length), one reply per
+request, over one TCP connection per tool process:
+
+    hello       {token}                     -> {version, readers}
+    readers                                 -> {readers}
+    connect     {reader, conn, mode}        -> {atr}
+    disconnect  {conn}                      -> {}
+    transmit    {conn, apdus, stop}         -> {responses: [[data, sw1, sw2], ...]}
+    escape      {conn, command}             -> {data}
+    Errors      -> {error: {type: no_card | connection | other, message}}
+
+APDUs and data are hex strings. A transmit carries several APDUs: the proxy
+runs them in order under the reader lock and, with stop, ends at the first
+status word other than 90 00. RFIDManager announces the APDUs of a sector
+(authentication and the reads or writes after it) with _pipeline; the
+connection sends them in one frame and answers the following transmit calls
+from the replies, so a card read or write costs one network round trip per
+sector instead of one per APDU. A transmit that does not match the next
+announced APDU (a retry, a wrong key) drops the rest and goes to the proxy.
+
+The escape command (reader_profiles.py, PN532 polling) is sent with the
+proxy PC's own IOCTL code. With READER_PROXY_TOKEN set on both sides, the
+proxy serves only clients that know it; the traffic itself is not encrypted,
+keep the proxy on the plant network.
+
+Usage:
+    python reader_proxy.py                        # Serve the local readers on READER_PROXY_PORT
+    python reader_proxy.py --simulate --delay 20  # Simulated reader, 20 ms added per reply
+    python reader_proxy.py --check kiosk:7725     # List a proxy's readers and its round-trip time
+"""
+
+import argparse
+import hmac
+import itertools
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from smartcard.Exceptions import CardConnectionException, NoCardException
+
+from cancellation import Deadline
+from config import READER_PROXY_PORT, READER_PROXY_TOKEN, READER_PROXY_TIMEOUT, READER_TRANSPORT
+
+
+PROTOCOL_VERSION = 1
+LENGTH = struct.Struct('>I')
+MAX_FRAME = 1 << 20
+
+# Operations that may be repeated on a fresh TCP connection (nothing on a card happened yet)
+_IDEMPOTENT = ('readers', 'connect')
+
+logger = logging.getLogger(__name__)
+
+
+def proxy_token() -> str:
+    return os.environ.get('KANBAN_PROXY_TOKEN', READER_PROXY_TOKEN)
+
+
+def send_frame(sock: socket.socket, message: Dict):
+    body = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    sock.sendall(LENGTH.pack(len(body)) + body)
+
+
+def recv_frame(sock: socket.socket) -> Optional[Dict]:
+    """Next message, or None when the peer closed the connection"""
+    header = _recv_exact(sock, LENGTH.size)
+    if header is None:
+        return None
+    (size,) = LENGTH.unpack(header)
+    if size > MAX_FRAME:
+        raise ConnectionError(f"Frame of {size} bytes refused")
+    body = _recv_exact(sock, size)
+    if body is None:
+        raise ConnectionError("Connection closed inside a frame")
+    return json.loads(body)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def _error(e: Exception) -> Dict:
+    kind = 'no_card' if isinstance(e, NoCardException) else \
+        'connection' if isinstance(e, CardConnectionException) else 'other'
+    return {'error': {'type': kind, 'message': str(e)}}
+
+
+def _raise(reply: Dict):
+    """Raise the pyscard exception a reply carries, as the local reader would have"""
+    error = reply.get('error')
+    if not error:
+        return
+    message = error.get('message', "")
+    if error.get('type') == 'no_card':
+        raise NoCardException(message)
+    if error.get('type') == 'connection':
+        raise CardConnectionException(message)
+    raise ReaderProxyError(message)
+
+
+class ReaderProxyError(Exception):
+    """The proxy failed a request for another reason than the card"""
+
+
+# ----------------------------------------------------------------------
+# Server (PC with the reader)
+# ----------------------------------------------------------------------
+
+class ReaderProxyServer(socketserver.ThreadingTCPServer):
+    """Serves the local readers; one handler thread per client"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: Tuple[str, int], reader_source: Callable[[], List],
+                 token: str = "", delay: float = 0.0):
+        """
+        Args:
+            address: (Host, port) to listen on; port 0 picks a free one
+            reader_source: Returns the readers to serve (pyscard readers or simulated ones)
+            token: Shared secret clients must present ("" serves everyone)
+            delay: Seconds added to every reply (simulated network latency)
+        """
+        super().__init__(address, _ProxyHandler)
+        self.reader_source = reader_source
+        self.token = token
+        self.delay = delay
+        self.frames = 0
+        self.apdus = 0
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def reader(self, name: str):
+        for reader in self.reader_source():
+            if str(reader) == name:
+                return reader
+        raise CardConnectionException(f"Reader not found: {name}")
+
+    def lock(self, name: str) -> threading.Lock:
+        """Per-reader lock: the APDUs of one frame are never interleaved with another client's"""
+        with self._locks_guard:
+            return self._locks.setdefault(name, threading.Lock())
+
+
+class _ProxyHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connections: Dict[int, Tuple[str, object]] = {}
+        peer = "%s:%d" % self.client_address[:2]
+        try:
+            hello = recv_frame(self.request)
+            if hello is None:
+                return
+            if hello.get('op') != 'hello' or not hmac.compare_digest(str(hello.get('token', "")),
+                                                                     self.server.token):
+                logger.warning(f"Client {peer} refused (wrong token)")
+                send_frame(self.request, {'error': {'type': 'other', 'message': "Wrong proxy token"}})
+                return
+            send_frame(self.request, {'version': PROTOCOL_VERSION, 'readers': self._readers()})
+            logger.info(f"Client {peer} connected")
+
+            while True:
+                message = recv_frame(self.request)
+                if message is None:
+                    break
+                reply = self._dispatch(message)
+                self.server.frames += 1
+                if self.server.delay:
+                    time.sleep(self.server.delay)
+                send_frame(self.request, reply)
+        except (OSError, ValueError) as e:
+            logger.info(f"Client {peer}: {e}")
+        finally:
+            for name, connection in self.connections.values():
+                try:
+                    connection.disconnect()
+                except Exception:
+                    pass
+            logger.info(f"Client {peer} disconnected")
+
+    def _readers(self) -> List[str]:
+        return [str(reader) for reader in self.server.reader_source()]
+
+    def _dispatch(self, message: Dict) -> Dict:
+        op = message.get('op')
+        try:
+            if op == 'readers':
+                return {'readers': self._readers()}
+            if op == 'connect':
+                return self._connect(message)
+            if op == 'disconnect':
+                name, connection = self.connections.pop(message['conn'], (None, None))
+                if connection is not None:
+                    connection.disconnect()
+                return {}
+
+            name, connection = self.connections.get(message.get('conn'), (None, None))
+            if connection is None:
+                raise CardConnectionException("Card connection is closed")
+            if op == 'transmit':
+                return self._transmit(name, connection, message)
+            if op == 'escape':
+                from pn532 import _escape_code  # This PC's IOCTL code, not the client's
+                with self.server.lock(name):
+                    data = connection.control(_escape_code(), list(bytes.fromhex(message['command'])))
+                return {'data': bytes(data).hex()}
+            return {'error': {'type': 'other', 'message': f"Unknown operation: {op}"}}
+        except Exception as e:
+            return _error(e)
+
+    def _connect(self, message: Dict) -> Dict:
+        name = message['reader']
+        connection = self.server.reader(name).createConnection()
+        mode = message.get('mode')
+        with self.server.lock(name):
+            if mode is None:
+                connection.connect()
+                atr = connection.getATR()
+            else:
+                connection.connect(mode=mode)
+                atr = []
+        self.connections[message['conn']] = (name, connection)
+        return {'atr': bytes(atr).hex()}
+
+    def _transmit(self, name: str, connection, message: Dict) -> Dict:
+        responses = []
+        with self.server.lock(name):
+            for apdu in message['apdus']:
+                try:
+                    data, sw1, sw2 = connection.transmit(list(bytes.fromhex(apdu)))
+                except Exception as e:
+                    return dict(_error(e), responses=responses)
+                self.server.apdus += 1
+                responses.append([bytes(data).hex(), sw1, sw2])
+                if message.get('stop') and (sw1, sw2) != (0x90, 0x00):
+                    break
+        return {'responses': responses}
+
+
+# ----------------------------------------------------------------------
+# Client (tool side)
+# ----------------------------------------------------------------------
+
+class ProxyClient:
+    """One TCP connection to a proxy, shared by its readers (requests are serialised)"""
+
+    def __init__(self, address: str, token: Optional[str] = None,
+                 timeout: float = READER_PROXY_TIMEOUT):
+        """
+        Args:
+            address: "host:port" (port defaults to READER_PROXY_PORT)
+            token: Shared secret (default: KANBAN_PROXY_TOKEN / READER_PROXY_TOKEN)
+            timeout: Seconds to wait for a reply
+        """
+        host, _, port = address.rpartition(':') if ':' in address else (address, '', '')
+        self.address = (host, int(port or READER_PROXY_PORT))
+        self.token = proxy_token() if token is None else token
+        self.timeout = timeout
+        self.round_trips = 0
+        self.readers: List[str] = []
+        self._sock: Optional[socket.socket] = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def __str__(self) -> str:
+        return "%s:%d" % self.address
+
+    def request(self, message: Dict, deadline: Optional[Deadline] = None) -> Dict:
+        """
+        Send one request and wait for its reply
+
+        Args:
+            message: Request frame
+            deadline: Deadline the reply must come by (default: the client timeout)
+
+        Raises:
+            CardConnectionException: The proxy cannot be reached (the card
+                connection is lost, as with an unplugged reader)
+        """
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._open()
+                    timeout = self.timeout if deadline is None else min(self.timeout, deadline.remaining())
+                    self._sock.settimeout(max(0.001, timeout))
+                    send_frame(self._sock, message)
+                    reply = recv_frame(self._sock)
+                    if reply is None:
+                        raise ConnectionError("closed by the proxy")
+                    self.round_trips += 1
+                    return reply
+                except (OSError, ValueError) as e:
+                    self._close()
+                    if attempt or message['op'] not in _IDEMPOTENT:
+                        raise CardConnectionException(f"Reader proxy {self}: {e}")
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _open(self):
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        send_frame(sock, {'op': 'hello', 'token': self.token})
+        reply = recv_frame(sock)
+        if reply is None or 'error' in reply:
+            sock.close()
+            raise ConnectionRefusedError((reply or {}).get('error', {}).get('message', "closed"))
+        self.readers = reply.get('readers', [])
+        self._sock = sock
+        logger.info(f"Reader proxy {self}: {len(self.readers)} reader(s)")
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+
+
+class RemoteReader:
+    """A reader of the proxy (duck-types the pyscard reader)"""
+
+    def __init__(self, client: ProxyClient, name: str):
+        self.client = client
+        self.name = name
+
+    def __str__(self) -> str:
+        return f"{self.name} @ {self.client}"
+
+    def createConnection(self) -> "RemoteConnection":
+        return RemoteConnection(self)
+
+
+class RemoteConnection:
+    """Card connection through the proxy, with the pipelined APDUs RFIDManager announced"""
+
+    def __init__(self, reader: RemoteReader):
+        self.reader = reader
+        self.client = reader.client
+        self.id: Optional[int] = None
+        self.deadline: Optional[Deadline] = None  # Deadline of the running card operation (set by RFIDManager)
+        self._atr: List[int] = []
+        self._pending: Deque[Tuple[List[int], object]] = deque()
+
+    def connect(self, *args, mode: Optional[int] = None, **kwargs):
+        self.id = self.client.next_id()
+        reply = self.client.request({'op': 'connect', 'reader': self.reader.name, 'conn': self.id, 'mode': mode})
+        _raise(reply)
+        self._atr = list(bytes.fromhex(reply['atr']))
+
+    def disconnect(self):
+        self._pending.clear()
+        if self.id is not None:
+            conn, self.id = self.id, None
+            try:
+                self.client.request({'op': 'disconnect', 'conn': conn})
+            except CardConnectionException:
+                pass
+
+    def getATR(self) -> List[int]:
+        return list(self._atr)
+
+    def transmit(self, apdu: List[int]) -> Tuple[List[int], int, int]:
+        if self._pending:
+            expected, result = self._pending.popleft()
+            if expected == list(apdu):
+                if isinstance(result, Exception):
+                    raise result
+                return result
+            self._pending.clear()  # The caller went another way (retry, wrong key)
+
+        responses, error = self._send([apdu], stop=False)
+        if error is not None:
+            raise error
+        return responses[0]
+
+    def pipeline(self, apdus: List[List[int]]):
+        """Run APDUs in one round trip; transmit() then answers them in order"""
+        self._pending.clear()
+        try:
+            responses, error = self._send(apdus, stop=True)
+        except Exception as e:
+            logger.debug(f"Pipeline not sent: {e}")  # transmit() reports it on the APDU itself
+            return
+        for apdu, response in zip(apdus, responses):
+            self._pending.append((list(apdu), response))
+        if error is not None and len(responses) < len(apdus):
+            self._pending.append((list(apdus[len(responses)]), error))
+
+    def control(self, code: int, command: List[int]) -> List[int]:
+        """Escape command (the proxy PC uses its own IOCTL code)"""
+        reply = self.client.request({'op': 'escape', 'conn': self.id, 'command': bytes(command).hex()})
+        _raise(reply)
+        return list(bytes.fromhex(reply['data']))
+
+    def _send(self, apdus: List[List[int]], stop: bool):
+        if self.id is None:
+            raise CardConnectionException("Card connection is closed")
+        reply = self.client.request({'op': 'transmit', 'conn': self.id, 'stop': stop,
+                                     'apdus': [bytes(apdu).hex() for apdu in apdus]}, self.deadline)
+        responses = [(list(bytes.fromhex(data)), sw1, sw2) for data, sw1, sw2 in reply.get('responses', [])]
+        try:
+            _raise(reply)
+        except Exception as e:
+            return responses, e
+        return responses, None
+
+
+class RemoteReaders:
+    """reader_source for RFIDManager: the readers of one proxy"""
+
+    def __init__(self, address: str, token: Optional[str] = None):
+        self.client = ProxyClient(address, token)
+
+    def __call__(self) -> List[RemoteReader]:
+        reply = self.client.request({'op': 'readers'})
+        _raise(reply)
+        return [RemoteReader(self.client, name) for name in reply['readers']]
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Serve the local card readers over TCP")
+    parser.add_argument('--bind', default='0.0.0.0', help="Address to listen on")
+    parser.add_argument('--port', type=int, default=READER_PROXY_PORT)
+    parser.add_argument('--simulate', action='store_true', help="Serve a simulated reader with a blank card")
+    parser.add_argument('--delay', type=float, default=0.0, help="Milliseconds added to every reply")
+    parser.add_argument('--check', metavar='HOST:PORT', help="List a proxy's readers and measure its round trip")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.check:
+        source = RemoteReaders(args.check)
+        try:
+            remote = source()  # Connects (hello) outside the timing
+            started = time.perf_counter()
+            for _ in range(10):
+                source()
+            rtt = (time.perf_counter() - started) / 10
+        except (CardConnectionException, ReaderProxyError) as e:
+            print(e)
+            return 1
+        for reader in remote:
+            print(f"  {reader}")
+        print(f"Round trip: {rtt * 1000:.1f} ms")
+        return 0
+
+    if args.simulate:
+        from simulated_reader import SimulatedCard, SimulatedReader
+        reader = SimulatedReader()
+        reader.place(SimulatedCard.blank("04 A1 B2 C3"))
+        reader_source = lambda: [reader]
+    elif READER_TRANSPORT == 'ccid':
+        from ccid_transport import usb_readers as reader_source
+    else:
+        from smartcard.System import readers as reader_source
+
+    token = proxy_token()
+    if not token:
+        logger.warning("No READER_PROXY_TOKEN: any client on the network can use the readers")
+    server = ReaderProxyServer((args.bind, args.port), reader_source, token, args.delay / 1000)
+    print(f"Reader proxy on {args.bind}:{server.server_address[1]}: "
+          f"{', '.join(str(r) for r in reader_source()) or 'no readers yet'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
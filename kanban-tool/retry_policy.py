@@ -0,0 +1,118 @@
+"""
+CWT Thread Verification System - Retry Policy
+Classifies APDU failures and decides whether the failing step is worth retrying
+"""
+
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from config import RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+
+try:
+    from smartcard.Exceptions import CardConnectionException, NoCardException
+except ImportError:  # Classification by message still works without pyscard
+    CardConnectionException = NoCardException = ()
+
+
+# Failure classes
+OK = 'ok'
+TRANSIENT = 'transient'          # RF glitch / reader busy: repeat the same APDU
+NEEDS_AUTH = 'needs_auth'        # Sector authentication lost: re-authenticate, then repeat
+AUTH_FAILED = 'auth_failed'      # Wrong key or access bits: never succeeds by retrying
+CARD_REMOVED = 'card_removed'    # Card left the field: reconnect if the same card returns
+FATAL = 'fatal'                  # Bad command for this card (block out of range, unsupported)
+
+# Steps of a card operation, as passed to classify_status
+STEP_LOAD_KEY = 'load_key'
+STEP_AUTH = 'auth'
+STEP_READ = 'read'
+STEP_WRITE = 'write'
+STEP_COMMAND = 'command'
+
+# PC/SC error codes that mean the card is gone
+_REMOVED_MARKERS = ('0x80100069', '0x80100066', 'removed', 'unresponsive', 'no smart card')
+
+
+def classify_status(step: str, sw1: int, sw2: int) -> str:
+    """
+    Classify an APDU status word
+
+    ACR122U answers 63 00 for any failed card operation. On the authenticate
+    command it means the key was rejected (fail fast). On read/write it
+    usually means the sector authentication was lost to an RF glitch, so the
+    sector is re-authenticated and the step repeated.
+
+    Args:
+        step: One of the STEP_* constants
+        sw1: Status byte 1
+        sw2: Status byte 2
+
+    Returns:
+        str: Failure class
+    """
+    if sw1 == 0x90 and sw2 == 0x00:
+        return OK
+    if sw1 == 0x63 and sw2 == 0x00:
+        if step == STEP_AUTH:
+            return AUTH_FAILED
+        if step in (STEP_READ, STEP_WRITE):
+            return NEEDS_AUTH
+        return TRANSIENT
+    if sw1 == 0x6A and sw2 in (0x81, 0x82):  # Function not supported / block not found
+        return FATAL
+    if sw1 == 0x69 and sw2 in (0x82, 0x86):  # Security status / command not allowed
+        return NEEDS_AUTH if step in (STEP_READ, STEP_WRITE) else AUTH_FAILED
+    return TRANSIENT
+
+
+def classify_exception(error: Exception) -> str:
+    """
+    Classify a pyscard exception raised by transmit/connect
+
+    Args:
+        error: Exception
+
+    Returns:
+        str: Failure class
+    """
+    if NoCardException and isinstance(error, NoCardException):
+        return CARD_REMOVED
+    text = str(error).lower()
+    if any(marker in text for marker in _REMOVED_MARKERS):
+        return CARD_REMOVED
+    if CardConnectionException and isinstance(error, CardConnectionException):
+        return CARD_REMOVED  # Connection is unusable; reconnecting is the only way on
+    return TRANSIENT
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Bounded exponential backoff for one failing step"""
+    max_attempts: int = RETRY_MAX_ATTEMPTS
+    base_delay: float = RETRY_BASE_DELAY
+    max_delay: float = RETRY_MAX_DELAY
+
+    def is_retryable(self, failure: str) -> bool:
+        """Whether a failure class can succeed on another attempt"""
+        return failure in (TRANSIENT, NEEDS_AUTH, CARD_REMOVED)
+
+    def delays(self) -> Iterator[float]:
+        """Backoff before each retry (max_attempts - 1 values)"""
+        delay = self.base_delay
+        for _ in range(self.max_attempts - 1):
+            yield min(delay, self.max_delay)
+            delay *= 2
+
+
+def describe(failure: str, sw1: Optional[int] = None, sw2: Optional[int] = None) -> str:
+    """Operator-facing text for a failure class"""
+    text = {
+        TRANSIENT: "Communication error",
+        NEEDS_AUTH: "Authentication lost",
+        AUTH_FAILED: "Wrong key or sector locked",
+        CARD_REMOVED: "Card removed",
+        FATAL: "Command not supported by this card",
+    }.get(failure, failure)
+    if sw1 is not None:
+        return f"{text} ({sw1:02X} {sw2:02X})"
+    return text
@@ -0,0 +1,365 @@
+"""
+CWT Thread Verification System - Card Revocation
+Revoked card UIDs (lost or retired bypass cards): a Bloom filter in memory, the exact set on disk
+
+REVOCATION_FILE is the list as written: one JSON object per line,
+
+    {"ts": "2025-01-15T08:30:12.345", "session": "PC01-1a2b3c",
+     "op": "revoke", "uid": "04 A1 B2 C3", "reason": "lost bypass card"}
+
+with op 'revoke' or 'restore' (the last event of a UID wins). It is compiled
+to REVOCATION_FILE + ".set":
+
+    header (32 bytes)   "KRVK", version, hash count, list size compiled,
+                        UID count, filter size
+    Bloom filter        about 1.8 bytes per UID at a 0.1 % false-positive rate
+    UID keys            sorted, 11 bytes each (length byte, zero-padded UID)
+
+Only the filter is held in memory; the keys are memory-mapped and binary-
+searched when the filter answers "maybe", so a list of millions of UIDs
+costs a few MB of RAM and a card that is not revoked never touches the disk.
+RFIDManager checks the UID once when a card is connected and keeps the
+answer, so every read path pays a boolean test. The list is re-read when
+REVOCATION_FILE changes (checked at most every REVOCATION_RELOAD_INTERVAL
+seconds) on a background thread: lookups keep answering from the loaded set
+until the new one is swapped in.
+
+Usage:
+    python revocation.py revoke "04 A1 B2 C3" --reason "lost bypass card"
+    python revocation.py revoke --file retired.txt --reason retired
+    python revocation.py restore "04 A1 B2 C3"
+    python revocation.py check "04 A1 B2 C3"
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config import REVOCATION_FILE, REVOCATION_FALSE_POSITIVE, REVOCATION_RELOAD_INTERVAL
+from card_archive import KEY_SIZE, uid_key
+from plan import normalize_uid
+
+
+SET_MAGIC = b"KRVK"
+SET_VERSION = 1
+SET_HEADER = struct.Struct('>4sHHQQQ')   # magic, version, hashes, list size, UID count, filter bytes
+
+REVOKE = 'revoke'
+RESTORE = 'restore'
+
+# One loaded set: filter, keys (mmap or bytes) with the offset of the sorted keys,
+# UID count, and the REVOCATION_FILE size it was compiled from
+_Loaded = namedtuple('_Loaded', 'bloom keys key_start count list_size')
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Bit array with k probes per key (double hashing of one BLAKE2b digest)"""
+
+    def __init__(self, size_bytes: int, hashes: int, bits: Optional[bytes] = None):
+        """
+        Args:
+            size_bytes: Filter size
+            hashes: Probes per key
+            bits: Filter content (default: empty)
+        """
+        self.bits = bytearray(bits) if bits is not None else bytearray(size_bytes)
+        self.size = len(self.bits) * 8
+        self.hashes = hashes
+
+    @classmethod
+    def for_capacity(cls, count: int, false_positive: float = REVOCATION_FALSE_POSITIVE) -> "BloomFilter":
+        """Filter sized for `count` keys at the given false-positive rate"""
+        count = max(count, 1)
+        size = max(64, math.ceil(-count * math.log(false_positive) / math.log(2) ** 2))
+        hashes = max(1, round(size / count * math.log(2)))
+        return cls((size + 7) // 8, hashes)
+
+    def add(self, key: bytes):
+        h1, h2 = self._hash(key)
+        bits, size = self.bits, self.size
+        for i in range(self.hashes):
+            p = (h1 + i * h2) % size
+            bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, key: bytes) -> bool:
+        h1, h2 = self._hash(key)
+        bits, size = self.bits, self.size
+        for i in range(self.hashes):
+            p = (h1 + i * h2) % size
+            if not bits[p >> 3] & 1 << (p & 7):
+                return False  # Most keys stop at the first or second probe
+        return True
+
+    @staticmethod
+    def _hash(key: bytes) -> Tuple[int, int]:
+        digest = int.from_bytes(hashlib.blake2b(key, digest_size=16).digest(), 'big')
+        return digest >> 64, digest & 0xFFFFFFFFFFFFFFFF | 1
+
+
+class RevocationList:
+    """Revoked card UIDs: constant-time negative answers from memory, exact confirmation on disk"""
+
+    def __init__(self, path: str = REVOCATION_FILE,
+                 false_positive: float = REVOCATION_FALSE_POSITIVE,
+                 reload_interval: float = REVOCATION_RELOAD_INTERVAL):
+        """
+        Args:
+            path: Revocation list (JSON lines); missing means no card is revoked
+            false_positive: Bloom filter false-positive rate when the list is compiled
+            reload_interval: Seconds between checks for a changed list
+        """
+        self.path = path
+        self.set_path = path + ".set"
+        self.false_positive = false_positive
+        self.reload_interval = reload_interval
+        self.session = f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+        self.logger = logging.getLogger(__name__)
+
+        self._loaded = _Loaded(BloomFilter(8, 1), b"", 0, 0, -1)
+        self._swap_lock = threading.Lock()      # Held by lookups; a mapping is closed only under it
+        self._reload_lock = threading.RLock()   # One reload / compile at a time
+        self._next_reload = 0.0
+        self.reload()
+
+    def __len__(self) -> int:
+        return self._loaded.count
+
+    def is_revoked(self, uid: Optional[str]) -> bool:
+        """
+        True if the card is revoked
+
+        Args:
+            uid: Card UID (None or malformed: not revoked)
+        """
+        if time.monotonic() >= self._next_reload:
+            self._reload_in_background()
+        try:
+            key = uid_key(uid) if uid else None
+        except ValueError:
+            return False
+        if key is None:
+            return False
+        with self._swap_lock:
+            loaded = self._loaded
+            return key in loaded.bloom and self._contains(loaded, key)
+
+    def reload(self):
+        """Load the compiled set again if REVOCATION_FILE changed (compiling it if needed)"""
+        with self._reload_lock:
+            self._next_reload = time.monotonic() + self.reload_interval
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            if size == self._loaded.list_size:
+                return
+            if not self._map(size):
+                self._compile()
+
+    def revoke(self, uids: Iterable[str], reason: str = "") -> int:
+        """
+        Revoke cards and recompile the set
+
+        Returns:
+            int: Number of UIDs written to the list
+        """
+        return self._append(REVOKE, uids, reason)
+
+    def restore(self, uids: Iterable[str], reason: str = "") -> int:
+        """Take cards off the list (a card found again) and recompile the set"""
+        return self._append(RESTORE, uids, reason)
+
+    def history(self, uid: str) -> List[Dict]:
+        """Revoke / restore events of one card, oldest first (scans the list: not for card paths)"""
+        key = uid_key(uid)
+        return [event for event, event_key in self._events() if event_key == key]
+
+    def compile(self):
+        """Build the Bloom filter and sorted key file from REVOCATION_FILE"""
+        with self._reload_lock:
+            self._compile()
+
+    def close(self):
+        self._swap(_Loaded(BloomFilter(8, 1), b"", 0, 0, -1))
+
+    def _reload_in_background(self):
+        """Start reload() on its own thread unless one is running (lookups keep the loaded set)"""
+        self._next_reload = time.monotonic() + self.reload_interval
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        self._reload_lock.release()
+        threading.Thread(target=self._reload_quietly, name="RevocationReload", daemon=True).start()
+
+    def _reload_quietly(self):
+        try:
+            self.reload()
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Failed to reload {self.path}: {e}")
+
+    def _compile(self):
+        """compile() (caller holds the reload lock)"""
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        state: Dict[bytes, bool] = {}
+        for event, key in self._events():
+            state[key] = event['op'] == REVOKE
+        keys = sorted(key for key, revoked in state.items() if revoked)
+
+        bloom = BloomFilter.for_capacity(len(keys), self.false_positive)
+        for key in keys:
+            bloom.add(key)
+        header = SET_HEADER.pack(SET_MAGIC, SET_VERSION, bloom.hashes, size, len(keys), len(bloom.bits))
+
+        data = b"".join(keys)
+        self._swap(_Loaded(bloom, data, 0, len(keys), size))  # An open mapping blocks the replace on Windows
+        if not size:
+            return
+        temp = self.set_path + ".tmp"
+        try:
+            with open(temp, 'wb') as f:
+                f.write(header)
+                f.write(bloom.bits)
+                f.write(data)
+            os.replace(temp, self.set_path)
+        except OSError as e:
+            self.logger.error(f"Failed to write {self.set_path} (list kept in memory): {e}")
+            return
+        self._map(size)
+        self.logger.info(f"{self.set_path}: {len(keys)} revoked cards, "
+                         f"{len(bloom.bits)} byte filter, {bloom.hashes} hashes")
+
+    def _map(self, size: int) -> bool:
+        """Map the compiled set if it was compiled from a list of this size"""
+        try:
+            with open(self.set_path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+
+        if len(data) < SET_HEADER.size:
+            data.close()
+            return False
+        magic, version, hashes, compiled, count, bloom_size = SET_HEADER.unpack_from(data)
+        if (magic != SET_MAGIC or version != SET_VERSION or compiled != size
+                or len(data) != SET_HEADER.size + bloom_size + count * KEY_SIZE):
+            data.close()
+            return False
+
+        start = SET_HEADER.size + bloom_size
+        self._swap(_Loaded(BloomFilter(bloom_size, hashes, data[SET_HEADER.size:start]), data, start, count, size))
+        return True
+
+    @staticmethod
+    def _contains(loaded: _Loaded, key: bytes) -> bool:
+        """Binary search of the sorted keys (caller holds the swap lock)"""
+        keys, start = loaded.keys, loaded.key_start
+        lo, hi = 0, loaded.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = start + mid * KEY_SIZE
+            if keys[pos:pos + KEY_SIZE] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        pos = start + lo * KEY_SIZE
+        return lo < loaded.count and keys[pos:pos + KEY_SIZE] == key
+
+    def _swap(self, loaded: _Loaded):
+        """Make a fully built set the current one and close the mapping it replaces"""
+        with self._swap_lock:
+            previous, self._loaded = self._loaded, loaded
+            if isinstance(previous.keys, mmap.mmap):
+                previous.keys.close()
+
+    def _events(self) -> Iterator[Tuple[Dict, bytes]]:
+        """(Event, UID key) per valid line of the list"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                    key = uid_key(event['uid'])
+                except (ValueError, KeyError, TypeError):
+                    continue  # Torn last line, or a hand edit gone wrong
+                if event.get('op') in (REVOKE, RESTORE):
+                    yield event, key
+
+    def _append(self, op: str, uids: Iterable[str], reason: str) -> int:
+        lines = []
+        for uid in uids:
+            uid = normalize_uid(uid)
+            uid_key(uid)  # Raises ValueError before anything is written
+            lines.append(json.dumps({
+                'ts': datetime.now().isoformat(timespec='milliseconds'),
+                'session': self.session,
+                'op': op,
+                'uid': uid,
+                'reason': reason,
+            }) + '\n')
+        if lines:
+            with self._reload_lock:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.writelines(lines)
+                self._compile()
+        return len(lines)
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Manage the revoked card list")
+    parser.add_argument('--list', default=REVOCATION_FILE, help="Revocation list (JSON lines)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, text in ((REVOKE, "Revoke cards"), (RESTORE, "Take cards off the list")):
+        command = commands.add_parser(name, help=text)
+        command.add_argument('uids', nargs='*', help="Card UIDs")
+        command.add_argument('--file', help="File with one UID per line")
+        command.add_argument('--reason', default="", help="Why (recorded with each card)")
+    check = commands.add_parser('check', help="Show whether a card is revoked, with its history")
+    check.add_argument('uid')
+    commands.add_parser('compile', help="Rebuild the compiled set")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+
+    revocations = RevocationList(args.list)
+    if args.command == 'compile':
+        revocations.compile()
+        print(f"{len(revocations)} revoked cards")
+        return 0
+
+    if args.command == 'check':
+        revoked = revocations.is_revoked(args.uid)
+        print(f"{normalize_uid(args.uid)}: {'REVOKED' if revoked else 'not revoked'}")
+        for event in revocations.history(args.uid):
+            print(f"  {event.get('ts', '')}  {event['op']:<8} {event.get('reason', '')}")
+        return 2 if revoked else 0
+
+    uids = list(args.uids)
+    if args.file:
+        with open(args.file, encoding='utf-8') as f:
+            uids.extend(line.strip() for line in f if line.strip())
+    try:
+        count = revocations.revoke(uids, args.reason) if args.command == REVOKE else \
+            revocations.restore(uids, args.reason)
+    except ValueError as e:
+        print(e)
+        return 1
+    print(f"{count} card(s) {'revoked' if args.command == REVOKE else 'restored'}; "
+          f"{len(revocations)} revoked in total")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
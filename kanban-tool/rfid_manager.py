@@ -3,28 +3,209 @@ CWT Thread Verification System - RFID Manager
 Handles all RFID card operations using ACR122U reader
 """
 
+import functools
 import logging
-from typing import Optional, Tuple, List
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Sequence, Tuple, List
 from smartcard.System import readers
 from smartcard.util import toHexString, toBytes
 from smartcard.Exceptions import CardConnectionException, NoCardException
 import time
 
 from config import (
-    BLOCK_THREAD1, BLOCK_THREAD2, BLOCK_SIZE,
+    BLOCK_THREAD1, BLOCK_THREAD2, BLOCK_COMMIT, BLOCK_SIZE,
     DEFAULT_KEY_A, BYPASS_KEYWORD, READER_TIMEOUT,
-    READER_NAME_FILTER
+    READER_NAME_FILTER, PRESENCE_POLL_INTERVAL, RETRY_REMOVED_WINDOW,
+    PN532_DIRECT, PN532_AUTOPOLL, READER_PROFILE, READER_PROXY, READER_TRANSPORT,
+    CARD_OPERATION_BUDGET
 )
+from kanban_format import (
+    encode_thread_code, decode_thread_code, payload_crc, check_commit,
+    CommitRecord, STATE_PENDING, STATE_COMMITTED
+)
+from retry_policy import (
+    RetryPolicy, classify_status, classify_exception, describe,
+    OK, NEEDS_AUTH, CARD_REMOVED, STEP_AUTH
+)
+from cancellation import UNBOUNDED, Budget, CancelToken, Deadline
+from card_drivers import CLASSIC, CARD_UNKNOWN, CLASSIC_1K_SECTORS, card_type_from_atr, driver_for
+from ccid_transport import usb_readers
+from event_bus import BUS, EventBus, ApduStats, CardArrived, CardRemoved, OperationFinished, OperationStarted
+from key_ring import KeyRing
+from reader_proxy import RemoteReaders
+from revocation import RevocationList
+import metrics
+import pn532
+import profiling
+import reader_profiles
+from reader_profiles import ReaderProfile
+
+
+# One lock per physical reader, shared by every RFIDManager using it
+_reader_locks: Dict[str, threading.RLock] = {}
+_reader_locks_guard = threading.Lock()
+
+
+def _lock_for_reader(reader) -> threading.RLock:
+    with _reader_locks_guard:
+        return _reader_locks.setdefault(str(reader), threading.RLock())
+
+
+def _locked(method):
+    """Run a method while holding the reader lock (APDU sequences are never interleaved)"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _bounded(method):
+    """
+    Run a card operation under the cancel= / deadline= keyword arguments
+    (cancellation.py); inside the reader lock, below _locked
+
+    A call made by another operation without its own arguments keeps the
+    outer operation's budget.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, cancel: Optional[CancelToken] = None,
+                deadline: Optional[Deadline] = None, **kwargs):
+        outer = self._budget
+        if outer is not UNBOUNDED and cancel is None and deadline is None:
+            return method(self, *args, **kwargs)
+        if deadline is None and CARD_OPERATION_BUDGET > 0:
+            deadline = Deadline(CARD_OPERATION_BUDGET)
+        self._budget = Budget(cancel, deadline)
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._budget = outer
+            self._bound_io()    # Later direct transmits (LED, UID) must not inherit the deadline
+    return wrapper
+
+
+_running = threading.local()   # Counted operation of this thread (see _counted)
+
+
+def _counted(op: str):
+    """
+    Count and time a card operation by result (first element of the returned
+    tuple), and publish its events
+
+    An operation run by another counted operation on the same thread is part
+    of it: metrics and events are recorded once, under the outer operation.
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if getattr(_running, 'op', None) is not None:
+                return method(self, *args, **kwargs)
+            events = self.events
+            if events.wants(OperationStarted):
+                events.publish(OperationStarted(op, str(self.reader), self._card_uid))
+            apdus, retries = self.apdus, self.retries
+            started = time.perf_counter()
+            _running.op = op
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                _running.op = None
+            seconds = time.perf_counter() - started
+            metrics.CARD_OPERATIONS.inc(op, 'ok' if result[0] else 'failed')
+            metrics.CARD_OPERATION_SECONDS.observe(seconds, op, self.card_type, self.driver.transport)
+            if events.wants(OperationFinished):
+                events.publish(OperationFinished(op, str(self.reader), self._card_uid, bool(result[0]),
+                                                 result[-1], seconds))
+            if events.wants(ApduStats):
+                events.publish(ApduStats(op, str(self.reader), self.apdus - apdus, self.retries - retries))
+            return result
+        return wrapper
+    return decorate
 
 
 class RFIDManager:
-    """Manages RFID card operations for Kanban cards"""
+    """
+    Manages RFID card operations for Kanban cards
+    
+    Safe to share between threads: every APDU sequence holds the reader lock,
+    and the card connection is private to the manager. Use session() to keep
+    a card across several calls (wait, write, disconnect) without another
+    thread taking the reader in between.
     
-    def __init__(self):
+    Card operations take cancel= (CancelToken) and deadline= (Deadline)
+    keyword arguments: both are checked before every APDU, and a cancelled
+    or late operation returns its failure tuple (see cancellation.py).
+    """
+    
+    def __init__(self, retry_policy: RetryPolicy = None,
+                 reader_source: Callable[[], List] = None,
+                 profile: Optional[ReaderProfile] = None,
+                 key_ring: Optional[KeyRing] = None,
+                 revocations: Optional[RevocationList] = None,
+                 events: Optional[EventBus] = None):
+        """
+        Args:
+            retry_policy: Retry policy for failing APDU steps
+            reader_source: Returns the available readers (default: PC/SC readers(),
+                the USB readers with READER_TRANSPORT = "ccid", or the readers of
+                READER_PROXY; pass a simulated reader list to run without hardware)
+            profile: Reader tuning applied on connect (default: READER_PROFILE)
+            key_ring: Sector keys to try per card (default: from config.py)
+            revocations: Revoked card UIDs (default: REVOCATION_FILE)
+            events: Bus for card and operation events (default: event_bus.BUS)
+        """
         self.reader = None
-        self.connection = None
+        self._connection = None
+        self._card_uid = None   # UID of the connected card (to recognise it after RF loss)
+        self._auth_key = None   # Key of the last authentication (for re-authentication)
+        self.key_ring = key_ring or KeyRing.from_settings()
+        self.revocations = revocations if revocations is not None else RevocationList()
+        self.card_revoked = False   # Card on the reader is on the revocation list (checked on connect and presence polls)
+        self.card_type = CARD_UNKNOWN   # Type of the connected card (card_drivers.CARD_*)
+        self.driver = CLASSIC   # Block access for the connected card type
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retries = 0        # Steps repeated by the retry policy
+        self.apdus = 0          # APDUs sent, retries included
+        self._budget = UNBOUNDED    # Token and deadline of the running card operation
+        self.events = events if events is not None else BUS
+        self._lock = threading.RLock()  # Replaced by the shared reader lock on connect
+        if reader_source is None:
+            reader_source = RemoteReaders(READER_PROXY) if READER_PROXY else \
+                usb_readers if READER_TRANSPORT == 'ccid' else readers
+        self.reader_source = reader_source
+        self.profile = profile or reader_profiles.get_profile(READER_PROFILE)
+        self.profile_status = "No reader profile"
+        self._profile_pending = False   # Profile still to be sent (needs a card without the escape channel)
         self.logger = logging.getLogger(__name__)
     
+    @property
+    def is_connected(self) -> bool:
+        """True while a card connection is open"""
+        return self._connection is not None
+    
+    @property
+    def card_uid(self) -> Optional[str]:
+        """UID read when the card was connected (no APDU; see get_card_uid)"""
+        return self._card_uid
+    
+    @contextmanager
+    def session(self):
+        """
+        Hold the reader for a sequence of operations on one card
+        
+        Example:
+            with rfid.session():
+                if rfid.wait_for_card()[0]:
+                    rfid.write_kanban(thread1, thread2)
+                rfid.disconnect()
+        """
+        with self._lock:
+            yield self
+    
+    @profiling.profiled
+    @_locked
     def check_card_present(self) -> bool:
         """
         Quick check if a card is present on the reader (non-blocking)
@@ -32,8 +213,45 @@ class RFIDManager:
         Returns:
             bool: True if card is present, False otherwise
         """
+        present, _ = self._probe_card(read_uid=False)
+        return present
+    
+    def poll_presence(self) -> Optional[Tuple[bool, Optional[str]]]:
+        """
+        Presence and UID for monitoring, without waiting for the reader
+        
+        Returns:
+            Optional[Tuple[bool, Optional[str]]]: (Card present, UID), or None if
+                another operation holds the reader (the state is unchanged then);
+                card_revoked is updated for the card found
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            if self._connection is not None:
+                return None  # A card session is open; its owner knows the state
+            present, uid = self._probe_card(read_uid=True)
+            self.card_revoked = bool(uid) and self.revocations.is_revoked(uid)
+            return present, uid
+        finally:
+            self._lock.release()
+    
+    @_locked
+    def get_card_uid_quick(self) -> Optional[str]:
+        """
+        UID of the card on the reader, using the open connection or a temporary one
+        
+        Returns:
+            Optional[str]: UID as hex string or None if no card
+        """
+        if self._connection is not None:
+            return self.get_card_uid()
+        return self._probe_card(read_uid=True)[1]
+    
+    def _probe_card(self, read_uid: bool) -> Tuple[bool, Optional[str]]:
+        """Temporary connection to test for a card (caller holds the lock)"""
         if self.reader is None:
-            return False
+            return False, None
         
         try:
             # Try to create a quick connection
@@ -41,15 +259,17 @@ class RFIDManager:
             temp_connection.connect()
             
             # If we get here, card is present
+            uid = self._read_uid(temp_connection) if read_uid else None
             temp_connection.disconnect()
-            return True
+            return True, uid
             
         except (NoCardException, CardConnectionException):
-            return False
+            return False, None
         except Exception as e:
             self.logger.debug(f"Error checking card presence: {e}")
-            return False
+            return False, None
     
+    @_locked
     def get_card_uid(self) -> Optional[str]:
         """
         Get the UID of the current card
@@ -57,14 +277,14 @@ class RFIDManager:
         Returns:
             Optional[str]: UID as hex string or None if not available
         """
-        if self.connection is None:
+        if self._connection is None:
             return None
         
         try:
             # Get UID using APDU command
             # FF CA 00 00 00 - Get Data command for UID
             get_uid_cmd = [0xFF, 0xCA, 0x00, 0x00, 0x00]
-            data, sw1, sw2 = self.connection.transmit(get_uid_cmd)
+            data, sw1, sw2 = self._connection.transmit(get_uid_cmd)
             
             if sw1 == 0x90 and sw2 == 0x00:
                 # Convert UID bytes to hex string
@@ -78,16 +298,23 @@ class RFIDManager:
             self.logger.debug(f"Error getting UID: {e}")
             return None
         
-    def connect_reader(self) -> Tuple[bool, str]:
+    def connect_reader(self, name: Optional[str] = None) -> Tuple[bool, str]:
         """
         Connect to ACR122U RFID reader
         
+        Args:
+            name: Exact reader name to bind (default: first ACR122U)
+        
         Returns:
             Tuple[bool, str]: (Success status, Message)
         """
         try:
             # Get list of available readers
-            reader_list = readers()
+            reader_list = self.reader_source()
+            if name is not None:
+                reader_list = [r for r in reader_list if str(r) == name]
+                if not reader_list:
+                    return False, f"Reader not found: {name}"
             
             if len(reader_list) == 0:
                 return False, "No RFID readers found. Please connect ACR122U."
@@ -104,20 +331,40 @@ class RFIDManager:
                 acr122_reader = reader_list[0]
                 self.logger.warning(f"ACR122U not found, using: {acr122_reader}")
             
-            self.reader = acr122_reader
+            with self._lock:
+                self.reader = acr122_reader
+                self._lock = _lock_for_reader(acr122_reader)
             self.logger.info(f"Connected to reader: {self.reader}")
+            
+            # A reader that was unplugged is back at its defaults
+            if self.profile is not None:
+                self._profile_pending = True
+                with self._lock:
+                    self._apply_profile_escape()
             return True, f"Reader connected: {self.reader}"
             
         except Exception as e:
             self.logger.error(f"Failed to connect reader: {e}")
             return False, f"Failed to connect reader: {str(e)}"
     
-    def wait_for_card(self, timeout: int = READER_TIMEOUT) -> Tuple[bool, str]:
+    @profiling.profiled
+    def wait_for_card(self, timeout: float = READER_TIMEOUT,
+                      should_stop: Optional[Callable[[], bool]] = None,
+                      poll_interval: float = 0.3,
+                      cancel: Optional[CancelToken] = None,
+                      deadline: Optional[Deadline] = None) -> Tuple[bool, str]:
         """
         Wait for a card to be placed on the reader
         
+        The reader lock is taken per connection attempt, so other threads can
+        use the reader while this one waits (unless it is inside session()).
+        
         Args:
             timeout: Maximum seconds to wait for card
+            should_stop: Polled between attempts; return True to give up early
+            poll_interval: Seconds between attempts
+            cancel: Ends the wait as soon as it is cancelled (not only between attempts)
+            deadline: Give up at this deadline, if it comes before the timeout
             
         Returns:
             Tuple[bool, str]: (Success status, Message)
@@ -126,110 +373,150 @@ class RFIDManager:
             return False, "Reader not connected"
         
         # Close any existing connection first
-        if self.connection is not None:
-            try:
-                self.connection.disconnect()
-            except:
-                pass
-            self.connection = None
+        self.disconnect()
+        poller = pn532.AutoPoller(self.reader) if PN532_AUTOPOLL else None
         
-        try:
-            # Try to connect to card
-            start_time = time.time()
+        budget = Budget(cancel, deadline)
+        start_time = time.time()
+        while time.time() - start_time < timeout and not budget.expired:
+            if budget.cancelled or (should_stop is not None and should_stop()):
+                return False, "Stopped waiting for card"
             
-            while time.time() - start_time < timeout:
+            if poller is not None and poller.available:
+                # The reader polls by itself for one period; connect once it has a card
+                with self._lock:
+                    target = poller.poll()
+                if target is None and poller.available:
+                    continue
+            
+            with self._lock:
                 try:
                     # Create new connection
-                    self.connection = self.reader.createConnection()
-                    self.connection.connect()
+                    with profiling.span('connect'):
+                        self._connection = self.reader.createConnection()
+                        self._connection.connect()
+                    if self._profile_pending:
+                        self._apply_profile(self._connection.transmit)
                     
-                    # Get card ATR (Answer To Reset)
-                    atr = self.connection.getATR()
-                    self.logger.info(f"Card detected, ATR: {toHexString(atr)}")
+                    # Get card ATR (Answer To Reset): it tells the card type
+                    atr = self._connection.getATR()
+                    self.card_type = card_type_from_atr(atr)
+                    self.driver = driver_for(self.card_type)
+                    if PN532_DIRECT:
+                        self.driver = pn532.direct_driver(self._connection, str(self.reader), self.driver)
+                    self.logger.info(f"Card detected, ATR: {toHexString(atr)} ({self.driver.name})")
+                    self._card_uid = self._read_uid(self._connection)
+                    self.card_revoked = self.revocations.is_revoked(self._card_uid)
+                    if self.card_revoked:
+                        self.logger.warning(f"Card {self._card_uid} is revoked")
+                    if self.driver.needs_auth:
+                        self.key_ring.prepare(self._card_uid)
+                    self.events.publish(CardArrived(str(self.reader), self._card_uid, self.card_type))
                     return True, "Card detected"
                     
                 except NoCardException:
                     # No card present, clean up and retry
-                    if self.connection is not None:
-                        try:
-                            self.connection.disconnect()
-                        except:
-                            pass
-                        self.connection = None
-                    time.sleep(0.3)  # Wait before retry
-                    continue
+                    self._close_connection()
                     
                 except CardConnectionException as e:
                     # Connection error, clean up and retry
                     self.logger.debug(f"Card connection error: {e}")
-                    if self.connection is not None:
-                        try:
-                            self.connection.disconnect()
-                        except:
-                            pass
-                        self.connection = None
-                    time.sleep(0.3)
-                    continue
+                    self._close_connection()
                     
                 except Exception as e:
                     self.logger.error(f"Error connecting to card: {e}")
-                    if self.connection is not None:
-                        try:
-                            self.connection.disconnect()
-                        except:
-                            pass
-                        self.connection = None
-                    time.sleep(0.3)
-                    continue
-            
-            return False, "Timeout waiting for card"
+                    self._close_connection()
             
-        except Exception as e:
-            self.logger.error(f"Error in wait_for_card: {e}")
-            return False, f"Error: {str(e)}"
+            budget.wait(poll_interval)  # Wait before retry (without the lock)
+        
+        return False, "Timeout waiting for card"
     
-    def authenticate_block(self, block: int, key: List[int] = None) -> Tuple[bool, str]:
+    @_locked
+    @_bounded
+    def authenticate_block(self, block: int, key: List[int] = None,
+                           then: Sequence[List[int]] = ()) -> Tuple[bool, str]:
         """
         Authenticate a block using Key A
         
+        Without a key, the key ring's keys for this card and sector are tried
+        (remembered key, diversified key, candidates); the card is selected
+        again after each wrong key. The key that works is remembered, so later
+        operations on the card start with it.
+        
         Args:
             block: Block number to authenticate
-            key: 6-byte authentication key (default: DEFAULT_KEY_A)
+            key: 6-byte authentication key (default: from the key ring)
+            then: APDUs the caller sends next if it succeeds (a remote reader
+                gets them in the same frame as the first key's authentication)
             
         Returns:
             Tuple[bool, str]: (Success status, Message)
         """
-        if self.connection is None:
+        if self._connection is None:
             return False, "No card connected"
         
-        if key is None:
-            key = DEFAULT_KEY_A
+        sector = block // 4
+        if key is not None:
+            keys = [key]
+        elif self.driver.needs_auth:
+            keys = self.key_ring.keys_for(self._card_uid, sector)
+        else:
+            keys = [DEFAULT_KEY_A]  # Nothing to try on cards without authentication
+        if not keys:
+            return False, "No keys configured (KEY_CANDIDATES / KEY_MASTER_FILE)"
+        remembered = self.key_ring.remembered(self._card_uid, sector) if key is None else None
         
         try:
-            # Load authentication key into reader
-            # Command: Load Key (FF 82 00 00 06 + 6 key bytes)
-            load_key = [0xFF, 0x82, 0x00, 0x00, 0x06] + key
-            data, sw1, sw2 = self.connection.transmit(load_key)
-            
-            if sw1 != 0x90 or sw2 != 0x00:
-                return False, f"Failed to load key: {sw1:02X} {sw2:02X}"
-            
-            # Authenticate block
-            # Command: Authenticate (FF 86 00 00 05 01 00 + block + 60 + key_number)
-            # 60 = Key A, 61 = Key B
-            auth_cmd = [0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, block, 0x60, 0x00]
-            data, sw1, sw2 = self.connection.transmit(auth_cmd)
-            
-            if sw1 != 0x90 or sw2 != 0x00:
-                return False, f"Authentication failed: {sw1:02X} {sw2:02X}"
+            for attempt, candidate in enumerate(keys):
+                # A wrong key halts a MIFARE Classic card until it is selected again
+                if attempt and not pn532.reselect(self, STEP_AUTH):
+                    break
+                if not attempt and then:
+                    self._pipeline(self.driver.auth_apdus(self, block, candidate) + list(then))
+                
+                # Classic: Load Key + Authenticate pseudo-APDUs (one PN532 command on the direct path)
+                success, msg = self.driver.authenticate(self, block, candidate)
+                if not success:
+                    if candidate == remembered:
+                        self.key_ring.forget(self._card_uid, sector)  # Card was re-keyed
+                    continue
+                
+                self.key_ring.remember(self._card_uid, sector, candidate)
+                if key is None:
+                    metrics.KEY_LOOKUPS.inc('memo' if candidate == remembered else 'search')
+                self._auth_key = candidate
+                self.logger.info(f"Block {block} authenticated successfully")
+                return True, f"Block {block} authenticated"
             
-            self.logger.info(f"Block {block} authenticated successfully")
-            return True, f"Block {block} authenticated"
+            if key is None and self.driver.needs_auth:
+                metrics.KEY_LOOKUPS.inc('none')
+                if len(keys) > 1:
+                    msg = f"{msg} (no key of the key ring opens sector {sector})"
+            return False, msg
             
         except Exception as e:
             self.logger.error(f"Error authenticating block {block}: {e}")
             return False, f"Authentication error: {str(e)}"
     
+    @_locked
+    def reselect(self) -> bool:
+        """
+        Select the connected card again, after a failed authentication halted it
+        
+        Returns:
+            bool: True if the card answered
+        """
+        if self._connection is None:
+            return False
+        
+        try:
+            return pn532.reselect(self, STEP_AUTH)
+        except Exception as e:
+            self.logger.debug(f"Error selecting card again: {e}")
+            return False
+    
+    @_locked
+    @_bounded
     def read_block(self, block: int) -> Tuple[bool, Optional[bytes], str]:
         """
         Read 16 bytes from a block
@@ -240,30 +527,47 @@ class RFIDManager:
         Returns:
             Tuple[bool, Optional[bytes], str]: (Success status, Data, Message)
         """
-        if self.connection is None:
+        if self._connection is None:
             return False, None, "No card connected"
         
         try:
-            # Authenticate first
-            success, msg = self.authenticate_block(block)
+            # Classic: authenticate, then Read Binary (FF B0 00 + block + 10)
+            success, data, msg = self.driver.read_blocks(self, [block])
             if not success:
                 return False, None, msg
             
-            # Read binary block
-            # Command: Read Binary (FF B0 00 + block + 10)
-            read_cmd = [0xFF, 0xB0, 0x00, block, BLOCK_SIZE]
-            data, sw1, sw2 = self.connection.transmit(read_cmd)
+            self.logger.info(f"Block {block} read: {toHexString(list(data[0]))}")
+            return True, data[0], f"Block {block} read successfully"
             
-            if sw1 != 0x90 or sw2 != 0x00:
-                return False, None, f"Read failed: {sw1:02X} {sw2:02X}"
+        except Exception as e:
+            self.logger.error(f"Error reading block {block}: {e}")
+            return False, None, f"Read error: {str(e)}"
+    
+    @_locked
+    @_bounded
+    def read_blocks(self, blocks: List[int]) -> Tuple[bool, Optional[List[bytes]], str]:
+        """
+        Read several blocks with the card's driver (MIFARE Classic:
+        authenticating once per sector)
+        
+        Args:
+            blocks: Block numbers to read (in order)
             
-            self.logger.info(f"Block {block} read: {toHexString(data)}")
-            return True, bytes(data), f"Block {block} read successfully"
+        Returns:
+            Tuple[bool, Optional[List[bytes]], str]: (Success status, Data per block, Message)
+        """
+        if self._connection is None:
+            return False, None, "No card connected"
+        
+        try:
+            return self.driver.read_blocks(self, blocks)
             
         except Exception as e:
-            self.logger.error(f"Error reading block {block}: {e}")
+            self.logger.error(f"Error reading blocks {blocks}: {e}")
             return False, None, f"Read error: {str(e)}"
     
+    @_locked
+    @_bounded
     def write_block(self, block: int, data: bytes) -> Tuple[bool, str]:
         """
         Write 16 bytes to a block
@@ -275,26 +579,18 @@ class RFIDManager:
         Returns:
             Tuple[bool, str]: (Success status, Message)
         """
-        if self.connection is None:
+        if self._connection is None:
             return False, "No card connected"
         
         if len(data) != BLOCK_SIZE:
             return False, f"Data must be exactly {BLOCK_SIZE} bytes"
         
         try:
-            # Authenticate first
-            success, msg = self.authenticate_block(block)
+            # Classic: authenticate, then Update Binary (FF D6 00 + block + 10 + 16 data bytes)
+            success, msg = self.driver.write_blocks(self, [(block, data)])
             if not success:
                 return False, msg
             
-            # Update binary block
-            # Command: Update Binary (FF D6 00 + block + 10 + 16 data bytes)
-            write_cmd = [0xFF, 0xD6, 0x00, block, BLOCK_SIZE] + list(data)
-            response, sw1, sw2 = self.connection.transmit(write_cmd)
-            
-            if sw1 != 0x90 or sw2 != 0x00:
-                return False, f"Write failed: {sw1:02X} {sw2:02X}"
-            
             self.logger.info(f"Block {block} written: {toHexString(list(data))}")
             return True, f"Block {block} written successfully"
             
@@ -302,10 +598,47 @@ class RFIDManager:
             self.logger.error(f"Error writing block {block}: {e}")
             return False, f"Write error: {str(e)}"
     
+    @_locked
+    @_bounded
+    def write_blocks(self, items: List[Tuple[int, bytes]],
+                     current: Optional[Dict[int, bytes]] = None) -> Tuple[bool, str]:
+        """
+        Write several blocks in order with the card's driver (MIFARE Classic:
+        authenticating once per sector)
+        
+        Args:
+            items: (Block number, 16 bytes of data) pairs
+            current: Data the card holds now, by block; NTAG/Ultralight cards
+                then skip the pages that do not change
+            
+        Returns:
+            Tuple[bool, str]: (Success status, Message)
+        """
+        if self._connection is None:
+            return False, "No card connected"
+        
+        try:
+            for block, data in items:
+                if len(data) != BLOCK_SIZE:
+                    return False, f"Data must be exactly {BLOCK_SIZE} bytes"
+            return self.driver.write_blocks(self, items, current)
+            
+        except Exception as e:
+            self.logger.error(f"Error writing blocks: {e}")
+            return False, f"Write error: {str(e)}"
+    
+    @profiling.profiled
+    @_counted('write')
+    @_locked
+    @_bounded
     def write_kanban(self, thread1: str, thread2: str) -> Tuple[bool, str]:
         """
         Write thread codes to Kanban card
         
+        Uses the two-phase commit in block 6, so a card pulled mid-write is
+        never accepted as valid. If the card still carries an interrupted
+        write of the same codes, only the blocks that are missing are written.
+        
         Args:
             thread1: Thread 1 code (max 16 characters)
             thread2: Thread 2 code (max 16 characters)
@@ -313,7 +646,11 @@ class RFIDManager:
         Returns:
             Tuple[bool, str]: (Success status, Message)
         """
-        if self.connection is None:
+        return self._write_kanban(thread1, thread2)
+    
+    def _write_kanban(self, thread1: str, thread2: str) -> Tuple[bool, str]:
+        """Validate and write thread codes (caller holds the lock; write_kanban and write_bypass)"""
+        if self._connection is None:
             return False, "No card connected"
         
         # Validate inputs
@@ -324,55 +661,112 @@ class RFIDManager:
         
         try:
             # Convert strings to bytes and pad with zeros
-            thread1_bytes = thread1.encode('ascii').ljust(BLOCK_SIZE, b'\x00')
-            thread2_bytes = thread2.encode('ascii').ljust(BLOCK_SIZE, b'\x00')
-            
-            # Write Thread 1 to Block 4
-            success, msg = self.write_block(BLOCK_THREAD1, thread1_bytes)
-            if not success:
-                return False, f"Failed to write Thread 1: {msg}"
-            
-            # Write Thread 2 to Block 5
-            success, msg = self.write_block(BLOCK_THREAD2, thread2_bytes)
-            if not success:
-                return False, f"Failed to write Thread 2: {msg}"
-            
-            # Verify written data
-            success, msg = self.verify_data(thread1, thread2)
-            if not success:
-                return False, f"Verification failed: {msg}"
+            thread1_bytes = encode_thread_code(thread1)
+            thread2_bytes = encode_thread_code(thread2)
             
-            return True, "Kanban card written and verified successfully"
+            return self._write_payload(thread1_bytes, thread2_bytes, committed=True)
             
         except Exception as e:
             self.logger.error(f"Error writing Kanban: {e}")
             return False, f"Write error: {str(e)}"
     
+    def _write_payload(self, thread1_bytes: bytes, thread2_bytes: bytes,
+                       committed: bool) -> Tuple[bool, str]:
+        """
+        Two-phase write of blocks 4-5 (caller holds the lock)
+        
+        1. Store a PENDING commit record with the CRC of the new payload
+           (skipped when the card already has one for this payload: resume)
+        2. Write the payload blocks that differ from the target, verify them
+        3. Store the COMMITTED record, or a blank block 6 when clearing
+        
+        Args:
+            thread1_bytes: Block 4 data
+            thread2_bytes: Block 5 data
+            committed: False to finish with a blank block 6 (cleared card)
+            
+        Returns:
+            Tuple[bool, str]: (Success status, Message)
+        """
+        target = {BLOCK_THREAD1: thread1_bytes, BLOCK_THREAD2: thread2_bytes}
+        crc = payload_crc(thread1_bytes, thread2_bytes)
+        
+        success, blocks, msg = self.read_blocks([BLOCK_THREAD1, BLOCK_THREAD2, BLOCK_COMMIT])
+        if not success:
+            return False, f"Failed to read card: {msg}"
+        current = dict(zip([BLOCK_THREAD1, BLOCK_THREAD2, BLOCK_COMMIT], blocks))
+        record = CommitRecord.decode(current[BLOCK_COMMIT])
+        
+        resuming = record is not None and not record.committed and record.crc == crc
+        if resuming:
+            generation = record.generation
+            self.logger.info(f"Resuming interrupted write (generation {generation})")
+        else:
+            generation = (record.generation + 1) & 0xFFFFFFFF if record is not None else 1
+        
+        # Phase 1: mark in progress, then write only the blocks still missing
+        missing = [block for block in (BLOCK_THREAD1, BLOCK_THREAD2) if current[block] != target[block]]
+        items = [(block, target[block]) for block in missing]
+        if not resuming:
+            items.insert(0, (BLOCK_COMMIT, CommitRecord(STATE_PENDING, generation, crc).encode()))
+        if items:
+            success, msg = self.write_blocks(items, current)
+            if not success:
+                return False, f"Write interrupted, place the card again to resume: {msg}"
+            current.update(items)
+        
+        # Verify the blocks written in this pass
+        if missing:
+            success, written, msg = self.read_blocks(missing)
+            if not success:
+                return False, f"Verification failed: {msg}"
+            for block, data in zip(missing, written):
+                if data != target[block]:
+                    return False, f"Verification failed: block {block} does not match"
+        
+        # Phase 2: commit
+        final = CommitRecord(STATE_COMMITTED, generation, crc).encode() if committed else b'\x00' * BLOCK_SIZE
+        if current[BLOCK_COMMIT] != final or items:
+            success, msg = self.write_blocks([(BLOCK_COMMIT, final)], current)
+            if not success:
+                return False, f"Commit failed, place the card again to resume: {msg}"
+        
+        if resuming:
+            return True, f"Interrupted write resumed ({len(missing)} block(s) written) and committed"
+        return True, "Kanban card written and verified successfully"
+    
+    @profiling.profiled
+    @_counted('read')
+    @_locked
+    @_bounded
     def read_kanban(self) -> Tuple[bool, Optional[str], Optional[str], str]:
         """
-        Read thread codes from Kanban card
+        Read thread codes from Kanban card (cards with an uncommitted write and
+        revoked cards are rejected)
         
         Returns:
             Tuple[bool, Optional[str], Optional[str], str]: 
                 (Success status, Thread1, Thread2, Message)
         """
-        if self.connection is None:
+        if self._connection is None:
             return False, None, None, "No card connected"
         
+        if self.card_revoked:
+            return False, None, None, f"Card {self._card_uid} is revoked (lost or retired card)"
+        
         try:
-            # Read Thread 1 from Block 4
-            success, data1, msg = self.read_block(BLOCK_THREAD1)
+            # Blocks 4 (Thread 1), 5 (Thread 2) and 6 (commit record), same sector
+            success, blocks, msg = self.read_blocks([BLOCK_THREAD1, BLOCK_THREAD2, BLOCK_COMMIT])
             if not success:
-                return False, None, None, f"Failed to read Thread 1: {msg}"
+                return False, None, None, f"Failed to read Kanban data: {msg}"
             
-            # Read Thread 2 from Block 5
-            success, data2, msg = self.read_block(BLOCK_THREAD2)
-            if not success:
-                return False, None, None, f"Failed to read Thread 2: {msg}"
+            err = check_commit(*blocks)
+            if err:
+                return False, None, None, f"{err}. Write the card again."
             
             # Convert bytes to strings (strip null padding)
-            thread1 = data1.decode('ascii', errors='ignore').rstrip('\x00')
-            thread2 = data2.decode('ascii', errors='ignore').rstrip('\x00')
+            thread1 = decode_thread_code(blocks[0])
+            thread2 = decode_thread_code(blocks[1])
             
             return True, thread1, thread2, "Kanban card read successfully"
             
@@ -380,6 +774,8 @@ class RFIDManager:
             self.logger.error(f"Error reading Kanban: {e}")
             return False, None, None, f"Read error: {str(e)}"
     
+    @_locked
+    @_bounded
     def verify_data(self, expected_thread1: str, expected_thread2: str) -> Tuple[bool, str]:
         """
         Verify that written data matches expected values
@@ -404,6 +800,10 @@ class RFIDManager:
         
         return True, "Data verified successfully"
     
+    @profiling.profiled
+    @_counted('bypass')
+    @_locked
+    @_bounded
     def write_bypass(self) -> Tuple[bool, str]:
         """
         Write bypass mode to Kanban card
@@ -411,26 +811,28 @@ class RFIDManager:
         Returns:
             Tuple[bool, str]: (Success status, Message)
         """
-        return self.write_kanban(BYPASS_KEYWORD, "")
+        return self._write_kanban(BYPASS_KEYWORD, "")
     
+    @profiling.profiled
+    @_counted('clear')
+    @_locked
+    @_bounded
     def clear_card(self) -> Tuple[bool, str]:
         """
-        Clear Kanban data from card (write zeros)
+        Clear Kanban data from card (write zeros, blank commit record)
         
         Returns:
             Tuple[bool, str]: (Success status, Message)
         """
+        if self._connection is None:
+            return False, "No card connected"
+        
         try:
-            # Write zeros to both blocks
+            # Zero both blocks under a pending record, so a torn clear is detected too
             zero_data = b'\x00' * BLOCK_SIZE
-            
-            success, msg = self.write_block(BLOCK_THREAD1, zero_data)
-            if not success:
-                return False, f"Failed to clear Thread 1: {msg}"
-            
-            success, msg = self.write_block(BLOCK_THREAD2, zero_data)
+            success, msg = self._write_payload(zero_data, zero_data, committed=False)
             if not success:
-                return False, f"Failed to clear Thread 2: {msg}"
+                return False, f"Failed to clear card: {msg}"
             
             return True, "Card cleared successfully"
             
@@ -438,14 +840,387 @@ class RFIDManager:
             self.logger.error(f"Error clearing card: {e}")
             return False, f"Clear error: {str(e)}"
     
+    @profiling.profiled
+    @_counted('dump')
+    @_locked
+    @_bounded
+    def dump_card(self) -> Tuple[bool, Optional[bytes], int, str]:
+        """
+        Read the whole card (MIFARE Classic 1K: 16 sectors, one authentication each)
+        
+        Each sector gets the key ring's keys for this card; a sector that no
+        key opens is left as zeros and the dump goes on with the next one.
+        Key A always reads as zeros from a sector trailer.
+        
+        Returns:
+            Tuple[bool, Optional[bytes], int, str]:
+                (Success status, 1 KB image, Readable sectors bit mask, Message)
+        """
+        if self._connection is None:
+            return False, None, 0, "No card connected"
+        
+        if not self.driver.needs_auth:
+            return False, None, 0, f"{self.driver.name} cards are not dumped (MIFARE Classic only)"
+        
+        try:
+            image = bytearray(CLASSIC_1K_SECTORS * 4 * BLOCK_SIZE)
+            readable = 0
+            halted = False
+            for sector in range(CLASSIC_1K_SECTORS):
+                # A sector no key opened leaves the card halted
+                if halted and not self.reselect():
+                    return False, None, 0, f"Card stopped answering at sector {sector}"
+                
+                # A remote reader gets the sector's reads in the authentication's frame
+                blocks = range(sector * 4, sector * 4 + 4)
+                success, msg = self.authenticate_block(sector * 4, then=[self.driver.read_apdu(b) for b in blocks])
+                halted = not success
+                if not success:
+                    self.logger.info(f"Sector {sector} not dumped: {msg}")
+                    continue
+                
+                for block in blocks:
+                    data, sw1, sw2 = self.driver.read_block(self, block)
+                    
+                    if sw1 != 0x90 or sw2 != 0x00:
+                        return False, None, 0, f"Read failed for block {block}: {sw1:02X} {sw2:02X}"
+                    image[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE] = bytes(data)
+                readable |= 1 << sector
+            
+            if not readable:
+                return False, None, 0, "No sector could be authenticated"
+            
+            count = bin(readable).count('1')
+            return True, bytes(image), readable, f"Card dumped ({count}/{CLASSIC_1K_SECTORS} sectors)"
+            
+        except Exception as e:
+            self.logger.error(f"Error dumping card: {e}")
+            return False, None, 0, f"Dump error: {str(e)}"
+    
+    @_locked
+    def set_detect_buzzer(self, enabled: bool) -> bool:
+        """
+        Enable or disable the reader's beep on every card detection
+        (ACR122U pseudo-APDU, needs a connected card; the setting stays until power off)
+        
+        Args:
+            enabled: True to beep on detection (reader default)
+            
+        Returns:
+            bool: True if the reader accepted the command
+        """
+        if self._connection is None:
+            return False
+        
+        try:
+            # Command: Set Buzzer Output during Card Detection (FF 00 52 FF/00 00)
+            cmd = [0xFF, 0x00, 0x52, 0xFF if enabled else 0x00, 0x00]
+            data, sw1, sw2 = self._connection.transmit(cmd)
+            return sw1 == 0x90
+        except Exception as e:
+            self.logger.debug(f"Error setting detection buzzer: {e}")
+            return False
+    
+    @_locked
+    def signal_exception(self, repeats: int = 3) -> bool:
+        """
+        Blink the red LED and beep (ACR122U LED and buzzer control)
+        
+        Args:
+            repeats: Number of blink/beep cycles
+            
+        Returns:
+            bool: True if the reader accepted the command
+        """
+        if self._connection is None:
+            return False
+        
+        try:
+            # Command: Bi-Color LED and Buzzer Control (FF 00 40 P2 04 T1 T2 Repeats Link)
+            # P2 0x50 = blink red, T1/T2 in 100 ms units, Link 0x01 = buzz during T1
+            cmd = [0xFF, 0x00, 0x40, 0x50, 0x04, 0x02, 0x02, repeats, 0x01]
+            data, sw1, sw2 = self._connection.transmit(cmd)
+            return sw1 == 0x90
+        except Exception as e:
+            self.logger.debug(f"Error signalling reader: {e}")
+            return False
+    
+    @_locked
+    def signal_result(self, success: bool) -> bool:
+        """
+        Show the result of a card operation on the reader (the profile's LED
+        pattern; call before disconnect)
+        
+        Args:
+            success: Whether the operation succeeded
+            
+        Returns:
+            bool: True if the reader showed it (False without a profile pattern or card)
+        """
+        pattern = None
+        if self.profile is not None:
+            pattern = self.profile.success if success else self.profile.failure
+        if pattern is None or self._connection is None:
+            return False
+        
+        try:
+            with profiling.span('feedback'):
+                data, sw1, sw2 = self._connection.transmit(pattern.apdu())
+            return sw1 == 0x90
+        except Exception as e:
+            self.logger.debug(f"Error signalling result: {e}")
+            return False
+    
+    @_locked
     def disconnect(self):
         """Disconnect from card (keep reader connected)"""
-        if self.connection is not None:
+        self._close_connection()
+        
+        # Keep self.reader connected for reuse
+        self.logger.info("Disconnected from card")
+    
+    def _close_connection(self):
+        """Drop the card connection (caller holds the lock)"""
+        if self._connection is not None:
             try:
-                self.connection.disconnect()
+                self._connection.disconnect()
             except:
                 pass
-            self.connection = None
+            self._connection = None
+        self._card_uid = None
+        self.card_revoked = False
+        self.card_type = CARD_UNKNOWN
+        self.driver = CLASSIC
+    
+    def _transmit(self, step: str, apdu: List[int], block: Optional[int] = None,
+                  response: Callable = None, retry: bool = True) -> Tuple[list, int, int]:
+        """
+        Send one APDU, retrying only this step when the failure is recoverable
+        (caller holds the lock)
         
-        # Keep self.reader connected for reuse
-        self.logger.info("Disconnected from card")
+        Transient errors repeat the APDU after a bounded backoff. Lost sector
+        authentication re-authenticates `block` first; RF loss reconnects if
+        the same card is back in the field. Wrong keys and unsupported
+        commands are returned at once.
+        
+        Args:
+            step: STEP_* constant (decides how status words are classified)
+            apdu: Command APDU
+            block: Block the command works on (for re-authentication)
+            response: Maps the raw (data, SW1, SW2) before classification
+                (pn532.unwrap: PN532 status byte to the ACR122U status word)
+            retry: False to return the first failure as it is (probing commands)
+            
+        Returns:
+            Tuple[list, int, int]: (Data, SW1, SW2) of the last attempt
+            
+        Raises:
+            Exception: The last pyscard exception if the step never got an answer
+            OperationCancelled: The operation was cancelled or ran out of time
+                (checked before each attempt and during the backoff)
+        """
+        delays = self.retry_policy.delays()
+        budget = self._budget
+        while True:
+            budget.check()
+            self._bound_io()
+            error = None
+            started = time.perf_counter()
+            self.apdus += 1
+            try:
+                with profiling.span(step):
+                    data, sw1, sw2 = self._connection.transmit(apdu)
+                if response is not None:
+                    data, sw1, sw2 = response(data, sw1, sw2)
+                failure = classify_status(step, sw1, sw2)
+            except Exception as e:
+                error, failure = e, classify_exception(e)
+            metrics.APDU_SECONDS.observe(time.perf_counter() - started, step)
+            
+            if failure == OK:
+                return data, sw1, sw2
+            metrics.APDU_FAILURES.inc(step, failure)
+            
+            delay = next(delays, None) if retry and self.retry_policy.is_retryable(failure) else None
+            if delay is None:
+                break
+            
+            self.retries += 1
+            detail = describe(failure) if error else describe(failure, sw1, sw2)
+            where = f" block {block}" if block is not None else ""
+            self.logger.warning(f"{step}{where}: {detail}, retrying in {delay * 1000:.0f} ms")
+            with profiling.span('retry_backoff'):
+                budget.sleep(delay)
+            
+            if failure == CARD_REMOVED and not self._reconnect():
+                break
+            if failure in (NEEDS_AUTH, CARD_REMOVED) and block is not None:
+                self._reauthenticate(block)
+        
+        if error is not None:
+            raise error
+        return data, sw1, sw2
+    
+    def _pipeline(self, apdus: List[List[int]]):
+        """
+        Announce the APDUs about to be sent (caller holds the lock)
+        
+        A remote reader (reader_proxy.py) runs them in one round trip and
+        answers the following _transmit calls from the results, so retries,
+        metrics and traces still see every APDU. Local readers ignore this.
+        """
+        pipeline = getattr(self._connection, 'pipeline', None)
+        if pipeline is not None and len(apdus) > 1:
+            self._bound_io()
+            pipeline(apdus)
+    
+    def _bound_io(self):
+        """Give the connection the operation's deadline (CCID and proxy transports bound their I/O by it)"""
+        if hasattr(self._connection, 'deadline'):
+            self._connection.deadline = self._budget.deadline
+    
+    def _reauthenticate(self, block: int):
+        """Authenticate the block's sector again with the last key (caller holds the lock)"""
+        key = self._auth_key or DEFAULT_KEY_A
+        try:
+            self.driver.authenticate(self, block, key)
+        except Exception as e:
+            self.logger.debug(f"Re-authentication of block {block} failed: {e}")
+    
+    @profiling.profiled(name='reconnect')
+    def _reconnect(self) -> bool:
+        """
+        Reconnect after RF loss, only to the same card (caller holds the lock)
+        
+        Returns:
+            bool: True if the card that was connected is back
+        """
+        expected_uid = self._card_uid
+        deadline = time.time() + RETRY_REMOVED_WINDOW
+        while True:
+            try:
+                if self._connection is not None:
+                    try:
+                        self._connection.disconnect()
+                    except Exception:
+                        pass
+                self._connection = self.reader.createConnection()
+                self._connection.connect()
+                uid = self._read_uid(self._connection)
+                if expected_uid is not None and uid != expected_uid:
+                    self.logger.warning(f"Different card on reader ({uid}), not resuming {expected_uid}")
+                    metrics.READER_RECONNECTS.inc('other_card')
+                    return False
+                self.logger.info("Card reconnected after RF loss")
+                metrics.READER_RECONNECTS.inc('ok')
+                if self.profile is not None:
+                    # The RF loss may have been a reader reset (USB brown-out)
+                    self._apply_profile(self._connection.transmit)
+                return True
+            except Exception:
+                if time.time() >= deadline or self._budget.wait(0.05):
+                    metrics.READER_RECONNECTS.inc('failed')
+                    return False
+    
+    def _apply_profile(self, transmit: reader_profiles.Transmit) -> bool:
+        """
+        Send the reader profile (caller holds the lock)
+        
+        Returns:
+            bool: False if the reader did not answer (the profile stays pending)
+        """
+        try:
+            success, self.profile_status = reader_profiles.apply(transmit, str(self.reader), self.profile)
+        except Exception as e:
+            self._profile_pending = True
+            self.logger.debug(f"Reader profile not sent: {e}")
+            return False
+        self._profile_pending = False   # A rejected profile is not retried on every card
+        if success:
+            self.logger.info(self.profile_status)
+        else:
+            self.logger.warning(self.profile_status)
+        return True
+    
+    def _apply_profile_escape(self):
+        """Send the reader profile without a card, if the escape channel is enabled (caller holds the lock)"""
+        if not pn532.escape_available(self.reader):
+            return
+        try:
+            with pn532.escape_channel(self.reader) as control:
+                if not self._apply_profile(reader_profiles.escape_transmit(control)):
+                    raise ConnectionError("no answer on the escape channel")
+        except Exception as e:
+            self.logger.debug(f"Escape channel unavailable ({e}), reader profile sent with the first card")
+    
+    @staticmethod
+    def _read_uid(connection) -> Optional[str]:
+        """UID of the card on a connection (single attempt)"""
+        try:
+            data, sw1, sw2 = connection.transmit([0xFF, 0xCA, 0x00, 0x00, 0x00])
+            if sw1 == 0x90 and sw2 == 0x00:
+                return toHexString(data)
+        except Exception:
+            pass
+        return None
+
+
+class PresenceMonitor:
+    """
+    Background thread that watches for card placement and removal
+    
+    Polling never waits for the reader: while another thread runs an APDU
+    sequence or holds a session, the tick is skipped, so a write in flight
+    is never disturbed. on_change is called from the monitor thread.
+    """
+    
+    def __init__(self, rfid: RFIDManager, on_change: Optional[Callable[[bool, Optional[str]], None]] = None,
+                 interval: float = PRESENCE_POLL_INTERVAL):
+        """
+        Args:
+            rfid: Manager to watch
+            on_change: Called with (card present, UID) when the state changes; the
+                change is also published on rfid.events (CardArrived / CardRemoved)
+            interval: Seconds between polls
+        """
+        self.rfid = rfid
+        self.on_change = on_change
+        self.interval = interval
+        self.logger = logging.getLogger(__name__)
+        self._stop = threading.Event()
+        self._thread = None
+        self._state = None
+    
+    def start(self):
+        """Start watching (no-op if already running)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="PresenceMonitor", daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout: float = 2.0):
+        """Stop watching and wait for the thread to finish"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+    
+    def refresh(self):
+        """Report the next poll result even if unchanged (e.g. after an operation)"""
+        self._state = None
+    
+    def _run(self):
+        while not self._stop.is_set():
+            state = self.rfid.poll_presence()
+            if state is not None and state != self._state:
+                self._state = state
+                present, uid = state
+                reader = str(self.rfid.reader)
+                self.rfid.events.publish(CardArrived(reader, uid) if present else CardRemoved(reader))
+                if self.on_change is not None:
+                    try:
+                        self.on_change(*state)
+                    except Exception as e:
+                        self.logger.error(f"Presence callback failed: {e}")
+            self._stop.wait(self.interval)
@@ -0,0 +1,335 @@
+"""
+CWT Thread Verification System - Job Scheduler
+Priority scheduling of card jobs on shared readers, with preemption at card boundaries
+
+A job is a function run on a reader's worker thread. A job that handles more
+than one card (or waits a long time for one) is written as a generator and
+yields at every card boundary: after finishing a card, and between attempts
+while waiting for the next one. At a yield no card is connected, so the
+scheduler may pause the job there, run a higher-priority job on the same
+reader and then resume it. An urgent read thus slots into a 200-card batch
+between two cards, within one card poll.
+
+    def write_batch(rfid, job):
+        for i in range(quantity):
+            success, msg = yield from wait_for_card_steps(rfid, job)
+            ...write the card, disconnect...
+            yield                     # card boundary
+        return summary
+
+    job = scheduler.submit(write_batch, BATCH, "Write x200")
+
+Jobs of equal priority never preempt each other and run in submission order.
+A job not pinned to a reader runs on whichever reader becomes free first;
+once started it stays on that reader (the operator is standing there).
+"""
+
+import heapq
+import inspect
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Tuple
+
+from cancellation import CancelToken
+from config import READER_TIMEOUT, SCHEDULER_POLL_INTERVAL
+import metrics
+
+
+# Priorities (lower runs first)
+URGENT = 0        # Supervisor check during a run
+INTERACTIVE = 1   # Single-card button actions
+BATCH = 2         # Continuous and multi-card runs
+
+PRIORITY_NAMES = {'urgent': URGENT, 'interactive': INTERACTIVE, 'batch': BATCH}
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINAL_STATES = (DONE, FAILED, CANCELLED)
+
+
+class ScheduledJob:
+    """Handle of a submitted job"""
+
+    def __init__(self, fn: Callable, priority: int, name: str, reader: Optional[str],
+                 on_done: Optional[Callable[["ScheduledJob"], None]]):
+        self.fn = fn
+        self.priority = priority
+        self.name = name or getattr(fn, '__name__', 'job')
+        self.reader = reader            # Pinned reader (set when the job starts)
+        self.on_done = on_done
+        self.state = QUEUED
+        self.result = None
+        self.error: Optional[str] = None
+        self.preemptions = 0
+        self.resumed = False            # Set when the job continues after a preemption
+        self.cancelled = CancelToken()   # Pass as cancel= to card operations
+        self.yield_requested = threading.Event()  # A higher-priority job waits for this reader
+        self._done = threading.Event()
+        self._steps: Optional[Generator] = None
+        self._seq = 0
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def cancel(self, reason: str = "Stopped"):
+        """
+        Ask the job to stop (a queued job never starts, a running one stops at
+        its next check; card operations given cancel=job.cancelled stop at
+        their next APDU)
+        """
+        self.cancelled.cancel(reason)
+
+    def should_pause(self) -> bool:
+        """True when the job should reach its next card boundary soon (cancel or preemption)"""
+        return self.cancelled.is_set() or self.yield_requested.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the job has finished"""
+        return self._done.wait(timeout)
+
+    def __repr__(self) -> str:
+        return f"<ScheduledJob {self.name!r} p{self.priority} {self.state}>"
+
+
+class CardScheduler:
+    """One worker thread per reader, taking jobs from a shared priority queue"""
+
+    def __init__(self, managers: Iterable):
+        """
+        Args:
+            managers: RFIDManager per reader; jobs get the manager of the reader they run on
+        """
+        self.logger = logging.getLogger(__name__)
+        self._cond = threading.Condition()
+        self._queue: List[Tuple[int, int, ScheduledJob]] = []  # (priority, seq, job)
+        self._seq = itertools.count()
+        self._running: Dict[str, Optional[ScheduledJob]] = {}
+        self._stopping = False
+        self._threads = []
+        self.managers: Dict[str, Any] = {}
+        for i, rfid in enumerate(managers):
+            name = str(rfid.reader) if rfid.reader is not None else f"reader{i}"
+            self.managers[name] = rfid
+            self._running[name] = None
+            thread = threading.Thread(target=self._worker, args=(name, rfid),
+                                      name=f"CardScheduler-{i}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    # ------------------------------------------------------------------
+    # Submitting and inspecting jobs
+    # ------------------------------------------------------------------
+
+    def submit(self, fn: Callable, priority: int = INTERACTIVE, name: str = "",
+               reader: Optional[str] = None,
+               on_done: Optional[Callable[[ScheduledJob], None]] = None) -> ScheduledJob:
+        """
+        Queue a job
+
+        Args:
+            fn: Called as fn(rfid, job); a generator function yields at card boundaries
+                and its return value becomes job.result
+            priority: URGENT, INTERACTIVE or BATCH
+            name: Label for logs
+            reader: Run on this reader only (default: first free reader)
+            on_done: Called with the job from the worker thread when it finishes
+
+        Returns:
+            ScheduledJob: Job handle
+
+        Raises:
+            ValueError: Unknown reader
+        """
+        if reader is not None and reader not in self.managers:
+            raise ValueError(f"Reader not found: {reader}")
+        job = ScheduledJob(fn, priority, name, reader, on_done)
+        with self._cond:
+            self._push(job, new=True)
+        return job
+
+    @property
+    def busy(self) -> bool:
+        """True while any job is running or waiting"""
+        with self._cond:
+            return bool(self._queue) or any(self._running.values())
+
+    def running(self, reader: str) -> Optional[ScheduledJob]:
+        """Job currently running on a reader"""
+        with self._cond:
+            return self._running.get(reader)
+
+    def queued(self, reader: Optional[str] = None) -> List[ScheduledJob]:
+        """Waiting and paused jobs in run order (only those that may run on `reader` if given)"""
+        with self._cond:
+            jobs = [job for _, _, job in sorted(self._queue)]
+        if reader is not None:
+            jobs = [job for job in jobs if job.reader in (None, reader)]
+        return jobs
+
+    def shutdown(self, timeout: float = 5.0):
+        """Cancel every job and stop the workers"""
+        with self._cond:
+            self._stopping = True
+            for _, _, job in self._queue:
+                job.cancel()
+            for job in self._running.values():
+                if job is not None:
+                    job.cancel()
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    def _push(self, job: ScheduledJob, new: bool = False):
+        """Queue a job; a paused job keeps its place among jobs of its priority"""
+        if new:
+            job._seq = next(self._seq)
+        heapq.heappush(self._queue, (job.priority, job._seq, job))
+        for reader, running in self._running.items():
+            if (running is not None and running.priority > job.priority
+                    and job.reader in (None, reader)):
+                running.yield_requested.set()
+        self._cond.notify_all()
+
+    def _best(self, reader: str) -> Optional[ScheduledJob]:
+        """Highest-priority job that may run on a reader (call with the lock held)"""
+        for entry in sorted(self._queue):
+            if entry[2].reader in (None, reader):
+                return entry[2]
+        return None
+
+    def _should_yield(self, reader: str, job: ScheduledJob) -> bool:
+        """Whether a higher-priority job waits for this reader"""
+        with self._cond:
+            best = self._best(reader)
+            return best is not None and best.priority < job.priority
+
+    def _worker(self, reader: str, rfid):
+        while True:
+            with self._cond:
+                job = self._best(reader)
+                while job is None and not self._stopping:
+                    self._cond.wait()
+                    job = self._best(reader)
+                if self._stopping:
+                    return
+                self._queue.remove((job.priority, job._seq, job))
+                heapq.heapify(self._queue)
+                job.reader = reader
+                self._running[reader] = job
+            try:
+                self._run_slice(reader, rfid, job)
+            finally:
+                with self._cond:
+                    self._running[reader] = None
+                    self._cond.notify_all()
+
+    def _run_slice(self, reader: str, rfid, job: ScheduledJob):
+        """Run a job until it finishes or yields to a higher-priority job"""
+        if job.cancelled.is_set() and job._steps is None:
+            self._finish(job, CANCELLED, error="Cancelled before start")
+            return
+
+        job.resumed = job._steps is not None
+        job.state = RUNNING
+        try:
+            if job._steps is None:
+                result = job.fn(rfid, job)
+                if not inspect.isgenerator(result):
+                    self._finish(job, DONE, result)
+                    return
+                job._steps = result
+
+            while True:
+                try:
+                    next(job._steps)
+                except StopIteration as stop:
+                    self._finish(job, CANCELLED if job.cancelled.is_set() else DONE, stop.value)
+                    return
+                # Card boundary
+                job.yield_requested.clear()
+                if not job.cancelled.is_set() and self._should_yield(reader, job):
+                    job.state = PAUSED
+                    job.preemptions += 1
+                    self.logger.info(f"{job.name}: paused for a higher-priority job on {reader}")
+                    with self._cond:
+                        self._push(job)
+                    return
+        except Exception as e:
+            self.logger.exception(f"{job.name} failed")
+            self._finish(job, FAILED, error=str(e))
+
+    def _finish(self, job: ScheduledJob, state: str, result=None, error: Optional[str] = None):
+        job.state = state
+        job.result = result
+        job.error = error
+        job._steps = None
+        job._done.set()
+        if job.on_done is not None:
+            try:
+                job.on_done(job)
+            except Exception as e:
+                self.logger.error(f"{job.name}: completion callback failed: {e}")
+
+
+def wait_for_card_steps(rfid, job: ScheduledJob, timeout: float = READER_TIMEOUT,
+                        skip: Iterable[str] = (),
+                        poll_interval: float = SCHEDULER_POLL_INTERVAL) -> Generator:
+    """
+    Wait for a card, yielding between attempts (use with `yield from` in a job)
+
+    The card stays connected on success (its UID from rfid.get_card_uid());
+    nothing is yielded after that, so the job can work on the card before its
+    next card boundary.
+
+    Args:
+        rfid: RFIDManager
+        job: Job (stops waiting when cancelled)
+        timeout: Maximum seconds to wait
+        skip: UIDs to ignore (cards of this run still on the reader); after a
+            preemption the card the other job left on the reader is ignored too
+        poll_interval: Seconds per attempt; bounds the preemption latency while waiting
+
+    Returns:
+        Tuple[bool, str]: (Card connected, Message)
+    """
+    skip = set(skip)
+    started = time.time()
+    deadline = started + timeout
+    while True:
+        if job.cancelled.is_set():
+            return False, "Stopped waiting for card"
+        if job.resumed:
+            # A card left on the reader by the job that ran in between is not ours
+            job.resumed = False
+            leftover = rfid.get_card_uid_quick()
+            if leftover:
+                skip.add(leftover)
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False, "Timeout waiting for card"
+        success, msg = rfid.wait_for_card(timeout=min(remaining, poll_interval),
+                                          should_stop=job.should_pause,
+                                          poll_interval=poll_interval / 3,
+                                          cancel=job.cancelled)
+        if success:
+            uid = rfid.get_card_uid()
+            if uid is None or uid not in skip:
+                metrics.CARD_WAIT_SECONDS.observe(time.time() - started)
+                return True, msg
+            rfid.disconnect()  # Previous card of this run, still on the reader
+            job.cancelled.wait(poll_interval / 3)
+        elif msg == "Reader not connected":
+            return False, msg
+        yield
@@ -0,0 +1,220 @@
+"""
+CWT Thread Verification System - Session Statistics
+Constant-memory statistics of continuous card runs (write/read/clear multiple, audit)
+
+Nothing is kept per card: counters, a fixed ring of recent completion times
+for the rolling rate, a capped table of thread-code counts and two t-digests
+for latency quantiles. A run of 10 cards and one of 100,000 use the same
+memory.
+
+    stats = SessionStats('read')
+    stats.record(ok, seconds, thread1, thread2)
+    gui.set_session_stats(stats.summary_line())
+"""
+
+import math
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+
+
+MAX_TRACKED_CODES = 500      # Distinct thread-code pairs counted individually
+RATE_WINDOW = 60.0           # Seconds covered by the rolling rate
+RATE_RING = 512              # Completion times kept for the rolling rate
+
+
+class TDigest:
+    """
+    Merging t-digest (Dunning & Ertl) for streaming quantiles
+
+    Centroids live in two float arrays; their number is bounded by the
+    compression (about compression / 2 after a merge), whatever the count.
+    """
+
+    __slots__ = ('compression', 'count', 'min', 'max', '_means', '_weights', '_buffer', '_buffer_size')
+
+    def __init__(self, compression: float = 100.0):
+        self.compression = compression
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self._means = array('d')
+        self._weights = array('d')
+        self._buffer = array('d')
+        self._buffer_size = int(compression * 5)
+
+    def add(self, value: float):
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self._buffer.append(value)
+        if len(self._buffer) >= self._buffer_size:
+            self._merge()
+
+    def _k(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _q(self, k: float) -> float:
+        if k >= self.compression / 4:
+            return 1.0
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+    def _merge(self):
+        if not self._buffer:
+            return
+        points = sorted(list(zip(self._means, self._weights)) + [(v, 1.0) for v in self._buffer])
+        self._buffer = array('d')
+        total = sum(w for _, w in points)
+
+        means, weights = array('d'), array('d')
+        mean, weight = points[0]
+        done = 0.0
+        limit = self._q(self._k(0.0) + 1) * total
+        for m, w in points[1:]:
+            if done + weight + w <= limit:
+                weight += w
+                mean += (m - mean) * w / weight
+            else:
+                means.append(mean)
+                weights.append(weight)
+                done += weight
+                limit = self._q(self._k(done / total) + 1) * total
+                mean, weight = m, w
+        means.append(mean)
+        weights.append(weight)
+        self._means, self._weights = means, weights
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimated value at quantile q (0..1)
+
+        Returns:
+            Optional[float]: Estimate, or None if nothing was added
+        """
+        if self.count == 0:
+            return None
+        self._merge()
+        means, weights = self._means, self._weights
+        if len(means) == 1:
+            return means[0]
+        target = q * self.count
+        # Interpolate between centroid centres (min and max bound the tails)
+        cumulative = weights[0] / 2
+        if target <= cumulative:
+            return self.min + (means[0] - self.min) * (target / cumulative if cumulative else 0)
+        for i in range(1, len(means)):
+            centre = cumulative + (weights[i - 1] + weights[i]) / 2
+            if target <= centre:
+                return means[i - 1] + (means[i] - means[i - 1]) * (target - cumulative) / (centre - cumulative)
+            cumulative = centre
+        tail = self.count - cumulative
+        return means[-1] + (self.max - means[-1]) * ((target - cumulative) / tail if tail else 1)
+
+    @property
+    def centroids(self) -> int:
+        self._merge()
+        return len(self._means)
+
+
+class SessionStats:
+    """Streaming statistics of one continuous run"""
+
+    __slots__ = ('op', 'started', 'ok', 'failed', 'no_card', 'codes', 'other_codes',
+                 'latency', 'cycle', '_times', '_next', '_last', '_batch')
+
+    def __init__(self, op: str):
+        """
+        Args:
+            op: Operation label ('write', 'read', 'clear', 'audit'); also the metrics label
+        """
+        self.op = op
+        self.started = time.monotonic()
+        self.ok = 0
+        self.failed = 0
+        self.no_card = 0
+        self.codes: Dict[Tuple[str, str], int] = {}
+        self.other_codes = 0        # Cards whose code pair did not fit in the table
+        self.latency = TDigest()    # Card operation time
+        self.cycle = TDigest()      # Time from one card to the next
+        self._times = array('d', [0.0] * RATE_RING)
+        self._next = 0
+        self._last: Optional[float] = None
+        self._batch = metrics.BatchTimer(op)
+
+    def record(self, ok: bool, seconds: Optional[float] = None,
+               thread1: Optional[str] = None, thread2: Optional[str] = None):
+        """
+        Record one card
+
+        Args:
+            ok: Whether the operation succeeded
+            seconds: Operation time (excluding the wait for the card)
+            thread1: Thread 1 code read or written (counted per code pair)
+            thread2: Thread 2 code
+        """
+        now = time.monotonic()
+        if ok:
+            self.ok += 1
+        else:
+            self.failed += 1
+        if seconds is not None:
+            self.latency.add(seconds)
+        if self._last is not None:
+            self.cycle.add(now - self._last)
+        self._last = now
+        self._times[self._next % RATE_RING] = now
+        self._next += 1
+        self._batch.card(ok)
+
+        if ok and thread1 is not None:
+            key = (thread1, thread2 or "")
+            if key in self.codes:
+                self.codes[key] += 1
+            elif len(self.codes) < MAX_TRACKED_CODES:
+                self.codes[key] = 1
+            else:
+                self.other_codes += 1
+
+    def record_no_card(self):
+        """A card slot that timed out without a card"""
+        self.no_card += 1
+
+    @property
+    def total(self) -> int:
+        return self.ok + self.failed
+
+    @property
+    def success_rate(self) -> Optional[float]:
+        return self.ok / self.total if self.total else None
+
+    def rate_per_minute(self, window: float = RATE_WINDOW) -> float:
+        """Cards per minute over the last `window` seconds (or since the start if shorter)"""
+        now = time.monotonic()
+        recent = [t for t in self._times[:min(self._next, RATE_RING)] if now - t <= window]
+        span = min(window, now - self.started)
+        if len(recent) == RATE_RING:
+            span = now - min(recent)  # Faster than the ring covers: rate over the ring
+        return len(recent) * 60 / span if span > 0 else 0.0
+
+    def top_codes(self, n: int = 10) -> List[Tuple[Tuple[str, str], int]]:
+        """Most frequent (thread1, thread2) pairs"""
+        return sorted(self.codes.items(), key=lambda item: -item[1])[:n]
+
+    def summary_line(self) -> str:
+        """One-line live summary for the status panel"""
+        parts = [f"{self.total} cards"]
+        if self.total:
+            parts.append(f"{self.success_rate:.1%} ok")
+        if self.failed:
+            parts.append(f"{self.failed} failed")
+        parts.append(f"{self.rate_per_minute():.1f}/min")
+        if self.latency.count:
+            parts.append(f"op p50 {self.latency.quantile(0.5) * 1000:.0f} ms "
+                         f"p95 {self.latency.quantile(0.95) * 1000:.0f} ms")
+        if self.cycle.count:
+            parts.append(f"cycle p50 {self.cycle.quantile(0.5):.1f} s")
+        return " | ".join(parts)
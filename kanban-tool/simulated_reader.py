@@ -0,0 +1,379 @@
+"""
+CWT Thread Verification System - Simulated Reader
+In-memory ACR122U with MIFARE Classic 1K and NTAG213 cards, for running the
+tool and the HTTP service without hardware (pseudo-APDUs and the PN532
+direct commands of pn532.py)
+
+The reader and connection objects duck-type the pyscard ones used by
+RFIDManager (createConnection / connect / getATR / transmit / disconnect),
+so the whole card engine runs unchanged:
+
+    reader = SimulatedReader()
+    rfid = RFIDManager(reader_source=lambda: [reader])
+    reader.place(SimulatedCard.blank("04 A1 B2 C3"))
+    reader.place(SimulatedUltralightCard.blank("04 11 22 33 44 55 66"))
+"""
+
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from smartcard.Exceptions import CardConnectionException, NoCardException
+from smartcard.scard import SCARD_SHARE_DIRECT
+
+from config import BLOCK_SIZE, DEFAULT_KEY_A
+from plan import normalize_uid
+
+
+# ATR reported by ACR122U for a MIFARE Classic 1K card
+MIFARE_1K_ATR = [0x3B, 0x8F, 0x80, 0x01, 0x80, 0x4F, 0x0C, 0xA0, 0x00, 0x00, 0x03, 0x06,
+                 0x03, 0x00, 0x01, 0x00, 0x00, 0x00, 0x00, 0x6A]
+# ... and for a MIFARE Ultralight / NTAG21x card (card name 00 03)
+ULTRALIGHT_ATR = MIFARE_1K_ATR[:14] + [0x03, 0x00, 0x00, 0x00, 0x00, 0x68]
+
+# Reader behaviour (reader_profiles.py settings)
+FIRMWARE = b"ACR122U207"
+DETECT_BEEP_SECONDS = 0.1                                 # Busy with the detection beep before the first connect
+PICC_POLL_250MS = 0x20                                    # PICC parameter bit: poll every 250 ms instead of 500 ms
+
+SW_OK = (0x90, 0x00)
+SW_FAIL = (0x63, 0x00)
+SW_NOT_FOUND = (0x6A, 0x82)
+
+# PN532 InDataExchange status bytes
+PN532_OK = 0x00
+PN532_TIMEOUT = 0x01                                      # No answer (or a NAK) from the card
+PN532_AUTH_ERROR = 0x14
+
+_TRANSPORT_TRAILER = bytes(DEFAULT_KEY_A) + bytes([0xFF, 0x07, 0x80, 0x69]) + bytes(DEFAULT_KEY_A)
+
+
+class SimulatedCard:
+    """MIFARE Classic 1K memory (64 blocks, Key A from each sector trailer)"""
+
+    atr = MIFARE_1K_ATR
+    sak = 0x08
+
+    def __init__(self, uid: str, blocks: Optional[Dict[int, bytes]] = None):
+        self.uid = normalize_uid(uid)
+        self.blocks = {block: bytes(BLOCK_SIZE) for block in range(64)}
+        for trailer in range(3, 64, 4):
+            self.blocks[trailer] = _TRANSPORT_TRAILER
+        self.blocks.update(blocks or {})
+        self.halted = False   # After a failed authentication, until selected again
+
+    @classmethod
+    def blank(cls, uid: str) -> "SimulatedCard":
+        """Factory-fresh card"""
+        return cls(uid)
+
+    def key_a(self, sector: int) -> bytes:
+        return self.blocks[sector * 4 + 3][:6]
+
+    def read(self, block: int) -> bytes:
+        """Block as a reader sees it: Key A of a trailer always reads as zeros"""
+        data = self.blocks[block]
+        return bytes(6) + data[6:] if block % 4 == 3 else data
+
+    @property
+    def uid_bytes(self) -> List[int]:
+        return [int(part, 16) for part in self.uid.split()]
+
+
+class SimulatedUltralightCard:
+    """NTAG213 memory (45 pages of 4 bytes, pages 0-2 read-only, no authentication)"""
+
+    atr = ULTRALIGHT_ATR
+    sak = 0x00
+    PAGES = 45
+
+    def __init__(self, uid: str, pages: Optional[Dict[int, bytes]] = None, fast_read: bool = True):
+        """
+        Args:
+            uid: Card UID
+            pages: Initial page contents
+            fast_read: False for a card without FAST_READ (first MIFARE Ultralight)
+        """
+        self.uid = normalize_uid(uid)
+        self.pages = {page: bytes(4) for page in range(self.PAGES)}
+        self.pages.update(pages or {})
+        self.fast_read = fast_read
+        self.halted = False   # After a NAK the card ignores commands until selected again
+
+    @classmethod
+    def blank(cls, uid: str) -> "SimulatedUltralightCard":
+        """Factory-fresh card"""
+        return cls(uid)
+
+    @property
+    def uid_bytes(self) -> List[int]:
+        return [int(part, 16) for part in self.uid.split()]
+
+    def transmit(self, apdu: List[int]) -> Tuple[List[int], int, int]:
+        """ACR122U storage APDUs on an Ultralight card"""
+        ins = apdu[1]
+        if ins == 0x82:                                   # Load key: reader memory only
+            return [], *SW_OK
+        if ins == 0x86:                                   # No MIFARE authentication
+            return [], *SW_FAIL
+        page = apdu[3]
+        if page >= self.PAGES:
+            return [], *SW_NOT_FOUND
+        if ins == 0xB0:                                   # READ: four pages, wrapping around
+            data = b''.join(self.pages[(page + i) % self.PAGES] for i in range(4))
+            return list(data[:apdu[4]]), *SW_OK
+        if ins == 0xD6:                                   # WRITE: one page
+            if page < 3 or apdu[4] != 4:
+                return [], *SW_FAIL
+            self.pages[page] = bytes(apdu[5:9])
+            return [], *SW_OK
+        return [], 0x6D, 0x00
+
+    def exchange(self, command: List[int]) -> Tuple[int, List[int]]:
+        """Card command through PN532 InDataExchange: (status, response)"""
+        if self.halted:
+            return PN532_TIMEOUT, []
+        op, page = command[0], command[1]
+        if op == 0x3A and not self.fast_read:
+            self.halted = True
+            return PN532_TIMEOUT, []
+        if page >= self.PAGES:
+            return PN532_TIMEOUT, []
+        if op == 0x30:                                    # READ: four pages
+            return PN532_OK, list(b''.join(self.pages[(page + i) % self.PAGES] for i in range(4)))
+        if op == 0x3A:                                    # FAST_READ: page range
+            end = command[2]
+            if end < page or end >= self.PAGES:
+                return PN532_TIMEOUT, []
+            return PN532_OK, list(b''.join(self.pages[p] for p in range(page, end + 1)))
+        if op == 0xA2 and page >= 3:                      # WRITE: one page
+            self.pages[page] = bytes(command[2:6])
+            return PN532_OK, []
+        self.halted = True
+        return PN532_TIMEOUT, []
+
+
+class SimulatedConnection:
+    """One card connection; becomes unusable when the card leaves the reader"""
+
+    def __init__(self, reader: "SimulatedReader"):
+        self.reader = reader
+        self.card = None
+        self.direct = False   # SCARD_SHARE_DIRECT: reader control without a card
+        self._loaded_key = None
+        self._auth_sector = None
+
+    def connect(self, *args, **kwargs):
+        if kwargs.get('mode') == SCARD_SHARE_DIRECT:
+            self.direct = True
+            return
+        with self.reader.lock:
+            if self.reader.card is None or time.monotonic() < self.reader.detected_at:
+                raise NoCardException("No smart card inserted")
+            self.card = self.reader.card
+            self.card.halted = False
+            beep = self.reader.detect_buzzer and self.reader.announced is not self.card
+            self.reader.announced = self.card
+        if beep:
+            time.sleep(DETECT_BEEP_SECONDS * self.reader.timing_scale)
+
+    def disconnect(self):
+        self.card = None
+        self.direct = False
+        self._auth_sector = None
+
+    def control(self, code: int, command: List[int]) -> List[int]:
+        """Escape command on a direct connection: reader pseudo-APDUs and InAutoPoll (FF 00 00 00 Lc D4 60 ...)"""
+        if not self.direct:
+            raise CardConnectionException("Escape command not supported")
+        if command[:2] == [0xFF, 0x00] and command[2] != 0x00:
+            return self.reader.command(command)
+        if command[5:7] != [0xD4, 0x60]:
+            raise CardConnectionException("Escape command not supported")
+        poll_nr, period = command[7], command[8]
+        deadline = time.monotonic() + poll_nr * period * 0.15
+        while self.reader.card is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        card = self.reader.card
+        if card is None:
+            return [0xD5, 0x61, 0x00, 0x90, 0x00]
+        self.reader.detected_at = min(self.reader.detected_at, time.monotonic())  # Found without waiting for a poll
+        target = self._target_data(card)
+        return [0xD5, 0x61, 0x01, 0x10, len(target)] + target + [0x90, 0x00]
+
+    def getATR(self) -> List[int]:
+        self._check_card()
+        return list(self.card.atr)
+
+    def transmit(self, apdu: List[int]) -> Tuple[List[int], int, int]:
+        self._check_card()
+        self.reader.apdu_count += 1
+        # RF glitch drops the crypto session. Not injected on authenticate: there a
+        # 63 00 means a wrong key to the retry policy, which never retries it.
+        direct = apdu[:4] == [0xFF, 0x00, 0x00, 0x00] and apdu[5:6] == [0xD4]
+        if (self.reader.fault_rate and apdu[1] != 0x86 and apdu[6:9:2] != [0x40, 0x60]
+                and self.reader.random.random() < self.reader.fault_rate):
+            self._auth_sector = None
+            return [], *SW_FAIL
+        if apdu[:2] != [0xFF, 0xCA] and apdu[0] != 0xFF:
+            return [], 0x6E, 0x00
+
+        if direct:                                        # PN532 direct transmit
+            return self._pn532(apdu[6], apdu[7:])
+
+        ins = apdu[1]
+        if ins == 0xCA:                                   # Get UID
+            return self.card.uid_bytes, *SW_OK
+        if isinstance(self.card, SimulatedUltralightCard) and ins != 0x00:
+            return self.card.transmit(apdu)
+        if ins == 0x82:                                   # Load key
+            self._loaded_key = bytes(apdu[5:11])
+            return [], *SW_OK
+        if self.card.halted and ins in (0x86, 0xB0, 0xD6):
+            return [], *SW_FAIL                           # Halted: no answer until selected again
+        if ins == 0x86:                                   # Authenticate
+            block = apdu[7]
+            if block >= 64:
+                return [], *SW_NOT_FOUND
+            if self._loaded_key != self.card.key_a(block // 4):
+                self._auth_sector = None
+                self.card.halted = True
+                return [], *SW_FAIL
+            self._auth_sector = block // 4
+            return [], *SW_OK
+        if ins in (0xB0, 0xD6):                           # Read / update binary
+            block = apdu[3]
+            if block >= 64:
+                return [], *SW_NOT_FOUND
+            if self._auth_sector != block // 4:
+                return [], *SW_FAIL
+            if ins == 0xB0:
+                return list(self.card.read(block)[:apdu[4]]), *SW_OK
+            if block == 0:
+                return [], *SW_FAIL                       # Manufacturer block is read-only
+            self.card.blocks[block] = bytes(apdu[5:5 + BLOCK_SIZE])
+            return [], *SW_OK
+        if ins == 0x00:                                   # Reader pseudo-APDUs (LED, buzzer, settings)
+            raw = self.reader.command(apdu)
+            return raw[:-2], raw[-2], raw[-1]
+        return [], 0x6D, 0x00
+
+    def _pn532(self, command: int, params: List[int]) -> Tuple[List[int], int, int]:
+        """One PN532 command: response frame D5 <command + 1> ..."""
+        if command == 0x02:                               # GetFirmwareVersion
+            body = [0x32, 0x01, 0x06, 0x07]
+        elif command == 0x4A:                             # InListPassiveTarget: select again
+            self.card.halted = False
+            self._auth_sector = None
+            body = [0x01] + self._target_data(self.card)
+        elif command == 0x40:                             # InDataExchange
+            status, data = self._exchange(params[1:])
+            body = [status] + data
+        else:
+            return [], 0x6D, 0x00
+        return [0xD5, command + 1] + body, *SW_OK
+
+    def _exchange(self, command: List[int]) -> Tuple[int, List[int]]:
+        if isinstance(self.card, SimulatedUltralightCard):
+            return self.card.exchange(command)
+        op, block = command[0], command[1]
+        if block >= 64 or self.card.halted:
+            return PN532_TIMEOUT, []
+        if op in (0x60, 0x61):                            # Authenticate: key, then UID (last 4 bytes)
+            if bytes(command[2:8]) != self.card.key_a(block // 4) or command[8:12] != self.card.uid_bytes[-4:]:
+                self._auth_sector = None
+                self.card.halted = True
+                return PN532_AUTH_ERROR, []
+            self._auth_sector = block // 4
+            return PN532_OK, []
+        if self._auth_sector != block // 4:
+            return PN532_TIMEOUT, []
+        if op == 0x30:
+            return PN532_OK, list(self.card.read(block))
+        if op == 0xA0 and block != 0:
+            self.card.blocks[block] = bytes(command[2:2 + BLOCK_SIZE])
+            return PN532_OK, []
+        return PN532_TIMEOUT, []
+
+    @staticmethod
+    def _target_data(card) -> List[int]:
+        """InListPassiveTarget / InAutoPoll target: Tg, SENS_RES, SEL_RES, NFCID"""
+        return [0x01, 0x00, 0x04 if card.sak else 0x44, card.sak, len(card.uid_bytes)] + card.uid_bytes
+
+    def _check_card(self):
+        if self.card is None or self.reader.card is not self.card:
+            raise CardConnectionException("Card was removed (0x80100069)")
+
+
+class SimulatedReader:
+    """A reader with at most one card in the field"""
+
+    def __init__(self, name: str = "Simulated ACR122U PICC Interface 00 00",
+                 fault_rate: float = 0.0, seed: Optional[int] = None):
+        """
+        Args:
+            name: Reader name as listed by PC/SC
+            fault_rate: Probability of an RF glitch (63 00) per APDU, to exercise retries
+            seed: Random seed for fault injection
+        """
+        self.name = name
+        self.card = None
+        self.fault_rate = fault_rate
+        self.random = random.Random(seed)
+        self.apdu_count = 0
+        self.lock = threading.Lock()
+        self.detect_buzzer = True     # Reader settings, as after power-on
+        self.picc_parameter = 0xFF
+        self.timeout = 0xFF
+        self.announced = None         # Card the detection beep was for
+        self.detected_at = 0.0        # The reader's polling sees the card from then on
+        self.timing_scale = 1.0       # Multiplier on detection, beep and LED times (0 = instant)
+
+    def __str__(self) -> str:
+        return self.name
+
+    def createConnection(self) -> SimulatedConnection:
+        return SimulatedConnection(self)
+
+    def place(self, card: SimulatedCard):
+        """Put a card on the reader (replaces any card already there)"""
+        # Seen at the reader's next poll: half an interval on average
+        interval = 0.25 if self.picc_parameter & PICC_POLL_250MS else 0.5
+        with self.lock:
+            self.card = card
+            self.detected_at = time.monotonic() + interval / 2 * self.timing_scale
+
+    def remove(self) -> Optional[SimulatedCard]:
+        """Take the card off the reader"""
+        with self.lock:
+            card, self.card = self.card, None
+            self.announced = None
+            return card
+
+    def command(self, apdu: List[int]) -> List[int]:
+        """
+        Reader pseudo-APDU (FF 00 P1 P2 ...), card or escape channel
+
+        Returns:
+            Raw response: data and status word, or the bare firmware string
+        """
+        p1, p2 = apdu[2], apdu[3]
+        if p1 == 0x48:                                    # Get firmware version (no status word)
+            return list(FIRMWARE)
+        if p1 == 0x50:                                    # Get PICC operating parameter
+            return [0x90, self.picc_parameter]
+        if p1 == 0x51:                                    # Set PICC operating parameter
+            self.picc_parameter = p2
+            return [0x90, p2]
+        if p1 == 0x52:                                    # Buzzer during card detection
+            self.detect_buzzer = p2 != 0x00
+            return [0x90, 0x00]
+        if p1 == 0x41:                                    # Timeout parameter
+            self.timeout = p2
+            return [0x90, 0x00]
+        if p1 == 0x40:                                    # LED / buzzer: answered after the sequence
+            t1, t2, repeats = apdu[5:8]
+            time.sleep((t1 + t2) * repeats * 0.1 * self.timing_scale)
+            return [0x90, 0x00]
+        return list(SW_OK)
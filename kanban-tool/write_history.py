@@ -0,0 +1,104 @@
+"""
+CWT Thread Verification System - Write History
+Append-only record of every Kanban card write, keyed by card UID
+
+One JSON object per line:
+    {"ts": "2025-01-15T08:30:12.345", "session": "PC01-1a2b3c", "op": "write",
+     "uid": "04 A1 B2 C3", "thread1": "TH-001", "thread2": "TH-002", "ok": true}
+
+op is 'write', 'bypass' or 'clear'. event_join.py joins these records with
+machine verification logs.
+"""
+
+import json
+import logging
+import os
+import socket
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator, Optional
+
+from config import WRITE_HISTORY_FILE
+from plan import normalize_uid
+
+
+@dataclass(frozen=True)
+class WriteRecord:
+    """One card write by the Kanban tool"""
+    ts: datetime
+    session: str
+    op: str
+    uid: str
+    thread1: str
+    thread2: str
+    ok: bool = True
+
+
+class WriteHistory:
+    """Appends write records for one tool session"""
+
+    def __init__(self, path: str = WRITE_HISTORY_FILE):
+        self.path = path
+        self.session = f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+        self.logger = logging.getLogger(__name__)
+
+    def record(self, op: str, uid: Optional[str], thread1: str = "", thread2: str = "",
+               ok: bool = True):
+        """
+        Append one record (history errors never fail the card operation)
+
+        Args:
+            op: 'write', 'bypass' or 'clear'
+            uid: Card UID (from RFIDManager.get_card_uid)
+            thread1: Thread 1 code written
+            thread2: Thread 2 code written
+            ok: Whether the write was verified
+        """
+        if not uid:
+            self.logger.warning(f"Card UID unavailable, {op} not recorded in history")
+            return
+
+        entry = {
+            'ts': datetime.now().isoformat(timespec='milliseconds'),
+            'session': self.session,
+            'op': op,
+            'uid': normalize_uid(uid),
+            'thread1': thread1,
+            'thread2': thread2,
+            'ok': ok,
+        }
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+        except OSError as e:
+            self.logger.error(f"Failed to write history {self.path}: {e}")
+
+
+def load_history(path: str) -> Iterator[WriteRecord]:
+    """
+    Read write records from a history file (malformed lines are skipped)
+
+    Args:
+        path: History file (JSON lines)
+
+    Yields:
+        WriteRecord: Records in file order
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                yield WriteRecord(
+                    ts=datetime.fromisoformat(entry['ts']),
+                    session=entry.get('session', ''),
+                    op=entry.get('op', 'write'),
+                    uid=normalize_uid(entry['uid']),
+                    thread1=entry.get('thread1', ''),
+                    thread2=entry.get('thread2', ''),
+                    ok=bool(entry.get('ok', True)),
+                )
+            except (ValueError, KeyError, TypeError):
+                continue
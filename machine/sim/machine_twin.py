@@ -0,0 +1,938 @@
+"""
+TVS2102 - Machine Digital Twin
+Python model of handleStateMachine() in src/main.cpp for offline evaluation
+
+The twin runs the firmware state machine against a virtual millis() clock.
+Card, bobbin-sensor and QR scanner behaviour comes from a simulated world
+that is either scripted (JSON lines event file) or driven by a randomised
+operator model. Timing constants are parsed from main.cpp so the model
+follows the firmware, and can be overridden to evaluate changes offline.
+
+Usage:
+    python machine_twin.py --cycles 5000
+    python machine_twin.py --cycles 5000 --set LOOP_DELAY=50 --set DEBOUNCE_DELAY=200
+    python machine_twin.py --scenario shift.jsonl
+"""
+
+import argparse
+import heapq
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+from dataclasses import dataclass, fields, replace
+from enum import Enum
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+FIRMWARE_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "main.cpp")
+
+
+class State(Enum):
+    """Firmware SystemState values (names match stateToString)"""
+    INIT = "INIT"
+    WAIT_KANBAN = "WAIT_KANBAN"
+    READ_KANBAN = "READ_KANBAN"
+    WAIT_BOBBINS = "WAIT_BOBBINS"
+    SCAN_QR1 = "SCAN_QR1"
+    SCAN_QR2 = "SCAN_QR2"
+    VERIFY = "VERIFY"
+    READY = "READY"
+    ERROR = "ERROR"
+    BYPASS = "BYPASS"
+
+
+class Commit(Enum):
+    """Commit record (Block 6) of a Kanban card, as isKanbanCommitted() sees it"""
+    NONE = "none"              # No record: card written before v1.1 (ACCEPT_LEGACY_CARDS)
+    PENDING = "pending"        # Write interrupted before the commit
+    COMMITTED = "committed"
+    BAD_CRC = "bad_crc"        # Record does not match the thread blocks (torn write)
+
+
+# States that poll card presence with their own static lastCardCheck
+CARD_CHECK_STATES = (State.READY, State.BYPASS, State.ERROR)
+
+
+@dataclass(frozen=True)
+class FirmwareConstants:
+    """Timing and protocol constants from main.cpp (milliseconds)"""
+    QR_TIMEOUT: int = 5000
+    DEBOUNCE_DELAY: int = 500
+    RESET_ALARM_DELAY: int = 250
+    RFID_RESET_DELAY: int = 50
+    QR_TRIGGER_DELAY: int = 500
+    QR_READ_DELAY: int = 50
+    QR_POLL_DELAY: int = 10
+    SERIAL_STABILIZE_DELAY: int = 100
+    LOOP_DELAY: int = 100
+    BOBBIN_WAIT_TIMEOUT: int = 30000
+    CARD_CHECK_INTERVAL: int = 300
+    CARD_MISSING_THRESHOLD: int = 1
+    ACCEPT_LEGACY_CARDS: int = 1
+    BYPASS_KEYWORD: str = "bypass"
+
+    @classmethod
+    def from_source(cls, path: str = FIRMWARE_SOURCE) -> "FirmwareConstants":
+        """
+        Parse #define values from the firmware source
+
+        Args:
+            path: Path to main.cpp
+
+        Returns:
+            FirmwareConstants: Constants found in the source, defaults for the rest
+        """
+        known = {f.name: f.type for f in fields(cls)}
+        values = {}
+        pattern = re.compile(r'^\s*#define\s+(\w+)\s+("[^"]*"|-?\d+)')
+
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                match = pattern.match(line)
+                if not match or match.group(1) not in known:
+                    continue
+                name, raw = match.groups()
+                values[name] = raw.strip('"') if raw.startswith('"') else int(raw)
+
+        return cls(**values)
+
+    def with_overrides(self, overrides: Dict[str, str]) -> "FirmwareConstants":
+        """Return a copy with NAME=value overrides applied"""
+        converted = {}
+        for name, raw in overrides.items():
+            current = getattr(self, name, None)
+            if current is None:
+                raise ValueError(f"Unknown firmware constant: {name}")
+            converted[name] = type(current)(raw)
+        return replace(self, **converted)
+
+
+@dataclass
+class Card:
+    """Kanban card as seen by the MFRC522"""
+    uid: str
+    thread1: str
+    thread2: str
+    read_fail_rate: float = 0.0  # Probability readKanbanCard() fails
+    halted: bool = False          # HALTed cards ignore REQA until the field resets
+    ultralight: bool = False      # NTAG21x / Ultralight: pages read without authentication
+    commit: Commit = Commit.COMMITTED
+
+
+@dataclass
+class ScannerModel:
+    """GM65 behaviour: decode latency after trigger and failure probability"""
+    latency_ms: int = 150
+    jitter_ms: int = 80
+    fail_rate: float = 0.01
+
+
+@dataclass
+class TimingModel:
+    """Costs of firmware calls that are not explicit delay() calls"""
+    card_read_ms: int = 25        # readKanbanCard(): select + 3x auth/read (MIFARE Classic)
+    card_read_ul_ms: int = 12     # readKanbanCard() on NTAG/Ultralight: select + 3 reads
+    pcd_init_ms: int = 5          # rfid.PCD_Init() soft reset
+    presence_miss_rate: float = 0.0  # Probability a WUPA misses a present card
+
+
+class World:
+    """Simulated card, bobbin sensor and scanner environment"""
+
+    def __init__(self, rng: random.Random, scanners: Tuple[ScannerModel, ScannerModel] = None):
+        self.rng = rng
+        self.scanners = scanners or (ScannerModel(), ScannerModel())
+        self.card: Optional[Card] = None
+        self.bobbins: List[Optional[str]] = [None, None]  # QR label per bobbin, None = absent
+        self.bobbins_loaded_at: Optional[int] = None
+        self.card_placed_at: Optional[int] = None
+        self._events = []
+        self._seq = 0
+        self.now = 0
+        self.version = 0  # Bumped whenever an event is applied
+
+    # ----- event stream -----
+
+    def schedule(self, time_ms: int, action: Callable[[], None]):
+        """Schedule an action to change the world at time_ms"""
+        heapq.heappush(self._events, (int(time_ms), self._seq, action))
+        self._seq += 1
+
+    def advance_to(self, now: int):
+        """Apply every event due at or before now"""
+        while self._events and self._events[0][0] <= now:
+            event_time, _, action = heapq.heappop(self._events)
+            self.now = event_time
+            action()
+            self.version += 1
+        self.now = now
+
+    def next_event_time(self) -> float:
+        """Time of the next pending event (inf if none)"""
+        return self._events[0][0] if self._events else math.inf
+
+    def last_event_time(self) -> int:
+        """Time of the last pending event (now if none)"""
+        return max([e[0] for e in self._events], default=self.now)
+
+    def load_events(self, path: str):
+        """
+        Load a scripted event stream (JSON lines)
+
+        Each line has "t" (ms) and "event", one of:
+            card_place   {"uid", "thread1", "thread2", "ultralight", "commit"}
+            card_remove  {}
+            bobbin_insert {"bobbin": 1|2, "label"}
+            bobbin_remove {"bobbin": 1|2}
+        """
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                record = json.loads(line)
+                event = record["event"]
+                t = record["t"]
+                if event == "card_place":
+                    card = Card(record.get("uid", "00 00 00 00"),
+                                record.get("thread1", ""), record.get("thread2", ""),
+                                ultralight=record.get("ultralight", False),
+                                commit=Commit(record.get("commit", Commit.COMMITTED.value)))
+                    self.schedule(t, lambda c=card: self.place_card(c))
+                elif event == "card_remove":
+                    self.schedule(t, self.remove_card)
+                elif event == "bobbin_insert":
+                    self.schedule(t, lambda i=record["bobbin"] - 1, lbl=record.get("label", ""):
+                                  self.insert_bobbin(i, lbl))
+                elif event == "bobbin_remove":
+                    self.schedule(t, lambda i=record["bobbin"] - 1: self.remove_bobbin(i))
+                else:
+                    raise ValueError(f"Unknown event '{event}' at t={t}")
+
+    # ----- world mutations -----
+
+    def place_card(self, card: Card):
+        card.halted = False
+        self.card = card
+        self.card_placed_at = self.now
+
+    def remove_card(self):
+        self.card = None
+
+    def insert_bobbin(self, index: int, label: str):
+        self.bobbins[index] = label
+        if all(b is not None for b in self.bobbins):
+            self.bobbins_loaded_at = self.now
+
+    def remove_bobbin(self, index: int):
+        self.bobbins[index] = None
+        self.bobbins_loaded_at = None
+
+    # ----- sensor views -----
+
+    def bobbin_present(self, index: int) -> bool:
+        return self.bobbins[index] is not None
+
+    def scan(self, index: int, trigger_time: int) -> Tuple[Optional[int], str]:
+        """
+        Model a GM65 decode triggered at trigger_time
+
+        Returns:
+            Tuple[Optional[int], str]: (Arrival time of the frame or None, decoded text)
+        """
+        model = self.scanners[index]
+        label = self.bobbins[index]
+        if label is None or self.rng.random() < model.fail_rate:
+            return None, ""
+        latency = max(0, model.latency_ms + self.rng.randint(-model.jitter_ms, model.jitter_ms))
+        return trigger_time + latency, label
+
+
+def byte_array_to_string(text: str) -> str:
+    """Mirror byteArrayToString(): stop at NUL, keep printable ASCII, trim"""
+    text = text[:16].split("\x00", 1)[0]
+    return "".join(ch for ch in text if 32 <= ord(ch) <= 126).strip()
+
+
+class TwinStats:
+    """Counters collected while the twin runs"""
+
+    def __init__(self):
+        self.state_time: Dict[State, int] = {s: 0 for s in State}
+        self.state_entries: Dict[State, int] = {s: 0 for s in State}
+        self.errors: Dict[str, int] = {}
+        self.resets: Dict[str, int] = {}
+        self.verify_latency_ms: List[int] = []  # Bobbins loaded -> machine enabled
+        self.machine_enabled_ms = 0
+        self.sew_cycles = 0
+        self.iterations = 0
+        self.stalled = False  # Run ended idle with no pending world events
+
+    def count_error(self, cause: str):
+        self.errors[cause] = self.errors.get(cause, 0) + 1
+
+    def count_reset(self, cause: str):
+        self.resets[cause] = self.resets.get(cause, 0) + 1
+
+
+class MachineTwin:
+    """Cycle-faithful model of the ESP32 handleStateMachine() loop"""
+
+    def __init__(self, world: World, constants: FirmwareConstants = None,
+                 timing: TimingModel = None):
+        self.world = world
+        self.c = constants or FirmwareConstants()
+        self.timing = timing or TimingModel()
+        self.stats = TwinStats()
+        self.now = 0
+
+        # Globals
+        self.state = State.INIT
+        self.kanban = ("", "", False)
+        self.qr_code1 = ""
+        self.qr_code2 = ""
+        self.kanban_uid = ""
+        self.thread1_error = False
+        self.thread2_error = False
+        self.reset_monitoring_armed = False
+        self.bobbins_latched = False
+        self.card_missing_count = 0
+        self.machine_output = False
+
+        # Function-local statics
+        self._state_entry_time = 0
+        self._previous_state = State.INIT
+        self._reader_reset = False
+        self._last_card_check = {s: 0 for s in CARD_CHECK_STATES}
+
+        self._machine_enabled_since: Optional[int] = None
+        self._idle = False
+        self.on_state_change: Optional[Callable[[State, State], None]] = None
+
+    # ----- Arduino primitives -----
+
+    def millis(self) -> int:
+        return self.now
+
+    def delay(self, ms: int):
+        self.now += ms
+        self.world.advance_to(self.now)
+
+    def detect_bobbin(self, index: int) -> bool:
+        self.world.advance_to(self.now)
+        return self.world.bobbin_present(index)
+
+    def set_machine_output(self, enable: bool):
+        if enable == self.machine_output:
+            return
+        self.machine_output = enable
+        if enable:
+            self._machine_enabled_since = self.now
+        elif self._machine_enabled_since is not None:
+            self.stats.machine_enabled_ms += self.now - self._machine_enabled_since
+            self._machine_enabled_since = None
+
+    def pcd_init(self):
+        self.delay(self.timing.pcd_init_ms)
+        if self.world.card is not None:
+            self.world.card.halted = False  # Antenna reset returns the card to IDLE
+
+    def picc_is_new_card_present(self) -> bool:
+        self.world.advance_to(self.now)
+        card = self.world.card
+        return card is not None and not card.halted
+
+    def is_kanban_card_still_present(self) -> bool:
+        self.world.advance_to(self.now)
+        card = self.world.card
+        miss_rate = self.timing.presence_miss_rate
+        present = card is not None and not (miss_rate and self.world.rng.random() < miss_rate)
+        if card is not None:
+            card.halted = True  # PICC_HaltA() after the wake-up
+        return present
+
+    def read_kanban_card(self) -> bool:
+        self.kanban = ("", "", False)
+        card = self.world.card
+        ultralight = card is not None and card.ultralight
+        self.delay(self.timing.card_read_ul_ms if ultralight else self.timing.card_read_ms)
+        if card is None or card is not self.world.card or self.world.rng.random() < card.read_fail_rate:
+            return False  # Removed during the read: the block reads fail
+
+        card.halted = True
+        if not self.is_kanban_committed(card):
+            return True  # Empty thread codes -> Invalid Kanban data (not even bypass)
+        thread1 = byte_array_to_string(card.thread1)
+        if thread1.lower() == self.c.BYPASS_KEYWORD.lower():
+            self.kanban = (thread1, "", True)
+            return True
+        self.kanban = (thread1, byte_array_to_string(card.thread2), False)
+        return True
+
+    def read_qr_code(self, index: int, trigger_time: int) -> str:
+        """readQRCode() timing: 10 ms polls, 50 ms settle, QR_TIMEOUT limit"""
+        arrival, text = self.world.scan(index, trigger_time)
+        start = self.now
+        timeout = self.c.QR_TIMEOUT
+        poll = max(1, self.c.QR_POLL_DELAY)
+
+        if arrival is not None:
+            first_poll = start + max(0, math.ceil((arrival - start) / poll)) * poll
+            if first_poll - start < timeout:
+                self.delay(first_poll - start + self.c.QR_READ_DELAY)
+                return byte_array_to_string(text)
+
+        self.delay(math.ceil(timeout / poll) * poll)
+        return ""
+
+    # ----- firmware functions -----
+
+    def is_kanban_committed(self, card: Card) -> bool:
+        """Mirror isKanbanCommitted(): False for a pending or torn write"""
+        if card.commit == Commit.NONE:
+            return bool(self.c.ACCEPT_LEGACY_CARDS)
+        return card.commit == Commit.COMMITTED
+
+    def clear_process_data(self):
+        self.kanban = ("", "", False)
+        self.qr_code1 = ""
+        self.qr_code2 = ""
+        self.kanban_uid = ""
+        self.thread1_error = False
+        self.thread2_error = False
+        self.reset_monitoring_armed = False
+        self.bobbins_latched = False
+        self.card_missing_count = 0
+
+    def handle_reset_if_bobbin_removed(self) -> bool:
+        if not self.reset_monitoring_armed:
+            return False
+
+        bobbin1 = self.detect_bobbin(0)
+        bobbin2 = self.detect_bobbin(1)
+
+        if bobbin1 and bobbin2 and not self.bobbins_latched:
+            self.bobbins_latched = True
+
+        if not self.bobbins_latched or (bobbin1 and bobbin2):
+            return False
+
+        self.stats.count_reset(f"bobbin_removed_{self.state.value}")
+        self.set_machine_output(False)
+        self.delay(self.c.RESET_ALARM_DELAY)
+        self.clear_process_data()
+        self.state = State.WAIT_KANBAN
+        return True
+
+    def _card_check_removed(self) -> bool:
+        """Shared READY/BYPASS/ERROR presence check; True when the state was reset"""
+        if self.millis() - self._last_card_check[self.state] <= self.c.CARD_CHECK_INTERVAL:
+            return False
+        self._last_card_check[self.state] = self.millis()
+
+        if self.is_kanban_card_still_present():
+            self.card_missing_count = 0
+            return False
+
+        self.card_missing_count += 1
+        if self.card_missing_count < self.c.CARD_MISSING_THRESHOLD:
+            return False
+
+        self.stats.count_reset(f"card_removed_{self.state.value}")
+        self.set_machine_output(False)
+        self.delay(self.c.RESET_ALARM_DELAY)
+        self.clear_process_data()
+        self.pcd_init()
+        self.delay(self.c.RFID_RESET_DELAY)
+        self.state = State.WAIT_KANBAN
+        return True
+
+    def handle_state_machine(self):
+        """One call of handleStateMachine()"""
+        if self.state != self._previous_state:
+            self._state_entry_time = self.millis()
+            self._enter_state(self._previous_state, self.state)
+            self._previous_state = self.state
+
+        if self.handle_reset_if_bobbin_removed():
+            return
+
+        state = self.state
+        c = self.c
+
+        if state == State.WAIT_KANBAN:
+            if not self._reader_reset:
+                self.pcd_init()
+                self.delay(c.RFID_RESET_DELAY)
+                self._reader_reset = True
+            self.set_machine_output(False)
+            if self.picc_is_new_card_present():
+                self._reader_reset = False
+                self.state = State.READ_KANBAN
+
+        elif state == State.READ_KANBAN:
+            if self.read_kanban_card():
+                self.kanban_uid = self.world.card.uid
+                thread1, thread2, is_bypass = self.kanban
+                if is_bypass:
+                    self.reset_monitoring_armed = True
+                    self.bobbins_latched = False
+                    self.state = State.BYPASS
+                elif thread1 and thread2:
+                    self.reset_monitoring_armed = True
+                    self.bobbins_latched = False
+                    self.state = State.WAIT_BOBBINS
+                else:
+                    self.stats.count_error("invalid_kanban")
+                    self.state = State.ERROR
+            else:
+                self.stats.count_error("kanban_read_failed")
+                self.delay(c.DEBOUNCE_DELAY)
+                self.state = State.WAIT_KANBAN
+
+        elif state == State.WAIT_BOBBINS:
+            bobbin1 = self.detect_bobbin(0)
+            bobbin2 = self.detect_bobbin(1)
+            if bobbin1 and bobbin2:
+                self.delay(c.DEBOUNCE_DELAY)
+                self.state = State.SCAN_QR1
+            if self.millis() - self._state_entry_time > c.BOBBIN_WAIT_TIMEOUT:
+                self.stats.count_error("bobbin_timeout")
+                self.state = State.ERROR
+
+        elif state == State.SCAN_QR1:
+            trigger_time = self.millis()
+            self.delay(c.QR_TRIGGER_DELAY)
+            self.qr_code1 = self.read_qr_code(0, trigger_time)
+            if self.qr_code1:
+                self.state = State.SCAN_QR2
+            else:
+                self.stats.count_error("qr1_failed")
+                self.thread1_error = True
+                self.thread2_error = False
+                self.state = State.ERROR
+
+        elif state == State.SCAN_QR2:
+            trigger_time = self.millis()
+            self.delay(c.QR_TRIGGER_DELAY)
+            self.qr_code2 = self.read_qr_code(1, trigger_time)
+            if self.qr_code2:
+                self.state = State.VERIFY
+            else:
+                self.stats.count_error("qr2_failed")
+                self.thread1_error = False
+                self.thread2_error = True
+                self.state = State.ERROR
+
+        elif state == State.VERIFY:
+            match1 = self.qr_code1 == self.kanban[0]
+            match2 = self.qr_code2 == self.kanban[1]
+            self.thread1_error = not match1
+            self.thread2_error = not match2
+            if match1 and match2:
+                self.state = State.READY
+            else:
+                self.stats.count_error("mismatch")
+                self.state = State.ERROR
+
+        elif state == State.READY:
+            bobbin1 = self.detect_bobbin(0)
+            bobbin2 = self.detect_bobbin(1)
+            if self._card_check_removed():
+                return
+            if not bobbin1 or not bobbin2:
+                self.stats.count_reset("bobbin_removed_READY_check")
+                self.set_machine_output(False)
+                self.delay(c.RESET_ALARM_DELAY)
+                self.clear_process_data()
+                self.state = State.WAIT_KANBAN
+                return
+            self.set_machine_output(True)
+
+        elif state == State.BYPASS:
+            if self._card_check_removed():
+                return
+            self.set_machine_output(True)
+
+        elif state == State.ERROR:
+            self.set_machine_output(False)
+            bobbin1 = self.detect_bobbin(0)
+            bobbin2 = self.detect_bobbin(1)
+            if self._card_check_removed():
+                return
+            if not bobbin1 or not bobbin2:
+                self.stats.count_reset("bobbin_removed_ERROR_check")
+                self.delay(c.RESET_ALARM_DELAY)
+                self.clear_process_data()
+                self.state = State.WAIT_KANBAN
+
+        else:
+            self.state = State.WAIT_KANBAN
+
+    def _enter_state(self, old: State, new: State):
+        """Bookkeeping at the point the firmware prints [STATE]"""
+        self.stats.state_entries[new] += 1
+        if new == State.READY and self.world.bobbins_loaded_at is not None:
+            self.stats.verify_latency_ms.append(self.now - self.world.bobbins_loaded_at)
+        if self.on_state_change is not None:
+            self.on_state_change(old, new)
+
+    # ----- main loop -----
+
+    def setup(self):
+        """setup(): serial, RFID and scanner init delays"""
+        self.delay(1000)
+        self.delay(2 * self.c.RFID_RESET_DELAY + self.c.SERIAL_STABILIZE_DELAY)
+        self.delay(100)
+        self.state = State.WAIT_KANBAN
+
+    def loop_once(self):
+        """One loop(): handleStateMachine() followed by delay(LOOP_DELAY)"""
+        start = self.now
+        state_before = self.state
+        stable_before = state_before == self._previous_state
+        world_version = self.world.version
+
+        self.handle_state_machine()
+        self.delay(self.c.LOOP_DELAY)
+
+        elapsed = self.now - start
+        self.stats.iterations += 1
+        self.stats.state_time[state_before] += elapsed
+        self._idle = (stable_before and self.state == state_before
+                      and elapsed == self.c.LOOP_DELAY
+                      and self.world.version == world_version)
+
+    def fast_forward(self, limit: float = math.inf) -> bool:
+        """
+        Skip loop iterations whose outcome cannot change
+
+        After an idle iteration (no transition, no extra delay) every further
+        iteration is identical until the world changes, the WAIT_BOBBINS
+        timeout expires, or a presence check could miss the card.
+
+        Args:
+            limit: Virtual time the skip must not pass
+
+        Returns:
+            bool: False if the twin is stalled (idle with no future events)
+        """
+        if not self._idle or self.state in (State.READ_KANBAN, State.SCAN_QR1,
+                                            State.SCAN_QR2, State.VERIFY):
+            return True
+
+        period = self.c.LOOP_DELAY
+        horizon = min(self.world.next_event_time(), limit)
+        check_state = self.state in CARD_CHECK_STATES
+
+        if self.state == State.WAIT_BOBBINS:
+            horizon = min(horizon, self._state_entry_time + self.c.BOBBIN_WAIT_TIMEOUT + 1)
+
+        interval_iterations = self.c.CARD_CHECK_INTERVAL // period + 1
+        first_check = 0
+        if check_state:
+            if self.world.card is None:
+                return True
+            last = self._last_card_check[self.state]
+            first_check = max(0, (last + self.c.CARD_CHECK_INTERVAL - self.now) // period + 1)
+            if self.timing.presence_miss_rate > 0:
+                horizon = min(horizon, self.now + first_check * period)
+
+        if horizon == math.inf:
+            return False
+
+        skip = math.ceil((horizon - self.now) / period)
+        if skip <= 0:
+            return True
+
+        if check_state and first_check < skip:
+            last_check = first_check + ((skip - 1 - first_check) // interval_iterations) * interval_iterations
+            self._last_card_check[self.state] = self.now + last_check * period
+            self.card_missing_count = 0
+            self.world.card.halted = True
+
+        self.stats.state_time[self.state] += skip * period
+        self.stats.iterations += skip
+        self.now += skip * period
+        self.world.advance_to(self.now)
+        return True
+
+    def run(self, until_ms: int = None, cycles: int = None,
+            stop: Callable[["MachineTwin"], bool] = None) -> TwinStats:
+        """
+        Run the twin until a virtual time, a number of sewing cycles, or a stop condition
+
+        Args:
+            until_ms: Stop when the virtual clock passes this time
+            cycles: Stop after this many completed sewing cycles
+            stop: Optional predicate checked after every iteration
+
+        Returns:
+            TwinStats: Collected statistics
+        """
+        if self.state == State.INIT:
+            self.setup()
+
+        while True:
+            if until_ms is not None and self.now >= until_ms:
+                break
+            if cycles is not None and self.stats.sew_cycles >= cycles:
+                break
+            if stop is not None and stop(self):
+                break
+            if not self.fast_forward(until_ms if until_ms is not None else math.inf):
+                self.stats.stalled = True
+                break
+            if until_ms is not None and self.now >= until_ms:
+                break
+            self.loop_once()
+
+        self.set_machine_output(False)
+        return self.stats
+
+
+@dataclass
+class OperatorProfile:
+    """Operator behaviour parameters (milliseconds / probabilities)"""
+    card_place_ms: int = 2500
+    bobbin_load_ms: int = 6000
+    sew_ms: int = 45000
+    reaction_ms: int = 3000
+    bobbin_changes_per_job: int = 4
+    wrong_bobbin_rate: float = 0.02
+    bypass_job_rate: float = 0.0
+    card_read_fail_rate: float = 0.01
+    ultralight_cards: bool = False
+
+
+class OperatorModel:
+    """Randomised operator that reacts to machine states like a person on the line"""
+
+    def __init__(self, twin: MachineTwin, profile: OperatorProfile, rng: random.Random,
+                 catalog: List[Tuple[str, str]] = None):
+        self.twin = twin
+        self.world = twin.world
+        self.profile = profile
+        self.rng = rng
+        self.catalog = catalog or [(f"TH-{i:03d}", f"TH-{i + 500:03d}") for i in range(1, 41)]
+        self.job: Optional[Card] = None
+        self.changes_left = 0
+        self._job_counter = 0
+        self._sewing = False
+        self._placing_card = False
+        self._removing = set()   # Bobbin indices with a removal scheduled
+        self._inserting = set()  # Bobbin indices with an insertion scheduled
+        twin.on_state_change = self.on_state_change
+
+    def _jitter(self, mean_ms: int) -> int:
+        return int(mean_ms * self.rng.uniform(0.5, 1.5))
+
+    def _after_pending(self, mean_ms: int) -> int:
+        return max(self.twin.now, self.world.last_event_time()) + self._jitter(mean_ms)
+
+    def _next_job(self) -> Card:
+        self._job_counter += 1
+        uid = " ".join(f"{b:02X}" for b in self._job_counter.to_bytes(4, "big"))
+        if self.rng.random() < self.profile.bypass_job_rate:
+            thread1, thread2 = self.twin.c.BYPASS_KEYWORD, ""
+        else:
+            thread1, thread2 = self.rng.choice(self.catalog)
+        self.changes_left = self.profile.bobbin_changes_per_job
+        return Card(uid, thread1, thread2, read_fail_rate=self.profile.card_read_fail_rate,
+                    ultralight=self.profile.ultralight_cards)
+
+    def _label_for(self, job: Card, index: int) -> str:
+        if self.rng.random() < self.profile.wrong_bobbin_rate:
+            return self.rng.choice(self.catalog)[index]
+        return job.thread1 if index == 0 else job.thread2
+
+    # ----- scheduled actions -----
+
+    def _schedule_remove(self, index: int, at: int):
+        self._removing.add(index)
+
+        def action():
+            self._removing.discard(index)
+            self.world.remove_bobbin(index)
+        self.world.schedule(at, action)
+
+    def _schedule_insert(self, index: int, at: int):
+        self._inserting.add(index)
+        job = self.job
+
+        def action():
+            self._inserting.discard(index)
+            self.world.insert_bobbin(index, self._label_for(job, index))
+        self.world.schedule(at, action)
+
+    def _schedule_card(self, at: int):
+        self._placing_card = True
+        self.job = self._next_job()
+        card = self.job
+
+        def action():
+            self._placing_card = False
+            self.world.place_card(card)
+        self.world.schedule(at, action)
+
+    def _finish_sewing(self):
+        self._sewing = False
+        self.twin.stats.sew_cycles += 1
+        now = self.world.now
+        if self.changes_left > 0:
+            self.changes_left -= 1
+            self._schedule_remove(0, now)
+            self._schedule_remove(1, now + 300)
+        else:
+            self.world.remove_card()
+            self._schedule_remove(0, now + 500)
+            self._schedule_remove(1, now + 800)
+            self._schedule_card(now + 800 + self._jitter(self.profile.card_place_ms))
+
+    # ----- reactions -----
+
+    def on_state_change(self, old: State, new: State):
+        if new == State.WAIT_KANBAN:
+            if self.world.card is None and not self._placing_card:
+                self._schedule_card(self._after_pending(self.profile.card_place_ms))
+
+        elif new == State.WAIT_BOBBINS:
+            missing = [i for i in (0, 1)
+                       if (self.world.bobbins[i] is None or i in self._removing) and i not in self._inserting]
+            at = self._after_pending(self.profile.bobbin_load_ms)
+            for n, index in enumerate(missing):
+                self._schedule_insert(index, at + n * 400)
+
+        elif new in (State.READY, State.BYPASS):
+            if not self._sewing:
+                self._sewing = True
+                self.world.schedule(self.twin.now + self._jitter(self.profile.sew_ms), self._finish_sewing)
+
+        elif new == State.ERROR:
+            if self._removing or self._inserting or self._placing_card:
+                return
+            at = self._after_pending(self.profile.reaction_ms)
+            if not self.twin.kanban[0]:
+                # Unusable card: swap it for the next job
+                self.world.schedule(at, self.world.remove_card)
+                self._schedule_card(at + self._jitter(self.profile.card_place_ms))
+                return
+            # Pull the bobbins flagged by the ALARM LEDs (both if none is flagged);
+            # the firmware resets and the reload happens from WAIT_BOBBINS
+            flagged = [i for i, err in enumerate((self.twin.thread1_error, self.twin.thread2_error)) if err]
+            for n, index in enumerate(flagged or [0, 1]):
+                self._schedule_remove(index, at + n * 300)
+
+
+def simulate(constants: FirmwareConstants, cycles: int, seed: int,
+             profile: OperatorProfile = None, timing: TimingModel = None,
+             scanners: Tuple[ScannerModel, ScannerModel] = None,
+             scenario: str = None) -> Tuple[TwinStats, int, float]:
+    """
+    Run one simulation
+
+    Returns:
+        Tuple[TwinStats, int, float]: (Statistics, virtual ms elapsed, wall seconds)
+    """
+    rng = random.Random(seed)
+    world = World(rng, scanners)
+    twin = MachineTwin(world, constants, timing)
+
+    wall_start = time.perf_counter()
+    if scenario:
+        world.load_events(scenario)
+        twin.on_state_change = lambda old, new: None
+        stats = twin.run()
+        stats.sew_cycles = stats.state_entries[State.READY] + stats.state_entries[State.BYPASS]
+    else:
+        OperatorModel(twin, profile or OperatorProfile(), rng)
+        stats = twin.run(cycles=cycles)
+    return stats, twin.now, time.perf_counter() - wall_start
+
+
+def _percentile(values: List[int], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return float(ordered[index])
+
+
+def format_report(label: str, stats: TwinStats, virtual_ms: int, wall_s: float) -> str:
+    """Format a human-readable summary of one run"""
+    hours = virtual_ms / 3_600_000
+    lines = [
+        f"=== {label} ===",
+        f"Virtual time:     {hours:.2f} h ({virtual_ms / max(wall_s, 1e-9) / 1000:.0f}x real time, "
+        f"{stats.iterations} loop iterations)",
+        f"Sewing cycles:    {stats.sew_cycles} ({stats.sew_cycles / hours if hours else 0:.1f}/h)",
+        f"Machine enabled:  {100 * stats.machine_enabled_ms / max(virtual_ms, 1):.1f}%",
+        f"Verify latency:   mean {sum(stats.verify_latency_ms) / max(len(stats.verify_latency_ms), 1):.0f} ms, "
+        f"p50 {_percentile(stats.verify_latency_ms, 50):.0f} ms, "
+        f"p95 {_percentile(stats.verify_latency_ms, 95):.0f} ms",
+    ]
+    if stats.stalled:
+        lines.append("Ended idle:       no further world events (scenario exhausted or operator stuck)")
+    if stats.errors:
+        lines.append("Errors:           " + ", ".join(f"{k}={v}" for k, v in sorted(stats.errors.items())))
+    if stats.resets:
+        lines.append("Resets:           " + ", ".join(f"{k}={v}" for k, v in sorted(stats.resets.items())))
+    time_share = ", ".join(
+        f"{s.value}={100 * t / max(virtual_ms, 1):.1f}%"
+        for s, t in stats.state_time.items() if t
+    )
+    lines.append(f"State time:       {time_share}")
+    return "\n".join(lines)
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="TVS2102 machine digital twin")
+    parser.add_argument("--cycles", type=int, default=2000, help="Sewing cycles to simulate")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    parser.add_argument("--source", default=FIRMWARE_SOURCE, help="Path to firmware main.cpp")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="Override a firmware constant (repeatable); compares against baseline")
+    parser.add_argument("--scenario", help="Scripted event stream (JSON lines) instead of the operator model")
+    parser.add_argument("--sew-ms", type=int, default=OperatorProfile.sew_ms, help="Mean sewing time per cycle")
+    parser.add_argument("--wrong-bobbin-rate", type=float, default=OperatorProfile.wrong_bobbin_rate)
+    parser.add_argument("--qr-fail-rate", type=float, default=ScannerModel.fail_rate)
+    parser.add_argument("--presence-miss-rate", type=float, default=TimingModel.presence_miss_rate,
+                        help="Probability a card presence check misses a present card")
+    parser.add_argument("--ultralight", action="store_true",
+                        help="Kanban cards are NTAG/Ultralight (read without authentication)")
+    args = parser.parse_args()
+
+    baseline = FirmwareConstants.from_source(args.source)
+    overrides = dict(item.split("=", 1) for item in args.set)
+    profile = OperatorProfile(sew_ms=args.sew_ms, wrong_bobbin_rate=args.wrong_bobbin_rate,
+                              ultralight_cards=args.ultralight)
+    timing = TimingModel(presence_miss_rate=args.presence_miss_rate)
+    scanners = (ScannerModel(fail_rate=args.qr_fail_rate), ScannerModel(fail_rate=args.qr_fail_rate))
+
+    runs = [("Baseline (main.cpp)", baseline)]
+    if overrides:
+        runs.append(("Candidate " + " ".join(args.set), baseline.with_overrides(overrides)))
+
+    results = []
+    for label, constants in runs:
+        stats, virtual_ms, wall_s = simulate(constants, args.cycles, args.seed, profile,
+                                             timing, scanners, args.scenario)
+        results.append((stats, virtual_ms))
+        print(format_report(label, stats, virtual_ms, wall_s))
+        print()
+
+    if len(results) == 2:
+        (base, base_ms), (cand, cand_ms) = results
+        base_rate = base.sew_cycles / (base_ms / 3_600_000)
+        cand_rate = cand.sew_cycles / (cand_ms / 3_600_000)
+        print(f"Cycles per hour: {base_rate:.1f} -> {cand_rate:.1f} "
+              f"({100 * (cand_rate - base_rate) / base_rate:+.2f}%)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -62,6 +62,9 @@
 // =============== CONSTANTS ===============
 #define BLOCK_THREAD1   4
 #define BLOCK_THREAD2   5
+#define BLOCK_COMMIT    6     // Commit record written by the Kanban tool (two-phase write)
+#define UL_FIRST_PAGE   4     // NTAG/Ultralight: block 4 -> pages 4-7, 5 -> 8-11, 6 -> 12-15
+#define ACCEPT_LEGACY_CARDS 1 // Accept cards without a commit record (written before v1.1)
 #define QR_TIMEOUT      5000
 #define BYPASS_KEYWORD  "bypass"
 
@@ -130,6 +133,9 @@ void setMachineOutput(bool enable);
 void triggerQRScanner(int scannerNum);
 String readQRCode(HardwareSerial& scanner, int timeoutMs);
 bool readKanbanCard(ThreadData& data);
+bool readCardBlock(byte block, byte* buffer, byte bufferSize, bool ultralight);
+bool isKanbanCommitted(byte* thread1Block, byte* thread2Block, byte* commitBlock);
+uint32_t crc32(const byte* data, size_t length);
 bool isKanbanCardStillPresent();
 bool detectBobbin(int bobbinPin);
 bool verifyThreads();
@@ -436,29 +442,27 @@ bool readKanbanCard(ThreadData& data) {
         }
     }   
     
-    // Read Thread 1 from Block 4
-    byte buffer1[18];
-    byte size1 = sizeof(buffer1);
-    MFRC522::StatusCode status;
+    // NTAG21x / Ultralight cards need no authentication (SAK 0x00)
+    bool ultralight = rfid.PICC_GetType(rfid.uid.sak) == MFRC522::PICC_TYPE_MIFARE_UL;
     
-    // Authenticate Block 4
-    status = rfid.PCD_Authenticate(MFRC522::PICC_CMD_MF_AUTH_KEY_A, BLOCK_THREAD1, &key, &(rfid.uid));
-    if (status != MFRC522::STATUS_OK) {
-        Serial.print("[RFID] Authentication failed for Block 4: ");
-        Serial.println(rfid.GetStatusCodeName(status));
+    // Read Thread 1, Thread 2 and the commit record (Blocks 4-6)
+    byte buffer1[18];
+    byte buffer2[18];
+    byte buffer3[18];
+    if (!readCardBlock(BLOCK_THREAD1, buffer1, sizeof(buffer1), ultralight) ||
+        !readCardBlock(BLOCK_THREAD2, buffer2, sizeof(buffer2), ultralight) ||
+        !readCardBlock(BLOCK_COMMIT, buffer3, sizeof(buffer3), ultralight)) {
         rfid.PCD_StopCrypto1();
         rfid.PICC_HaltA();
         return false;
     }
+    rfid.PCD_StopCrypto1();
+    rfid.PICC_HaltA();
     
-    // Read Block 4
-    status = rfid.MIFARE_Read(BLOCK_THREAD1, buffer1, &size1);
-    if (status != MFRC522::STATUS_OK) {
-        Serial.print("[RFID] Read failed for Block 4: ");
-        Serial.println(rfid.GetStatusCodeName(status));
-        rfid.PCD_StopCrypto1();
-        rfid.PICC_HaltA();
-        return false;
+    // A card pulled out during writing must not be accepted (not even as bypass)
+    if (!isKanbanCommitted(buffer1, buffer2, buffer3)) {
+        Serial.println("[RFID] Card write not committed (interrupted write) - rewrite card");
+        return true;  // Empty thread codes -> Invalid Kanban data
     }
     
     data.thread1 = byteArrayToString(buffer1, 16);
@@ -469,44 +473,83 @@ bool readKanbanCard(ThreadData& data) {
     if (data.thread1.equalsIgnoreCase(BYPASS_KEYWORD)) {
         data.isBypass = true;
         Serial.println("[RFID] BYPASS MODE DETECTED");
-        rfid.PCD_StopCrypto1();
-        rfid.PICC_HaltA();
         return true;
     }
     
-    // Read Thread 2 from Block 5
-    byte buffer2[18];
-    byte size2 = sizeof(buffer2);
+    data.thread2 = byteArrayToString(buffer2, 16);
+    Serial.print("[RFID] Thread 2: ");
+    Serial.println(data.thread2);
     
-    // Authenticate Block 5
-    status = rfid.PCD_Authenticate(MFRC522::PICC_CMD_MF_AUTH_KEY_A, BLOCK_THREAD2, &key, &(rfid.uid));
+    return true;
+}
+
+// Authenticate and read one block (bufferSize >= 18 for MIFARE_Read)
+// NTAG/Ultralight: no authentication, one READ returns the block's four pages
+bool readCardBlock(byte block, byte* buffer, byte bufferSize, bool ultralight) {
+    MFRC522::StatusCode status;
+    
+    if (ultralight) {
+        byte page = UL_FIRST_PAGE + (block - BLOCK_THREAD1) * 4;
+        status = rfid.MIFARE_Read(page, buffer, &bufferSize);
+        if (status != MFRC522::STATUS_OK) {
+            Serial.print("[RFID] Read failed for Page ");
+            Serial.print(page);
+            Serial.print(": ");
+            Serial.println(rfid.GetStatusCodeName(status));
+            return false;
+        }
+        return true;
+    }
+    
+    status = rfid.PCD_Authenticate(MFRC522::PICC_CMD_MF_AUTH_KEY_A, block, &key, &(rfid.uid));
     if (status != MFRC522::STATUS_OK) {
-        Serial.print("[RFID] Authentication failed for Block 5: ");
+        Serial.print("[RFID] Authentication failed for Block ");
+        Serial.print(block);
+        Serial.print(": ");
         Serial.println(rfid.GetStatusCodeName(status));
-        rfid.PCD_StopCrypto1();
-        rfid.PICC_HaltA();
         return false;
     }
     
-    // Read Block 5
-    status = rfid.MIFARE_Read(BLOCK_THREAD2, buffer2, &size2);
+    status = rfid.MIFARE_Read(block, buffer, &bufferSize);
     if (status != MFRC522::STATUS_OK) {
-        Serial.print("[RFID] Read failed for Block 5: ");
+        Serial.print("[RFID] Read failed for Block ");
+        Serial.print(block);
+        Serial.print(": ");
         Serial.println(rfid.GetStatusCodeName(status));
-        rfid.PCD_StopCrypto1();
-        rfid.PICC_HaltA();
         return false;
     }
-    
-    data.thread2 = byteArrayToString(buffer2, 16);
-    Serial.print("[RFID] Thread 2: ");
-    Serial.println(data.thread2);
-    
-    rfid.PCD_StopCrypto1();
-    rfid.PICC_HaltA();
     return true;
 }
 
+// Commit record (Block 6): 'K' 'B' version state('P'/'C') generation[4] crc32[4] reserved[4]
+bool isKanbanCommitted(byte* thread1Block, byte* thread2Block, byte* commitBlock) {
+    if (commitBlock[0] != 'K' || commitBlock[1] != 'B' || commitBlock[2] != 1) {
+        return ACCEPT_LEGACY_CARDS;  // No commit record
+    }
+    if (commitBlock[3] != 'C') {
+        return false;  // Pending: write was interrupted
+    }
+    
+    byte payload[32];
+    memcpy(payload, thread1Block, 16);
+    memcpy(payload + 16, thread2Block, 16);
+    uint32_t stored = ((uint32_t)commitBlock[8] << 24) | ((uint32_t)commitBlock[9] << 16) |
+                      ((uint32_t)commitBlock[10] << 8) | commitBlock[11];
+    return crc32(payload, sizeof(payload)) == stored;
+}
+
+// CRC-32 (IEEE 802.3, same as zlib.crc32 in the Kanban tool)
+uint32_t crc32(const byte* data, size_t length) {
+    uint32_t crc = 0xFFFFFFFF;
+    for (size_t i = 0; i < length; i++) {
+        crc ^= data[i];
+        for (byte bit = 0; bit < 8; bit++) {
+            crc = (crc >> 1) ^ (0xEDB88320 & (0 - (crc & 1)));
+        }
+    }
+    return ~crc;
+}
+
 // =============== BOBBIN DETECTION ===============
 bool detectBobbin(int bobbinPin) {
     // PNP sensor or active HIGH logic